@@ -12,10 +12,21 @@
 	#include <netdb.h>
 	#include <netinet/tcp.h>
 	#include <arpa/inet.h>
+	#include <sys/mman.h>
+	#include <sys/stat.h>
+	#include <fcntl.h>
 #endif
 
+#define SHARED_MEMORY_FLAG 16777216
+
 int32_t socketfd;
 
+// payload of the messages, when mapped and enabled in the header flags
+char *shared_memory = 0;
+int64_t shared_memory_size = 0;
+int64_t shared_memory_offset = 0;
+bool payload_in_shared_memory = false;
+
 //private funtions
 
 void forsockets_send(void *buffer, int32_t length, int32_t file_descriptor) {
@@ -69,18 +80,78 @@ void forsockets_receive(void *buffer, int32_t length, int32_t file_descriptor) {
 
 }
 
+void forsockets_receive_payload(void *buffer, int32_t length) {
+	if (payload_in_shared_memory) {
+		memcpy(buffer, shared_memory + shared_memory_offset, length);
+		shared_memory_offset += length;
+	} else {
+		forsockets_receive(buffer, length, socketfd);
+	}
+}
+
+void forsockets_send_payload(void *buffer, int32_t length) {
+	if (payload_in_shared_memory) {
+		memcpy(shared_memory + shared_memory_offset, buffer, length);
+		shared_memory_offset += length;
+	} else {
+		forsockets_send(buffer, length, socketfd);
+	}
+}
+
 //public functions
 
+void forsockets_shared_memory_init(char *path) {
+#ifdef WIN32
+	fprintf(stderr, "shared memory channel is not supported on windows\n");
+	exit(1);
+#else
+	struct stat info;
+	int file_descriptor = open(path, O_RDWR);
+
+	if (file_descriptor < 0 || fstat(file_descriptor, &info) < 0) {
+		perror("could not open shared memory file");
+		exit(1);
+	}
+
+	shared_memory_size = info.st_size;
+	shared_memory = (char *) mmap(0, shared_memory_size, PROT_READ | PROT_WRITE, MAP_SHARED, file_descriptor, 0);
+
+	if (shared_memory == MAP_FAILED) {
+		perror("could not map shared memory file");
+		exit(1);
+	}
+
+	close(file_descriptor);
+#endif
+}
+
+// the arrays following this call are read from or written to the shared
+// memory if the flags (of the header) have the shared memory flag set
+void forsockets_begin_payload(int32_t flags) {
+	payload_in_shared_memory = (flags & SHARED_MEMORY_FLAG) != 0;
+	shared_memory_offset = 0;
+}
+
+// returns the flag to set in the header if a payload of size bytes can
+// be send in the shared memory, 0 otherwise
+int32_t forsockets_shared_memory_flag(int64_t size) {
+	if (shared_memory != 0 && size <= shared_memory_size) {
+		return SHARED_MEMORY_FLAG;
+	} else {
+		return 0;
+	}
+}
+
 void forsockets_receive_integers(int32_t *integers, int32_t length) {
-	forsockets_receive((void *) integers, length * sizeof(int32_t), socketfd);
+	forsockets_receive_payload((void *) integers, length * sizeof(int32_t));
 }
 
 void forsockets_receive_longs(int64_t *longs, int32_t length) {
-	forsockets_receive((void *) longs, length * sizeof(int64_t), socketfd);
+	forsockets_receive_payload((void *) longs, length * sizeof(int64_t));
 }
 
 void forsockets_receive_floats(float *floats, int32_t length) {
-	forsockets_receive((void *) floats, length * sizeof(float), socketfd);
+	forsockets_receive_payload((void *) floats, length * sizeof(float));
 }
 
 void forsockets_receive_doubles(double *doubles, int32_t length) {
@@ -94,11 +165,11 @@ void forsockets_receive_doubles(double *doubles, int32_t length) {
 //		doubles[i] = array[i];
 //	}
 //	fprintf(stderr, "\n");
-	forsockets_receive((void *) doubles, length * sizeof(double), socketfd);
+	forsockets_receive_payload((void *) doubles, length * sizeof(double));
 }
 
 void forsockets_receive_booleans(bool *booleans, int32_t length) {
-	forsockets_receive((void *) booleans, length * sizeof(bool), socketfd);
+	forsockets_receive_payload((void *) booleans, length * sizeof(bool));
 }
 
 void forsockets_receive_string(char *string, int32_t length) {
@@ -106,23 +177,23 @@ void forsockets_receive_string(char *string, int32_t length) {
 }
 
 void forsockets_send_integers(int32_t *integers, int32_t length) {
-	forsockets_send((void *) integers, length * sizeof(int32_t), socketfd);
+	forsockets_send_payload((void *) integers, length * sizeof(int32_t));
 }
 
 void forsockets_send_longs(int64_t *longs, int32_t length) {
-	forsockets_send((void *) longs, length * sizeof(int64_t), socketfd);
+	forsockets_send_payload((void *) longs, length * sizeof(int64_t));
 }
 
 void forsockets_send_floats(float *floats, int32_t length) {
-	forsockets_send((void *) floats, length * sizeof(float), socketfd);
+	forsockets_send_payload((void *) floats, length * sizeof(float));
 }
 
 void forsockets_send_doubles(double *doubles, int32_t length) {
-	forsockets_send((void *) doubles, length * sizeof(double), socketfd);
+	forsockets_send_payload((void *) doubles, length * sizeof(double));
 }
 
 void forsockets_send_booleans(bool *booleans, int32_t length) {
-	forsockets_send((void *) booleans, length * sizeof(bool), socketfd);
+	forsockets_send_payload((void *) booleans, length * sizeof(bool));
 }
 
 void forsockets_send_string(char *string, int32_t length) {
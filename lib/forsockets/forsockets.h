@@ -2,6 +2,10 @@
 void forsockets_init(char *host, int32_t port);
 void forsockets_close();
 
+void forsockets_shared_memory_init(char *path);
+void forsockets_begin_payload(int32_t flags);
+int32_t forsockets_shared_memory_flag(int64_t size);
+
 void forsockets_receive_integers(int32_t *integers, int32_t length);
 void forsockets_receive_longs(int64_t *longs, int32_t length);
 void forsockets_receive_floats(float *floats, int32_t length);
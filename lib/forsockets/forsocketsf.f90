@@ -135,5 +135,30 @@ module FortranSocketsInterface
             implicit none
         end subroutine forsockets_close
 
+        subroutine forsockets_shared_memory_init &
+            (path) &
+            bind(c, name='forsockets_shared_memory_init')
+            use iso_c_binding
+            implicit none
+            character(kind=c_char) :: path(*)
+        end subroutine forsockets_shared_memory_init
+
+        subroutine forsockets_begin_payload &
+            (flags) &
+            bind(c, name='forsockets_begin_payload')
+            use iso_c_binding
+            implicit none
+            integer (c_int32_t), value :: flags
+        end subroutine forsockets_begin_payload
+
+        function forsockets_shared_memory_flag &
+            (size) &
+            bind(c, name='forsockets_shared_memory_flag')
+            use iso_c_binding
+            implicit none
+            integer (c_int64_t), value :: size
+            integer (c_int32_t) :: forsockets_shared_memory_flag
+        end function forsockets_shared_memory_flag
+
     end interface
 end module FortranSocketsInterface
@@ -12,6 +12,7 @@ from amuse.units.quantities import zero
 
 from amuse.datamodel import Particles
 from amuse.rfi.core import *
+from amuse.ext.kepler_drift import kepler_drift
 def stumpff_C(z):
     if(z==0): 
         return 1/2.
@@ -227,6 +228,7 @@ class TwoBodyImplementation(object):
         self.particles=[]
         self.tnow=0.0
         self.begin_time_parameter = 0.0
+        self.many_binaries = False
         return 0
           
     def cleanup_code(self):
@@ -251,7 +253,7 @@ class TwoBodyImplementation(object):
         
     def new_particle(self, index_of_the_particle, mass, radius, x, y, z, vx, vy, vz):
         index_of_the_particle.value = 0
-        if( len(self.particles)>=2):
+        if( len(self.particles)>=2 and not self.many_binaries):
             return -1
         self.particles.append( 
             {
@@ -369,6 +371,11 @@ class TwoBodyImplementation(object):
         return 0
       
     def get_kinetic_energy(self, kinetic_energy):
+        if self.many_binaries:
+            mass, position, velocity = self.get_arrays()
+            kinetic_energy.value = 0.5 * (mass * (velocity**2).sum(axis=1)).sum()
+            return 0
+        
         if(len(self.particles)!=1 and len(self.particles)!=2):
             return -1
           
@@ -394,6 +401,10 @@ class TwoBodyImplementation(object):
             return 0 
   
     def get_gravity_at_point(self, eps, x, y, z, ax, ay, az, npoints):
+        if self.many_binaries:
+            phi, ax.value, ay.value, az.value = self.get_field_of_all_particles(eps, x, y, z)
+            return 0
+        
         if(len(self.particles)==1):
             return -2
         elif(len(self.particles)==2):
@@ -416,6 +427,10 @@ class TwoBodyImplementation(object):
             return -1
     
     def get_potential_at_point(self, eps, x, y, z, phi, npoints):
+        if self.many_binaries:
+            phi.value, ax, ay, az = self.get_field_of_all_particles(eps, x, y, z)
+            return 0
+        
         if(len(self.particles)==1):
             return -2
         elif(len(self.particles)==2):
@@ -440,8 +455,24 @@ class TwoBodyImplementation(object):
     def set_begin_time(self, value_in):
         self.begin_time_parameter = value_in
         return 0
+    
+    def get_many_binaries(self, value_out):
+        value_out.value = self.many_binaries
+        return 0
+        
+    def set_many_binaries(self, value_in):
+        self.many_binaries = value_in
+        return 0
         
     def get_potential_energy(self, potential_energy):
+        if self.many_binaries:
+            if len(self.particles) % 2 != 0:
+                return -1
+            mass, position, velocity = self.get_arrays()
+            r = numpy.sqrt(((position[0::2] - position[1::2])**2).sum(axis=1))
+            potential_energy.value = (-self.__G * mass[0::2] * mass[1::2] / r).sum()
+            return 0
+        
         if(len(self.particles)!=1 and len(self.particles)!=2):
             return -1
           
@@ -461,9 +492,70 @@ class TwoBodyImplementation(object):
             potential_energy.value = -self.__G*mass0*mass1/r
             return 0    
 
+    def get_arrays(self):
+        mass = numpy.array([x['mass'] for x in self.particles])
+        position = numpy.array([[x['x'], x['y'], x['z']] for x in self.particles]).reshape((-1,3))
+        velocity = numpy.array([[x['vx'], x['vy'], x['vz']] for x in self.particles]).reshape((-1,3))
+        return mass, position, velocity
+    
+    def get_field_of_all_particles(self, eps, x, y, z):
+        # potential and acceleration of all binaries together at the points
+        mass, position, velocity = self.get_arrays()
+        shape = (-1,) + (1,) * numpy.ndim(x)
+        mass = mass.reshape(shape)
+        dx = position[:,0].reshape(shape) - x
+        dy = position[:,1].reshape(shape) - y
+        dz = position[:,2].reshape(shape) - z
+        dr2 = dx**2 + dy**2 + dz**2 + numpy.asarray(eps)**2
+        dr = numpy.sqrt(dr2)
+        phi = -self.__G * (mass / dr).sum(axis=0)
+        factor = self.__G * mass / (dr2 * dr)
+        return phi, (factor * dx).sum(axis=0), (factor * dy).sum(axis=0), (factor * dz).sum(axis=0)
+    
+    def evolve_binaries(self, time):
+        # particles 2i and 2i+1 form binary i, all binaries are drifted
+        # at once, collisions are not detected
+        if len(self.particles) % 2 != 0:
+            return -1
+        
+        dt = time - self.tnow
+        mass, position, velocity = self.get_arrays()
+        m0 = mass[0::2].reshape((-1,1))
+        m1 = mass[1::2].reshape((-1,1))
+        tm = m0 + m1
+        cmpos = (m0 * position[0::2] + m1 * position[1::2]) / tm
+        cmvel = (m0 * velocity[0::2] + m1 * velocity[1::2]) / tm
+        dpos, dvel = kepler_drift(
+            self.__G * tm[...,0], 
+            position[0::2] - position[1::2], 
+            velocity[0::2] - velocity[1::2], 
+            dt
+        )
+        cmpos = cmpos + dt * cmvel
+        f0 = m1 / tm
+        f1 = m0 / tm
+        position[0::2] = cmpos + f0 * dpos
+        position[1::2] = cmpos - f1 * dpos
+        velocity[0::2] = cmvel + f0 * dvel
+        velocity[1::2] = cmvel - f1 * dvel
+        
+        for particle, (x, y, z), (vx, vy, vz) in zip(self.particles, position.tolist(), velocity.tolist()):
+            particle['x'] = x
+            particle['y'] = y
+            particle['z'] = z
+            particle['vx'] = vx
+            particle['vy'] = vy
+            particle['vz'] = vz
+        
+        self.tnow = time
+        return 0
+    
     def evolve_model(self, time):
         time_end = time
         
+        if self.many_binaries:
+            return self.evolve_binaries(time)
+        
         if(len(self.particles)!=1 and len(self.particles)!=2):
             return -1
           
@@ -536,6 +628,27 @@ class TwoBodyInterface(PythonCodeInterface, GravitationalDynamicsInterface, Grav
     def __init__(self, **options):
         PythonCodeInterface.__init__(self, TwoBodyImplementation, 'twobody_worker', **options)
     
+    @legacy_function
+    def get_many_binaries():
+        """
+        Retrieve if the particles are evolved as independent binaries
+        """
+        function = LegacyFunctionSpecification()
+        function.addParameter('value', dtype='bool', direction=function.OUT)
+        function.result_type = 'int32'
+        return function
+    
+    @legacy_function
+    def set_many_binaries():
+        """
+        Set if the particles are evolved as independent binaries, particles
+        2i and 2i+1 form binary i
+        """
+        function = LegacyFunctionSpecification()
+        function.addParameter('value', dtype='bool', direction=function.IN)
+        function.result_type = 'int32'
+        return function
+    
    
 
 class TwoBody(GravitationalDynamics, GravityFieldCode):
@@ -573,4 +686,11 @@ class TwoBody(GravitationalDynamics, GravityFieldCode):
             "model time to start the simulation at",
             default_value = 0.0 | nbody_system.time
         )
+        handler.add_boolean_parameter(
+            "get_many_binaries",
+            "set_many_binaries",
+            "many_binaries",
+            "evolve any number of independent binaries at once (particles 2i and 2i+1 form binary i), collisions are not detected",
+            False
+        )
     
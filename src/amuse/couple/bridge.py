@@ -85,11 +85,14 @@
 # - timestepping: adaptive dt?
 
 import threading
+import time
 
 from amuse.units import quantities
 from amuse.units import units, constants, generic_unit_system, nbody_system
 from amuse import datamodel
 from amuse.support.exceptions import AmuseException
+from amuse.rfi.async_request import AsyncRequestsPool
+from amuse.rfi.async_request import FakeASyncRequest
 
 
 
@@ -297,9 +300,18 @@ class CalculateFieldForParticles(object):
 class GravityCodeInField(object):
 
 
-    def __init__(self, code, field_codes, do_sync=True, verbose=False, radius_is_eps=False, h_smooth_is_eps=False, zero_smoothing=False):
+    def __init__(self, code, field_codes, do_sync=True, verbose=False, radius_is_eps=False, h_smooth_is_eps=False, zero_smoothing=False,
+            use_field_cache=False):
         """
         verbose indicates whether to output some run info
+
+        use_field_cache indicates whether the copy of the particles, their
+        softening lengths and the gravity of the field codes are reused
+        while the code and the field codes have the same model time and
+        no particles were added or removed (as between the last half kick
+        of one evolve_model call and the first half kick of the next).
+        This assumes the particles are only changed by evolving the codes,
+        call clear_field_cache after changing the particles otherwise.
         """
         self.code = code
         self.field_codes = field_codes
@@ -329,6 +341,11 @@ class GravityCodeInField(object):
         else:
             self.zero_smoothing=zero_smoothing
 
+        self.use_field_cache = use_field_cache
+        self.field_cache_hits = 0
+        self.field_cache_misses = 0
+        self.clear_field_cache()
+
 
     def evolve_model(self,tend,timestep=None):
         """
@@ -384,7 +401,7 @@ class GravityCodeInField(object):
             return quantities.zero
 
         result = self.code.potential_energy
-        particles = self.code.particles.copy(filter_attributes = self.required_attributes)
+        particles = self.copy_of_particles()
 
         for y in self.field_codes:
             energy = self.get_potential_energy_in_field_code(particles, y)
@@ -445,7 +462,7 @@ class GravityCodeInField(object):
         if self.cannot_kick():
             return quantities.zero
 
-        particles = self.code.particles.copy(filter_attributes = self.required_attributes)
+        particles = self.copy_of_particles()
         kinetic_energy_before = particles.kinetic_energy()
 
         for field_code in self.field_codes:
@@ -461,14 +478,112 @@ class GravityCodeInField(object):
             if(self.verbose):
                 print ".. done"
 
+        return self.end_kick(particles, kinetic_energy_before)
+
+    def begin_kick(self):
+        """
+        first part of a kick done by a scheduler (see Bridge.kick_codes),
+        returns a copy of the particles to kick and their kinetic energy
+        or None if the code cannot be kicked
+        """
+        if self.cannot_kick():
+            return None
+
+        particles = self.copy_of_particles()
+        return particles, particles.kinetic_energy()
+
+    def end_kick(self, particles, kinetic_energy_before):
         channel=particles.new_channel_to(self.code.particles)
         channel.copy_attributes(["vx","vy","vz"])
 
         kinetic_energy_after = particles.kinetic_energy()
         return kinetic_energy_after - kinetic_energy_before
 
+    def field_request(self, particles, field_code):
+        """
+        returns an asynchronous request for the gravity of the field code
+        at the particles, or None if the field code does not support
+        asynchronous calls
+        """
+        key = self._field_cache_key(particles, field_code)
+        if key in self._cached_fields:
+            self.field_cache_hits += 1
+            return FakeASyncRequest(self._cached_fields[key])
+
+        method = field_code.get_gravity_at_point
+        if not getattr(method, "is_async_supported", False):
+            return None
+
+        request = method.asynchronous(
+            self._softening_lengths(particles),
+            particles.x,
+            particles.y,
+            particles.z
+        )
+        if not key is None:
+            self.field_cache_misses += 1
+            def store_field(function):
+                result = function()
+                self._cached_fields[key] = result
+                return result
+            request.add_result_handler(store_field)
+        return request
+
+    def clear_field_cache(self):
+        self._cached_particles = None
+        self._cached_particles_key = None
+        self._cached_softening_lengths = None
+        self._cached_fields = {}
+
+    def _state_key(self, code):
+        """
+        the state of a code for the field cache, None if unknown
+        """
+        if not hasattr(code, "model_time"):
+            return None
+        if hasattr(code, "particles") and hasattr(code.particles, "_get_version"):
+            return (code.model_time, code.particles._get_version())
+        return (code.model_time, None)
+
+    def _field_cache_key(self, particles, field_code):
+        if particles is not self._cached_particles:
+            return None
+        state = self._state_key(field_code)
+        if state is None:
+            return None
+        return (id(field_code), state)
+
+    def copy_of_particles(self):
+        """
+        returns a copy of the particles of the code (with the required
+        attributes only), the copy is reused when the field cache is used
+        and the code has not changed
+        """
+        key = None
+        if self.use_field_cache:
+            key = self._state_key(self.code)
+            if not key is None and key == self._cached_particles_key:
+                self.field_cache_hits += 1
+                return self._cached_particles
+
+        particles = self.code.particles.copy(filter_attributes = self.required_attributes)
+
+        if not key is None:
+            self.field_cache_misses += 1
+            self.clear_field_cache()
+            self._cached_particles = particles
+            self._cached_particles_key = key
+        return particles
+
 
     def _softening_lengths(self, particles):
+        if particles is self._cached_particles:
+            if self._cached_softening_lengths is None:
+                self._cached_softening_lengths = self._new_softening_lengths(particles)
+            return self._cached_softening_lengths
+        return self._new_softening_lengths(particles)
+
+    def _new_softening_lengths(self, particles):
         if self.radius_is_eps:
             return particles.radius
         elif self.h_smooth_is_eps:
@@ -488,12 +603,20 @@ class GravityCodeInField(object):
         return (pot*particles.mass).sum() / 2
 
     def kick_with_field_code(self, particles, field_code, dt):
-        ax,ay,az=field_code.get_gravity_at_point(
-            self._softening_lengths(particles),
-            particles.x,
-            particles.y,
-            particles.z
-        )
+        key = self._field_cache_key(particles, field_code)
+        if key in self._cached_fields:
+            self.field_cache_hits += 1
+            ax,ay,az=self._cached_fields[key]
+        else:
+            ax,ay,az=field_code.get_gravity_at_point(
+                self._softening_lengths(particles),
+                particles.x,
+                particles.y,
+                particles.z
+            )
+            if not key is None:
+                self.field_cache_misses += 1
+                self._cached_fields[key] = (ax, ay, az)
         self.update_velocities(particles, dt, ax, ay, az)
 
     def update_velocities(self,particles, dt,  ax, ay, az):
@@ -505,9 +628,21 @@ class GravityCodeInField(object):
         self.code.stop()
 
 class Bridge(object):
-    def __init__(self, timestep = None, verbose=False, use_threading=True,method=None):
+    def __init__(self, timestep = None, verbose=False, use_threading=True,method=None,
+            use_async_kicks=True, use_field_cache=False):
         """
         verbose indicates whether to output some run info
+
+        use_async_kicks indicates whether the gravity of all field codes
+        is requested at once, with asynchronous calls, in a kick (for
+        field codes that support asynchronous calls)
+
+        use_field_cache indicates whether the systems reuse the gravity of
+        their partners while nothing changed (see GravityCodeInField),
+        call clear_field_cache after changing particles outside of bridge
+
+        the time spent in the kick, drift and channel copy phases is kept
+        for the last step in step_timing and for all steps in timing
         """
         self.codes=[]
         self.time=quantities.zero
@@ -515,9 +650,14 @@ class Bridge(object):
         self.timestep=timestep
         self.kick_energy = quantities.zero
         self.use_threading = use_threading
+        self.use_async_kicks = use_async_kicks
+        self.use_field_cache = use_field_cache
         self.time_offsets = dict()
         self.method=method
         self.channels = datamodel.Channels()
+        self.timing = dict(kick=0.0, drift=0.0, copy=0.0)
+        self.step_timing = dict(kick=0.0, drift=0.0, copy=0.0)
+        self._current_step_timing = dict(kick=0.0, drift=0.0, copy=0.0)
 
     def add_system(self, interface, partners=set(), do_sync=True,
             radius_is_eps=False, h_smooth_is_eps=False, zero_smoothing=False):
@@ -527,7 +667,7 @@ class Bridge(object):
 
         if hasattr(interface, "particles"):
             code = GravityCodeInField(interface, partners, do_sync, self.verbose,
-                radius_is_eps, h_smooth_is_eps, zero_smoothing)
+                radius_is_eps, h_smooth_is_eps, zero_smoothing, self.use_field_cache)
             self.add_code(code)
         else:
             if len(partners):
@@ -561,8 +701,9 @@ class Bridge(object):
         while self.time < (tend-timestep/2):
             self._drift_time=self.time
             self.method(self.kick_codes,self.drift_codes_dt, timestep)
-            self.channels.copy()
+            self.copy_channels()
             self.time=self.time+timestep
+            self.end_step()
 
     def evolve_joined_leapfrog(self,tend,timestep):
         first=True
@@ -575,11 +716,13 @@ class Bridge(object):
 
             self.drift_codes(self.time+timestep)
 
-            self.channels.copy()
+            self.copy_channels()
             self.time += timestep
+            self.end_step()
 
         if not first:
             self.kick_codes(timestep/2.)
+            self.end_step()
 
 
     def synchronize_model(self):
@@ -597,6 +740,28 @@ class Bridge(object):
             if hasattr(one_code, "stop"):
                 one_code.stop()
 
+    def clear_field_cache(self):
+        for x in self.codes:
+            if hasattr(x, "clear_field_cache"):
+                x.clear_field_cache()
+
+    @property
+    def field_cache_statistics(self):
+        """
+        number of hits and misses of the field caches of all systems
+        """
+        result = dict(hits=0, misses=0)
+        for x in self.codes:
+            if hasattr(x, "field_cache_statistics"):
+                statistics = x.field_cache_statistics
+            elif hasattr(x, "field_cache_hits"):
+                statistics = dict(hits=x.field_cache_hits, misses=x.field_cache_misses)
+            else:
+                continue
+            result["hits"] += statistics["hits"]
+            result["misses"] += statistics["misses"]
+        return result
+
     def get_potential_at_point(self,radius,x,y,z):
         pot=quantities.zero
         for code in self.codes:
@@ -680,11 +845,27 @@ class Bridge(object):
         return datamodel.ParticlesSuperset(array)
 
 # 'private' functions
+    def add_timing(self, phase, seconds):
+        self._current_step_timing[phase] += seconds
+        self.timing[phase] += seconds
+
+    def end_step(self):
+        self.step_timing = self._current_step_timing
+        self._current_step_timing = dict(kick=0.0, drift=0.0, copy=0.0)
+        if self.verbose:
+            print "bridge step timing, kick: {kick:.3g} s, drift: {drift:.3g} s, copy: {copy:.3g} s".format(**self.step_timing)
+
+    def copy_channels(self):
+        start = time.time()
+        self.channels.copy()
+        self.add_timing("copy", time.time() - start)
+
     def drift_codes_dt(self,dt):
         self._drift_time+=dt
         self.drift_codes(self._drift_time)
 
     def drift_codes(self,tend):
+        start = time.time()
         threads=[]
 
         for x in self.codes:
@@ -704,11 +885,77 @@ class Bridge(object):
             for x in threads:
                 x.run()
 
+        self.add_timing("drift", time.time() - start)
+
     def kick_codes(self,dt):
+        start = time.time()
+
+        if self.use_async_kicks:
+            de = self.kick_codes_asynchronous(dt)
+        else:
+            de = quantities.zero
+            for x in self.codes:
+                if hasattr(x,"kick"):
+                    de += x.kick(dt)
+
+        self.kick_energy += de
+        self.add_timing("kick", time.time() - start)
 
+    def _can_kick_asynchronously(self, code):
+        if not hasattr(code, "begin_kick"):
+            return False
+        if isinstance(code, GravityCodeInField):
+            # subclasses that override kick are kicked with their own kick
+            return type(code).kick.im_func is GravityCodeInField.kick.im_func
+        return True
+
+    def kick_codes_asynchronous(self, dt):
+        """
+        kicks all codes, the gravity of all field codes supporting
+        asynchronous calls is requested at once and the velocities are
+        updated as the results arrive. The other field codes are
+        evaluated while the requests are handled by the workers.
+
+        The particles of all codes are copied before the first request
+        is sent, a copy from a code would otherwise wait for the requests
+        already sent to that code. Codes without begin_kick, or with their
+        own kick, are kicked with their kick method first.
+        """
+        pool = AsyncRequestsPool()
+        kicks = []
+        synchronous_fields = []
         de = quantities.zero
+
+        def update_velocities(request, code, particles):
+            ax, ay, az = request.result()
+            code.update_velocities(particles, dt, ax, ay, az)
+
         for x in self.codes:
-            if hasattr(x,"kick"):
+            if not hasattr(x,"kick"):
+                continue
+            if not self._can_kick_asynchronously(x):
                 de += x.kick(dt)
-
-        self.kick_energy += de
+                continue
+
+            state = x.begin_kick()
+            if state is None:
+                continue
+            particles, kinetic_energy_before = state
+            kicks.append((x, particles, kinetic_energy_before))
+
+        for x, particles, kinetic_energy_before in kicks:
+            for field_code in x.field_codes:
+                request = x.field_request(particles, field_code)
+                if request is None:
+                    synchronous_fields.append((x, particles, field_code))
+                else:
+                    pool.add_request(request, update_velocities, args = (x, particles))
+
+        for x, particles, field_code in synchronous_fields:
+            x.kick_with_field_code(particles, field_code, dt)
+
+        pool.waitall()
+
+        for x, particles, kinetic_energy_before in kicks:
+            de += x.end_kick(particles, kinetic_energy_before)
+        return de
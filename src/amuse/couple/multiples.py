@@ -3,6 +3,7 @@ import numpy
 import collections
 import math
 import copy
+import timeit
 
 from amuse.datamodel import particle_attributes
 from amuse.datamodel import trees
@@ -15,7 +16,9 @@ from amuse.units import nbody_system
 from amuse.units import units
 from amuse.units import constants
 from amuse.units.quantities import zero
+from amuse.units.quantities import value_in
 from amuse.support.exceptions import KeysNotInStorageException
+from amuse.ext.octree import Octree
 from amuse import io
 
 #---------------------------------------------------------------------
@@ -180,6 +183,21 @@ class Multiples(object):
         #self.neighbor_distance_factor = 2.0
         self.neighbor_perturbation_limit = 0.02
 
+        # Neighbor-limited encounter handling.  False means that all
+        # stars are copied from the gravity module at every encounter,
+        # and all are considered as perturbers.  True means that only
+        # the stars within neighbor_search_factor times the distance
+        # at which a star of the largest mass would reach the
+        # neighbor_perturbation_limit are copied and considered as
+        # perturbers.  Of the other stars only the masses and
+        # positions are copied (to find the neighbors and to compute
+        # the tidal field on the encounter).  The strongest perturber
+        # of wide binaries (step 6b) is still searched for in all
+        # stars.
+
+        self.copy_neighbors_only = False
+        self.neighbor_search_factor = 2.0
+
         # Neighbor veto policy.  True means we allow neighbors to veto
         # a two-body encounter (meaning that don't want to deal with
         # complex initial many-body configurations).  False means we
@@ -222,6 +240,13 @@ class Multiples(object):
         # encounters algorithm.
         
         self.number_of_collisions = 0
+
+        # Wall clock time (in seconds) spent evolving the gravity
+        # module and handling encounters, summed over all calls to
+        # evolve_model.
+
+        self.gravity_code_time = 0.0
+        self.encounter_time = 0.0
     
         # Repeat encounter management data
 
@@ -449,7 +474,9 @@ class Multiples(object):
 	    	    self.gravity_code.model_time, 'to', end_time
                 sys.stdout.flush()
 
+            start_time = timeit.default_timer()
             self.gravity_code.evolve_model(end_time)
+            self.gravity_code_time += timeit.default_timer() - start_time
             newtime = self.gravity_code.model_time
            
             # JB modified this: in Bonsai we can take a zero-length
@@ -467,6 +494,8 @@ class Multiples(object):
 
             if stopping_condition.is_set():
 
+                start_time = timeit.default_timer()
+
                 # Synchronize everything for now.  Later we can
                 # just synchronize neighbors if gravity supports
                 # that.  TODO
@@ -502,10 +531,16 @@ class Multiples(object):
                     if self.global_debug > 0:
                         print 'interaction at time', time
                 
-                    # Like synchronize.  We only should copy data from
-                    # the particles and their neighbors.  TODO
+                    # Like synchronize.  Copy data from the particles
+                    # and their neighbors only, if requested.
 
-                    self.channel_from_code_to_memory.copy()
+                    if self.copy_neighbors_only:
+                        neighbors, perturber \
+                            = self.copy_neighbors_from_code(star1, star2)
+                    else:
+                        self.channel_from_code_to_memory.copy()
+                        neighbors = None
+                        perturber = None
                     
                     initial_energy = self.get_total_energy(self.gravity_code)
 
@@ -535,7 +570,8 @@ class Multiples(object):
                         = self.manage_encounter(time, star1, star2, 
                                                 self._inmemory_particles,
                                                 self.gravity_code.particles,
-                                                self.kepler)
+                                                self.kepler, neighbors,
+                                                perturber)
 
                     if cont and not veto:
 
@@ -695,9 +731,14 @@ class Multiples(object):
         
                 count_ignore_encounter += ignore
 
+                self.encounter_time += timeit.default_timer() - start_time
+
         print ''
         print 'Resolved', count_resolve_encounter, 'encounters'
         print 'Ignored', count_ignore_encounter, 'encounters'
+        if self.global_debug > 0:
+            print 'Time spent in gravity code', self.gravity_code_time, \
+                's, handling encounters', self.encounter_time, 's'
         sys.stdout.flush()
 
         self.gravity_code.synchronize_model()
@@ -710,6 +751,62 @@ class Multiples(object):
 
         self.channel_from_code_to_memory.copy_attribute("index_in_code", "id")
 
+    def copy_neighbors_from_code(self, star1, star2):
+
+        # Copy star1, star2 and the stars that may perturb them from
+        # the gravity module to memory, and return these stars (in
+        # memory) and the strongest perturber of the center of mass
+        # of star1 and star2 among all stars (see
+        # find_strongest_perturber).  A star of mass m at distance d from the center of
+        # mass of star1 and star2 is a neighbor if m/d**3 exceeds
+        # neighbor_perturbation_limit*(m1+m2)/(2*sep12**3), or if d <
+        # sep12 (see manage_encounter).  The search radius is extended
+        # by neighbor_search_factor.  Of the other stars only the
+        # masses and positions are copied.  These cannot be skipped:
+        # the distances of all stars are needed to find the neighbors
+        # and the strongest perturber (used for the wide binary check
+        # at 6b in manage_encounter), and the masses and positions of
+        # all stars determine the tidal field on the encounter
+        # (phi_rem and phi_ins).  This copies 4 instead of all
+        # attributes and avoids the O(N) scans of particle sets in
+        # manage_encounter.
+
+        self.channel_from_code_to_memory.copy_attributes(["mass",
+                                                          "x", "y", "z"])
+        stars = self._inmemory_particles
+        position = stars.position
+        length_unit = position.unit
+        position = position.value_in(length_unit)
+        mass = stars.mass
+        mass_unit = mass.unit
+        mass = mass.value_in(mass_unit)
+
+        pos1 = star1.position.value_in(length_unit)
+        pos2 = star2.position.value_in(length_unit)
+        m1 = star1.mass.value_in(mass_unit)
+        m2 = star2.mass.value_in(mass_unit)
+        sep12 = numpy.sqrt(((pos1 - pos2)**2).sum())
+        center_of_mass = (m1*pos1 + m2*pos2)/(m1 + m2)
+
+        radius = sep12 * max(1.0, (2*mass.max() \
+                    / (self.neighbor_perturbation_limit*(m1 + m2)))**(1/3.))
+        radius *= self.neighbor_search_factor
+        distances_squared = ((position - center_of_mass)**2).sum(axis=1)
+        neighbors = stars[numpy.flatnonzero(distances_squared <= radius**2)]
+        if self.global_debug > 1:
+            print 'copying', len(neighbors), 'neighbors within', \
+                radius | length_unit
+
+        neighbors_in_code \
+            = neighbors.get_intersecting_subset_in(self.gravity_code.particles)
+        neighbors_in_code.new_channel_to(neighbors).copy()
+
+        perturber = find_strongest_perturber(stars,
+                                    center_of_mass | length_unit,
+                                    [star1.key, star2.key],
+                                    numpy.sqrt(distances_squared) | length_unit)
+        return neighbors, perturber
+
     def expand_encounter(self, scattering_stars):
 
         # Create an encounter particle set from the top-level stars.
@@ -732,14 +829,18 @@ class Multiples(object):
         return particles_in_encounter, Emul
 
     def manage_encounter(self, global_time, star1, star2,
-                         stars, gravity_stars, kep):
+                         stars, gravity_stars, kep, neighbors = None,
+                         perturber = None):
 
         # Manage an encounter between star1 and star2.  Stars is the
         # python memory data set.  Gravity_stars points to the gravity
-        # module data.  Return values are the change in top-level
-        # energy, the tidal error, and the integration error in the
-        # scattering calculation.  Steps below follow those defined in
-        # the PDF description.
+        # module data.  Neighbors, if given, is the subset of stars to
+        # search for perturbers (see copy_neighbors_only), and
+        # perturber the strongest perturber among all stars, as
+        # returned by copy_neighbors_from_code.  Return
+        # values are the change in top-level energy, the tidal error,
+        # and the integration error in the scattering calculation.
+        # Steps below follow those defined in the PDF description.
 
         # print 'in manage_encounter'
         # sys.stdout.flush()
@@ -754,7 +855,6 @@ class Multiples(object):
             'global_time': global_time,
             'star1': star1.copy(),
             'star2': star2.copy(),
-            'stars': stars.copy(),
             #'gravity_stars': gravity_stars.copy(),
             'self.root_to_tree': self.root_to_tree.copy(),
             'particles_in_encounter': Particles(0),
@@ -776,7 +876,10 @@ class Multiples(object):
         star1 = scattering_stars[0]
         star2 = scattering_stars[1]
         center_of_mass = scattering_stars.center_of_mass()
-        other_stars = stars - scattering_stars	# probably only need perturbers?
+        if neighbors is None:
+            other_stars = stars - scattering_stars
+        else:
+            other_stars = neighbors - scattering_stars
         
         # Brewer Mod:  Check for a repeat encounter.
 
@@ -835,47 +938,61 @@ class Multiples(object):
 
             max_pert = sorted_perturbations[0]/fac12
             largest_perturbers = [sorted_stars[0]]
-            for i in range(1, len(sorted_stars)):
-                if sorted_perturbations[i] > 0.025*sorted_perturbations[0]:
-                    largest_perturbers.append(sorted_stars[i])
+            is_large = sorted_perturbations > 0.025*sorted_perturbations[0]
+            for i in numpy.flatnonzero(is_large[1:]) + 1:
+                largest_perturbers.append(sorted_stars[i])
 
         # Perturbation limit for identification as a neighbor.
         
         pert_min = self.neighbor_perturbation_limit*fac12
-        for i in range(len(sorted_stars)):    # NB no loop if len() = 0
+
+        # Include anything lying "inside" the binary, even if it
+        # is a weak perturber.
+
+        is_neighbor = numpy.logical_or(sorted_perturbations > pert_min,
+                                       sorted_distances < sep12)
+        for i in numpy.flatnonzero(is_neighbor):    # NB no loop if none
             
             star = sorted_stars[i]
 
-            # Include anything lying "inside" the binary, even if it
-            # is a weak perturber.
-
-            if sorted_perturbations[i] > pert_min \
-                    or sorted_distances[i] < sep12:
-                if not self.neighbor_veto:
-                    scattering_stars.add_particle(star)
-                    if self.global_debug > 1:
-                        print 'added',
-                        if hasattr(star, 'id'):
-                            print 'star', star.id,
-                        else:
-                            print 'unknown star',
-                        print 'to scattering list'
-                        sys.stdout.flush()
-                    snapshot['scattering_stars'].add_particle(star)
-                    #initial_scale = sorted_distances[i]    # don't expand!
-                else:
-                    if self.global_debug > 0:
-                        print 'encounter vetoed by', \
-                            star.id, 'at distance', \
-                            sorted_distances[i], \
-                            'pert =', sorted_perturbations[i]/fac12
-                    if self.repeat_count > 0: self.repeat_count -= 1
-                    return True, 0., 0., 0., 0., 0., None
+            if not self.neighbor_veto:
+                scattering_stars.add_particle(star)
+                if self.global_debug > 1:
+                    print 'added',
+                    if hasattr(star, 'id'):
+                        print 'star', star.id,
+                    else:
+                        print 'unknown star',
+                    print 'to scattering list'
+                    sys.stdout.flush()
+                snapshot['scattering_stars'].add_particle(star)
+                #initial_scale = sorted_distances[i]    # don't expand!
+            else:
+                if self.global_debug > 0:
+                    print 'encounter vetoed by', \
+                        star.id, 'at distance', \
+                        sorted_distances[i], \
+                        'pert =', sorted_perturbations[i]/fac12
+                if self.repeat_count > 0: self.repeat_count -= 1
+                return True, 0., 0., 0., 0., 0., None
 
         self.before.add_particles(scattering_stars)
 
         # Note: sorted_stars, etc. are used once more, when checking
-        # for wide binaries (at 6b below).
+        # for wide binaries (at 6b below).  With neighbors, these only
+        # cover the search radius, so the strongest perturber of all
+        # stars is used instead.
+
+        strongest_perturber = None
+        strongest_perturbation = zero
+        if len(sorted_perturbations) > 0:
+            strongest_perturber = sorted_stars[0]
+            strongest_distance = sorted_distances[0]
+            strongest_perturbation = sorted_perturbations[0]
+        if not neighbors is None and not perturber is None \
+                and not perturber[0] is None:
+            strongest_perturber, strongest_distance, \
+                strongest_perturbation = perturber
 
         #----------------------------------------------------------------
         # 2a. Calculate the total internal and external potential
@@ -1139,7 +1256,6 @@ class Multiples(object):
             global_time = snapshot['global_time']
             star1 = snapshot['star1']
             star2 = snapshot['star2']
-            stars = snapshot['stars']
             #gravity_stars = snapshot['gravity_stars']
             gravity_stars.add_particle(star1)
             gravity_stars.add_particle(star2)
@@ -1270,11 +1386,11 @@ class Multiples(object):
             # its current strongest external perturber.
 
             max_perturbation = 0.0
-            if len(sorted_perturbations) > 0:
+            if not strongest_perturber is None:
                 max_perturbation = \
-                    	2*sorted_perturbations[0]*binary_scale**3/mass
-                perturber = sorted_stars[0]
-                perturber_distance = sorted_distances[0]
+                    	2*strongest_perturbation*binary_scale**3/mass
+                perturber = strongest_perturber
+                perturber_distance = strongest_distance
             
             # Check that other stars involved in the encounter but not
             # in this multiple are not the dominant perturbation.
@@ -2042,75 +2158,123 @@ def find_nnn(star1, star2, stars, G):  # print next nearest neighbor
 def find_nn(plist, field, G):
 
     # Find and print info on the closest field particle (as
-    # measured by potential) to any particle in plist.
-
-    pminmin = None
-    fminmin = None
-    phiminmin = zero
-    for f in field:
-        dx = (plist.position - f.position).lengths()
-        phi = -G*f.mass*plist.mass/dx
-        phimin = zero
-        dxmin = 1.e30
-        pmin = None
-        for i in range(len(phi)):
-            if phi[i] < phimin:
-                phimin = phi[i]
-                dxmin = dx[i]
-                pmin = plist[i]
-        if phimin < phiminmin:
-            phiminmin = phimin
-            pminmin = pmin
-            dxminmin = dxmin
-            fminmin = f
+    # measured by potential) to any particle in plist.  Same as
+    # find_nn3.
 
-    return pminmin, fminmin, dxminmin
+    return find_nn3(plist, field, G)
 
-def find_nn3(plist, field, G):
+def find_nn3(plist, field, G, block_size = 1000000):
     
     # Find and print info on the closest field particle (as
     # measured by potential) to any particle in plist.
-    # revised, faster version of find_nn
+    # revised, faster version of find_nn, working on unitless
+    # arrays of (block_size / len(field)) particles of plist at a
+    # time.  Returns None for all three if no pair is found.
     
     pminmin = None
     fminmin = None
-    phiminmin = zero
-    
-    for p in plist:
-        
-        dx = (p.position - field.position).lengths()
-        phi = -G*field.mass*p.mass/dx
-        #phi = numpy.divide(numpy.prod([-1,G,field.mass,p.mass]),dx)
-        phimin = zero
-        dxmin = 1.e30
-        pmin = None
-        j = numpy.argmin(phi.number)
-        phimin = phi[j]
-        dxmin = dx[j]
-        pmin = p
-        if phimin < phiminmin:
-            phiminmin = phimin
-            pminmin = pmin
-            dxminmin = dxmin
+    dxminmin = None
+    if len(plist) == 0 or len(field) == 0:
+        return pminmin, fminmin, dxminmin
+
+    field_position = field.position
+    length_unit = field_position.unit
+    field_position = field_position.value_in(length_unit)
+    field_mass = field.mass
+    mass_unit = field_mass.unit
+    field_mass = field_mass.value_in(mass_unit)
+    position = plist.position.value_in(length_unit)
+    mass = plist.mass.value_in(mass_unit)
+
+    # G is the same for all pairs, and does not change the order
+    phiminmin = 0.0
+    number_per_block = max(1, block_size // len(field))
+    for offset in range(0, len(plist), number_per_block):
+        block = slice(offset, offset + number_per_block)
+        dx = numpy.sqrt(((position[block, None, :] 
+                          - field_position[None, :, :])**2).sum(axis=2))
+        with numpy.errstate(divide = 'ignore'):
+            phi = -mass[block, None] * field_mass[None, :] / dx
+        k = numpy.argmin(phi)
+        i, j = numpy.unravel_index(k, phi.shape)
+        if phi[i, j] < phiminmin:
+            phiminmin = phi[i, j]
+            pminmin = plist[offset + i]
             fminmin = field[j]
+            dxminmin = dx[i, j] | length_unit
 
     return pminmin, fminmin, dxminmin
 
-def find_binaries(particles, G):
-
-    # Search for and print out bound pairs using a numpy-accelerated
-    # N^2 search.
-
-    for p in particles:
-        mu = p.mass*particles.mass/(p.mass+particles.mass)
-        dr = (particles.position - p.position).lengths()
-        dv = (particles.velocity - p.velocity).lengths()
-        E = 0.5*mu*dv*dv - G*p.mass*particles.mass/dr
-        indices = numpy.argsort(E.number)
-        sorted_E = E[indices]
-        Emin = sorted_E[1].number
-        if Emin < -1.e-4 and p.id < particles[indices[1]].id:
-            print 'bound', p.id, particles[indices[1]].id, Emin
+def find_binaries(particles, G, threshold = 1.e-4):
+
+    # Search for and print out bound pairs, pairing every particle
+    # with its most bound partner.  A pair can only have an energy
+    # below -threshold if G*m1*m2/dr exceeds threshold, which bounds
+    # the distance to the partners to search for (with a spatial
+    # index).  Energies are in units of the particle masses and
+    # velocities.  Returns the bound pairs as (id1, id2, energy).
+
+    pairs = []
+    if len(particles) < 2:
+        return pairs
+
+    position = particles.position
+    length_unit = position.unit
+    position = position.value_in(length_unit)
+    velocity = particles.velocity
+    speed_unit = velocity.unit
+    velocity = velocity.value_in(speed_unit)
+    mass = particles.mass
+    mass_unit = mass.unit
+    mass = mass.value_in(mass_unit)
+    G = value_in(G, length_unit * speed_unit**2 / mass_unit)
+
+    radius = G * mass * mass.max() / threshold
+    i, j, dr2 = Octree(position).query_radius(position, radius)
+    is_pair = i != j
+    i, j, dr2 = i[is_pair], j[is_pair], dr2[is_pair]
+
+    mu = mass[i]*mass[j]/(mass[i]+mass[j])
+    dv2 = ((velocity[i] - velocity[j])**2).sum(axis=1)
+    E = 0.5*mu*dv2 - G*mass[i]*mass[j]/numpy.sqrt(dr2)
+
+    # most bound partner of every particle (in order of i)
+    order = numpy.lexsort((E, i))
+    i, j, E = i[order], j[order], E[order]
+    is_first = numpy.ones(len(i), dtype=bool)
+    is_first[1:] = i[1:] != i[:-1]
+    i, j, E = i[is_first], j[is_first], E[is_first]
+
+    ids = particles.id
+    for k in numpy.flatnonzero(E < -threshold):
+        if ids[i[k]] < ids[j[k]]:
+            print 'bound', ids[i[k]], ids[j[k]], E[k]
+            pairs.append((ids[i[k]], ids[j[k]], E[k]))
+
+    return pairs
+
+def find_strongest_perturber(stars, center, excluded_keys,
+                             distances = None):
+
+    # Find the star (not in excluded_keys) with the largest
+    # perturbation m/d**3 on the center.  Distances, if given, are
+    # the distances of the stars to the center (from the scan in
+    # copy_neighbors_from_code), otherwise these are computed.
+    # Returns the star, its distance and perturbation, or None for
+    # all three if there are no other stars.
+
+    candidates = numpy.flatnonzero(numpy.logical_not(
+                        numpy.in1d(stars.key, excluded_keys)))
+    if len(candidates) == 0:
+        return None, None, None
+
+    if distances is None:
+        distances = (stars.position - center).lengths()
+    distances = distances[candidates]
+    with numpy.errstate(divide = 'ignore'):
+        perturbations = stars.mass[candidates] / distances**3
+    k = numpy.argmax(perturbations.number)
+    return stars[candidates[k]], distances[k], perturbations[k]
 
 def potential_energy_in_field(particles, field_particles,
                               smoothing_length_squared = zero,
@@ -2145,28 +2309,28 @@ def potential_energy_in_field(particles, field_particles,
     #     print ''
     # print particles
 
-    sum_of_energies = zero
-    for particle in particles:
-        dx = particle.x - field_particles.x
-        dy = particle.y - field_particles.y
-        dz = particle.z - field_particles.z
-        dr_squared = (dx * dx) + (dy * dy) + (dz * dz)
-        dr = (dr_squared+smoothing_length_squared).sqrt()
-        m_m = particle.mass * field_particles.mass
-        potentials = -m_m/dr
-        energy_of_this_particle = potentials.sum()
-        sum_of_energies += energy_of_this_particle
-        #print potentials
-        #print dr
-        imin = numpy.argmin(potentials.number)
-        #print ' ', particle.id, field_particles[imin].id, potentials[imin]
-        imin = numpy.argmin(dr.number)
-        #print ' ', particle.id, field_particles[imin].id, dr[imin]
+    # Retrieve the field once, and work on unitless arrays.
+
+    field_position = field_particles.position
+    length_unit = field_position.unit
+    field_position = field_position.value_in(length_unit)
+    field_mass = field_particles.mass
+    mass_unit = field_mass.unit
+    field_mass = field_mass.value_in(mass_unit)
+    smoothing = value_in(smoothing_length_squared, length_unit**2)
+
+    sum_of_energies = 0.0
+    for position, mass in zip(particles.position.value_in(length_unit),
+                              particles.mass.value_in(mass_unit)):
+        dr_squared = ((field_position - position)**2).sum(axis=1)
+        dr = numpy.sqrt(dr_squared + smoothing)
+        potentials = -mass * field_mass / dr
+        sum_of_energies += potentials.sum()
 
     #print 'sum_of_energies =', sum_of_energies
     #sys.stdout.flush()
 
-    return G * sum_of_energies
+    return G * (sum_of_energies | mass_unit**2 / length_unit)
 
 def offset_particle_tree(particle, dpos, dvel):
 
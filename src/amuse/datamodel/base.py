@@ -19,6 +19,8 @@ import numpy.random
 import random
 import inspect
 import warnings
+import operator
+import itertools
 
 class KeyGenerator(object):
     
@@ -680,6 +682,126 @@ class PrivateProperties(object):
 class UndefinedAttribute(object):
     def __get__(self, obj, type=None):
         raise AttributeError()
+
+
+class AttributeReference(object):
+    """
+    Refers to an attribute of the particles in a set. Comparing
+    a reference with a value or another reference gives a condition 
+    to select particles with (see :meth:`AbstractSet.where`).
+    
+    >>> from amuse.datamodel import Particles
+    >>> particles = Particles(3)
+    >>> particles.mass = [10.0, 20.0, 30.0] | units.kg
+    >>> particles.x = [1.0, 2.0, 3.0] | units.m
+    >>> mass, x = AttributeReference("mass"), AttributeReference("x")
+    >>> subset = particles.where(mass > 15.0 | units.kg, x < 250 | units.cm)
+    >>> print subset.mass
+    [20.0] kg
+    """
+    
+    def __init__(self, name):
+        self.name = name
+    
+    def __lt__(self, other):
+        return AttributeComparison(operator.lt, self, other)
+    
+    def __le__(self, other):
+        return AttributeComparison(operator.le, self, other)
+    
+    def __gt__(self, other):
+        return AttributeComparison(operator.gt, self, other)
+    
+    def __ge__(self, other):
+        return AttributeComparison(operator.ge, self, other)
+    
+    def __eq__(self, other):
+        return AttributeComparison(operator.eq, self, other)
+    
+    def __ne__(self, other):
+        return AttributeComparison(operator.ne, self, other)
+    
+    __hash__ = object.__hash__
+
+
+class AttributeCondition(object):
+    """
+    Condition on the attributes of the particles in a set, 
+    conditions can be combined with &, | and ~.
+    """
+    
+    def __and__(self, other):
+        return CombinedAttributeCondition(numpy.logical_and, self, other)
+    
+    def __or__(self, other):
+        return CombinedAttributeCondition(numpy.logical_or, self, other)
+    
+    def __invert__(self):
+        return NegatedAttributeCondition(self)
+    
+    def get_attribute_names(self):
+        raise NotImplementedError()
+    
+    def evaluate(self, values):
+        """
+        Returns a boolean array, values is a dictionary with, 
+        for every attribute name, the numbers and the unit 
+        (None if the attribute has no unit).
+        """
+        raise NotImplementedError()
+
+
+class AttributeComparison(AttributeCondition):
+    
+    def __init__(self, operator, reference, other):
+        self.operator = operator
+        self.reference = reference
+        self.other = other
+    
+    def get_attribute_names(self):
+        if isinstance(self.other, AttributeReference):
+            return [self.reference.name, self.other.name]
+        else:
+            return [self.reference.name]
+    
+    def evaluate(self, values):
+        numbers, unit = values[self.reference.name]
+        other = self.other
+        if isinstance(other, AttributeReference):
+            other_numbers, other_unit = values[other.name]
+            other = other_numbers if other_unit is None else other_unit.new_quantity(other_numbers)
+        
+        if unit is None:
+            other = other.value_in(units.none) if is_quantity(other) else other
+        else:
+            other = quantities.value_in(other, unit)
+        return self.operator(numbers, other)
+
+
+class CombinedAttributeCondition(AttributeCondition):
+    
+    def __init__(self, function, left, right):
+        self.function = function
+        self.left = left
+        self.right = right
+    
+    def get_attribute_names(self):
+        return self.left.get_attribute_names() + self.right.get_attribute_names()
+    
+    def evaluate(self, values):
+        return self.function(self.left.evaluate(values), self.right.evaluate(values))
+
+
+class NegatedAttributeCondition(AttributeCondition):
+    
+    def __init__(self, condition):
+        self.condition = condition
+    
+    def get_attribute_names(self):
+        return self.condition.get_attribute_names()
+    
+    def evaluate(self, values):
+        return numpy.logical_not(self.condition.evaluate(values))
         
 class AbstractSet(object):
     """
@@ -1288,15 +1410,73 @@ class AbstractSet(object):
         keys = self.get_all_keys_in_store()
         #values = self._get_values(keys, attributes) #fast but no vectors
         values = map(lambda x: getattr(self, x), attributes)
+        return self._subset(self._selected_keys(selection_function, keys, values))
+    
+    def _selected_keys(self, selection_function, keys, values):
+        """
+        Returns the keys for which the selection function returns True.
+        If all values have one number per key, the selection function is
+        first called once with the complete arrays. When this fails or
+        does not return one boolean per key, the function does not
+        work on arrays and is called for every key.
+        """
+        if len(keys) == 0:
+            return []
+        
+        shape = (len(keys),)
+        if all([getattr(x, 'shape', None) == shape for x in values]):
+            try:
+                selections = selection_function(*values)
+            except Exception:
+                selections = None
+            if isinstance(selections, numpy.ndarray) and selections.shape == shape:
+                return numpy.compress(selections.astype(bool), keys)
+        
         selected_keys = []
         for index in range(len(keys)):
             key = keys[index]
-            arguments = [None] * len(attributes)
-            for attr_index, attribute in enumerate(attributes):
-                arguments[attr_index] = values[attr_index][index]
+            arguments = [None] * len(values)
+            for attr_index, attribute_values in enumerate(values):
+                arguments[attr_index] = attribute_values[index]
             if selection_function(*arguments):
                 selected_keys.append(key)
-        return self._subset(selected_keys)
+        return selected_keys
+    
+    def where(self, *conditions):
+        """
+        Returns a subset view on this set, containing the
+        particles that meet all conditions. The conditions are made by
+        comparing :class:`AttributeReference` objects. The attribute 
+        values are retrieved once and the conditions are evaluated on
+        the numbers, the values to compare with are converted to
+        the units of the attributes.
+        
+        >>> from amuse.datamodel import Particles
+        >>> particles = Particles(3)
+        >>> particles.mass = [10.0, 20.0, 30.0] | units.kg
+        >>> mass = AttributeReference("mass")
+        >>> subset = particles.where((mass < 15.0 | units.kg) | (mass > 25.0 | units.kg))
+        >>> print subset.mass
+        [10.0, 30.0] kg
+        """
+        keys = self.get_all_keys_in_store()
+        
+        names = set()
+        for x in conditions:
+            names.update(x.get_attribute_names())
+        
+        values = {}
+        for name in names:
+            value = getattr(self, name)
+            if is_quantity(value):
+                values[name] = (value.number, value.unit)
+            else:
+                values[name] = (numpy.asarray(value), None)
+        
+        selections = numpy.ones(len(keys), dtype = bool)
+        for x in conditions:
+            selections &= x.evaluate(values)
+        return self._subset(numpy.compress(selections, keys))
         
     def select_array(self, selection_function, attributes = ()):
         """
@@ -1597,6 +1777,58 @@ class LinkedArray(numpy.ndarray):
                 raise exceptions.AmuseException("unkown type in link {0}, transfer link not implemented".format(type(x)))
                 
         return result
+    
+    def copy_with_particle_link_transfer(self, from_container, to_container, keys, particles):
+        """
+        Transfers the links in bulk, for arrays that only link to
+        particles (or contain None). The links to particles of the
+        from_container are replaced by the particles at the same
+        position in *particles* as the key of the particle in the
+        sorted *keys*. Returns None if the array also links to other
+        objects, use copy_with_link_transfer for these.
+        """
+        from amuse.datamodel.particles import Particle
+        
+        flattened = self.view(numpy.ndarray).ravel()
+        is_link = numpy.fromiter(
+            itertools.imap(operator.is_not, flattened, itertools.repeat(None)),
+            dtype='bool',
+            count=len(flattened)
+        )
+        links = flattened[is_link]
+        
+        if not all(issubclass(x, Particle) for x in set(map(type, links))):
+            return None
+        
+        if from_container is None:
+            must_transfer = numpy.ones(len(links), dtype='bool')
+        else:
+            particle_sets = map(operator.attrgetter("particles_set"), links)
+            ids = numpy.fromiter(itertools.imap(id, particle_sets), dtype='uint64', count=len(particle_sets))
+            unique_ids, first, inverse = numpy.unique(ids, return_index=True, return_inverse=True)
+            is_from_container = numpy.asarray(
+                [particle_sets[i]._original_set() is from_container for i in first],
+                dtype='bool'
+            )
+            must_transfer = is_from_container[inverse]
+        
+        transferred = links.copy()
+        if must_transfer.any():
+            indices = numpy.flatnonzero(must_transfer)
+            link_keys = numpy.asarray(map(operator.attrgetter("key"), links[indices]), dtype=keys.dtype)
+            positions = numpy.minimum(numpy.searchsorted(keys, link_keys), max(len(keys) - 1, 0))
+            if len(keys) > 0:
+                is_found = keys[positions] == link_keys
+            else:
+                is_found = numpy.zeros(len(link_keys), dtype='bool')
+            
+            transferred[indices[is_found]] = particles[positions[is_found]]
+            for index in indices[~is_found]:
+                transferred[index] = to_container._get_particle_unsave(links[index].key)
+        
+        result = numpy.empty(len(flattened), dtype='object')
+        result[is_link] = transferred
+        return LinkedArray(result.reshape(self.shape))
         
 
     def as_set(self):
@@ -8,10 +8,12 @@ from amuse.units.quantities import VectorQuantity
 from amuse.units.quantities import new_quantity
 from amuse.units.quantities import zero
 from amuse.units.quantities import column_stack
+from amuse.units.quantities import is_quantity
 from amuse.support import exceptions
 from amuse.datamodel.base import *
 from amuse.datamodel.memory_storage import *
 import numpy
+import itertools
 
 from amuse.datamodel import indexing
 
@@ -114,9 +116,9 @@ class AbstractGrid(AbstractSet):
         
     def samplePoints(self, positions=None, method="nearest", **kwargs):
         if method in ["nearest"]:
-            return SamplePointsOnGrid(self, positions, SamplePointOnCellCenter, **kwargs)
-        elif method in ["interpolation", "linear"]:
-            return SamplePointsOnGrid(self, positions, SamplePointWithInterpolation, **kwargs)
+            return SamplePointsOnGrid(self, positions, SamplePointOnCellCenter, method, **kwargs)
+        elif method in ["interpolation", "linear", "conservative"]:
+            return SamplePointsOnGrid(self, positions, SamplePointWithInterpolation, method, **kwargs)
         else:
             raise Exception("unknown sample method")
 
@@ -889,97 +891,235 @@ class SamplePointWithInterpolation(object):
         
 
 class SamplePointsOnGrid(object):
+    """
+    Samples the attributes of a regular grid at many points at once.
+    The cells and weights of all points are calculated with array
+    operations when the sampler is created, an attribute is sampled
+    by combining the values of the cells for all points at once.
+
+    The method can be:
+
+    * "nearest", the value of the cell containing the point
+    * "linear" (or "interpolation"), the (tri)linear interpolation between
+      the centers of the 2**d cells surrounding the point
+    * "conservative", the overlap of a cell sized cloud centered
+      on the point with the cells (cloud in cell). Inside the grid these 
+      weights are the same as the linear weights, near the boundaries
+      the weights of the cells outside the grid are left out and the 
+      other weights are scaled to sum to one.
+
+    Points outside the grid are left out of the samples, for the
+    linear interpolation also the points beyond the centers of the
+    outer cells.
+
+    >>> from amuse.datamodel import new_regular_grid
+    >>> grid = new_regular_grid((5,5,5), [10.0, 10.0, 10.0] | units.m)
+    >>> grid.mass = grid.x.value_in(units.m) | units.kg
+    >>> samples = grid.samplePoints([[3.5,3.0,3.0], [4.5,3.0,3.0]] | units.m, method="linear")
+    >>> print samples.mass
+    [3.5, 4.5] kg
+    """
     
-    def __init__(self, grid, points=None, samples_factory = SamplePointWithInterpolation, **kwargs):
+    def __init__(self, grid, points=None, samples_factory = SamplePointWithInterpolation, method = None, **kwargs):
         self.grid = grid
-        points=self.grid._get_array_of_positions_from_arguments(pos=points,**kwargs)
-        self.samples = [samples_factory(grid, x) for x in points]
-        self.samples = [x for x in self.samples if x.isvalid ]
+        self.samples_factory = samples_factory
+        if method is None:
+            method = "nearest" if samples_factory is SamplePointOnCellCenter else "linear"
+        self.method = method
+        
+        points = self.grid._get_array_of_positions_from_arguments(pos=points, **kwargs)
+        if len(points.shape) == 1:
+            points = points.reshape((1, -1))
+        
+        cellsize = self.grid.cellsize()
+        unit = cellsize.unit
+        self.number_of_dimensions = len(cellsize)
+        self.shape = numpy.asarray(self.grid.shape[:self.number_of_dimensions])
+        
+        positions = points.value_in(unit)[:, :self.number_of_dimensions]
+        minimum_position = self.grid.get_minimum_position().value_in(unit)[:self.number_of_dimensions]
+        scaled_positions = (positions - minimum_position) / cellsize.value_in(unit)
+        
+        index = numpy.floor(scaled_positions).astype(numpy.int)
+        is_inside = numpy.logical_and(numpy.all(index >= 0, axis=1), numpy.all(index < self.shape, axis=1))
+        
+        if self.method == "nearest":
+            self.is_valid = is_inside
+        elif self.method in ["linear", "interpolation", "conservative"]:
+            # positions relative to the center of the first cell
+            scaled_positions -= 0.5
+            index_for_000_cell = numpy.floor(scaled_positions).astype(numpy.int)
+            if self.method == "conservative":
+                self.is_valid = is_inside
+            else:
+                self.is_valid = numpy.logical_and(
+                    numpy.all(index_for_000_cell >= 0, axis=1), 
+                    numpy.all(index_for_000_cell + 1 < self.shape, axis=1)
+                )
+            self.index_for_000_cell = index_for_000_cell[self.is_valid]
+            self.fractions = scaled_positions[self.is_valid] - self.index_for_000_cell
+        else:
+            raise exceptions.AmuseException("unknown sample method {0!r}".format(self.method))
         
+        self.points = points[self.is_valid]
+        self.index = index[self.is_valid]
+    
+    @late
+    def translations(self):
+        return numpy.array(list(itertools.product([0, 1], repeat = self.number_of_dimensions)))
+    
+    @late
+    def surrounding_cell_indices(self):
+        """The indices of the 2**d cells used for every sample, not for the nearest method"""
+        return self.index_for_000_cell[:,numpy.newaxis,:] + self.translations
+    
+    @late
+    def weighing_factors(self):
+        """The weights of the surrounding cells of every sample, not for the nearest method"""
+        result = numpy.empty((len(self.points), len(self.translations)))
+        for i, translation in enumerate(self.translations):
+            result[:,i] = numpy.where(translation == 1, self.fractions, 1.0 - self.fractions).prod(axis=1)
+        
+        if self.method == "conservative":
+            indices = self.surrounding_cell_indices
+            is_inside = numpy.logical_and(numpy.all(indices >= 0, axis=2), numpy.all(indices < self.shape, axis=2))
+            result[~is_inside] = 0.0
+            result /= result.sum(axis=1)[:,numpy.newaxis]
+        return result
+    
+    def get_values_of_attribute(self, name_of_the_attribute):
+        values = getattr(self.grid, name_of_the_attribute)
+        if is_quantity(values):
+            unit = values.unit
+            values = values.number
+        else:
+            unit = None
+        
+        if self.method == "nearest":
+            result = values[tuple(self.index.T)]
+        else:
+            # the weights of the points are combined per surrounding cell,
+            # clipping keeps the cells with a zero weight in the grid
+            weighing_factors = self.weighing_factors
+            shape_of_the_weights = (len(self.points),) + (1,) * (len(values.shape) - self.number_of_dimensions)
+            result = 0.0
+            for i, translation in enumerate(self.translations):
+                indices = numpy.clip(self.index_for_000_cell + translation, 0, self.shape - 1)
+                result = result + weighing_factors[:,i].reshape(shape_of_the_weights) * values[tuple(indices.T)]
+        
+        if unit is None:
+            return result
+        else:
+            return unit.new_quantity(result)
+    
+    @late
+    def position(self):
+        if self.method == "nearest":
+            return self.get_values_of_attribute("position")
+        else:
+            return self.points
+    
     @late
     def indices(self):
-        for x in self.samples:
-            yield x.index
+        return self.index
             
     @late
     def positions(self):
-        for x in self.samples:
-            yield x.position
+        return self.position
         
     def __getattr__(self, name_of_the_attribute):
-        result = quantities.AdaptingVectorQuantity()
-        for x in self.samples:
-            result.append(getattr(x, name_of_the_attribute))
-        return result
+        if name_of_the_attribute.startswith('__'):
+            raise AttributeError(name_of_the_attribute)
+        return self.get_values_of_attribute(name_of_the_attribute)
     
     def __iter__(self):
-        for x in len(self):
+        for x in range(len(self)):
             yield self[x]
     
     def __getitem__(self, index):
-        return self.samples[index]
+        return self.samples_factory(self.grid, self.points[index])
     
     def __len__(self):
-        return len(self.samples)
+        return len(self.points)
 
 class SamplePointsOnMultipleGrids(object):
+    """
+    Samples the attributes of a set of grids at many points. The
+    grid of every point is found first (with the index made by
+    index_factory or else by testing the grids in order, the first grid 
+    containing the point is used), the points of each grid are then 
+    sampled at once with a SamplePointsOnGrid. The samples are in
+    the order of the points, points outside the grids are left out.
+    """
     
-    def __init__(self, grids, points, samples_factory = SamplePointWithInterpolation, index_factory = None):
+    def __init__(self, grids, points, samples_factory = SamplePointWithInterpolation, index_factory = None, method = None):
         self.grids = grids
         self.points = points
         self.samples_factory = samples_factory
+        self.method = method
         if index_factory is None:
             self.index = None
         else:
             self.index = index_factory(self.grids)
+    
+    def _grids_for_points(self, points):
+        if self.index is None:
+            result = -numpy.ones(len(points), dtype=numpy.int)
+            for index_of_grid in range(len(self.grids)-1, -1, -1):
+                result[self.grids[index_of_grid].contains(points)] = index_of_grid
+            return result
+        else:
+            return self.index.grids_for_points(points)
         
     def _grid_for_point(self, point):
-        if self.index is None:
-            for grid in self.grids:
-                if (numpy.all(point >= grid.get_minimum_position()) and
-                     numpy.all(point < grid.get_maximum_position())):
-                    return grid
-            return None 
+        index_of_grid = self._grids_for_points(point.reshape((1,-1)))[0]
+        if index_of_grid < 0:
+            return None
         else:
-            return self.index.grid_for_point(point)
+            return self.grids[index_of_grid]
+    
+    @late
+    def samplers(self):
+        """
+        The samplers of the grids and the positions of their samples 
+        in the samples of all grids
+        """
+        index_of_grid = self._grids_for_points(self.points)
+        
+        samplers = []
+        is_valid = numpy.zeros(len(self.points), dtype=bool)
+        for i in numpy.unique(index_of_grid[index_of_grid >= 0]):
+            selection = numpy.flatnonzero(index_of_grid == i)
+            sampler = SamplePointsOnGrid(self.grids[i], self.points[selection], self.samples_factory, self.method)
+            is_valid[selection[sampler.is_valid]] = True
+            samplers.append((sampler, selection[sampler.is_valid]))
+        
+        position_in_samples = numpy.cumsum(is_valid) - 1
+        self.is_selected = numpy.ones(numpy.sum(is_valid), dtype=bool)
+        return [(sampler, position_in_samples[x]) for sampler, x in samplers]
     
     def filterout_duplicate_indices(self):
-        previous_grid = None
-        previous_index = None  
-        filteredout = [] 
-        for x in self.samples:
-            if x.grid is previous_grid and numpy.all(x.index == previous_index):
-                pass
-            else:
-                previous_grid= x.grid
-                previous_index = x.index
-                filteredout.append(x)
-        self.samples = filteredout
+        """Removes the samples in the same cell as the sample before it"""
+        samplers = self.samplers
+        grid_and_index = numpy.zeros((len(self.is_selected), 4), dtype=numpy.int)
+        for index_of_grid, (sampler, positions) in enumerate(samplers):
+            grid_and_index[positions, 0] = index_of_grid
+            grid_and_index[positions, 1:1+sampler.number_of_dimensions] = sampler.index
+        is_duplicate = numpy.all(grid_and_index[1:] == grid_and_index[:-1], axis=1)
+        self.is_selected[1:][is_duplicate] = False
+        self.__dict__.pop('samples', None)
         
     def get_samples(self):
-        result = []
-        for x in self.points:
-            grid = self._grid_for_point(x)
-            if grid is None:
-                continue
-            sample = self.samples_factory(grid, x)
-            if not sample.isvalid:
-                continue
-            result.append(sample)
-        return result
+        return self.samples
         
     @late
     def samples(self):
-        result = []
-        for x in self.points:
-            grid = self._grid_for_point(x)
-            if grid is None:
-                continue
-            sample = self.samples_factory(grid, x)
-            if not sample.isvalid:
-                continue
-            result.append(sample)
-        return result
+        samplers = self.samplers
+        result = [None] * len(self.is_selected)
+        for sampler, positions in samplers:
+            for i, position in enumerate(positions):
+                result[position] = sampler[i]
+        return [x for x, is_selected in zip(result, self.is_selected) if is_selected]
         
     @late
     def indices(self):
@@ -990,27 +1130,57 @@ class SamplePointsOnMultipleGrids(object):
     def positions(self):
         for x in self.samples:
             yield x.position
+    
+    def get_values_of_attribute(self, name_of_the_attribute):
+        result = None
+        for sampler, positions in self.samplers:
+            values = getattr(sampler, name_of_the_attribute)
+            if result is None:
+                if is_quantity(values):
+                    unit = values.unit
+                    result = numpy.empty((len(self.is_selected),) + values.shape[1:], dtype=values.number.dtype)
+                else:
+                    unit = None
+                    result = numpy.empty((len(self.is_selected),) + values.shape[1:], dtype=values.dtype)
+            if unit is None:
+                result[positions] = values
+            else:
+                result[positions] = values.value_in(unit)
         
+        if result is None:
+            return quantities.AdaptingVectorQuantity()
+        
+        result = result[self.is_selected]
+        if unit is None:
+            return result
+        else:
+            return unit.new_quantity(result)
+    
     def __getattr__(self, name_of_the_attribute):
-        self.get_samples()
-        result = quantities.AdaptingVectorQuantity()
-        for x in self.samples:
-            result.append(getattr(x, name_of_the_attribute))
-        return result
+        if name_of_the_attribute.startswith('__'):
+            raise AttributeError(name_of_the_attribute)
+        return self.get_values_of_attribute(name_of_the_attribute)
     
     def __iter__(self):
-        for x in len(self):
+        for x in range(len(self)):
             yield self[x]
     
     def __getitem__(self, index):
         return self.samples[index]
     
     def __len__(self):
-        return len(self.samples)
+        self.samplers
+        return numpy.sum(self.is_selected)
         
         
 
 class NonOverlappingGridsIndexer(object):
+    """
+    Index of grids that do not overlap, to find the grid of a point.
+    The volume of the grids is divided into boxes the size of the smallest
+    grid, every box stores the index of the grid it is in (or -1).
+    The grids must be aligned on these boxes.
+    """
         
     def __init__(self, grids):
         self.grids = grids
@@ -1034,35 +1204,40 @@ class NonOverlappingGridsIndexer(object):
                 smallest_boxsize = boxsize.minimum(smallest_boxsize)
             
         self.smallest_boxsize = smallest_boxsize
-        max_index = [0,0,0]
+        max_index = numpy.zeros(len(smallest_boxsize), dtype=numpy.int)
         
         for x in self.grids:
-            index = (x.get_maximum_position() / smallest_boxsize)
-            index = numpy.floor(index).astype(numpy.int)
-            max_index = numpy.where(index > max_index, index, max_index)
+            index = ((x.get_maximum_position() - self.minimum_position) / smallest_boxsize)
+            index = numpy.round(index).astype(numpy.int)
+            max_index = numpy.maximum(index, max_index)
             
-        self.grids_on_index = numpy.zeros(max_index, 'int')
+        self.grids_on_index = -numpy.ones(max_index, 'int')
         
         for index,x in enumerate(self.grids):
             bottom_left = x.get_minimum_position()
-            index_of_grid = (bottom_left / smallest_boxsize)
+            index_of_grid = ((bottom_left - self.minimum_position) / smallest_boxsize)
             size = ((x.get_maximum_position() - x.get_minimum_position()) / smallest_boxsize)
-            i,j,k = numpy.floor(index_of_grid).astype(numpy.int)
-            ni,nj,nk = numpy.floor(size).astype(numpy.int)
-            self.grids_on_index[i:i+ni,j:j+nj,k:k+nk] = index
-        
+            start = numpy.round(index_of_grid).astype(numpy.int)
+            end = start + numpy.round(size).astype(numpy.int)
+            self.grids_on_index[tuple([slice(i, j) for i, j in zip(start, end)])] = index
         
     def grid_for_point(self, position):
-        index = ((position - self.minimum_position) / self.smallest_boxsize)
-        index = numpy.floor(index).astype(numpy.int)
-        index_of_grid = self.grids_on_index[tuple(index)]
+        index_of_grid = self.grids_for_points(position.reshape((1,-1)))[0]
+        if index_of_grid < 0:
+            return None
         return self.grids[index_of_grid]
         
     def grids_for_points(self, points):
+        """Returns the index of the grid of every point, -1 for points outside the grids"""
         index = ((points - self.minimum_position) / self.smallest_boxsize)
         index = numpy.floor(index).astype(numpy.int)
-        index_of_grid = self.grids_on_index[tuple(index)]
-        return self.grids[index_of_grid]
+        is_inside = numpy.logical_and(
+            numpy.all(index >= 0, axis=1), 
+            numpy.all(index < self.grids_on_index.shape, axis=1)
+        )
+        result = -numpy.ones(len(points), dtype=numpy.int)
+        result[is_inside] = self.grids_on_index[tuple(index[is_inside].T)]
+        return result
 
 
 # convenience function to convert input arguments to positions (or vector of "points")
@@ -985,9 +985,15 @@ class InCodeAttributeStorage(AbstractInCodeAttributeStorage):
             request = ASyncRequestSequence(new_request, args=(setters,attributes, values, indices_in_the_code))
         else:
             for setter in setters:
-                request = setter.set_attribute_values(self, attributes, values, indices_in_the_code)
+                request = setter.set_attribute_values_async(self, attributes, values, indices_in_the_code)
         return request
     
+    def is_async_get_supported(self, attributes):
+        return all(getattr(x.method, "is_async_supported", False) for x in self.select_getters_for(attributes))
+    
+    def is_async_set_supported(self, attributes):
+        return all(getattr(x.method, "is_async_supported", False) for x in self.select_setters_for(attributes))
+    
 
     def remove_particles_from_store(self, indices_in_the_code):
         if indices_in_the_code is None:
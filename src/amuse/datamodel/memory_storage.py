@@ -18,6 +18,7 @@ except BaseException as ex:
   _SIMPLE_HASH_PRESENT_=False
 
 _PREFER_SORTED_KEYS_=True
+_PREFER_AMORTIZED_GROWTH_=False
 
 class InMemoryAttributeStorage(AttributeStorage):
     
@@ -467,8 +468,206 @@ class InMemoryAttributeStorageUseSimpleHash(InMemoryAttributeStorage):
 
 
 
+class InMemoryAttributeStorageUseAmortizedGrowth(InMemoryAttributeStorage):
+    """
+    Storage for sets that often grow or shrink by a few particles. The
+    attributes are stored in arrays with room for more particles (the
+    capacity is doubled when full), the keys are mapped to the rows in
+    a dictionary that is updated for the added and removed particles only.
+    Removed particles are marked as removed, the rows of removed
+    particles are removed (the storage is compacted) when more than half
+    of the rows are of removed particles. Indices are the rows of the
+    particles, these do not change until the next add or remove and
+    are the same in a copy of the storage.
+    
+    Used for all sets in memory if _PREFER_AMORTIZED_GROWTH_ is True,
+    or for one set with Particles(storage = InMemoryAttributeStorageUseAmortizedGrowth()).
+    """
+    
+    MINIMUM_CAPACITY = 16
+    
+    def __init__(self):
+        InMemoryAttributeStorage.__init__(self)
+        self.mapping_from_particle_to_index = {}
+        self.keys_in_rows = numpy.zeros(0, dtype='uint64')
+        self.is_removed = numpy.zeros(0, dtype='bool')
+        self.number_of_rows = 0
+        self.number_of_removed_rows = 0
+        self.all_rows = numpy.zeros(0, dtype='int64')
+        self._rows = None
+        
+    @property
+    def capacity(self):
+        return len(self.keys_in_rows)
+    
+    def add_particles_to_store(self, keys, attributes = [], quantities = []):
+        if len(quantities) != len(attributes):
+            raise exceptions.AmuseException(
+                "you need to provide the same number of quantities as attributes, found {0} attributes and {1} list of values".format(
+                    len(attributes), len(quantities)
+                )
+            )
+        if len(quantities) > 0 and len(keys) != len(quantities[0]):
+            raise exceptions.AmuseException(
+                "you need to provide the same number of values as particles, found {0} values and {1} particles".format(
+                    len(quantities[0]), len(keys)
+                )
+            )
+        
+        self.__version__ = self.__version__ + 1
+        
+        keys = numpy.array(keys, dtype='uint64').reshape(-1)
+        first = self.number_of_rows
+        last = first + len(keys)
+        if last > self.capacity:
+            self.increase_capacity(max(last, 2 * self.capacity, self.MINIMUM_CAPACITY))
+        
+        for attribute, values_to_set in zip(attributes, quantities):
+            storage = self.get_or_new_attribute(attribute, values_to_set, len(keys))
+            try:
+                storage.set_values(slice(first, last), values_to_set)
+            except Exception as ex:
+                raise AttributeError("exception in setting attribute '{0}', error was '{1}'".format(attribute, ex))
+        
+        self.keys_in_rows[first:last] = keys
+        self.mapping_from_particle_to_index.update(izip(keys, xrange(first, last)))
+        self.number_of_rows = last
+        self.update_rows()
+        return numpy.arange(first, last)
+        
+    def increase_capacity(self, capacity):
+        for attribute_values in self.mapping_from_attribute_to_quantities.itervalues():
+            attribute_values.increase_to_length(capacity)
+        
+        keys_in_rows = numpy.zeros(capacity, dtype='uint64')
+        keys_in_rows[:self.number_of_rows] = self.keys_in_rows[:self.number_of_rows]
+        self.keys_in_rows = keys_in_rows
+        
+        is_removed = numpy.zeros(capacity, dtype='bool')
+        is_removed[:self.number_of_rows] = self.is_removed[:self.number_of_rows]
+        self.is_removed = is_removed
+        
+        self.all_rows = numpy.arange(capacity)
+        
+    def get_or_new_attribute(self, attribute, values_to_set, number_of_values):
+        if attribute in self.mapping_from_attribute_to_quantities:
+            return self.mapping_from_attribute_to_quantities[attribute]
+        
+        if is_quantity(values_to_set):
+            shape = values_to_set.shape if values_to_set.is_vector() else ()
+        else:
+            shape = numpy.shape(values_to_set)
+        if len(shape) > 1 and shape[0] == number_of_values:
+            shape = (self.capacity,) + shape[1:]
+        else:
+            shape = self.capacity
+        storage = InMemoryAttribute.new_attribute(attribute, shape, values_to_set)
+        self.mapping_from_attribute_to_quantities[attribute] = storage
+        return storage
+    
+    def remove_particles_from_store(self, indices):
+        indices = numpy.asarray(indices, dtype='int64').reshape(-1)
+        mapping_from_particle_to_index = self.mapping_from_particle_to_index
+        for key in self.keys_in_rows[indices]:
+            del mapping_from_particle_to_index[key]
+        self.is_removed[indices] = True
+        self.number_of_removed_rows += len(indices)
+        
+        if 2 * self.number_of_removed_rows > self.number_of_rows:
+            self.compact()
+        
+        self.__version__ = self.__version__ + 1
+        self.update_rows()
+        
+    def compact(self):
+        removed_rows = numpy.flatnonzero(self.is_removed[:self.number_of_rows])
+        for attribute_values in self.mapping_from_attribute_to_quantities.itervalues():
+            attribute_values.remove_indices(removed_rows)
+        self.keys_in_rows = numpy.delete(self.keys_in_rows, removed_rows)
+        self.is_removed = numpy.zeros(len(self.keys_in_rows), dtype='bool')
+        self.all_rows = numpy.arange(len(self.keys_in_rows))
+        self.number_of_rows -= len(removed_rows)
+        self.number_of_removed_rows = 0
+        self.reindex()
+        
+    def reindex(self):
+        self.mapping_from_particle_to_index = dict(izip(self.keys_in_rows[:self.number_of_rows], xrange(self.number_of_rows)))
+    
+    def update_rows(self):
+        self._rows = None
+        
+    def get_rows(self):
+        """
+        the rows of the particles that are not removed
+        """
+        if self._rows is None:
+            if self.number_of_removed_rows == 0:
+                self._rows = self.all_rows[:self.number_of_rows]
+            else:
+                self._rows = numpy.flatnonzero(~self.is_removed[:self.number_of_rows])
+        return self._rows
+        
+    def __len__(self):
+        return self.number_of_rows - self.number_of_removed_rows
+        
+    def get_all_keys_in_store(self):
+        if self.number_of_removed_rows == 0:
+            return self.keys_in_rows[:self.number_of_rows]
+        else:
+            return self.keys_in_rows[self.get_rows()]
+            
+    def get_all_indices_in_store(self):
+        return self.get_rows()
+        
+    def get_values_in_store(self, indices, attributes):
+        if indices is None or indices is Ellipsis:
+            indices = self.get_rows()
+        return InMemoryAttributeStorage.get_values_in_store(self, indices, attributes)
+        
+    def set_values_in_store(self, indices, attributes, list_of_values_to_set):
+        if indices is None or indices is Ellipsis:
+            indices = self.get_rows()
+        for attribute, values_to_set in zip(attributes, list_of_values_to_set):
+            if not attribute in self.mapping_from_attribute_to_quantities:
+                number_of_values = numpy.size(numpy.arange(self.capacity)[indices])
+                self.get_or_new_attribute(attribute, values_to_set, number_of_values)
+        InMemoryAttributeStorage.set_values_in_store(self, indices, attributes, list_of_values_to_set)
+        
+    def has_key_in_store(self, key):
+        return key in self.mapping_from_particle_to_index
+        
+    def get_indices_of(self, keys):
+        if keys is None:
+            return self.get_rows()
+        
+        mapping_from_particle_to_index = self.mapping_from_particle_to_index
+        try:
+            return numpy.fromiter((mapping_from_particle_to_index[x] for x in keys), dtype='int64')
+        except KeyError:
+            keys = numpy.asarray(keys)
+            are_found = numpy.asarray([x in mapping_from_particle_to_index for x in keys], dtype='bool')
+            raise exceptions.KeysNotInStorageException(
+                keys[are_found], 
+                numpy.asarray([mapping_from_particle_to_index[x] for x in keys[are_found]], dtype='int64'),
+                keys[~are_found]
+            )
+    
+    def copy(self):
+        copy = type(self)()
+        for attribute, attribute_values in self.mapping_from_attribute_to_quantities.iteritems():
+            copy.mapping_from_attribute_to_quantities[attribute] = attribute_values.copy()
+        copy.mapping_from_particle_to_index = self.mapping_from_particle_to_index.copy()
+        copy.keys_in_rows = self.keys_in_rows.copy()
+        copy.is_removed = self.is_removed.copy()
+        copy.number_of_rows = self.number_of_rows
+        copy.number_of_removed_rows = self.number_of_removed_rows
+        copy.all_rows = self.all_rows.copy()
+        return copy
+        
 def get_in_memory_attribute_storage_factory():
-    if _SIMPLE_HASH_PRESENT_:
+    if _PREFER_AMORTIZED_GROWTH_:
+        return InMemoryAttributeStorageUseAmortizedGrowth
+    elif _SIMPLE_HASH_PRESENT_:
        return InMemoryAttributeStorageUseSimpleHash
     elif _PREFER_SORTED_KEYS_:
         return InMemoryAttributeStorageUseSortedKeys
@@ -595,7 +794,7 @@ class InMemoryVectorQuantityAttribute(InMemoryAttribute):
         return self.quantity[index]
 
     def remove_indices(self, indices):
-        self.quantity._number = numpy.delete(self.quantity.number, indices)
+        self.quantity._number = numpy.delete(self.quantity.number, indices, axis=0)
 
     def has_units(self):
         return True
@@ -647,7 +846,7 @@ class InMemoryUnitlessAttribute(InMemoryAttribute):
         return self.values[index]
 
     def remove_indices(self, indices):
-        self.values = numpy.delete(self.values, indices)
+        self.values = numpy.delete(self.values, indices, axis=0)
 
     def has_units(self):
         return False
@@ -725,7 +924,7 @@ class InMemoryLinkedAttribute(InMemoryAttribute):
         return value
 
     def remove_indices(self, indices):
-        self.values = numpy.delete(self.values, indices)
+        self.values = LinkedArray(numpy.delete(self.values, indices, axis=0))
 
     def has_units(self):
         return False
@@ -1,4 +1,6 @@
 import numpy
+import random
+import multiprocessing
 from collections import namedtuple
 
 from amuse.units import nbody_system
@@ -12,7 +14,8 @@ from amuse.units.quantities import new_quantity
 from amuse.units.quantities import zero
 
 from amuse.support import exceptions
-from amuse.ext.basicgraph import Graph, MinimumSpanningTreeFromEdges, MinimumSpanningTree
+from amuse.ext.basicgraph import Graph, MinimumSpanningTreeFromEdges
+from amuse.ext.octree import Octree, tree_potentials, euclidean_minimum_spanning_tree
 
 from amuse.datamodel import base
 from amuse.datamodel import rotation
@@ -215,12 +218,19 @@ def kinetic_energy(particles):
     return 0.5 * m_v_squared.sum()
 
 
-def potential_energy(particles, smoothing_length_squared = zero, G = constants.G):
+def potential_energy(particles, smoothing_length_squared = zero, G = constants.G,
+        method = "direct", opening_angle = 0.5, block_size = 0):
     """
     Returns the total potential energy of the particles in the particles set.
 
     :argument smooting_length_squared: gravitational softening, added to every distance**2.
     :argument G: gravitational constant, need to be changed for particles in different units systems
+    :argument method: "direct" (exact, loops over the particles), "direct-blocked"
+        (exact, numpy kernel on unitless arrays, processed in blocks of rows) or
+        "tree" (Barnes-Hut octree approximation)
+    :argument opening_angle: opening angle of the tree, only used for method "tree"
+    :argument block_size: number of rows per block for method "direct-blocked",
+        determined from the number of particles if 0
 
     >>> from amuse.datamodel import Particles
     >>> particles = Particles(2)
@@ -235,6 +245,14 @@ def potential_energy(particles, smoothing_length_squared = zero, G = constants.G
     if len(particles) < 2:
         return zero
 
+    if method == "direct-blocked":
+        return _potential_energy_direct_blocked(particles, smoothing_length_squared, G, block_size)
+    elif method == "tree":
+        return _potential_energy_tree(particles, smoothing_length_squared, G, opening_angle)
+    elif method != "direct":
+        raise exceptions.AmuseException("Unknown method '{0}' for potential_energy, "
+            "use 'direct', 'direct-blocked' or 'tree'".format(method))
+
     mass = particles.mass
     x_vector = particles.x
     y_vector = particles.y
@@ -258,6 +276,49 @@ def potential_energy(particles, smoothing_length_squared = zero, G = constants.G
 
     return G * sum_of_energies
 
+def _unitless_positions_and_masses(particles, smoothing_length_squared):
+    position = particles.position
+    mass = particles.mass
+    length_unit = position.unit
+    mass_unit = mass.unit
+    energy_unit = mass_unit ** 2 / length_unit
+    return (
+        position.value_in(length_unit),
+        mass.value_in(mass_unit),
+        smoothing_length_squared.value_in(length_unit ** 2),
+        energy_unit
+    )
+
+def _potential_energy_direct_blocked(particles, smoothing_length_squared, G, block_size = 0):
+    positions, masses, eps2, energy_unit = _unitless_positions_and_masses(particles, smoothing_length_squared)
+    n = len(masses)
+    if block_size == 0:
+        block_size = max(1, (100000 * 100) // n) #10m floats per block (block_size rows of n)
+
+    x, y, z = positions[:,0], positions[:,1], positions[:,2]
+    sum_of_energies = 0.0
+    for offset in range(0, n - 1, block_size):
+        end = min(offset + block_size, n)
+        dx = x[offset:end].reshape((-1, 1)) - x[offset:]
+        dy = y[offset:end].reshape((-1, 1)) - y[offset:]
+        dz = z[offset:end].reshape((-1, 1)) - z[offset:]
+        dr_squared = dx * dx
+        dr_squared += dy * dy
+        dr_squared += dz * dz
+        dr_squared += eps2
+        # only count every pair (i < j) once
+        dr_squared[numpy.tril_indices(end - offset, 0, n - offset)] = numpy.inf
+        m_m = masses[offset:end].reshape((-1, 1)) * masses[offset:]
+        sum_of_energies -= (m_m / numpy.sqrt(dr_squared)).sum()
+
+    return G * new_quantity(sum_of_energies, energy_unit)
+
+def _potential_energy_tree(particles, smoothing_length_squared, G, opening_angle = 0.5):
+    positions, masses, eps2, energy_unit = _unitless_positions_and_masses(particles, smoothing_length_squared)
+    potentials = tree_potentials(positions, masses, opening_angle = opening_angle,
+        smoothing_length_squared = eps2)
+    return G * new_quantity(-0.5 * (masses * potentials).sum(), energy_unit)
+
 def thermal_energy(particles):
     """
     Returns the total internal energy of the (gas)
@@ -713,7 +774,10 @@ def LagrangianRadii(stars, unit_converter=None, mf=[0.01,0.02,0.05,0.1,0.2,0.5,0
     
 def find_closest_particle_to(particles,x,y,z):
     """
-    return closest particle to x,y,z position
+    return closest particle to x,y,z position, or the closest particles 
+    (as a subset) if x, y and z are arrays. For one position the spatial
+    index is only used if it is already cached, otherwise the distances
+    to all particles are compared.
 
     >>> from amuse.datamodel import Particles
     >>> particles = Particles(2)
@@ -723,8 +787,17 @@ def find_closest_particle_to(particles,x,y,z):
     >>> print particles.find_closest_particle_to( -1 | units.m,0.| units.m,0.| units.m).x
     0.0 m
     """
-    d2=(particles.x-x)**2+(particles.y-y)**2+(particles.z-z)**2
-    return particles[d2.number.argmin()]
+    point = quantities.as_vector_quantity([x, y, z])
+    if len(point.shape) > 1:
+        indices, distances = particles.spatial_index().nearest(point.transpose())
+        return particles[indices[:, 0]]
+    
+    positions = particles.position
+    index = _get_cached_spatial_index(particles, positions)
+    if index is None:
+        return particles[((positions - point)**2).sum(axis=1).number.argmin()]
+    indices, distances = index.nearest(point.reshape((1, 3)))
+    return particles[indices[0, 0]]
 
 def potential_energy_in_field(particles, field_particles, smoothing_length_squared = zero, G = constants.G, just_potential = False):
     """
@@ -792,9 +865,13 @@ def nearest_neighbour(particles, neighbours=None, max_array_length=10000000):
     Returns the nearest neighbour of each particle in this set. If the 'neighbours'
     particle set is supplied, the search is performed on the neighbours set, for 
     each particle in the orignal set. Otherwise the nearest neighbour in the same 
-    set is searched.
+    set is searched. The set that is searched cannot be empty.
+
+    The search is done with the (cached) spatial index of the set that is searched,
+    see :func:`spatial_index`.
 
     :argument neighbours: the particle set in which to search for the nearest neighbour (optional)
+    :argument max_array_length: limits the size of the temporary arrays of the search
     
     >>> from amuse.datamodel import Particles
     >>> particles = Particles(3)
@@ -815,26 +892,129 @@ def nearest_neighbour(particles, neighbours=None, max_array_length=10000000):
     else:
         other_particles = neighbours
     
-    if len(particles) * len(other_particles) * 3 > max_array_length:
-        neighbour_indices = []
-        particles_per_batch = max(1, max_array_length // (3 * len(other_particles)))
-        number_of_batches = (len(particles) - 1) // particles_per_batch + 1
-        indices_in_each_batch = [numpy.arange(particles_per_batch) + i*particles_per_batch for i in range(number_of_batches-1)]
-        indices_in_each_batch.append(numpy.arange(indices_in_each_batch[-1][-1]+1, len(particles)))
-        for indices in indices_in_each_batch:
-            distances_squared = particles[indices].distances_squared(other_particles)
-            if neighbours is None:
-                diagonal_indices = [numpy.arange(len(indices)), indices]
-                distances_squared.number[diagonal_indices] = numpy.inf # can't be your own neighbour
-            neighbour_indices.append(distances_squared.argmin(axis=1))
-        return other_particles[numpy.concatenate(neighbour_indices)]
-    
-    distances_squared = particles.distances_squared(other_particles)
+    if len(other_particles) == 0 and len(particles) > 0:
+        raise exceptions.AmuseException("Cannot find the nearest neighbours in an empty particles set.")
+
+    block_size = max(1, max_array_length // (3 * 256))
     if neighbours is None:
-        diagonal_indices = [numpy.arange(len(particles))]*2
-        distances_squared.number[diagonal_indices] = numpy.inf # can't be your own neighbour
-    return other_particles[distances_squared.argmin(axis=1)]
+        indices, distances = particles.spatial_index().nearest(block_size = block_size)
+        # a particle without others is its own neighbour
+        indices = numpy.where(indices[:,0] < 0, numpy.arange(len(particles)), indices[:,0])
+    else:
+        indices, distances = other_particles.spatial_index().nearest(particles.position, block_size = block_size)
+        indices = indices[:,0]
+    return other_particles[indices]
+    
+
+class SpatialIndex(object):
+    """
+    Spatial index (octree) on the positions of a set of particles, answers
+    k-nearest neighbour, fixed radius and friends-of-friends queries in 
+    O(N log N). Get the (cached) index of a set with :func:`spatial_index`.
+    Queries return indices into the set.
+    
+    >>> from amuse.datamodel import Particles
+    >>> particles = Particles(3)
+    >>> particles.x = [1.0, 3.0, 4.0] | units.m
+    >>> particles.y = [0.0, 0.0, 0.0] | units.m
+    >>> particles.z = [0.0, 0.0, 0.0] | units.m
+    >>> indices, distances = particles.spatial_index().nearest()
+    >>> print indices[:,0]
+    [1 2 1]
+    """
+    
+    def __init__(self, positions, version = None, leaf_size = 8):
+        self.length_unit = positions.unit
+        self.positions = positions.value_in(self.length_unit).reshape((-1, 3))
+        self.version = version
+        self.tree = Octree(self.positions, leaf_size = leaf_size)
+    
+    def __len__(self):
+        return len(self.positions)
+    
+    def is_valid_for(self, version, positions):
+        """
+        The version of a set only changes when particles are added or removed,
+        the positions are compared as well.
+        """
+        if version != self.version or positions.shape != self.positions.shape:
+            return False
+        return numpy.array_equal(positions.value_in(self.length_unit), self.positions)
+    
+    def _points(self, positions):
+        return quantities.value_in(positions, self.length_unit).reshape((-1, 3))
+    
+    def nearest(self, positions = None, k = 1, block_size = 4096):
+        """
+        Returns the indices of the k nearest particles and the distances to these 
+        particles, as two (n, k) arrays, for every position. If no positions are 
+        given the nearest neighbours of the indexed particles are returned 
+        (excluding the particle itself). Missing neighbours have index -1.
+        """
+        if positions is None:
+            indices, d2 = self.tree.query_nearest(self.positions, k, 
+                exclude = numpy.arange(len(self)), block_size = block_size)
+        else:
+            indices, d2 = self.tree.query_nearest(self._points(positions), k, block_size = block_size)
+        return indices, new_quantity(numpy.sqrt(d2), self.length_unit)
+    
+    def within(self, radius, positions = None, block_size = 4096):
+        """
+        Returns all (position, particle) pairs with a distance smaller than or 
+        equal to the radius, as two arrays of indices. If no positions are 
+        given the indexed particles themselves are used (a particle is not
+        its own neighbour).
+        """
+        radius = quantities.value_in(radius, self.length_unit)
+        if positions is None:
+            i, j, d2 = self.tree.query_radius(self.positions, radius, block_size = block_size)
+            is_other = i != j
+            return i[is_other], j[is_other]
+        else:
+            i, j, d2 = self.tree.query_radius(self._points(positions), radius, block_size = block_size)
+            return i, j
     
+    def pairs_within(self, radius, block_size = 4096):
+        """
+        Returns all pairs (i < j) of indexed particles with a distance smaller 
+        than or equal to the radius, as two arrays of indices.
+        """
+        i, j, d2 = self.tree.pairs_within(quantities.value_in(radius, self.length_unit), block_size = block_size)
+        return i, j
+    
+    def friends_of_friends(self, linking_length, block_size = 4096):
+        """
+        Returns the group number of every indexed particle, particles closer 
+        than the linking length are in the same group.
+        """
+        return self.tree.friends_of_friends(quantities.value_in(linking_length, self.length_unit), block_size = block_size)
+
+def spatial_index(particles):
+    """
+    Returns the spatial index on the positions of the particles, see
+    :class:`SpatialIndex`. The index is cached on the set and is only rebuilt
+    when particles were added, removed or moved.
+    
+    >>> from amuse.datamodel import Particles
+    >>> particles = Particles(3)
+    >>> particles.x = [1.0, 3.0, 4.0] | units.m
+    >>> particles.y = [0.0, 0.0, 0.0] | units.m
+    >>> particles.z = [0.0, 0.0, 0.0] | units.m
+    >>> particles.spatial_index() is particles.spatial_index()
+    True
+    """
+    positions = particles.position
+    index = _get_cached_spatial_index(particles, positions)
+    if index is None:
+        index = SpatialIndex(positions, particles._get_version())
+        particles._private.cached_results.results["spatial_index"] = index
+    return index
+
+def _get_cached_spatial_index(particles, positions):
+    index = particles._private.cached_results.results.get("spatial_index", None)
+    if index is None or not index.is_valid_for(particles._get_version(), positions):
+        return None
+    return index
 
 def velocity_diff_squared(particles,field_particles):
     """
@@ -867,12 +1047,20 @@ def Qparameter(parts, distfunc=None):
     for a projection of the particle set.
     
     :argument distfunc:  distfunc is the distance function which can be used to select
-    the projection plane.
+    the projection plane. For the default (projection on the x-y plane) the minimum
+    spanning tree is calculated on the positions, without building the full graph.
 
     """
     if distfunc is None:
-      def distfunc(p,q):
-        return (((p.x-q.x)**2+(p.y-q.y)**2)**0.5).value_in(p.x.unit)
+      N=len(parts)
+      length_unit=parts.x.unit
+      positions=numpy.zeros((N,3))
+      positions[:,0]=parts.x.value_in(length_unit)
+      positions[:,1]=parts.y.value_in(length_unit)
+      first, second, lengths = euclidean_minimum_spanning_tree(positions)
+      ml=_mean_separation(positions)
+      mlmst=lengths.mean()/(N*numpy.pi)**0.5*(N-1)
+      return mlmst/ml
     N=len(parts)
   
     graph=Graph()
@@ -900,6 +1088,9 @@ def connected_components(parts, threshold=None, distfunc=None, verbose=False):
     return a list of connected component subsets of particles, connected if the distfunc
     is smaller than the threshold.
     
+    For the default (3D euclidean) distance function the components are found 
+    with a friends-of-friends search on the spatial index of the set.
+    
     :argument threshold: value of the threshold. Must have consistent units with distfunc
     :argument distfunc: distance or weight function. Must have consistent units with threshold
     """
@@ -907,8 +1098,17 @@ def connected_components(parts, threshold=None, distfunc=None, verbose=False):
       threshold=1. | parts.x.unit
     
     if distfunc is None:
-      def distfunc(p,q):
-        return (((p.x-q.x)**2+(p.y-q.y)**2+(p.z-q.z)**2)**0.5)
+      if verbose: print "making CC"
+      labels = parts.spatial_index().friends_of_friends(threshold)
+      order = numpy.argsort(labels, kind='mergesort')
+      boundaries = numpy.flatnonzero(numpy.diff(labels[order])) + 1
+      members = numpy.split(order, boundaries) if len(order) > 0 else []
+      # same order as the search below, last particle first
+      members.sort(key = lambda x : -x[-1])
+      cc = [parts[x] for x in members]
+      if verbose: print "done"
+      if verbose: print "number of CC:",len(cc)
+      return cc
   
     if verbose: print "making CC"
     tocheck=range(len(parts))
@@ -931,24 +1131,37 @@ def connected_components(parts, threshold=None, distfunc=None, verbose=False):
     if verbose: print "number of CC:",len(cc)
     return cc
 
+def _mean_separation(positions, max_array_length=10000000):
+    n = len(positions)
+    block_size = max(1, max_array_length // (3 * n))
+    total = 0.0
+    for offset in range(0, n - 1, block_size):
+        end = min(offset + block_size, n)
+        delta = positions[offset:end].reshape((-1, 1, 3)) - positions[offset:]
+        distances = numpy.sqrt((delta**2).sum(-1))
+        # only count every pair (i < j) once
+        distances[numpy.tril_indices(end - offset, 0, n - offset)] = 0.0
+        total += distances.sum()
+    return total / (n * (n - 1) / 2.0)
+
 def minimum_spanning_tree_length(particles):
     """
-    Calculates the length of the minimum spanning tree (MST) of a set of particles 
-    using David Eppstein's Python implemention of Kruskal's algorithm.
+    Calculates the length of the minimum spanning tree (MST) of a set of particles.
+    The tree is found with Boruvka's algorithm on the nearest neighbour graph of the
+    positions (see amuse.ext.octree.euclidean_minimum_spanning_tree).
     """
-    graph = Graph()
-    for particle in particles:
-        others = particles - particle
-        distances = (particle.position - others.position).lengths()
-        for other, distance in zip(others, distances):
-            graph.add_edge(particle, other, distance)
-    return sum([edge[0] for edge in MinimumSpanningTree(graph)], zero)
+    position = particles.position
+    first, second, lengths = euclidean_minimum_spanning_tree(position.value_in(position.unit))
+    return new_quantity(lengths.sum(), position.unit)
 
 MassSegregationRatioResults = namedtuple('MassSegregationRatioResults', 
     ['mass_segregation_ratio', 'uncertainty'])
 
+def _minimum_spanning_tree_length(positions):
+    return euclidean_minimum_spanning_tree(positions)[2].sum()
+
 def mass_segregation_ratio(particles, number_of_particles=20, number_of_random_sets=50, 
-        also_compute_uncertainty=False):
+        also_compute_uncertainty=False, number_of_processes=1):
     """
     Calculates the mass segregation ratio (Allison et al. 2009, MNRAS 395 1449).
     
@@ -963,12 +1176,29 @@ def mass_segregation_ratio(particles, number_of_particles=20, number_of_random_s
     :argument number_of_random_sets:  the number of randomly selected subsets for 
         which the MST is calculated to determine l_norm
     :argument also_compute_uncertainty: if True, a namedtuple is returned with (MSR, sigma) 
+    :argument number_of_processes: the MSTs of the random sets are divided over this 
+        number of processes (the random sets are drawn beforehand, so the result does 
+        not depend on the number of processes)
     """
     most_massive = particles.sorted_by_attribute("mass")[-number_of_particles:]
     l_massive = most_massive.minimum_spanning_tree_length()
-    l_norms = [] | particles.position.unit
-    for i in range(number_of_random_sets):
-        l_norms.append(particles.random_sample(number_of_particles).minimum_spanning_tree_length())
+    
+    position = particles.position
+    positions = position.value_in(position.unit)
+    random_sets = [random.sample(xrange(len(particles)), number_of_particles) for i in range(number_of_random_sets)]
+    random_positions = [positions[x] for x in random_sets]
+    
+    if number_of_processes > 1:
+        pool = multiprocessing.Pool(number_of_processes)
+        try:
+            lengths = pool.map(_minimum_spanning_tree_length, random_positions)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        lengths = map(_minimum_spanning_tree_length, random_positions)
+    
+    l_norms = new_quantity(numpy.array(lengths), position.unit)
     msr = l_norms.mean() / l_massive
     if also_compute_uncertainty:
         sigma = l_norms.std() / l_massive
@@ -1134,6 +1364,7 @@ AbstractParticleSet.add_global_function_attribute("LagrangianRadii", LagrangianR
 AbstractParticleSet.add_global_function_attribute("find_closest_particle_to", find_closest_particle_to)
 AbstractParticleSet.add_global_function_attribute("distances_squared", distances_squared)
 AbstractParticleSet.add_global_function_attribute("nearest_neighbour", nearest_neighbour)
+AbstractParticleSet.add_global_function_attribute("spatial_index", spatial_index)
 
 AbstractParticleSet.add_global_function_attribute("Qparameter", Qparameter)
 AbstractParticleSet.add_global_function_attribute("connected_components", connected_components)
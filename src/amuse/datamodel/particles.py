@@ -14,8 +14,10 @@ from amuse.units.quantities import is_quantity
 from amuse.units.quantities import as_vector_quantity
 from amuse.units.quantities import zero
 from amuse.units.quantities import AdaptingVectorQuantity
+from amuse.rfi.async_request import FakeASyncRequest
 
 import random
+import sys
 import numpy
 from numpy import ma
 
@@ -856,15 +858,22 @@ class AbstractParticleSet(AbstractSet):
 
         #values = self._get_values(keys, attributes) #fast but no vectors
         values = map(lambda x: getattr(self, x), attributes)
-        selected_keys = []
-        for index in range(len(keys)):
-            key = keys[index]
-            arguments = [None] * len(attributes)
-            for attr_index, attribute in enumerate(attributes):
-                arguments[attr_index] = values[attr_index][index]
-            if selection_function(*arguments):
-                selected_keys.append(key)
-        return self._subset(selected_keys)
+        return self._subset(self._selected_keys(selection_function, keys, values))
+    
+    def _children_index(self):
+        """
+        Returns the (cached) index from the parents to the children
+        of the particles in this set. The index is made again after
+        particles are added or removed or the parents are set.
+        """
+        version = (self._get_version(), self._get_parents_version())
+        cached_results = self._private.cached_results.results
+        index = cached_results.get("children_index", None)
+        if index is None or index.version != version:
+            keys = numpy.asarray(self.get_all_keys_in_store())
+            index = ChildrenIndex(keys, getattr(self, "parent"), version)
+            cached_results["children_index"] = index
+        return index
 
     def select_array(self, selection_function, attributes = ()):
         """
@@ -1125,6 +1134,7 @@ class Particles(AbstractParticleSet):
         AbstractParticleSet.__init__(self)
 
         self._private.version = 0
+        self._private.parents_version = 0
         self._private.is_working_copy = is_working_copy
 
         if storage is None:
@@ -1207,6 +1217,9 @@ class Particles(AbstractParticleSet):
     def _get_version(self):
         return self._private.version
 
+    def _get_parents_version(self):
+        return self._private.parents_version
+
     def __iter__(self):
         keys =  self.get_all_keys_in_store()
         indices = self.get_all_indices_in_store()
@@ -1328,6 +1341,7 @@ class Particles(AbstractParticleSet):
 
     def remove_attribute_from_store(self, name):
         self._private.attribute_storage.remove_attribute_from_store(name)
+        self._update_parents_version([name])
         
     def add_particles_to_store(self, keys, attributes = [], values = []):
         self._private.attribute_storage.add_particles_to_store(keys, attributes, values)
@@ -1367,10 +1381,18 @@ class Particles(AbstractParticleSet):
 
     def set_values_in_store(self, indices, attributes, values):
         self._private.attribute_storage.set_values_in_store(indices, attributes, values)
+        self._update_parents_version(attributes)
 
     def set_values_in_store_async(self, indices, attributes, values):
+        self._update_parents_version(attributes)
         return self._private.attribute_storage.set_values_in_store_async(indices, attributes, values)
 
+    def _update_parents_version(self, attributes):
+        for x in attributes:
+            if x == "parent" or x.endswith("__parent"):
+                self._private.parents_version += 1
+                break
+
     def get_attribute_names_defined_in_store(self):
         return self._private.attribute_storage.get_defined_attribute_names()
 
@@ -1559,6 +1581,7 @@ class ParticlesSuperset(AbstractParticleSet):
         self._private.indices = numpy.arange(self._private.length)
         self._private.keys = self._get_concatenated_keys_in_store()
         self._private.key_to_index = {}
+        self._private.indices_in_sets = None
 
         d = self._private.key_to_index
         index = 0
@@ -1591,6 +1614,9 @@ class ParticlesSuperset(AbstractParticleSet):
 
         return self._private.version
 
+    def _get_parents_version(self):
+        return numpy.sum([x._get_parents_version() for x in self._private.particle_sets])
+
 
     def __getitem__(self, index):
         self._ensure_updated_set_properties()
@@ -1654,37 +1680,122 @@ class ParticlesSuperset(AbstractParticleSet):
         return split_sets, split_indices
 
 
-    def _split_indices_over_sets(self, indices):
+    def _get_indices_in_sets(self):
+        """
+        Returns the offsets of the sets in the superset, the indices
+        in the store of every set and the indices of all particles split
+        over the sets. These are kept until the version of the superset changes.
+        """
         self._ensure_updated_set_properties()
 
-        split_sets = [ [] for x in self._private.particle_sets ]
-        split_indices = [ [] for x in self._private.particle_sets ]
+        if self._private.indices_in_sets is None:
+            offsets = [0]
+            indices_in_store = []
+            split_indices = []
+            for x in self._private.particle_sets:
+                indices_in_store.append(numpy.array(x.get_all_indices_in_store()))
+                split_indices.append(numpy.arange(offsets[-1], offsets[-1] + len(indices_in_store[-1])))
+                offsets.append(offsets[-1] + len(indices_in_store[-1]))
+            self._private.indices_in_sets = (offsets, indices_in_store, split_indices)
+
+        return self._private.indices_in_sets
+
+    def _split_indices_over_sets(self, indices):
+        offsets, indices_in_store, indices_in_superset = self._get_indices_in_sets()
 
-        offset = 0
         if isinstance(indices, set):
             indices = numpy.array(list(indices))
 
         if indices is None or isinstance(indices,EllipsisType):
-            offset = 0
-
-            for setindex, x in enumerate(self._private.particle_sets):
-                split_sets[setindex] = x.get_all_indices_in_store()
-                split_indices[setindex] = numpy.arange(offset, offset + len(x))
-                offset = offset + len(x)
+            split_sets = list(indices_in_store)
+            split_indices = list(indices_in_superset)
         elif len(indices) == 0:
-            for setindex, x in enumerate(self._private.particle_sets):
-                split_sets[setindex] = []
-                split_indices[setindex] = []
+            split_sets = [ [] for x in self._private.particle_sets ]
+            split_indices = [ [] for x in self._private.particle_sets ]
         else:
+            indices = numpy.asarray(indices)
+            split_sets = []
+            split_indices = []
             result_indices_array = numpy.arange(len(indices))
-            for setindex, x in enumerate(self._private.particle_sets):
-                mask = numpy.logical_and( (indices >= offset) , (indices < (offset + len(x))) )
-                indices_in_store = numpy.asarray(x.get_all_indices_in_store())
-                split_sets[setindex] = indices_in_store[(indices-offset)[mask]]
-                split_indices[setindex] = result_indices_array[mask]
-                offset = offset + len(x)
+            for offset, end, indices_in_store_of_set in zip(offsets[:-1], offsets[1:], indices_in_store):
+                mask = numpy.logical_and( (indices >= offset) , (indices < end) )
+                split_sets.append(indices_in_store_of_set[(indices-offset)[mask]])
+                split_indices.append(result_indices_array[mask])
         return split_sets, split_indices
 
+    def _get_code_of_set(self, particle_set, name_of_the_method, attributes):
+        """
+        Returns the code storing the attributes of the set, or None if
+        the set does not store these attributes directly in a code or the
+        code does not support asynchronous calls of the method.
+        """
+        if isinstance(particle_set, ParticlesMaskedSubset) or not isinstance(particle_set, (Particles, ParticlesSubset)):
+            return None
+
+        particles = particle_set._original_set()
+        if not isinstance(particles, Particles):
+            return None
+
+        storage = particles._private.attribute_storage
+        code = getattr(storage, "code_interface", None)
+        if code is None:
+            return None
+
+        # derived attributes are only handled by the synchronous get
+        missing_attributes = set(attributes) - set(particles.get_attribute_names_defined_in_store()) - set(["index_in_code"])
+        if len(missing_attributes) > 0:
+            return None
+
+        if name_of_the_method == "get_values_in_store":
+            is_supported = storage.is_async_get_supported(attributes)
+        else:
+            is_supported = storage.is_async_set_supported(attributes)
+
+        return code if is_supported else None
+
+    def _call_on_sets(self, name_of_the_method, sets_and_arguments, attributes):
+        """
+        Calls the get or set method on every set and returns the results.
+        Sets stored in different codes are handled concurrently, the
+        requests are send to all codes before waiting for the answers.
+        Requests to the same code are send one after the other.
+        """
+        requests = []
+        last_request_to_code = {}
+        try:
+            for particle_set, arguments in sets_and_arguments:
+                code = self._get_code_of_set(particle_set, name_of_the_method, attributes)
+                if code is None:
+                    request = FakeASyncRequest(getattr(particle_set, name_of_the_method)(*arguments))
+                else:
+                    if id(code) in last_request_to_code:
+                        last_request_to_code[id(code)].wait()
+                    request = getattr(particle_set, name_of_the_method + "_async")(*arguments)
+                    if request is None:
+                        request = FakeASyncRequest()
+                    last_request_to_code[id(code)] = request
+                requests.append(request)
+        except:
+            # the codes cannot handle new requests before the answers are received
+            self._wait_for_requests(requests)
+            raise
+
+        return self._wait_for_requests(requests)
+
+    def _wait_for_requests(self, requests):
+        results = []
+        exception_info = None
+        for request in requests:
+            try:
+                results.append(request.result())
+            except:
+                results.append(None)
+                if exception_info is None:
+                    exception_info = sys.exc_info()
+        if not exception_info is None:
+            raise exception_info[0], exception_info[1], exception_info[2]
+        return results
+
 
 
     def add_particles_to_store(self, keys, attributes = [], values = []):
@@ -1707,18 +1818,23 @@ class ParticlesSuperset(AbstractParticleSet):
     def get_values_in_store(self, indices, attributes):
         split_indices_in_subset, split_indices_in_input = self._split_indices_over_sets(indices)
 
-        indices_and_values = []
-
-        for indices_in_subset, indices_in_input, set in zip(split_indices_in_subset, split_indices_in_input, self._private.particle_sets):
-            if len(indices_in_subset) > 0:
-                values_for_set = set.get_values_in_store(indices_in_subset, attributes)
-                indices_and_values.append( (indices_in_input, values_for_set) )
-
         if indices is None or isinstance(indices, EllipsisType):
             resultlength = len(self)
+            offsets = self._get_indices_in_sets()[0]
+            # the particles of a set are stored in one block of the result
+            split_indices_in_input = [slice(start, end) for start, end in zip(offsets[:-1], offsets[1:])]
         else:
             resultlength = len(indices)
 
+        sets_and_arguments = []
+        indices_in_result = []
+        for indices_in_subset, indices_in_input, set in zip(split_indices_in_subset, split_indices_in_input, self._private.particle_sets):
+            if len(indices_in_subset) > 0:
+                sets_and_arguments.append( (set, (indices_in_subset, attributes)) )
+                indices_in_result.append(indices_in_input)
+
+        indices_and_values = zip(indices_in_result, self._call_on_sets("get_values_in_store", sets_and_arguments, attributes))
+
         values = [[]] * len(attributes)
         units = [None] * len(attributes)
         converts = [lambda x : x] * len(attributes)
@@ -1736,12 +1852,15 @@ class ParticlesSuperset(AbstractParticleSet):
                         units[valueindex] = quantity.unit
                     shape = list(quantity.shape)
                     shape[0] = resultlength
-                    resultvalue = numpy.zeros(shape,dtype=dtype)
+                    resultvalue = numpy.empty(shape,dtype=dtype)
                     values[valueindex] = resultvalue
 
                 resultunit = units[valueindex]
                 if not resultunit is None:
-                    resultvalue[indices] = quantity.value_in(resultunit)
+                    if quantity.unit is resultunit:
+                        resultvalue[indices] = quantity.number
+                    else:
+                        resultvalue[indices] = quantity.value_in(resultunit)
                 else:
                     current_dtype = quantity.dtype
                     result_dtype = resultvalue.dtype
@@ -1755,11 +1874,10 @@ class ParticlesSuperset(AbstractParticleSet):
     def set_values_in_store(self, indices, attributes, values):
         split_indices_in_subset, split_indices_in_input = self._split_indices_over_sets(indices)
         if indices is None or indices is Ellipsis:
-            len_indices = 0
-            for x in split_indices_in_subset:
-                len_indices += len(split_indices_in_subset)
+            len_indices = len(self)
         else:
             len_indices = len(indices)
+        sets_and_arguments = []
         for indices_in_subset, indices_in_input, set in zip(split_indices_in_subset, split_indices_in_input, self._private.particle_sets):
             quantities = [None] * len(attributes)
             for valueindex, quantity in enumerate(values):
@@ -1780,7 +1898,9 @@ class ParticlesSuperset(AbstractParticleSet):
                         numbers = numpy.take(quantity, indices_in_input)
                     quantities[valueindex] = numbers
 
-            set.set_values_in_store(indices_in_subset, attributes, quantities)
+            sets_and_arguments.append( (set, (indices_in_subset, attributes, quantities)) )
+
+        self._call_on_sets("set_values_in_store", sets_and_arguments, attributes)
 
     def get_attribute_names_defined_in_store(self):
         self._ensure_updated_set_properties()
@@ -1944,6 +2064,9 @@ class ParticlesSubset(AbstractParticleSet):
     def _get_version(self):
         return self._private.particles._get_version()
 
+    def _get_parents_version(self):
+        return self._private.particles._get_parents_version()
+
     def compressed(self):
         keys = self._private.keys
         return self._subset(keys[numpy.logical_and(keys > 0 ,  keys < 18446744073709551615L)])
@@ -2161,6 +2284,9 @@ class ParticlesMaskedSubset(ParticlesSubset):
     def _get_version(self):
         return self._private.particles._get_version()
 
+    def _get_parents_version(self):
+        return self._private.particles._get_parents_version()
+
     def unconverted_set(self):
         return ParticlesMaskedSubset(self._private.particles.unconverted_set(), self._private.keys)
 
@@ -2384,6 +2510,9 @@ class ParticlesOverlay(AbstractParticleSet):
     def _get_version(self):
         return self._private.overlay_set._get_version() +  self._private.base_set._get_version()
 
+    def _get_parents_version(self):
+        return self._private.overlay_set._get_parents_version() +  self._private.base_set._get_parents_version()
+
 
     def __getitem__(self, index):
         self._ensure_updated_set_properties()
@@ -2684,6 +2813,9 @@ class ParticlesWithFilteredAttributes(AbstractParticleSet):
     def _get_version(self):
         return self._private.base_set._get_version()
 
+    def _get_parents_version(self):
+        return self._private.base_set._get_parents_version()
+
     def __getitem__(self, index):
         keys = self.get_all_keys_in_store()[index]
 
@@ -2814,6 +2946,9 @@ class ParticlesWithUnitsConverted(AbstractParticleSet):
     def _get_version(self):
         return self._private.particles._get_version()
 
+    def _get_parents_version(self):
+        return self._private.particles._get_parents_version()
+
     def shallow_copy(self):
         copiedParticles =  self._private.particles.shallow_copy()
         return ParticlesWithUnitsConverted(copiedParticles, self._private.converter)
@@ -2990,6 +3125,9 @@ class ParticlesWithAttributesTransformed(AbstractParticleSet):
     def _get_version(self):
         return self._private.particles._get_version()
 
+    def _get_parents_version(self):
+        return self._private.particles._get_parents_version()
+
     def shallow_copy(self):
         copiedParticles =  self._private.particles.shallow_copy()
         return ParticlesWithUnitsConverted(copiedParticles, self._private.converter)
@@ -3113,6 +3251,34 @@ class ParticleInformationChannel(object):
         self.to_indices = self.to_particles.get_indices_of_keys(self.keys)
         self.from_version = self.from_particles._get_version()
         self.to_version = self.to_particles._get_version()
+        self._particles_in_target = None
+
+    def _get_particles_in_target(self):
+        # particles of the target set for the (sorted) keys, only created
+        # when links are copied, and reused until the sets change
+        if self._particles_in_target is None:
+            result = numpy.empty(len(self.keys), dtype='object')
+            for i, key in enumerate(self.keys):
+                result[i] = self.to_particles._get_particle_unsave(key)
+            self._particles_in_target = result
+        return self._particles_in_target
+
+    def _transfer_links(self, values):
+        converted = []
+        for x in values:
+            if isinstance(x, LinkedArray):
+                transferred = x.copy_with_particle_link_transfer(
+                    self.from_particles,
+                    self.to_particles,
+                    self.keys,
+                    self._get_particles_in_target()
+                )
+                if transferred is None:
+                    transferred = x.copy_with_link_transfer(self.from_particles, self.to_particles)
+                converted.append(transferred)
+            else:
+                converted.append(x)
+        return converted
 
 
     def reverse(self):
@@ -3151,13 +3317,7 @@ class ParticleInformationChannel(object):
             return
         
         values = self.from_particles.get_values_in_store(self.from_indices, attributes)
-        
-        converted = []
-        for x in values:
-            if isinstance(x, LinkedArray):
-                converted.append(x.copy_with_link_transfer(self.from_particles, self.to_particles))
-            else:
-                converted.append(x)
+        converted = self._transfer_links(values)
         self.to_particles.set_values_in_store(self.to_indices, target_names, converted)
 
     def copy_attributes_async(self, attributes, target_names = None, async_get = True, async_set = False):
@@ -3180,25 +3340,14 @@ class ParticleInformationChannel(object):
             request = self.from_particles.get_values_in_store_async(self.from_indices, attributes)
             def result_handler(inner):
                 values = inner()
-                converted = []
-                for x in values:
-                    if isinstance(x, LinkedArray):
-                        converted.append(x.copy_with_link_transfer(self.from_particles, self.to_particles))
-                    else:
-                        converted.append(x)
+                converted = self._transfer_links(values)
                 self.to_particles.set_values_in_store(self.to_indices, target_names, converted)
                 return converted
             request.add_result_handler(result_handler)
             return request
         elif async_set:
             values = self.from_particles.get_values_in_store(self.from_indices, attributes)
-            
-            converted = []
-            for x in values:
-                if isinstance(x, LinkedArray):
-                    converted.append(x.copy_with_link_transfer(self.from_particles, self.to_particles))
-                else:
-                    converted.append(x)
+            converted = self._transfer_links(values)
             request = self.to_particles.set_values_in_store_async(self.to_indices, target_names, converted)
             return request
 
@@ -3362,6 +3511,9 @@ class ParticlesWithNamespacedAttributesView(AbstractParticleSet):
     def _get_version(self):
         return self._private.particles._get_version()
 
+    def _get_parents_version(self):
+        return self._private.particles._get_parents_version()
+
     def shallow_copy(self):
         copiedParticles =  self._private.particles.shallow_copy()
         return ParticlesWithNamespacedAttributesView(
@@ -3472,6 +3624,37 @@ class DomainAttribute(DerivedAttribute):
 class Stars(Particles):
     pass
 
+class ChildrenIndex(object):
+    """
+    Index from the keys of the parents to the indices of their
+    children in a set, made from the parent attribute of the set.
+    """
+    
+    def __init__(self, keys, parents, version):
+        self.keys = keys
+        self.version = version
+        
+        is_child = numpy.array([isinstance(x, Particle) for x in parents], dtype=bool)
+        indices = numpy.flatnonzero(is_child)
+        parent_keys = numpy.array([x.key for x in parents[indices]], dtype=keys.dtype)
+        order = numpy.argsort(parent_keys, kind='mergesort')
+        self.parent_keys = parent_keys[order]
+        self.indices = indices[order]
+    
+    def indices_of_children(self, keys_of_parents):
+        """
+        Returns the indices of the children of the given parents, in 
+        the order of the set.
+        """
+        keys_of_parents = numpy.asarray(keys_of_parents, dtype=self.parent_keys.dtype)
+        start = numpy.searchsorted(self.parent_keys, keys_of_parents, side='left')
+        end = numpy.searchsorted(self.parent_keys, keys_of_parents, side='right')
+        if len(keys_of_parents) == 1:
+            result = self.indices[start[0]:end[0]]
+        else:
+            result = numpy.concatenate([self.indices[i:j] for i, j in zip(start, end)] + [numpy.zeros(0, dtype=self.indices.dtype)])
+        return numpy.sort(result)
+
 class Particle(object):
     """A physical object or a physical region simulated as a
     physical object (cloud particle).
@@ -3552,17 +3735,18 @@ class Particle(object):
             raise AttributeError("You tried to access attribute '{0}' but this attribute is not defined for this set.".format(name_of_the_attribute, ex))
 
     def children(self):
-        return self.particles_set.select(lambda x : x == self, ["parent"])
+        index = self.particles_set._children_index()
+        return self.particles_set._subset(index.keys[index.indices_of_children([self.key])])
 
     def descendents(self):
-        result = self.children()
-        stack = list(result)
-        while len(stack) > 0:
-            current = stack.pop()
-            children = current.children()
-            result = result.union(children)
-            stack.extend(children)
-        return result
+        index = self.particles_set._children_index()
+        is_descendent = numpy.zeros(len(index.keys), dtype=bool)
+        indices = index.indices_of_children([self.key])
+        while len(indices) > 0:
+            indices = indices[~is_descendent[indices]]
+            is_descendent[indices] = True
+            indices = index.indices_of_children(index.keys[indices])
+        return self.particles_set._subset(index.keys[is_descendent])
 
     def add_child(self, child):
         if self.particles_set != child.particles_set:
@@ -3777,6 +3961,9 @@ class UpdatingParticlesSubset(AbstractParticleSet):
     def _get_version(self):
         return self._private.particles._get_version()
 
+    def _get_parents_version(self):
+        return self._private.particles._get_parents_version()
+
 
 
     def compressed(self):
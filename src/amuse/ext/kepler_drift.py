@@ -0,0 +1,192 @@
+"""
+Kepler drift of many independent two-body systems
+
+this module provides:
+
+kepler_drift
+stumpff_C
+stumpff_S
+
+The relative orbits are advanced in the universal variable formulation,
+solving the universal Kepler equation with Laguerre's method (as the
+twobody code does for one pair), on arrays with one orbit per element.
+"""
+
+import numpy
+
+from amuse.units.quantities import is_quantity
+
+# below this |z| the Stumpff functions are evaluated with their series,
+# the closed forms lose precision (1 - cos(sqrt(z)) for small z)
+SERIES_LIMIT = 0.1
+NUMBER_OF_SERIES_TERMS = 7
+
+def _stumpff(z, closed_form_positive, closed_form_negative, first_factorial):
+    z = numpy.asarray(z, dtype='float64')
+    result = numpy.empty_like(z)
+
+    is_small = abs(z) < SERIES_LIMIT
+    zs = z[is_small]
+    term = numpy.ones_like(zs) / numpy.prod(numpy.arange(1.0, first_factorial + 1.0))
+    series = term.copy()
+    for k in range(1, NUMBER_OF_SERIES_TERMS):
+        n = first_factorial + 2 * k
+        term = term * -zs / ((n - 1) * n)
+        series += term
+    result[is_small] = series
+
+    is_positive = numpy.logical_and(z > 0, numpy.logical_not(is_small))
+    result[is_positive] = closed_form_positive(z[is_positive])
+    is_negative = numpy.logical_and(z < 0, numpy.logical_not(is_small))
+    result[is_negative] = closed_form_negative(z[is_negative])
+    return result
+
+def stumpff_C(z):
+    """
+    Returns the Stumpff function C(z) = (1 - cos(sqrt(z))) / z for
+    an array of z (series near z = 0)
+    """
+    return _stumpff(
+        z,
+        lambda z : (1 - numpy.cos(numpy.sqrt(z))) / z,
+        lambda z : -(numpy.cosh(numpy.sqrt(-z)) - 1) / z,
+        2
+    )
+
+def stumpff_S(z):
+    """
+    Returns the Stumpff function S(z) = (sqrt(z) - sin(sqrt(z))) / sqrt(z)**3
+    for an array of z (series near z = 0)
+    """
+    return _stumpff(
+        z,
+        lambda z : (numpy.sqrt(z) - numpy.sin(numpy.sqrt(z))) / numpy.sqrt(z)**3,
+        lambda z : (numpy.sinh(numpy.sqrt(-z)) - numpy.sqrt(-z)) / numpy.sqrt(-z)**3,
+        3
+    )
+
+def universal_kepler(xi, r0, vr0, smu, alpha):
+    z = alpha * xi**2
+    return (r0 * vr0 * xi**2 * stumpff_C(z) / smu +
+        (1 - alpha * r0) * xi**3 * stumpff_S(z) + r0 * xi)
+
+def universal_kepler_dxi(xi, r0, vr0, smu, alpha):
+    z = alpha * xi**2
+    return (r0 * vr0 * xi * (1 - alpha * xi**2 * stumpff_S(z)) / smu +
+        (1 - alpha * r0) * xi**2 * stumpff_C(z) + r0)
+
+def universal_kepler_dxidxi(xi, r0, vr0, smu, alpha):
+    return -alpha * universal_kepler(xi, r0, vr0, smu, alpha) + r0 * vr0 / smu + xi
+
+def initial_universal_anomaly(r0, vr0, smu, alpha, dt):
+    xi0 = smu * alpha * dt
+
+    is_hyperbolic = alpha < 0
+    mu = smu[is_hyperbolic]**2
+    a = alpha[is_hyperbolic]
+    sign = numpy.sign(dt[is_hyperbolic])
+    # this last formula is 4.5.11 in bate et al., fundamentals of astrodynamics
+    # with +1 in the logarithm
+    hyperbolic = sign / numpy.sqrt(-a) * numpy.log(1 - 2 * mu * dt[is_hyperbolic] * a /
+        ((vr0 * r0)[is_hyperbolic] + sign * smu[is_hyperbolic] / numpy.sqrt(-a) * (1 - r0[is_hyperbolic] * a)))
+    dxi0 = smu[is_hyperbolic] / r0[is_hyperbolic] * dt[is_hyperbolic]
+    xi0[is_hyperbolic] = numpy.where(abs(a * dxi0**2) < 1, dxi0, hyperbolic)
+    return xi0
+
+def solve_universal_kepler(xi0, r0, vr0, smu, alpha, dt, order = 4, tolerance = 1.e-14, maximum_number_of_iterations = 50):
+    """
+    Solves the universal Kepler equation with Laguerre's method, iterating
+    only on the elements that have not yet converged. Returns the universal
+    anomalies and an error code per element, 0 when converged, -1 when not
+    converged and -2 if a derivative was zero (xi0 is returned).
+    """
+    xi = xi0.copy()
+    errorcodes = -numpy.ones(len(xi), dtype='int32')
+    active = numpy.arange(len(xi))
+    for i in range(maximum_number_of_iterations):
+        if len(active) == 0:
+            break
+        x = xi[active]
+        arguments = (r0[active], vr0[active], smu[active], alpha[active])
+        fv = universal_kepler(x, *arguments) - smu[active] * dt[active]
+        dfv = universal_kepler_dxi(x, *arguments)
+        ddfv = universal_kepler_dxidxi(x, *arguments)
+
+        is_failed = numpy.logical_or(dfv == 0, ddfv == 0)
+        with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+            delta = -order * fv / (dfv + numpy.sign(dfv) *
+                numpy.sqrt(abs((order - 1)**2 * dfv**2 - order * (order - 1) * fv * ddfv)))
+        is_converged = numpy.logical_and(abs(delta) < tolerance, numpy.logical_not(is_failed))
+
+        xi[active] = numpy.where(is_failed, xi0[active], x + delta)
+        errorcodes[active[is_failed]] = -2
+        errorcodes[active[is_converged]] = 0
+        active = active[numpy.logical_not(numpy.logical_or(is_failed, is_converged))]
+    return xi, errorcodes
+
+def _kepler_drift(mu, position, velocity, dt):
+    n = len(position)
+    mu = numpy.ones(n) * mu
+    dt = numpy.ones(n) * dt
+    smu = numpy.sqrt(mu)
+
+    r0 = numpy.sqrt((position**2).sum(axis = 1))
+    v0 = numpy.sqrt((velocity**2).sum(axis = 1))
+    vr0 = (position * velocity).sum(axis = 1) / r0
+    alpha = 2. / r0 - v0**2 / mu
+
+    xi0 = initial_universal_anomaly(r0, vr0, smu, alpha, dt)
+    xi, errorcodes = solve_universal_kepler(xi0, r0, vr0, smu, alpha, dt)
+
+    z = alpha * xi**2
+    c = stumpff_C(z)
+    s = stumpff_S(z)
+    lagrange_f = 1. - xi**2 / r0 * c
+    lagrange_g = r0 * vr0 * (xi / smu)**2 * c - r0 * xi * z / smu * s + r0 * xi / smu
+    new_position = position * lagrange_f.reshape((-1,1)) + velocity * lagrange_g.reshape((-1,1))
+
+    r = numpy.sqrt((new_position**2).sum(axis = 1))
+    lagrange_dfdxi = xi / r0 * (z * s - 1)
+    lagrange_dgdxi = r0 * vr0 / smu * (xi / smu) * (1 - z * s) - z * r0 / smu * c + r0 / smu
+    new_velocity = (position * (smu / r * lagrange_dfdxi).reshape((-1,1)) +
+        velocity * (smu / r * lagrange_dgdxi).reshape((-1,1)))
+    return new_position, new_velocity
+
+def kepler_drift(mu, position, velocity, dt):
+    """
+    Advances many independent two-body orbits over a time dt. Returns the
+    new relative positions and velocities.
+
+    :argument mu: gravitational parameter G * (m1 + m2) of the orbits
+    :argument position: relative positions, one row per orbit
+    :argument velocity: relative velocities, one row per orbit
+    :argument dt: time to drift, one for all orbits or one per orbit
+
+    >>> from amuse.units import nbody_system
+    >>> position, velocity = kepler_drift(
+    ...     [1.0, 2.0] | nbody_system.length**3 / nbody_system.time**2,
+    ...     [[1.0, 0.0, 0.0], [2.0, 0.0, 0.0]] | nbody_system.length,
+    ...     [[0.0, 1.0, 0.0], [0.0, 1.0, 0.0]] | nbody_system.speed,
+    ...     numpy.pi | nbody_system.time)
+    >>> print position.value_in(nbody_system.length).round(6)
+    [[-1.  0.  0.]
+     [ 0.  2.  0.]]
+    """
+    if is_quantity(position):
+        length_unit = position.unit
+        time_unit = dt.unit
+        speed_unit = length_unit / time_unit
+        new_position, new_velocity = _kepler_drift(
+            mu.value_in(length_unit**3 / time_unit**2),
+            position.value_in(length_unit),
+            velocity.value_in(speed_unit),
+            dt.value_in(time_unit)
+        )
+        return length_unit.new_quantity(new_position), speed_unit.new_quantity(new_velocity).as_quantity_in(velocity.unit)
+    else:
+        return _kepler_drift(
+            numpy.asarray(mu, dtype='float64'),
+            numpy.asarray(position, dtype='float64'),
+            numpy.asarray(velocity, dtype='float64'),
+            numpy.asarray(dt, dtype='float64')
+        )
@@ -0,0 +1,512 @@
+"""
+Barnes-Hut octree on plain numpy arrays
+
+The tree is stored as a linear (Morton ordered) octree: the particles are
+sorted along a space filling curve, so every node corresponds to a
+contiguous range of the sorted particles. Nodes are built level by level
+and the tree walks process all (target, node) pairs of one level at
+once, so no python level recursion is done per particle.
+
+Besides the potential, the tree answers neighbour queries (k-nearest,
+fixed radius and friends-of-friends), it is the engine behind
+particle_attributes.SpatialIndex and of the euclidean minimum spanning
+tree used by particle_attributes.minimum_spanning_tree_length.
+
+All quantities are unitless, the caller is responsible for stripping
+the units (see particle_attributes.potential_energy).
+"""
+
+import numpy
+
+
+def _ranges(starts, counts):
+    """
+    Returns the concatenation of arange(start, start + count) for
+    every start, count pair.
+    """
+    counts = numpy.asarray(counts, dtype=numpy.int64)
+    total = counts.sum()
+    if total == 0:
+        return numpy.zeros(0, dtype=numpy.int64)
+    offsets = numpy.cumsum(counts) - counts
+    return numpy.repeat(starts - offsets, counts) + numpy.arange(total, dtype=numpy.int64)
+
+def _interleave_bits(i, j, k, number_of_bits):
+    result = numpy.zeros(len(i), dtype=numpy.int64)
+    for bit in range(number_of_bits):
+        result |= ((i >> bit) & 1) << (3 * bit + 2)
+        result |= ((j >> bit) & 1) << (3 * bit + 1)
+        result |= ((k >> bit) & 1) << (3 * bit)
+    return result
+
+def _connected_component_labels(number_of_points, first, second):
+    """
+    Returns a label for every point, points connected by the edges
+    (first[i], second[i]) get the same label. Labels are numbered
+    0 .. number_of_components - 1.
+    """
+    labels = numpy.arange(number_of_points)
+    while True:
+        first_labels = labels[first]
+        second_labels = labels[second]
+        lower = numpy.minimum(first_labels, second_labels)
+        higher = numpy.maximum(first_labels, second_labels)
+        is_changed = lower != higher
+        if not is_changed.any():
+            break
+        numpy.minimum.at(labels, higher[is_changed], lower[is_changed])
+        while True:
+            next_labels = labels[labels]
+            if numpy.array_equal(next_labels, labels):
+                break
+            labels = next_labels
+    return numpy.unique(labels, return_inverse=True)[1]
+
+class Octree(object):
+    """
+    Octree over a set of point masses.
+
+    :argument positions: (N, 3) array of positions
+    :argument masses: (N,) array of masses, unit masses if not given
+    :argument leaf_size: nodes with this many particles or less are not split
+    """
+    maximum_depth = 20
+
+    def __init__(self, positions, masses = None, leaf_size = 8):
+        self.positions = numpy.asarray(positions, dtype=numpy.float64).reshape((-1, 3))
+        if masses is None:
+            masses = numpy.ones(len(self.positions))
+        self.masses = numpy.asarray(masses, dtype=numpy.float64).reshape(-1)
+        self.leaf_size = max(1, int(leaf_size))
+        self.build()
+
+    def __len__(self):
+        return len(self.masses)
+
+    def build(self):
+        n = len(self.masses)
+        lower = self.positions.min(axis=0) if n > 0 else numpy.zeros(3)
+        upper = self.positions.max(axis=0) if n > 0 else numpy.ones(3)
+        size = (upper - lower).max()
+        if not size > 0:
+            size = 1.0
+        self.size = size * (1 + 1e-10)
+        self.lower = lower
+
+        depth = self.maximum_depth
+        keys = self.keys_of(self.positions)
+
+        self.order = numpy.argsort(keys, kind='mergesort')
+        keys = keys[self.order]
+        self.sorted_keys = keys
+        self.sorted_positions = self.positions[self.order]
+        self.sorted_masses = self.masses[self.order]
+
+        cumulative_mass = numpy.concatenate(([0.0], numpy.cumsum(self.sorted_masses)))
+        cumulative_moment = numpy.concatenate(
+            (numpy.zeros((1, 3)), numpy.cumsum(self.sorted_positions * self.sorted_masses[:, None], axis=0))
+        )
+        cumulative_position = numpy.concatenate(
+            (numpy.zeros((1, 3)), numpy.cumsum(self.sorted_positions, axis=0))
+        )
+
+        starts_per_level = []
+        ends_per_level = []
+        levels = []
+        is_leaf_per_level = []
+
+        starts = numpy.zeros(1 if n > 0 else 0, dtype=numpy.int64)
+        ends = numpy.asarray([n] if n > 0 else [], dtype=numpy.int64)
+        level = 0
+        while True:
+            is_leaf = ((ends - starts) <= self.leaf_size) | (level == depth)
+            starts_per_level.append(starts)
+            ends_per_level.append(ends)
+            levels.append(numpy.zeros(len(starts), dtype=numpy.int64) + level)
+            is_leaf_per_level.append(is_leaf)
+            if is_leaf.all():
+                break
+
+            level += 1
+            prefix = keys >> (3 * (depth - level))
+            boundaries = numpy.flatnonzero(numpy.concatenate(([True], prefix[1:] != prefix[:-1])))
+            child_starts = boundaries
+            child_ends = numpy.concatenate((boundaries[1:], [n]))
+            parent = numpy.searchsorted(starts, child_starts, side='right') - 1
+            keep = (parent >= 0) & (child_starts < ends[parent]) & ~is_leaf[parent]
+            starts = child_starts[keep]
+            ends = child_ends[keep]
+
+        offsets = numpy.cumsum([0] + [len(x) for x in starts_per_level])
+        first_child = []
+        number_of_children = []
+        for index, (starts, ends, is_leaf) in enumerate(zip(starts_per_level, ends_per_level, is_leaf_per_level)):
+            if index + 1 < len(starts_per_level):
+                child_starts = starts_per_level[index + 1]
+                first = numpy.searchsorted(child_starts, starts)
+                last = numpy.searchsorted(child_starts, ends)
+                first_child.append(first + offsets[index + 1])
+                number_of_children.append(numpy.where(is_leaf, 0, last - first))
+            else:
+                first_child.append(numpy.zeros(len(starts), dtype=numpy.int64))
+                number_of_children.append(numpy.zeros(len(starts), dtype=numpy.int64))
+
+        self.node_start = numpy.concatenate(starts_per_level)
+        self.node_end = numpy.concatenate(ends_per_level)
+        self.node_level = numpy.concatenate(levels)
+        self.node_first_child = numpy.concatenate(first_child).astype(numpy.int64)
+        self.node_number_of_children = numpy.concatenate(number_of_children).astype(numpy.int64)
+        self.node_width = self.size / (2.0 ** self.node_level)
+
+        self.node_mass = cumulative_mass[self.node_end] - cumulative_mass[self.node_start]
+        moment = cumulative_moment[self.node_end] - cumulative_moment[self.node_start]
+        centre = (cumulative_position[self.node_end] - cumulative_position[self.node_start]) / \
+            numpy.maximum(self.node_end - self.node_start, 1)[:, None]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            self.node_centre_of_mass = numpy.where(
+                self.node_mass[:, None] != 0,
+                moment / self.node_mass[:, None],
+                centre
+            )
+
+        self.level_offsets = offsets
+        self.node_lower = self.reduce_over_nodes(self.sorted_positions, numpy.minimum)
+        self.node_upper = self.reduce_over_nodes(self.sorted_positions, numpy.maximum)
+
+    def reduce_over_nodes(self, sorted_values, ufunc):
+        """
+        Returns the reduction (ufunc.reduce) of the values of the particles
+        in every node, the values must be given in the tree order.
+        """
+        result = numpy.zeros((len(self.node_start),) + sorted_values.shape[1:], dtype=sorted_values.dtype)
+        if len(sorted_values) == 0:
+            return result
+        leaves = numpy.flatnonzero(self.node_number_of_children == 0)
+        leaves = leaves[numpy.argsort(self.node_start[leaves])]
+        result[leaves] = ufunc.reduceat(sorted_values, self.node_start[leaves], axis=0)
+        offsets = self.level_offsets
+        for level in reversed(range(len(offsets) - 2)):
+            nodes = numpy.arange(offsets[level], offsets[level + 1])
+            parents = nodes[self.node_number_of_children[nodes] > 0]
+            if len(parents) == 0:
+                continue
+            children = slice(offsets[level + 1], offsets[level + 2])
+            first_child = self.node_first_child[parents] - offsets[level + 1]
+            result[parents] = ufunc.reduceat(result[children], first_child, axis=0)
+        return result
+
+    def keys_of(self, points):
+        """
+        Returns the Morton keys of the points, points outside the
+        root cell are clipped onto its boundary.
+        """
+        number_of_cells = 2 ** self.maximum_depth
+        cells = numpy.floor((points - self.lower) / self.size * number_of_cells)
+        cells = numpy.clip(cells, 0, number_of_cells - 1).astype(numpy.int64)
+        return _interleave_bits(cells[:,0], cells[:,1], cells[:,2], self.maximum_depth)
+
+    @property
+    def number_of_nodes(self):
+        return len(self.node_start)
+
+    def potentials(self, opening_angle = 0.5, smoothing_length_squared = 0.0, block_size = 4096):
+        """
+        Returns the potential (sum of m / sqrt(r**2 + eps**2), without
+        the minus sign and the gravitational constant) at the position of
+        every particle in the tree, caused by all other particles.
+
+        A node is accepted as a point mass when its width divided by the
+        distance to its centre of mass is smaller than the opening angle.
+        An opening angle of zero gives the exact direct sum.
+        """
+        n = len(self.masses)
+        result = numpy.zeros(n)
+        for offset in range(0, n, block_size):
+            targets = numpy.arange(offset, min(offset + block_size, n))
+            result[targets] = self._potentials_for_sorted_targets(targets, opening_angle, smoothing_length_squared)
+        potentials = numpy.empty(n)
+        potentials[self.order] = result
+        return potentials
+
+    def _potentials_for_sorted_targets(self, targets, opening_angle, smoothing_length_squared):
+        first_target = targets[0]
+        number_of_targets = len(targets)
+        result = numpy.zeros(number_of_targets)
+        opening_angle_squared = opening_angle ** 2
+
+        target_indices = targets
+        node_indices = numpy.zeros(number_of_targets, dtype=numpy.int64)
+        while len(target_indices) > 0:
+            delta = self.sorted_positions[target_indices] - self.node_centre_of_mass[node_indices]
+            distance_squared = (delta * delta).sum(axis=1)
+
+            contains_target = (target_indices >= self.node_start[node_indices]) & (target_indices < self.node_end[node_indices])
+            accept = ~contains_target & (self.node_width[node_indices] ** 2 < opening_angle_squared * distance_squared)
+            if accept.any():
+                result += numpy.bincount(
+                    target_indices[accept] - first_target,
+                    weights = self.node_mass[node_indices[accept]] / numpy.sqrt(distance_squared[accept] + smoothing_length_squared),
+                    minlength = number_of_targets
+                )
+
+            rejected = ~accept
+            is_leaf = self.node_number_of_children[node_indices] == 0
+
+            direct = rejected & is_leaf
+            if direct.any():
+                leaf_targets = target_indices[direct]
+                leaf_nodes = node_indices[direct]
+                counts = self.node_end[leaf_nodes] - self.node_start[leaf_nodes]
+                sources = _ranges(self.node_start[leaf_nodes], counts)
+                pair_targets = numpy.repeat(leaf_targets, counts)
+                not_self = sources != pair_targets
+                sources = sources[not_self]
+                pair_targets = pair_targets[not_self]
+                delta = self.sorted_positions[pair_targets] - self.sorted_positions[sources]
+                distance_squared = (delta * delta).sum(axis=1) + smoothing_length_squared
+                result += numpy.bincount(
+                    pair_targets - first_target,
+                    weights = self.sorted_masses[sources] / numpy.sqrt(distance_squared),
+                    minlength = number_of_targets
+                )
+
+            opened = rejected & ~is_leaf
+            parent_nodes = node_indices[opened]
+            counts = self.node_number_of_children[parent_nodes]
+            node_indices = _ranges(self.node_first_child[parent_nodes], counts)
+            target_indices = numpy.repeat(target_indices[opened], counts)
+        return result
+
+
+    def query_radius(self, points, radius, block_size = 4096):
+        """
+        Returns all (point, particle) pairs closer than or at the radius,
+        as three arrays: the indices of the points, the indices of the
+        particles (in the order the particles were given) and the
+        squared distances. The pairs are ordered by point index.
+
+        :argument radius: a single radius or one radius per point
+        """
+        points = numpy.asarray(points, dtype=numpy.float64).reshape((-1, 3))
+        radius_squared = numpy.zeros(len(points)) + numpy.asarray(radius, dtype=numpy.float64) ** 2
+        point_indices = []
+        particle_indices = []
+        distances_squared = []
+        if len(self) > 0:
+            for offset in range(0, len(points), block_size):
+                block = slice(offset, min(offset + block_size, len(points)))
+                i, j, d2 = self._pairs_for_points(points[block], radius_squared[block])
+                order = numpy.lexsort((j, i))
+                point_indices.append(i[order] + offset)
+                particle_indices.append(self.order[j[order]])
+                distances_squared.append(d2[order])
+        if len(point_indices) == 0:
+            return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0)
+        return numpy.concatenate(point_indices), numpy.concatenate(particle_indices), numpy.concatenate(distances_squared)
+
+    def _pairs_for_points(self, points, radius_squared, point_labels = None, labels = None):
+        """
+        When labels are given, only pairs of a point and a particle with
+        a different label are returned.
+        """
+        if not labels is None:
+            sorted_labels = labels[self.order]
+            node_minimum_label = self.reduce_over_nodes(sorted_labels, numpy.minimum)
+            node_maximum_label = self.reduce_over_nodes(sorted_labels, numpy.maximum)
+        query_indices = numpy.arange(len(points))
+        node_indices = numpy.zeros(len(points), dtype=numpy.int64)
+        point_indices = []
+        particle_indices = []
+        distances_squared = []
+        while len(query_indices) > 0:
+            positions = points[query_indices]
+            delta = numpy.maximum(self.node_lower[node_indices] - positions, 0.0)
+            delta += numpy.maximum(positions - self.node_upper[node_indices], 0.0)
+            is_near = (delta * delta).sum(axis=1) <= radius_squared[query_indices]
+            if not labels is None:
+                query_labels = point_labels[query_indices]
+                is_near &= ~((node_minimum_label[node_indices] == query_labels) & (node_maximum_label[node_indices] == query_labels))
+            query_indices = query_indices[is_near]
+            node_indices = node_indices[is_near]
+
+            is_leaf = self.node_number_of_children[node_indices] == 0
+            leaf_nodes = node_indices[is_leaf]
+            counts = self.node_end[leaf_nodes] - self.node_start[leaf_nodes]
+            sources = _ranges(self.node_start[leaf_nodes], counts)
+            targets = numpy.repeat(query_indices[is_leaf], counts)
+            delta = points[targets] - self.sorted_positions[sources]
+            d2 = (delta * delta).sum(axis=1)
+            is_inside = d2 <= radius_squared[targets]
+            if not labels is None:
+                is_inside &= sorted_labels[sources] != point_labels[targets]
+            point_indices.append(targets[is_inside])
+            particle_indices.append(sources[is_inside])
+            distances_squared.append(d2[is_inside])
+
+            parent_nodes = node_indices[~is_leaf]
+            counts = self.node_number_of_children[parent_nodes]
+            node_indices = _ranges(self.node_first_child[parent_nodes], counts)
+            query_indices = numpy.repeat(query_indices[~is_leaf], counts)
+        return numpy.concatenate(point_indices), numpy.concatenate(particle_indices), numpy.concatenate(distances_squared)
+
+    def query_nearest(self, points, k = 1, exclude = None, block_size = 4096):
+        """
+        Returns the indices of, and the squared distances to, the k
+        nearest particles of every point, as two (len(points), k) arrays.
+        Missing neighbours (fewer than k particles) have index -1 and
+        an infinite distance. Ties are resolved in favour of the particle
+        with the lowest index.
+
+        :argument exclude: for every point, the index of a particle that
+            may not be returned (the point itself, in a self query)
+        """
+        points = numpy.asarray(points, dtype=numpy.float64).reshape((-1, 3))
+        number_of_points = len(points)
+        indices = -numpy.ones((number_of_points, k), dtype=numpy.int64)
+        distances_squared = numpy.zeros((number_of_points, k)) + numpy.inf
+
+        number_of_candidates = len(self) - (0 if exclude is None else 1)
+        number_to_find = min(k, number_of_candidates)
+        if number_of_points == 0 or number_to_find <= 0:
+            return indices, distances_squared
+
+        # the k-th nearest of any k particles bounds the search radius, take
+        # the particles around the point along the space filling curve
+        window = min(len(self), max(2 * (number_to_find + 1), 16))
+        for offset in range(0, number_of_points, block_size):
+            block = slice(offset, min(offset + block_size, number_of_points))
+            block_points = points[block]
+            start = numpy.searchsorted(self.sorted_keys, self.keys_of(block_points)) - window // 2
+            start = numpy.clip(start, 0, len(self) - window)
+            candidates = start[:, None] + numpy.arange(window)
+            delta = self.sorted_positions[candidates] - block_points[:, None, :]
+            d2 = (delta * delta).sum(axis=2)
+            if not exclude is None:
+                d2[self.order[candidates] == exclude[block][:, None]] = numpy.inf
+            bound = numpy.partition(d2, number_to_find - 1, axis=1)[:, number_to_find - 1]
+
+            i, j, d2 = self._pairs_for_points(block_points, bound * (1 + 1e-12))
+            j = self.order[j]
+            if not exclude is None:
+                is_allowed = j != exclude[block][i]
+                i, j, d2 = i[is_allowed], j[is_allowed], d2[is_allowed]
+            order = numpy.lexsort((j, d2, i))
+            i, j, d2 = i[order], j[order], d2[order]
+            rank = numpy.arange(len(i)) - numpy.searchsorted(i, i)
+            is_selected = rank < number_to_find
+            i, j, d2, rank = i[is_selected], j[is_selected], d2[is_selected], rank[is_selected]
+            indices[i + offset, rank] = j
+            distances_squared[i + offset, rank] = d2
+        return indices, distances_squared
+
+    def pairs_within(self, radius, block_size = 4096):
+        """
+        Returns all pairs of particles (i < j) closer than or at the
+        radius, as three arrays (i, j, squared distance).
+        """
+        i, j, d2 = self.query_radius(self.positions, radius, block_size = block_size)
+        is_unique = i < j
+        return i[is_unique], j[is_unique], d2[is_unique]
+
+    def friends_of_friends(self, linking_length, block_size = 4096):
+        """
+        Returns a group label for every particle, particles closer than the
+        linking length to any member of a group are in the same group.
+        """
+        i, j, d2 = self.pairs_within(linking_length, block_size = block_size)
+        is_linked = d2 < linking_length ** 2
+        return _connected_component_labels(len(self), i[is_linked], j[is_linked])
+
+
+def tree_potentials(positions, masses, opening_angle = 0.5, smoothing_length_squared = 0.0, leaf_size = 8):
+    """
+    Returns the (positive, G=1) potential at the position of every
+    particle, computed with a Barnes-Hut octree.
+    """
+    return Octree(positions, masses, leaf_size = leaf_size).potentials(
+        opening_angle = opening_angle,
+        smoothing_length_squared = smoothing_length_squared
+    )
+
+
+def euclidean_minimum_spanning_tree(positions, number_of_neighbours = 10):
+    """
+    Returns the edges of the euclidean minimum spanning tree of the
+    points, as three arrays (i, j, length).
+
+    Boruvka's algorithm on the k-nearest neighbour graph: in every round
+    each component is joined to its nearest other component. When the
+    neighbour lists of a component do not prove which outgoing edge is
+    the shortest (all neighbours of some of its points are inside the
+    component), these points are searched in the tree, skipping the
+    nodes that only contain members of the component. So the result is
+    exact.
+    """
+    positions = numpy.asarray(positions, dtype=numpy.float64).reshape((-1, 3))
+    n = len(positions)
+    first = []
+    second = []
+    distances_squared = []
+    if n < 2:
+        return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0)
+
+    indices = numpy.arange(n)
+    tree = Octree(positions)
+    k = min(number_of_neighbours, n - 1)
+    neighbours, neighbour_distances_squared = tree.query_nearest(positions, k, exclude = indices)
+
+    labels = numpy.zeros(n, dtype=numpy.int64) + indices
+    number_of_components = n
+    smallest_distance_squared = (tree.size / 2 ** tree.maximum_depth) ** 2
+    while number_of_components > 1:
+        is_outside = labels[neighbours] != labels[:, None]
+        has_outside = is_outside.any(axis=1)
+        column = is_outside.argmax(axis=1)
+        candidate = neighbours[indices, column]
+        candidate_distance_squared = numpy.where(has_outside, neighbour_distances_squared[indices, column], numpy.inf)
+        lower_bound = numpy.where(has_outside, numpy.inf, neighbour_distances_squared[:, -1])
+
+        lower = numpy.minimum(indices, candidate)
+        higher = numpy.maximum(indices, candidate)
+        order = numpy.lexsort((higher, lower, candidate_distance_squared, labels))
+        is_first = numpy.concatenate(([True], labels[order][1:] != labels[order][:-1]))
+        best_point = order[is_first]
+        best_candidate = candidate[best_point]
+        best_distance_squared = candidate_distance_squared[best_point]
+
+        component_lower_bound = numpy.zeros(number_of_components) + numpy.inf
+        numpy.minimum.at(component_lower_bound, labels, lower_bound)
+        unresolved = numpy.flatnonzero(component_lower_bound <= best_distance_squared)
+        # search around the points of the unresolved components, for members
+        # of other components, with a growing radius
+        is_open = numpy.zeros(number_of_components, dtype=bool)
+        is_open[unresolved] = True
+        radius_squared = numpy.minimum(best_distance_squared, 4 * component_lower_bound)
+        while is_open.any():
+            points = numpy.flatnonzero(is_open[labels] & (lower_bound <= radius_squared[labels]))
+            i, j, d2 = tree._pairs_for_points(positions[points], radius_squared[labels[points]],
+                point_labels = labels[points], labels = labels)
+            i = numpy.concatenate((points[i], best_point))
+            j = numpy.concatenate((tree.order[j], best_candidate))
+            d2 = numpy.concatenate((d2, best_distance_squared))
+            component = labels[i]
+            order = numpy.lexsort((numpy.maximum(i, j), numpy.minimum(i, j), d2, component))
+            is_first = numpy.concatenate(([True], component[order][1:] != component[order][:-1]))
+            best = order[is_first]
+            best_point, best_candidate, best_distance_squared = i[best], j[best], d2[best]
+
+            is_open &= best_distance_squared > radius_squared
+            radius_squared[is_open] = numpy.maximum(4 * radius_squared[is_open], smallest_distance_squared)
+
+        lower = numpy.minimum(best_point, best_candidate)
+        higher = numpy.maximum(best_point, best_candidate)
+        edge_keys, unique = numpy.unique(lower * n + higher, return_index=True)
+        first.append(lower[unique])
+        second.append(higher[unique])
+        distances_squared.append(best_distance_squared[unique])
+
+        component_labels = _connected_component_labels(number_of_components, labels[lower[unique]], labels[higher[unique]])
+        labels = component_labels[labels]
+        number_of_components = component_labels.max() + 1
+
+    return numpy.concatenate(first), numpy.concatenate(second), numpy.sqrt(numpy.concatenate(distances_squared))
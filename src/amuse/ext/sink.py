@@ -25,6 +25,67 @@ def angular_momentum(mass,position,velocity):
     except:
       return mass * position.cross(velocity)
 
+def pairs_within_sink_radius(sink_positions, sink_radii, positions):
+    """
+    Returns the indices of the positions and of the sinks, and the squared
+    distances, for all pairs where the position lies within the sink radius.
+    Arguments are plain arrays (in the same unit). The positions are binned on
+    a spatial hash of cubic cells at least as large as the largest sink radius,
+    so only the positions in the 27 cells around a sink are checked.
+    """
+    empty = numpy.zeros(0, dtype='int64')
+    if len(sink_positions) == 0 or len(positions) == 0:
+        return empty, empty, numpy.zeros(0)
+
+    # only positions in the bounding box of the sinks can be within a sink radius
+    lower = (sink_positions - sink_radii.reshape((-1,1))).min(axis=0)
+    upper = (sink_positions + sink_radii.reshape((-1,1))).max(axis=0)
+    candidates = numpy.flatnonzero(((positions >= lower) & (positions <= upper)).all(axis=1))
+    if len(candidates) == 0:
+        return empty, empty, numpy.zeros(0)
+
+    # cells are larger than the sink radii and small enough for the
+    # cell coordinates to combine into one integer
+    cell_size = max(sink_radii.max(), (upper - lower).max() / 2**20)
+    if cell_size <= 0:
+        cell_size = 1.0
+    # the cells are padded by one on all sides, so the neighbours
+    # of a cell never wrap around
+    shape = numpy.floor((upper - lower) / cell_size).astype('int64') + 3
+    def cell_keys(cells):
+        return (cells[...,0] * shape[1] + cells[...,1]) * shape[2] + cells[...,2]
+
+    cells = numpy.floor((positions[candidates] - lower) / cell_size).astype('int64') + 1
+    keys = cell_keys(numpy.minimum(cells, shape - 2))
+    order = numpy.argsort(keys)
+    sorted_keys = keys[order]
+    sorted_candidates = candidates[order]
+
+    sink_cells = numpy.floor((sink_positions - lower) / cell_size).astype('int64') + 1
+    sink_keys = cell_keys(sink_cells)
+    position_indices = []
+    sink_indices = []
+    for offset in numpy.ndindex(3, 3, 3):
+        neighbour_keys = sink_keys + cell_keys(numpy.asarray(offset) - 1)
+        first = numpy.searchsorted(sorted_keys, neighbour_keys, side='left')
+        counts = numpy.searchsorted(sorted_keys, neighbour_keys, side='right') - first
+        has_positions = numpy.flatnonzero(counts)
+        if len(has_positions) == 0:
+            continue
+        counts = counts[has_positions]
+        # expand to one pair per position in the cell
+        starts = numpy.repeat(first[has_positions] - numpy.cumsum(counts) + counts, counts)
+        position_indices.append(sorted_candidates[starts + numpy.arange(len(starts))])
+        sink_indices.append(numpy.repeat(has_positions, counts))
+
+    if len(position_indices) == 0:
+        return empty, empty, numpy.zeros(0)
+    position_indices = numpy.concatenate(position_indices)
+    sink_indices = numpy.concatenate(sink_indices)
+    distances_squared = ((positions[position_indices] - sink_positions[sink_indices])**2).sum(axis=1)
+    is_within = distances_squared < sink_radii[sink_indices]**2
+    return position_indices[is_within], sink_indices[is_within], distances_squared[is_within]
+
 class SinkParticles(ParticlesOverlay):
 
     def __init__(self, original_particles, sink_radius=None, mass=None, position=None,
@@ -50,6 +111,8 @@ class SinkParticles(ParticlesOverlay):
     def accrete(self,orgparticles):
         if self._private.looping_over=="sinks":
           return self.accrete_looping_over_sinks(orgparticles)
+        elif self._private.looping_over=="cells":
+          return self.accrete_looping_over_cells(orgparticles)
         else:
           return self.accrete_looping_over_sources(orgparticles)
 
@@ -162,6 +225,81 @@ class SinkParticles(ParticlesOverlay):
             orgparticles.remove_particles(all_too_close)
         return all_too_close
 
+    def accrete_looping_over_cells(self, orgparticles):
+        if len(self) == 0:
+            return
+        length_unit = self.position.unit
+        sink_positions = self.position.value_in(length_unit)
+        sink_radii = self.sink_radius.value_in(length_unit)
+        sink_masses = self.mass.value_in(self.mass.unit)
+
+        sources = numpy.flatnonzero(numpy.logical_not(numpy.in1d(orgparticles.key, self.key)))
+        positions = orgparticles.position.value_in(length_unit)[sources]
+        source_indices, sink_indices, distances_squared = pairs_within_sink_radius(
+            sink_positions,
+            sink_radii,
+            positions
+        )
+        source_indices = sources[source_indices]
+
+        # a source within more than one sink radius goes to the sink with the strongest
+        # attraction (smallest d^2/m), order on the source and then on the attraction
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            weakness = distances_squared / sink_masses[sink_indices]
+        weakness[numpy.isnan(weakness)] = numpy.inf
+        order = numpy.lexsort((sink_indices, weakness, source_indices))
+        source_indices = source_indices[order]
+        is_first = numpy.ones(len(source_indices), dtype='bool')
+        is_first[1:] = source_indices[1:] != source_indices[:-1]
+        source_indices = source_indices[is_first]
+        sink_indices = sink_indices[order][is_first]
+
+        all_too_close = orgparticles[source_indices].copy()
+        if len(all_too_close):
+            self.aggregate_mass_of_sources(all_too_close, sink_indices)
+            orgparticles.remove_particles(all_too_close)
+        return all_too_close
+
+    def aggregate_mass_of_sources(self, sources, sink_indices):
+        """
+        Adds the sources to the sinks, *sink_indices* gives the index of the sink
+        of every source. The mass, momentum and angular momentum are summed over
+        the sources of every sink.
+        """
+        mass_unit = self.mass.unit
+        length_unit = self.position.unit
+        speed_unit = self.velocity.unit
+        angular_momentum_unit = self.angular_momentum.unit
+
+        m = self.mass.value_in(mass_unit)
+        pos = self.position.value_in(length_unit)
+        vel = self.velocity.value_in(speed_unit)
+        source_m = sources.mass.value_in(mass_unit)
+        source_pos = sources.position.value_in(length_unit)
+        source_vel = sources.velocity.value_in(speed_unit)
+
+        def sum_over_sinks(values):
+            if len(values.shape) == 1:
+                return numpy.bincount(sink_indices, weights = values, minlength = len(m))
+            else:
+                return numpy.column_stack([sum_over_sinks(x) for x in values.T])
+
+        total_mass = m + sum_over_sinks(source_m)
+        cmpos = (m.reshape((-1,1)) * pos + sum_over_sinks(source_m.reshape((-1,1)) * source_pos)) / total_mass.reshape((-1,1))
+        cmvel = (m.reshape((-1,1)) * vel + sum_over_sinks(source_m.reshape((-1,1)) * source_vel)) / total_mass.reshape((-1,1))
+        L = (
+            self.angular_momentum.value_in(mass_unit * length_unit * speed_unit) +
+            m.reshape((-1,1)) * numpy.cross(pos - cmpos, vel - cmvel) +
+            sum_over_sinks(source_m.reshape((-1,1)) * numpy.cross(source_pos - cmpos[sink_indices], source_vel - cmvel[sink_indices]))
+        )
+
+        has_sources = numpy.bincount(sink_indices, minlength = len(m)) > 0
+        sinks = self[has_sources]
+        sinks.mass = mass_unit.new_quantity(total_mass[has_sources])
+        sinks.position = length_unit.new_quantity(cmpos[has_sources])
+        sinks.velocity = speed_unit.new_quantity(cmvel[has_sources])
+        sinks.angular_momentum = (mass_unit * length_unit * speed_unit).new_quantity(L[has_sources]).as_quantity_in(angular_momentum_unit)
+
     def aggregate_mass(self,too_close):
         corrected_masses = AdaptingVectorQuantity()
         corrected_positions = AdaptingVectorQuantity()
@@ -263,6 +401,9 @@ class NonSphericalSinkParticles(SinkParticles):
     def accrete_looping_over_sources(self, orgparticles):
         raise AmuseException("Looping over sources not supported for non spherical sink particles")
 
+    def accrete_looping_over_cells(self, orgparticles):
+        raise AmuseException("Looping over cells not supported for non spherical sink particles")
+
 def new_sink_particles(original_particles, *list_arguments, **keyword_arguments):
     """
     Returns new sink particles. These are bound to the 'original_particles' in
@@ -276,6 +417,9 @@ def new_sink_particles(original_particles, *list_arguments, **keyword_arguments)
     :argument sink_radius: the radii of the sinks (default: original_particles.radius)
     :argument mass: masses of the sinks if not supplied by the original_particles (default: zero)
     :argument position: positions of the sinks if not supplied by the original_particles (default: the origin)
+    :argument looping_over: how to find the particles to accrete, "sinks" (default) or "sources"
+        loop over the sinks or the particles, "cells" bins the particles on a spatial hash
+        and accretes with array operations, fastest for many particles and sinks
     :argument shapes: the sink particles can be made non spherical by adding a
         shape object for each particle or a single shape for all particles.
         Note that this is slower then spherical accretion without a shape added.
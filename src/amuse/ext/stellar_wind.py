@@ -31,6 +31,83 @@ def kudritzki_wind_velocity(mass, radius, luminosity, temperature,
     return v_esc * numpy.select(condlist, choicelist)
 
 
+def hermite_interpolation(x, xs, ys, slopes):
+    """
+        Evaluates the piecewise cubic Hermite interpolant through the
+        points (xs, ys), with derivatives slopes, at x. The xs have to be
+        increasing and x is clipped to the range of xs.
+    """
+    x = numpy.clip(x, xs[0], xs[-1])
+    i = numpy.searchsorted(xs, x, side='right') - 1
+    i = numpy.clip(i, 0, len(xs) - 2)
+    h = xs[i+1] - xs[i]
+    s = (x - xs[i]) / h
+    return ((1. + 2. * s) * (1. - s)**2 * ys[i]
+            + s * (1. - s)**2 * h * slopes[i]
+            + s**2 * (3. - 2. * s) * ys[i+1]
+            + s**2 * (s - 1.) * h * slopes[i+1])
+
+
+class WindProfile(object):
+    """
+        Tabulated relation between the distance to the star and the time
+        the wind needs to get there, with radii in RSun, times in yr and
+        velocities in RSun/yr. Both directions are cubic Hermite
+        interpolations, using the velocity as the slope, beyond the table
+        the wind moves at the last velocity.
+
+        The profiles of many stars can be joined with concatenate, the
+        tables are then shifted in radius and time so that all of them can
+        be interpolated in one call (index selects the star).
+    """
+
+    def __init__(self, radius, time, velocity):
+        self.radius = radius
+        self.time = time
+        self.velocity = velocity
+        self.first = numpy.array([0])
+        self.last = numpy.array([len(radius) - 1])
+        self.radius_offset = numpy.zeros(1)
+        self.time_offset = numpy.zeros(1)
+
+    @classmethod
+    def concatenate(cls, profiles):
+        lengths = numpy.array([len(p.radius) for p in profiles])
+        last = numpy.cumsum(lengths) - 1
+        radius_offset = numpy.cumsum([0.] + [p.radius[-1] + 1. for p in profiles[:-1]])
+        time_offset = numpy.cumsum([0.] + [p.time[-1] + 1. for p in profiles[:-1]])
+
+        result = cls(
+            numpy.concatenate([p.radius + o for p, o in zip(profiles, radius_offset)]),
+            numpy.concatenate([p.time + o for p, o in zip(profiles, time_offset)]),
+            numpy.concatenate([p.velocity for p in profiles]))
+        result.first = last - lengths + 1
+        result.last = last
+        result.radius_offset = radius_offset
+        result.time_offset = time_offset
+        return result
+
+    def radius_from_time(self, time, index=0):
+        return self.interpolate(time, index, self.time, self.time_offset,
+                                self.radius, self.radius_offset,
+                                self.velocity)
+
+    def time_from_radius(self, radius, index=0):
+        return self.interpolate(radius, index, self.radius, self.radius_offset,
+                                self.time, self.time_offset,
+                                1. / self.velocity)
+
+    def interpolate(self, x, index, xs, x_offset, ys, y_offset, slopes):
+        first = self.first[index]
+        last = self.last[index]
+        x = numpy.asarray(x, dtype=float) + x_offset[index]
+
+        y = hermite_interpolation(numpy.clip(x, xs[first], xs[last]),
+                                  xs, ys, slopes)
+        y = y + slopes[last] * numpy.maximum(x - xs[last], 0.)
+        return y - y_offset[index]
+
+
 class PositionGenerator(object):
     def __init__(self, grid_type="regular", rotate=True):
         self.cube_generator = {
@@ -100,8 +177,7 @@ class PositionGenerator(object):
 
     def rotate_positions(self, positions, axis, angle):
         matrix = self.rotation_matrix(axis, angle)
-        rotated = [matrix.dot(p) for p in positions]
-        return numpy.asarray(rotated)
+        return numpy.dot(positions, matrix.transpose())
 
     def uniform_hollow_sphere(self, N, rmin):
         cube_sphere_ratio = 4/3. * numpy.pi * 0.5**3 * (1 - rmin**3)
@@ -148,6 +224,43 @@ class PositionGenerator(object):
 
         return position, unit_vectors
 
+    def generate_positions_for_stars(self, numbers, rmin, rmax,
+                                     radius_function=None, stars=None):
+        """
+            As generate_positions, for the particles of many stars at once;
+            numbers, rmin and rmax have one entry per star. The hollow
+            spheres are drawn per star, the distances to the stars are
+            derived for all particles in one call to
+            radius_function(x, rmax, stars, indices).
+
+            Returns the positions, the unit vectors and, per particle, the
+            index of its star.
+        """
+        indices = numpy.repeat(numpy.arange(len(numbers)), numbers)
+        ratios = 1. * rmin / rmax
+        positions = numpy.concatenate(
+            [self.uniform_hollow_sphere(N, ratio).reshape(-1, 3)
+             for N, ratio in zip(numbers, ratios)])
+        vector_lengths = numpy.sqrt((positions**2).sum(1))
+
+        unit_vectors = positions/self.as_three_vector(vector_lengths)
+
+        particle_rmin = rmin[indices]
+        particle_rmax = rmax[indices]
+        int_v_over_total = (((vector_lengths * particle_rmax)**3
+                             - particle_rmin**3)
+                            / (particle_rmax**3 - particle_rmin**3))
+
+        if radius_function is not None:
+            distance = radius_function(int_v_over_total, rmax, stars, indices)
+        else:
+            distance = (int_v_over_total * (particle_rmax - particle_rmin)
+                        + particle_rmin)
+
+        position = unit_vectors * self.as_three_vector(distance)
+
+        return position, unit_vectors, indices
+
 
 class StarsWithMassLoss(Particles):
     def __init__(self, *args, **kwargs):
@@ -441,54 +554,58 @@ class SimpleWind(PositionGenerator):
 
         return 0.5 * star.terminal_wind_velocity**2
 
-    def wind_sphere(self, star, Ngas):
-        wind = Particles(Ngas)
+    def wind_spheres(self, stars, numbers):
+        """
+            Creates the wind particles of all stars, numbers gives the
+            number of particles per star. Positions and velocities are
+            relative to the stars.
+        """
+        wind = Particles(numbers.sum())
 
-        wind_velocity = star.initial_wind_velocity
+        wind_velocity = stars.initial_wind_velocity
 
-        outer_wind_distance = star.radius + wind_velocity * (
-            self.model_time - star.wind_release_time)
+        outer_wind_distance = stars.radius + wind_velocity * (
+            self.model_time - stars.wind_release_time)
 
-        if self.r_max is not None and outer_wind_distance < self.r_max:
-            outer_wind_distance = self.r_max
+        if self.r_max is not None:
+            outer_wind_distance[outer_wind_distance < self.r_max] = self.r_max
 
-        wind.position, direction = self.generate_positions(
-            Ngas, star.radius, outer_wind_distance)
+        wind.position, direction, indices = self.generate_positions_for_stars(
+            numbers, stars.radius, outer_wind_distance)
 
         if self.compensate_gravity:
             r = wind.position.lengths()
-            escape_velocity_squared = 2. * constants.G * star.mass / r
-            speed = (wind_velocity**2 + escape_velocity_squared).sqrt()
-            wind.velocity = self.as_three_vector(speed) * direction
+            escape_velocity_squared = 2. * constants.G * stars.mass[indices] / r
+            speed = (wind_velocity[indices]**2 + escape_velocity_squared).sqrt()
         else:
-            wind.velocity = direction * wind_velocity
+            speed = wind_velocity[indices]
+        wind.velocity = self.as_three_vector(speed) * direction
 
         return wind
 
-    def create_wind_particles_for_one_star(self, star):
-        Ngas = int(star.lost_mass/self.sph_particle_mass)
-        star.lost_mass -= Ngas * self.sph_particle_mass
+    def internal_energies(self, stars, wind, indices):
+        return self.internal_energy_formula(stars[indices], wind)
 
-        wind = self.wind_sphere(star, Ngas)
+    def create_wind_particles(self):
+        stars = self.particles[self.particles.lost_mass > self.sph_particle_mass]
+        if len(stars) == 0:
+            return Particles(0)
 
-        wind.mass = self.sph_particle_mass
-        wind.u = self.internal_energy_formula(star, wind)
-        wind.position += star.position
-        wind.velocity += star.velocity
+        numbers = (stars.lost_mass / self.sph_particle_mass).astype(int)
+        stars.lost_mass -= numbers * self.sph_particle_mass
+        indices = numpy.repeat(numpy.arange(len(stars)), numbers)
 
-        if self.tag_gas_source:
-            wind.source = star.key
+        wind = self.wind_spheres(stars, numbers)
 
-        return wind
+        wind.mass = self.sph_particle_mass
+        wind.u = self.internal_energies(stars, wind, indices)
+        wind.position += stars.position[indices]
+        wind.velocity += stars.velocity[indices]
 
-    def create_wind_particles(self):
-        wind = Particles(0)
+        if self.tag_gas_source:
+            wind.source = stars.key[indices]
 
-        for star in self.particles:
-            if star.lost_mass > self.sph_particle_mass:
-                new_particles = self.create_wind_particles_for_one_star(star)
-                wind.add_particles(new_particles)
-                star.wind_release_time = self.model_time
+        stars.wind_release_time = self.model_time
 
         return wind
 
@@ -552,16 +669,24 @@ class AccelerationFunction(object):
     Abstact superclass of all acceleration functions.
     It numerically derives everything using acceleration_from_radius
     Overwrite as many of these functions with analitic solutions as possible.
+
+    radius_from_time and radius_from_number interpolate in a WindProfile,
+    tabulated per star from velocity_from_radius on profile_resolution
+    intervals out to profile_extent stellar radii. The profile is kept
+    until the radius, the wind velocities or the acceleration cutoff of
+    the star change.
     """
 
     def __init__(self):
         try:
-            from scipy import integrate, optimize
+            from scipy import integrate
             self.quad = integrate.quad
-            self.brentq = optimize.brentq
         except ImportError:
             self.quad = self.unsupported
-            self.brentq = self.unsupported
+
+        self.profile_resolution = 2000
+        self.profile_extent = 1e5
+        self.profiles = {}
 
     def unsupported(self, *args, **kwargs):
         raise AmuseException("Importing SciPy has failed")
@@ -588,29 +713,62 @@ class AccelerationFunction(object):
 
         return (2. * integral + star.initial_wind_velocity**2).sqrt()
 
-    def radius_from_time(self, time, star):
+    def profile_break_radii(self, star):
         """
+            Radii where the velocity profile has a kink, these are added
+            to the table.
+        """
+        acc_cutoff = getattr(star, "acc_cutoff", None)
+        if acc_cutoff is None:
+            return []
+        return [acc_cutoff.value_in(units.RSun)]
+
+    def new_wind_profile(self, star, break_radii):
+        """
+            Tabulates the travel time of the wind, the integral of 1/v
+            from the stellar surface, with Simpson's rule on intervals that
+            are logarithmic in the distance to the surface (the velocity
+            changes fastest just above the surface).
             following http://math.stackexchange.com/questions/54586/
             converting-a-function-for-velocity-vs-position-vx-to-position-vs-time
         """
+        start = star.radius.value_in(units.RSun)
+        height = numpy.logspace(-8., numpy.log10(self.profile_extent),
+                                self.profile_resolution)
+        radius = start * numpy.concatenate([[1.], 1. + height])
+        radius = numpy.union1d(radius, [r for r in break_radii
+                                        if start < r < radius[-1]])
+        midpoints = 0.5 * (radius[1:] + radius[:-1])
+
+        velocity = self.velocity_from_radius(
+            numpy.concatenate([radius, midpoints]) | units.RSun, star)
+        velocity = velocity.value_in(units.RSun/units.yr)
+        v, v_mid = velocity[:len(radius)], velocity[len(radius):]
+
+        dt = (radius[1:] - radius[:-1]) / 6. * (1./v[:-1] + 4./v_mid + 1./v[1:])
+        time = numpy.concatenate([[0.], numpy.cumsum(dt)])
+
+        return WindProfile(radius, time, v)
+
+    def wind_profile(self, star):
+        break_radii = self.profile_break_radii(star)
+        parameters = (star.radius.value_in(units.RSun),
+                      star.initial_wind_velocity.value_in(units.kms),
+                      star.terminal_wind_velocity.value_in(units.kms),
+                      tuple(break_radii))
+
+        if star.key in self.profiles:
+            profile_parameters, profile = self.profiles[star.key]
+            if profile_parameters == parameters:
+                return profile
+
+        profile = self.new_wind_profile(star, break_radii)
+        self.profiles[star.key] = (parameters, profile)
+        return profile
 
-        def inverse_velocity(r1):
-            velocity = self.velocity_from_radius(r1 | units.RSun, star)
-            return 1. / velocity.value_in(units.RSun/units.yr)
-
-        def one_radius(t):
-            def residual(r2):
-                start = star.radius.value_in(units.RSun)
-                result = self.quad(inverse_velocity, start, r2)
-                return result[0] - t.value_in(units.yr)
-
-            start = star.radius.value_in(units.RSun)
-            end = 1e5 * start
-            result = self.brentq(residual, start, end)
-
-            return result
-
-        radius = numpy.vectorize(one_radius)(time)
+    def radius_from_time(self, time, star):
+        profile = self.wind_profile(star)
+        radius = profile.radius_from_time(time.value_in(units.yr))
         return radius | units.RSun
 
     def radius_from_number(self, numbers, max_radius, star):
@@ -618,31 +776,49 @@ class AccelerationFunction(object):
             See http://www.av8n.com/physics/arbitrary-probability.htm
             for some good info on this.
         """
+        profile = self.wind_profile(star)
+        max_time = profile.time_from_radius(max_radius.value_in(units.RSun))
+        numbers = quantities.value_in(numbers, units.none)
+        radius = profile.radius_from_time(numbers * max_time)
 
-        rmin = star.radius.value_in(units.RSun)
-        rmax = max_radius.value_in(units.RSun)
-
-        def inverse_velocity(r1):
-            velocity = self.velocity_from_radius(r1 | units.RSun, star)
-            velocity = velocity.value_in(units.RSun/units.s)
-            return 1. / velocity
-
-        def cumulative_inverse_velocity(q):
-            res = self.quad(inverse_velocity, rmin, q)
-            return res[0]
-
-        d_max = cumulative_inverse_velocity(rmax)
-
-        def one_radius(x):
-            def residual(r2):
-                return cumulative_inverse_velocity(r2) / d_max - x
-
-            return self.brentq(residual, rmin, rmax)
+        return radius | units.RSun
 
-        radius = numpy.vectorize(one_radius)(numbers)
+    def radius_from_time_for_stars(self, time, stars):
+        """
+            radius_from_time for many stars, one time per star.
+        """
+        profile = WindProfile.concatenate(
+            [self.wind_profile(star) for star in stars])
+        radius = profile.radius_from_time(time.value_in(units.yr),
+                                          numpy.arange(len(stars)))
+        return radius | units.RSun
 
+    def radius_from_number_for_stars(self, numbers, max_radius, stars,
+                                     indices):
+        """
+            radius_from_number for many stars, max_radius has one entry
+            per star and indices gives the star of each number.
+        """
+        profile = WindProfile.concatenate(
+            [self.wind_profile(star) for star in stars])
+        max_time = profile.time_from_radius(max_radius.value_in(units.RSun),
+                                            numpy.arange(len(stars)))
+        radius = profile.radius_from_time(numbers * max_time[indices], indices)
         return radius | units.RSun
 
+    def velocity_from_radius_for_stars(self, radius, stars, indices):
+        """
+            velocity_from_radius for many stars, indices (sorted) gives the
+            star of each radius.
+        """
+        velocity = numpy.zeros(len(radius)) | units.kms
+        bounds = numpy.searchsorted(indices, numpy.arange(len(stars) + 1))
+        for star, begin, end in zip(stars, bounds[:-1], bounds[1:]):
+            if end > begin:
+                velocity[begin:end] = self.velocity_from_radius(
+                    radius[begin:end], star)
+        return velocity
+
     def fix_cutoffs(self, test, value, star, default):
         if hasattr(value, "__len__"):
             value[test] = default
@@ -691,6 +867,16 @@ class ConstantVelocityAcceleration(AccelerationFunction):
         r_star = star.radius
         return x * (r_max - r_star) + r_star
 
+    def radius_from_time_for_stars(self, t, stars):
+        return self.radius_from_time(t, stars)
+
+    def radius_from_number_for_stars(self, x, r_max, stars, indices):
+        r_star = stars.radius[indices]
+        return x * (r_max[indices] - r_star) + r_star
+
+    def velocity_from_radius_for_stars(self, radius, stars, indices):
+        return self.velocity(stars)[indices]
+
 
 class RSquaredAcceleration(AccelerationFunction):
     def scaling(self, star):
@@ -722,6 +908,11 @@ class DelayedRSquaredAcceleration(AccelerationFunction):
         numerator = star.terminal_wind_velocity**2 - star.initial_wind_velocity**2
         return 0.5 * numerator / denominator
 
+    def profile_break_radii(self, star):
+        break_radii = super(DelayedRSquaredAcceleration,
+                            self).profile_break_radii(star)
+        return break_radii + [star.acc_start.value_in(units.RSun)]
+
     def fix_acc_start_cutoff(self, r, acc, star):
         return self.fix_cutoffs(r < star.acc_start, acc, star, quantities.zero)
 
@@ -856,6 +1047,8 @@ class AcceleratingWind(SimpleWind):
             acc_func = self.acc_functions[acc_func]
 
         self.acc_function = acc_func(**acc_func_args)
+        self.initial_acc_function = ConstantVelocityAcceleration(
+            use_initial=True)
 
         def r_out_function(r):
             if r_out_ratio is None:
@@ -911,23 +1104,49 @@ class AcceleratingWind(SimpleWind):
         u = rho_0**(1 - self.gamma) * rho**(self.gamma - 1) * u_0
         return u
 
-    def wind_sphere(self, star, Ngas):
-        wind = Particles(Ngas)
+    def wind_spheres(self, stars, numbers):
+        wind = Particles(numbers.sum())
+        indices = numpy.repeat(numpy.arange(len(stars)), numbers)
 
-        dt = (self.model_time - star.wind_release_time)
-        if self.critical_timestep is None or dt > self.critical_timestep:
-            acc_function = self.acc_function
+        dt = (self.model_time - stars.wind_release_time)
+        if self.critical_timestep is None:
+            accelerating = numpy.ones(len(stars), dtype=bool)
         else:
-            acc_function = ConstantVelocityAcceleration(use_initial=True)
-
-        outer_wind_distance = acc_function.radius_from_time(dt, star)
-
-        wind.position, direction = self.generate_positions(
-            Ngas, star.radius, outer_wind_distance,
-            acc_function.radius_from_number, star=star)
-
-        velocities = acc_function.velocity_from_radius(
-            wind.position.lengths(), star)
+            accelerating = dt > self.critical_timestep
+
+        # (function, its stars, its particles, star of each of its particles)
+        groups = []
+        for acc_function, selection in [
+                (self.acc_function, accelerating),
+                (self.initial_acc_function, ~accelerating)]:
+            if selection.any():
+                in_group = selection[indices]
+                group_indices = (numpy.cumsum(selection) - 1)[indices[in_group]]
+                groups.append((acc_function, selection, in_group, group_indices))
+
+        outer_wind_distance = stars.radius.copy()
+        for acc_function, selection, in_group, group_indices in groups:
+            outer_wind_distance[selection] = \
+                acc_function.radius_from_time_for_stars(dt[selection],
+                                                        stars[selection])
+
+        def radius_function(x, r_max, stars, indices):
+            distance = numpy.zeros(len(x)) | units.RSun
+            for acc_function, selection, in_group, group_indices in groups:
+                distance[in_group] = acc_function.radius_from_number_for_stars(
+                    x[in_group], r_max[selection], stars[selection],
+                    group_indices)
+            return distance
+
+        wind.position, direction, indices = self.generate_positions_for_stars(
+            numbers, stars.radius, outer_wind_distance, radius_function,
+            stars=stars)
+
+        radii = wind.position.lengths()
+        velocities = numpy.zeros(len(wind)) | units.kms
+        for acc_function, selection, in_group, group_indices in groups:
+            velocities[in_group] = acc_function.velocity_from_radius_for_stars(
+                radii[in_group], stars[selection], group_indices)
         wind.velocity = direction * self.as_three_vector(velocities)
 
         return wind
@@ -1075,12 +1294,21 @@ class HeatingWind(SimpleWind):
 
         return self.feedback_efficiency * lmech_wind / mass_lost
 
-    def wind_sphere(self, star, Ngas):
-        wind = Particles(Ngas)
+    def internal_energies(self, stars, wind, indices):
+        # the mechanical energy is handed out star by star
+        energies = [self.internal_energy_formula(star, wind[indices == i])
+                    for i, star in enumerate(stars)]
+        return quantities.as_vector_quantity(energies)[indices]
 
-        r_max = self.r_max or self.r_max_ratio * star.radius
-        wind.position, direction = self.generate_positions(Ngas, star.radius,
-                                                           r_max)
+    def wind_spheres(self, stars, numbers):
+        wind = Particles(numbers.sum())
+
+        if self.r_max:
+            r_max = numpy.ones(len(stars)) * self.r_max
+        else:
+            r_max = self.r_max_ratio * stars.radius
+        wind.position, direction, indices = self.generate_positions_for_stars(
+            numbers, stars.radius, r_max)
         wind.velocity = [0, 0, 0] | units.kms
 
         return wind
@@ -4,6 +4,7 @@ King model generator
 This module contains a function used to create King models.
 """
 
+import os
 import math
 import numpy
 
@@ -13,12 +14,18 @@ from amuse import datamodel
 
 __all__ = ["new_king_model"]
 
+# the tables only depend on the parameters of the model, not on the
+# number of particles, so these are shared by all models in the process
+_g_integrals = {}
+_profiles = {}
+
 class MakeKingModel(object):
     def __init__(self, number_of_particles, W0, convert_nbody = None, do_scale = False, 
-            beta = 0.0, verbose = False,center_model=True):
+            beta = 0.0, verbose = False,center_model=True, cache_directory = None):
         self.number_of_particles = number_of_particles
         self.convert_nbody = convert_nbody
         self.center_model=center_model
+        self.cache_directory = cache_directory
         self.do_scale = do_scale
         self.verbose = verbose
         self.beta = beta
@@ -28,7 +35,7 @@ class MakeKingModel(object):
 
         self.YMAX = 4.0 # Note: make sure YMAX is a float.
         self.NG = 1000
-        self.g_integral = self.compute_g_integral()
+        self.g_integral = self.get_g_integral()
         self.v33 = self.compute_v33()
         
         # // profile
@@ -43,6 +50,12 @@ class MakeKingModel(object):
             v33.append(self.scale_fac * math.pow(((self.YMAX/self.NG) * i), 3) / 3.0)
         return v33
     
+    def get_g_integral(self):
+        key = (self.YMAX, self.NG)
+        if not key in _g_integrals:
+            _g_integrals[key] = self.compute_g_integral()
+        return _g_integrals[key]
+    
     def compute_g_integral(self):
         dy = self.YMAX/self.NG
         g = [0.0]
@@ -300,38 +313,117 @@ class MakeKingModel(object):
         self.zm[:] = [x*c_zm for x in self.zm]
         return nprof, v2_0
     
+    def get_profile(self):
+        # // Solve Poisson's equation only once per set of parameters, the
+        # // tables are kept in memory and, if a cache directory was given,
+        # // also on disk.
+        key = (self.W0, self.beta, self.NM, self.NG, self.YMAX)
+        if not key in _profiles:
+            profile = self.read_profile_from_cache_directory()
+            if profile is None:
+                (nprof, v20) = self.poisson()
+                profile = (nprof, v20, self.rr, self.d, self.v2, self.psi, self.zm)
+                self.write_profile_to_cache_directory(profile)
+            _profiles[key] = profile
+        
+        (nprof, v20, rr, d, v2, psi, zm) = _profiles[key]
+        # the zm table is scaled in place by makeking, return copies
+        self.rr = list(rr); self.d = list(d); self.v2 = list(v2); self.psi = list(psi); self.zm = list(zm)
+        return nprof, v20
+    
+    def get_profile_filename(self):
+        return os.path.join(
+            self.cache_directory,
+            "king_W0_{0!r}_beta_{1!r}_{2}_{3}_{4!r}.npz".format(self.W0, self.beta, self.NM, self.NG, self.YMAX)
+        )
+    
+    def read_profile_from_cache_directory(self):
+        if self.cache_directory is None:
+            return None
+        filename = self.get_profile_filename()
+        if not os.path.exists(filename):
+            return None
+        
+        data = numpy.load(filename)
+        try:
+            return (
+                int(data['nprof']), 
+                float(data['v20']), 
+                data['rr'].tolist(), 
+                data['d'].tolist(), 
+                data['v2'].tolist(), 
+                data['psi'].tolist(), 
+                data['zm'].tolist()
+            )
+        finally:
+            data.close()
+    
+    def write_profile_to_cache_directory(self, profile):
+        if self.cache_directory is None:
+            return
+        if not os.path.exists(self.cache_directory):
+            os.makedirs(self.cache_directory)
+        
+        (nprof, v20, rr, d, v2, psi, zm) = profile
+        filename = self.get_profile_filename()
+        # write to a temporary file first, other processes may read the file
+        temporary_filename = "{0}.{1}.tmp".format(filename, os.getpid())
+        with open(temporary_filename, "wb") as stream:
+            numpy.savez(stream, nprof = nprof, v20 = v20, rr = rr, d = d, v2 = v2, psi = psi, zm = zm)
+        os.rename(temporary_filename, filename)
+    
     def coordinates_from_spherical(self, radius, theta, phi):
         x = radius * numpy.sin( theta ) * numpy.cos( phi )
         y = radius * numpy.sin( theta ) * numpy.sin( phi )
         z = radius * numpy.cos( theta )
         return [x,y,z]
     
-    def setpos(self):
-        # // Obtain a random position for body b from the King profile
-        # // and return the scaled potential at that location.
-        
-        #  //  Choose radius randomly from the mass distribution.
-        rno = numpy.random.uniform()
-        i = int(self.NINDX * rno)
-        found_index = False
-        for i1 in range(self.index[i],self.index[i+1]+2): #(i1 = self.indx[i]; i1 <= indx[i+1]+1; i1++)
-            if (self.zm[i1] > rno):
-                found_index = True
+    def draw_random_numbers(self):
+        # // Draw the random numbers for all stars at once, in the same order
+        # // as when drawing them star by star: 3 numbers for the position and
+        # // 3 for the velocity, or 2 if the potential is too high for a
+        # // non zero speed (no speed is drawn). Returns the numbers, the
+        # // offset of every star and the radii and potentials of the stars.
+        state = numpy.random.get_state()
+        numbers = numpy.random.random_sample(6 * self.number_of_particles)
+        offsets = 6 * numpy.arange(self.number_of_particles)
+        start = 0
+        while True:
+            radius, potential = self.setpos(numbers[offsets])
+            without_speed = numpy.flatnonzero(potential[start:] >= -self.beta_w0)
+            if len(without_speed) == 0:
                 break
-        if (not found_index):
-            raise exceptions.AmuseException("makeking: error in getpos")
-        rfac = (rno - self.zm[i1-1]) / (self.zm[i1] - self.zm[i1-1])
-        radius = self.rr[i1-1] + rfac * (self.rr[i1] - self.rr[i1-1])
-        potential = self.psi[i1-1] + rfac * (self.psi[i1] - self.psi[i1-1])
+            start += without_speed[0] + 1
+            offsets[start:] -= 1
         
-        #  //  Angular position random.
-        theta = numpy.arccos(numpy.random.uniform(-1.0, 1.0))
-        phi = numpy.random.uniform(0.0, 2.0*math.pi)
-        return self.coordinates_from_spherical(radius, theta, phi), potential
+        number_of_numbers_used = len(numbers) - (potential >= -self.beta_w0).sum()
+        if number_of_numbers_used < len(numbers):
+            numpy.random.set_state(state)
+            numpy.random.random_sample(number_of_numbers_used)
+        
+        return numbers, offsets, radius, potential
+    
+    def setpos(self, rno):
+        # // Obtain the radii from the King profile, for the given random
+        # // numbers (uniform in [0,1>), and return the scaled potentials
+        # // at these radii.
+        
+        #  //  Choose radius from the mass distribution, zm is increasing
+        #  //  so zm[i1-1] <= rno < zm[i1]
+        zm = numpy.asarray(self.zm)
+        rr = numpy.asarray(self.rr)
+        psi = numpy.asarray(self.psi)
+        i1 = numpy.searchsorted(zm, rno, side = 'right')
+        if (i1 >= len(zm)).any():
+            raise exceptions.AmuseException("makeking: error in getpos")
+        rfac = (rno - zm[i1-1]) / (zm[i1] - zm[i1-1])
+        radius = rr[i1-1] + rfac * (rr[i1] - rr[i1-1])
+        potential = psi[i1-1] + rfac * (psi[i1] - psi[i1-1])
+        return radius, potential
     
-    def setvel(self, potential):
-        #// Obtain a random velocity for body b from the King profile
-        #// given its scaled potential.
+    def setvel(self, potential, numbers):
+        #// Obtain the speeds from the King profile given the scaled
+        #// potentials, and the random numbers (uniform in [0,1>).
         
         #    // Array v33[] contains the second term in the integral for the density,
         #    // namely exp(beta*W0) * v_esc^3 / 3 (scaling v^2 by 2 sig^2, as usual).
@@ -343,38 +435,61 @@ class MakeKingModel(object):
         #    // where y = i*YMAX/NG (i = 0,...,NG) and v = sqrt(2)*sig*y (sig = 1 here).
 
         #    //  Choose speed randomly from the distribution at this radius.
-        v = 0
-        if (potential < -self.beta_w0):
-            pfac = math.exp(-potential)
-            ymax = math.sqrt(-potential-self.beta_w0)
-            #	// Will obtain v by bisection.  Determine maximum possible
-            #	// range in the index i.
-            il = 0
-            iu = int(((self.NG/self.YMAX) * math.sqrt(-potential))) #	// Binning OK for W0 < 16,
-            #   				        		// *only* if beta >= 0.
-            if (iu > self.NG): 
-                iu = self.NG
-            rl = 0
-            ru = pfac * self.g_integral[iu] - self.v33[iu]
-            rno = numpy.random.uniform(0.0, ru)
-            while (iu - il > 1):
-                im = (il + iu) // 2
-                rm = pfac * self.g_integral[im] - self.v33[im]
-                if (rm > rno):
-                    iu = im
-                    ru = rm
-                else:
-                    il = im
-                    rl = rm
-            #	// Maximum possible range of il here (for beta = 0) is
-            #	//	0 to NG*sqrt(-p)/YMAX.
-            #	// Maximum possible value of v (for beta = 0) is the local
-            #	//      escape speed, sqrt(-2*p).
-            v = (self.YMAX/self.NG) * math.sqrt(2.0) * (il + (rno - rl)/(ru - rl))
+        g_integral = numpy.asarray(self.g_integral)
+        v33 = numpy.asarray(self.v33)
+        v = numpy.zeros(len(potential))
+        has_speed = potential < -self.beta_w0
+        potential = potential[has_speed]
+        pfac = numpy.exp(-potential)
+        #	// Will obtain v by bisection.  Determine maximum possible
+        #	// range in the index i.
+        il = numpy.zeros(len(potential), dtype='int64')
+        iu = ((self.NG/self.YMAX) * numpy.sqrt(-potential)).astype('int64') #	// Binning OK for W0 < 16,
+        #   				        		// *only* if beta >= 0.
+        iu = numpy.minimum(iu, self.NG)
+        rl = numpy.zeros(len(potential))
+        ru = pfac * g_integral[iu] - v33[iu]
+        rno = ru * numbers[has_speed]
+        #	// The cumulative distribution differs for every star,
+        #	// bisect for all stars at once
+        active = iu - il > 1
+        while active.any():
+            im = (il + iu) // 2
+            rm = pfac * g_integral[im] - v33[im]
+            is_upper = active & (rm > rno)
+            is_lower = active & ~(rm > rno)
+            iu = numpy.where(is_upper, im, iu)
+            ru = numpy.where(is_upper, rm, ru)
+            il = numpy.where(is_lower, im, il)
+            rl = numpy.where(is_lower, rm, rl)
+            active = iu - il > 1
+        #	// Maximum possible range of il here (for beta = 0) is
+        #	//	0 to NG*sqrt(-p)/YMAX.
+        #	// Maximum possible value of v (for beta = 0) is the local
+        #	//      escape speed, sqrt(-2*p).
+        v[has_speed] = (self.YMAX/self.NG) * math.sqrt(2.0) * (il + (rno - rl)/(ru - rl))
+        return v
+    
+    def setpos_and_setvel(self):
+        # // Obtain random positions and velocities for all stars, returns
+        # // the positions and velocities as 3 arrays of coordinates each.
+        numbers, offsets, radius, potential = self.draw_random_numbers()
+        has_speed = potential < -self.beta_w0
+        
+        #  //  Angular position random.
+        theta = numpy.arccos(-1.0 + 2.0 * numbers[offsets + 1])
+        phi = 2.0*math.pi * numbers[offsets + 2]
+        position = self.coordinates_from_spherical(radius, theta, phi)
+        
+        offsets = offsets + 3
+        speed = self.setvel(potential, numbers[numpy.minimum(offsets, len(numbers) - 1)])
+        offsets[has_speed] += 1
+        
         #    //  Direction is random.
-        theta = numpy.arccos(numpy.random.uniform(-1.0, 1.0))
-        phi = numpy.random.uniform(0.0, 2.0*math.pi)
-        return self.coordinates_from_spherical(v, theta, phi)
+        theta = numpy.arccos(-1.0 + 2.0 * numbers[offsets])
+        phi = 2.0*math.pi * numbers[offsets + 1]
+        velocity = self.coordinates_from_spherical(speed, theta, phi)
+        return position, velocity
         
     def makeking(self):
         #// Create a King model, and optionally initialize an N-body system
@@ -382,7 +497,7 @@ class MakeKingModel(object):
         if (self.W0 > 16): 
             raise exceptions.AmuseException("makeking: must specify w0 < 16")
         #    // Compute the cluster density/velocity/potential profile
-        (nprof, v20) = self.poisson()
+        (nprof, v20) = self.get_profile()
         zm = self.zm
         d = self.d
         rr = self.rr
@@ -439,23 +554,17 @@ class MakeKingModel(object):
         #    // Assign positions and velocities. Note that it may actually
         #    // be preferable to do this in layers instead.
         masses = numpy.zeros(self.number_of_particles) + (1.0 / self.number_of_particles)
-        positions = []
-        velocities = []
         #    // Convenient to have the "unscaled" system 
         #    // be as close to standard units as possible, so rescale position
         #    // and velocity with 'xfac' and 'vfac' to force
         #    // the virial radius to 1.  (Steve, 9/04)
         xfac = 1.0/rvirial
         vfac = 1.0/math.sqrt(xfac)
-        for i in range(self.number_of_particles):
-            (position, potential) = self.setpos()
-            velocity = self.setvel(potential)
-            #	// Unit of length = rc.
-            #	// Unit of velocity = sig.
-            position[:] = [xfac*comp for comp in position]
-            velocity[:] = [vfac*comp*sig for comp in velocity]
-            positions.append(position)
-            velocities.append(velocity)
+        (position, velocity) = self.setpos_and_setvel()
+        #	// Unit of length = rc.
+        #	// Unit of velocity = sig.
+        positions = numpy.column_stack([xfac*comp for comp in position])
+        velocities = numpy.column_stack([vfac*comp*sig for comp in velocity])
         #    // System is in virial equilibrium in a consistent set of units
         #    // with G, core radius, and total mass = 1.
         
@@ -497,6 +606,8 @@ def new_king_model(number_of_particles, W0, *list_arguments, **keyword_arguments
         rescaled King models; models with b < 0 approach isothermal spheres as 
         b --> -infinity.
     :argument verbose: Be verbose (output is suppressed by default) [False]
+    :argument cache_directory: When given, the solved profile of the model is stored
+        in this directory and reused by later runs with the same W0 and beta [None]
     """
     uc = MakeKingModel(number_of_particles, W0, *list_arguments, **keyword_arguments)
     return uc.result
@@ -494,6 +494,36 @@ class FortranFileFormatProcessor(BinaryFileFormatProcessor):
     def read_fortran_block_float_vectors(self, file, size = 3):
         result = self.read_fortran_block_floats(file)
         return result.reshape(len(result)//size,size)
+    
+    def map_file(self, file):
+        """Returns the contents of the file, from the current
+        position, as an array of bytes. The file is memory mapped 
+        if possible, otherwise it is read completely.
+        """
+        position = file.tell()
+        if hasattr(file, "fileno"):
+            try:
+                return numpy.memmap(file, dtype='uint8', mode='r', offset=position)
+            except (ValueError, IOError, EnvironmentError):
+                file.seek(position)
+        return numpy.frombuffer(file.read(), dtype='uint8')
+    
+    def read_fortran_block_from_buffer(self, buffer, offset):
+        """Returns the contents of the block starting at offset in 
+        the buffer (an array of bytes) and the offset of the next
+        block. The contents is a view on the buffer, it is not read
+        until used, so unneeded blocks can be skipped cheaply.
+        """
+        if offset + 4 > len(buffer):
+            raise IoException("Unexpected end of file, no block at position {0}".format(offset))
+        length_of_block = int(buffer[offset:offset+4].view(self.uint_type)[0])
+        end = offset + 4 + length_of_block
+        if end + 4 > len(buffer):
+            raise IoException("Unexpected end of file, block at position {0} is truncated".format(offset))
+        length_of_block_after = int(buffer[end:end+4].view(self.uint_type)[0])
+        if(length_of_block_after != length_of_block):
+            raise IoException("Block is mangled sizes don't match before: {0}, after: {1}".format(length_of_block, length_of_block_after))
+        return buffer[offset+4:end], end + 4
         
     def write_fortran_block(self, file, input):
         format = self.endianness+'I'
@@ -530,4 +560,16 @@ class FortranFileFormatProcessor(BinaryFileFormatProcessor):
         array = array.reshape(len(array) * size)
         self.write_fortran_block(file, array.data)
     
+    def write_fortran_block_arrays(self, file, arrays, dtype):
+        """Writes the values of all arrays in one block. The
+        arrays are converted to dtype and written one after the other,
+        so no packed copy of all values is made.
+        """
+        format = self.endianness+'I'
+        length_of_block = sum([numpy.size(x) for x in arrays]) * dtype.itemsize
+        file.write(struct.pack(format, length_of_block))
+        for x in arrays:
+            file.write(numpy.ascontiguousarray(x, dtype=dtype).data)
+        file.write(struct.pack(format, length_of_block))
+    
     
@@ -1,5 +1,7 @@
 import struct
 import numpy
+import os.path
+import threading
 
 from collections import namedtuple
 
@@ -54,6 +56,26 @@ class GadgetFileFormatProcessor(base.FortranFileFormatProcessor):
             ('NallHW', 6, 'i'),
             ('flag_entr_ics', 1, 'i'),
         )
+    
+    @base.format_option
+    def particle_types_to_load(self):
+        """The particle types to load (GAS=0, HALO=1, DISK=2, BULGE=3, STARS=4 
+        and BNDRY=5), the sets of the other types are returned empty"""
+        return (0, 1, 2, 3, 4, 5)
+    
+    @base.format_option
+    def blocks_to_load(self):
+        """Names of the attributes to load from the file, the blocks 
+        of other attributes are skipped. The id block is always 
+        loaded if ids_are_keys is set"""
+        return ('position', 'velocity', 'id', 'mass', 'u', 'rho', 'h_smooth', 
+            'potential_energy', 'acceleration', 'timestep')
+    
+    @base.format_option
+    def number_of_threads(self):
+        """Number of threads to copy the files of a snapshot stored
+        in multiple files with"""
+        return 4
         
     @base.format_option
     def has_potential_energy(self):
@@ -169,130 +191,149 @@ class GadgetFileFormatProcessor(base.FortranFileFormatProcessor):
         
     def load_header(self, file):
         header_bytes = self.read_fortran_block(file)
+        self.header_struct = self.unpack_header(header_bytes)
+    
+    def unpack_header(self, header_bytes):
         values = struct.unpack(self.header_format, header_bytes[0:self.header_size])
         values = self.collect_values(values)
-        self.header_struct = self.struct_class(*values)
+        return self.struct_class(*values)
     
-    def load_body(self, file):
-        self.positions = self.read_fortran_block_float_vectors(file)
-        self.velocities = self.read_fortran_block_float_vectors(file)
-        
-        id_bytes = self.read_fortran_block(file)
-        if len(id_bytes) == 4*self.total_number_of_particles:
-            self.ids = numpy.frombuffer(id_bytes, dtype=self.uint_type)
-        else:
-            self.ids = numpy.frombuffer(id_bytes, dtype=self.ulong_type)
-        
-        
-        if self.total_number_of_particles_with_variable_masses > 0:
-            self.masses = self.read_fortran_block_floats(file)
-        else:
-            self.masses = None
-
-        if self.number_of_gas_particles > 0:
-            self.u = self.read_fortran_block_floats(file)[:self.number_of_gas_particles]
-            #print self.u, self.number_of_gas_particles, len(self.u)
-        else:
-            self.u = None
+    def load_header_from_buffer(self, buffer):
+        header_bytes, offset = self.read_fortran_block_from_buffer(buffer, 0)
+        return self.unpack_header(header_bytes.tostring()), offset
+    
+    def block_layout(self, header):
+        """Returns the name, the particle types and the
+        number of values per particle of the blocks, in the order 
+        of the blocks in a file with the given header
+        """
+        all_types = range(6)
+        gas = [self.GAS]
+        variable_mass = [i for i, mass in enumerate(header.Massarr) if mass == 0.0]
+        number_of_gas_particles = header.Npart[self.GAS]
+        
+        result = [('position', all_types, 3), ('velocity', all_types, 3), ('id', all_types, 1)]
+        if sum([header.Npart[i] for i in variable_mass]) > 0:
+            result.append(('mass', variable_mass, 1))
+        if number_of_gas_particles > 0:
+            result.append(('u', gas, 1))
         
         if self.is_initial_conditions_format:
-            self.density = None
-            self.hsml = None
-            self.pot = None
-            self.acc = None
-            self.da_dt = None
-            self.dt = None
-            return
+            return result
         
-        if self.number_of_gas_particles > 0:
-            self.density = self.read_fortran_block_floats(file)
-            self.hsml = self.read_fortran_block_floats(file)
-        else:
-            self.density  = None
-            self.hsml = None
-            
+        if number_of_gas_particles > 0:
+            result.append(('rho', gas, 1))
+            result.append(('h_smooth', gas, 1))
         if self.has_potential_energy:
-            self.pot = self.read_fortran_block_floats(file)
-        else:
-            self.pot = None
-            
+            result.append(('potential_energy', all_types, 1))
         if self.has_acceleration:
-            self.acc = self.read_fortran_block_floats(file)
-        else:
-            self.acc = None
-            
+            result.append(('acceleration', all_types, 3))
         if self.has_rate_of_entropy_production:
-            self.da_dt = self.read_fortran_block_floats(file)
-        else:
-            self.da_dt = None
-            
+            result.append(('da_dt', gas, 1))
         if self.has_timestep:
-            self.dt = self.read_fortran_block_floats(file)
-        else:
-            self.dt = None
+            result.append(('timestep', all_types, 1))
+        return result
     
-
-    def new_sets_from_arrays(self):
-        offset = 0
-        ids_per_set = []
-        for x in self.header_struct.Npart:
-            ids_per_set.append(self.ids[offset:offset+x])
-            offset += x
-        
-        if self.ids_are_keys:
-            sets = [datamodel.Particles(len(x), keys=x) for x in ids_per_set]
-        else:
-            sets = [datamodel.Particles(len(x)) for x in ids_per_set]
-            for set, x in zip(sets, ids_per_set):
-                if len(set) > 0:
-                    set.id = x
-                
-        offset = 0
-        for x in sets:
-            length = len(x)
-            if length == 0:
-                continue
-                
-            x.position = nbody_system.length.new_quantity(self.positions[offset:offset+length])
-            x.velocity = nbody_system.speed.new_quantity(self.velocities[offset:offset+length])
-            if self.convert_gadget_w_to_velocity:
-                x.velocity *= numpy.sqrt(1.0 + self.header_struct.Redshift)
-            if not self.pot is None:
-                x.potential_energy = nbody_system.energy.new_quantity(self.pot[offset:offset+length])
-            if not self.acc is None:
-                x.acceleration = nbody_system.acceleration.new_quantity(self.acc[offset:offset+length])
-            if not self.dt is None:
-                x.timestep = nbody_system.time.new_quantity(self.dt[offset:offset+length])
-            offset += length
-        
-        offset = 0
-        for x, mass in zip(sets, self.header_struct.Massarr):
-            length = len(x)
-            if length == 0:
+    def find_blocks(self, buffer, offset, header):
+        """Returns a dictionary with, for every particle type and 
+        block to load, the bytes in the buffer. Other blocks are skipped.
+        """
+        result = {}
+        for name, types, size in self.block_layout(header):
+            block, offset = self.read_fortran_block_from_buffer(buffer, offset)
+            if not (name in self.blocks_to_load or (name == 'id' and self.ids_are_keys)):
                 continue
-            if mass == 0.0:
-                x.mass = nbody_system.mass.new_quantity(self.masses[offset:offset+length])
-                offset += length
-            else:
-                x.mass = nbody_system.mass.new_quantity(mass)
-        
-        if self.number_of_gas_particles > 0:
-            gas_set = sets[self.GAS]
-            unit = (nbody_system.length / nbody_system.time) ** 2
-            gas_set.u = unit.new_quantity(self.u)
-            unit = nbody_system.mass / nbody_system.length ** 3
-            if not self.density is None:
-                gas_set.rho = unit.new_quantity(self.density)
-            if not self.hsml is None:
-                gas_set.h_smooth = nbody_system.length.new_quantity(self.hsml)
             
-        return sets
-        
+            number_of_values = sum([header.Npart[i] for i in types]) * size
+            if name == 'id' and len(block) == 4 * number_of_values:
+                dtype = self.uint_type
+            elif name == 'id':
+                dtype = self.ulong_type
+            else:
+                dtype = self.float_type
+            values = block[:number_of_values * dtype.itemsize].view(dtype)
             
-        
-    def load_file(self, file):
-        self.load_header(file)
-        self.load_body(file)
+            start = 0
+            for i in types:
+                end = start + header.Npart[i] * size
+                if i in self.particle_types_to_load:
+                    result[i, name] = values[start:end].reshape(-1, size) if size > 1 else values[start:end]
+                start = end
+        return result
+    
+    def names_of_files(self):
+        """The files of a snapshot stored in multiple files are
+        named name.0, name.1, ..., the processor must be given the
+        name of the first file.
+        """
+        with open(self.filename, 'rb') as file:
+            header, offset = self.load_header_from_buffer(self.map_file(file))
+        if header.NumFiles > 1 and self.filename.endswith('.0'):
+            return [self.filename[:-1] + str(i) for i in range(header.NumFiles)]
+        else:
+            return [self.filename]
+    
+    def load(self):
+        buffers = []
+        for x in self.names_of_files():
+            if not os.path.exists(x):
+                raise base.IoException("Error: file '{0}' of the snapshot does not exist.".format(x))
+            with open(x, 'rb') as file:
+                buffers.append(self.map_file(file))
+        return self.load_buffers(buffers)
+    
+    def load_body(self, buffers, headers, offsets):
+        """Copies the blocks to load from all buffers into one 
+        array per particle type and block. The buffers are divided 
+        over number_of_threads threads.
+        """
+        blocks_per_buffer = map(self.find_blocks, buffers, offsets, headers)
+        
+        self.arrays = {}
+        destinations = []
+        for blocks in blocks_per_buffer:
+            destination = []
+            for key, values in blocks.iteritems():
+                particle_type = key[0]
+                if not key in self.arrays:
+                    shape = list(values.shape)
+                    shape[0] = sum([header.Npart[particle_type] for header in headers])
+                    self.arrays[key] = numpy.empty(shape, dtype = values.dtype)
+                start = sum([header.Npart[particle_type] for header in headers[:len(destinations)]])
+                destination.append((self.arrays[key][start:start+len(values)], values))
+            destinations.append(destination)
+        
+        def copy_blocks(indices):
+            for i in indices:
+                for target, values in destinations[i]:
+                    target[...] = values
+        
+        number_of_threads = min(self.number_of_threads, len(buffers))
+        if number_of_threads > 1:
+            threads = [threading.Thread(target=copy_blocks, args=(range(i, len(buffers), number_of_threads),)) 
+                for i in range(number_of_threads)]
+            for x in threads:
+                x.start()
+            for x in threads:
+                x.join()
+        else:
+            copy_blocks(range(len(buffers)))
+    
+    def load_buffers(self, buffers):
+        headers = []
+        offsets = []
+        for x in buffers:
+            header, offset = self.load_header_from_buffer(x)
+            headers.append(header)
+            offsets.append(offset)
+        
+        self.header_struct = headers[0]
+        if len(headers) > 1:
+            self.header_struct = self.header_struct._replace(
+                Npart = tuple([sum(x) for x in zip(*[header.Npart for header in headers])])
+            )
+        
+        self.load_body(buffers, headers, offsets)
         
         attribute_names = ["gas","halo","disk","bulge","stars","bndry"]
         values = self.new_sets_from_arrays()
@@ -302,6 +343,52 @@ class GadgetFileFormatProcessor(base.FortranFileFormatProcessor):
             values += list(self.header_struct)
         return namedtuple("GadgetData", attribute_names)(*values)
     
+    def new_sets_from_arrays(self):
+        return [self.new_set_from_arrays(i) for i in range(6)]
+    
+    def new_set_from_arrays(self, particle_type):
+        length = self.header_struct.Npart[particle_type]
+        if length == 0 or not particle_type in self.particle_types_to_load:
+            return datamodel.Particles()
+        
+        arrays = dict([(name, values) for (i, name), values in self.arrays.iteritems() if i == particle_type])
+        if self.ids_are_keys:
+            result = datamodel.Particles(length, keys=arrays['id'])
+        else:
+            result = datamodel.Particles(length)
+            if 'id' in arrays:
+                result.id = arrays['id']
+        
+        if 'position' in arrays:
+            result.position = nbody_system.length.new_quantity(arrays['position'])
+        if 'velocity' in arrays:
+            result.velocity = nbody_system.speed.new_quantity(arrays['velocity'])
+            if self.convert_gadget_w_to_velocity:
+                result.velocity *= numpy.sqrt(1.0 + self.header_struct.Redshift)
+        
+        mass = self.header_struct.Massarr[particle_type]
+        if 'mass' in arrays:
+            result.mass = nbody_system.mass.new_quantity(arrays['mass'])
+        elif mass != 0.0 and 'mass' in self.blocks_to_load:
+            result.mass = nbody_system.mass.new_quantity(mass)
+        
+        if 'u' in arrays:
+            result.u = ((nbody_system.length / nbody_system.time) ** 2).new_quantity(arrays['u'])
+        if 'rho' in arrays:
+            result.rho = (nbody_system.mass / nbody_system.length ** 3).new_quantity(arrays['rho'])
+        if 'h_smooth' in arrays:
+            result.h_smooth = nbody_system.length.new_quantity(arrays['h_smooth'])
+        if 'potential_energy' in arrays:
+            result.potential_energy = nbody_system.energy.new_quantity(arrays['potential_energy'])
+        if 'acceleration' in arrays:
+            result.acceleration = nbody_system.acceleration.new_quantity(arrays['acceleration'])
+        if 'timestep' in arrays:
+            result.timestep = nbody_system.time.new_quantity(arrays['timestep'])
+        return result
+        
+    def load_file(self, file):
+        return self.load_buffers([self.map_file(file)])
+    
     
     @late
     def sets_to_save(self):
@@ -385,101 +472,55 @@ class GadgetFileFormatProcessor(base.FortranFileFormatProcessor):
         self.write_fortran_block(file, bytes)
     
     
-    def _pack_sets(self, attributename, unit = None):
+    def _arrays_from_sets(self, attributename, unit = None, sets = None):
         result = []
-        for x in self.sets_to_save:
+        for x in (self.sets_to_save if sets is None else sets):
             if len(x) > 0:
                 if unit is None:
-                    result.extend(getattr(x,attributename))
+                    result.append(getattr(x,attributename))
                 else:
-                    result.extend(getattr(x,attributename).value_in(unit))
+                    result.append(getattr(x,attributename).value_in(unit))
         return result
     
     
     def store_body(self, file):
-        self.positions = self._pack_sets('position', nbody_system.length)
-        self.velocities = self._pack_sets('velocity', nbody_system.speed)
+        self.write_fortran_block_arrays(file, self._arrays_from_sets('position', nbody_system.length), self.float_type)
+        self.write_fortran_block_arrays(file, self._arrays_from_sets('velocity', nbody_system.speed), self.float_type)
         
         if self.ids_are_keys:
-            self.ids = self._pack_sets('key')
+            ids = self._arrays_from_sets('key')
         else:
-            self.ids = self._pack_sets('id')
-            
-        self.masses = []
-        for equal_mass, x in zip(self.equal_mass_array, self.sets_to_save):
-            if len(x) > 0 and not equal_mass > (0.0 | nbody_system.mass):
-                self.masses.extend(x.mass.value_in(nbody_system.mass)) 
-        if len(self.masses) == 0:
-            self.masses = None
-            
-        
-        number_of_gas_particles = len(self.sets_to_save[self.GAS])
-        if number_of_gas_particles > 0:
-            self.u = self.sets_to_save[0].u.value_in(nbody_system.potential)
-        else:
-            self.u = None
-        
-            
-        self.write_fortran_block_float_vectors(file, self.positions)
-        self.write_fortran_block_float_vectors(file, self.velocities)
+            ids = self._arrays_from_sets('id')
         
         if self.ids_are_long:
-            self.write_fortran_block_ulongs(file, self.ids)
+            self.write_fortran_block_arrays(file, ids, self.ulong_type)
         else:
-            self.write_fortran_block_uints(file, self.ids)
+            self.write_fortran_block_arrays(file, ids, self.uint_type)
         
-        if not self.masses is None:
-            self.write_fortran_block_floats(file, self.masses)
+        sets_with_variable_mass = []
+        for equal_mass, x in zip(self.equal_mass_array, self.sets_to_save):
+            if len(x) > 0 and not equal_mass > (0.0 | nbody_system.mass):
+                sets_with_variable_mass.append(x)
+        if len(sets_with_variable_mass) > 0:
+            self.write_fortran_block_arrays(file, self._arrays_from_sets('mass', nbody_system.mass, sets_with_variable_mass), self.float_type)
         
-        if not self.u is None:
-            self.write_fortran_block_floats(file, self.u)
+        gas_sets = [self.sets_to_save[self.GAS]]
+        number_of_gas_particles = len(gas_sets[0])
+        if number_of_gas_particles > 0:
+            self.write_fortran_block_arrays(file, self._arrays_from_sets('u', nbody_system.potential, gas_sets), self.float_type)
             
         if self.is_initial_conditions_format:
             return
         
         if number_of_gas_particles > 0:
-            self.density =  self.sets_to_save[0].rho.value_in(nbody_system.density)
-            self.hsml = self.sets_to_save[0].h_smooth.value_in(nbody_system.length)
-        else:
-            self.density  = None
-            self.hsml = None
+            self.write_fortran_block_arrays(file, self._arrays_from_sets('rho', nbody_system.density, gas_sets), self.float_type)
+            self.write_fortran_block_arrays(file, self._arrays_from_sets('h_smooth', nbody_system.length, gas_sets), self.float_type)
         
         if self.has_potential_energy:
-            self.pot = self._pack_sets('potential_energy', nbody_system.energy)
-        else:
-            self.pot = None
+            self.write_fortran_block_arrays(file, self._arrays_from_sets('potential_energy', nbody_system.energy), self.float_type)
             
         if self.has_acceleration:
-            self.acc = self._pack_sets('acceleration', nbody_system.acceleration)
-        else:
-            self.acc = None
-            
-        if self.has_rate_of_entropy_production:
-            self.da_dt = None
-        else:
-            self.da_dt = None
+            self.write_fortran_block_arrays(file, self._arrays_from_sets('acceleration', nbody_system.acceleration), self.float_type)
             
         if self.has_timestep:
-            self.dt = self._pack_sets('timestep', nbody_system.time)
-        else:
-            self.dt = None
-        
-        
-        if not self.density is None:
-            self.write_fortran_block_floats(file, self.density)
-        
-        if not self.hsml is None:
-            self.write_fortran_block_floats(file, self.hsml)
-            
-        if not self.pot is None:
-            self.write_fortran_block_floats(file, self.pot)
-            
-        if not self.acc is None:
-            self.write_fortran_block_floats(file, self.acc)
-            
-        if not self.da_dt is None:
-            self.write_fortran_block_floats(file, self.da_dt)
-            
-        if not self.dt is None:
-            self.write_fortran_block_floats(file, self.dt)
-            
+            self.write_fortran_block_arrays(file, self._arrays_from_sets('timestep', nbody_system.time), self.float_type)
@@ -64,7 +64,8 @@ class HDF5FileFormatProcessor(base.FileFormatProcessor):
                     open_for_writing = self.allow_writing, 
                     append_to_file = self.append_to_file, 
                     copy_history = self.copy_history,
-                    return_working_copy = self.return_working_copy
+                    return_working_copy = self.return_working_copy,
+                    **self.lazy_options()
                 )
         else:
                 processor = store_v2.StoreHDF(
@@ -72,7 +73,8 @@ class HDF5FileFormatProcessor(base.FileFormatProcessor):
                     open_for_writing = self.allow_writing, 
                     append_to_file = self.append_to_file,
                     copy_history = self.copy_history,
-                    return_working_copy = self.return_working_copy
+                    return_working_copy = self.return_working_copy,
+                    **self.lazy_options()
                 )
      
         if len(self.names) > 0:
@@ -92,6 +94,15 @@ class HDF5FileFormatProcessor(base.FileFormatProcessor):
         return processor, result
         
 
+    def lazy_options(self):
+        return dict(
+            lazy = self.lazy,
+            page_size = self.page_size,
+            cache_size = self.cache_size,
+            index_range = self.index_range,
+            key_range = self.key_range
+        )
+        
     def store(self):
         
         if self.version == '1.0':
@@ -107,7 +118,12 @@ class HDF5FileFormatProcessor(base.FileFormatProcessor):
             processor = store_v2.StoreHDF(
                 self.filename, 
                 self.append_to_file, 
-                open_for_writing = True
+                open_for_writing = True,
+                compression = self.compression,
+                compression_opts = self.compression_opts,
+                shuffle = self.shuffle,
+                chunks = self.chunks,
+                timeseries = self.timeseries
             )
         
             if not processor.is_correct_version():
@@ -165,6 +181,75 @@ class HDF5FileFormatProcessor(base.FileFormatProcessor):
         return True
     
 
+    @base.format_option
+    def compression(self):
+        """Compression filter for the stored attributes, "gzip" or "lzf".
+        Only available for version 2.0 (default: None)"""
+        return None
+    
+    @base.format_option
+    def compression_opts(self):
+        """Options of the compression filter, the level (0-9) for "gzip".
+        Only available for version 2.0 (default: None)"""
+        return None
+    
+    @base.format_option
+    def shuffle(self):
+        """If set to True, the bytes of the stored attributes are shuffled
+        before compression, improves the compression of floating point
+        values. Only available for version 2.0 (default: False)"""
+        return False
+    
+    @base.format_option
+    def chunks(self):
+        """Shape of the chunks of the stored attributes, True to let h5py 
+        choose the shape. The shape may have fewer dimensions than an 
+        attribute, the chunks span the remaining dimensions. 
+        Only available for version 2.0 (default: None)"""
+        return None
+    
+    @base.format_option
+    def timeseries(self):
+        """If set to True, a set with the same particles and attributes as the
+        previous set in the file is appended to the attributes of the previous
+        set (along a time axis), instead of stored in a new group. Reduces 
+        the size of files with many snapshots and speeds up reading the history 
+        of a particle. Only available for version 2.0 (default: False)"""
+        return False
+    
+    @base.format_option
+    def lazy(self):
+        """If set to True, the attributes and keys of the loaded sets are read
+        from the file when needed and only for the selected particles, in pages 
+        that are kept in a cache of limited size. The history is not copied
+        into memory and the loaded sets are read only. Use with close_file 
+        set to False. Only available for version 2.0 (default: False)"""
+        return False
+    
+    @base.format_option
+    def page_size(self):
+        """Number of rows read at once from a stored attribute when loading 
+        lazily (default: 65536)"""
+        return 2**16
+    
+    @base.format_option
+    def cache_size(self):
+        """Maximum number of bytes of the pages kept in memory when loading 
+        lazily (default: 128 MB)"""
+        return 2**27
+    
+    @base.format_option
+    def index_range(self):
+        """When loading lazily, only load the particles with an index in the
+        stored sets in this range, (start, stop) (default: None)"""
+        return None
+    
+    @base.format_option
+    def key_range(self):
+        """When loading lazily, only load the particles with keys in this range,
+        (minimum, maximum), the maximum is excluded (default: None)"""
+        return None
+    
     @base.format_option
     def return_context(self):
         """If set to True, will return a context manager instead of
@@ -9,6 +9,7 @@ import numpy
 import pickle
 import os.path
 import sys
+import collections
 
 from amuse.units import si
 from amuse.units import units
@@ -585,6 +586,288 @@ class HDF5GridAttributeStorage(AttributeStorage):
             bools[indices] = True
             dataset.set_values(bools, quantity)
     
+class HDF5SnapshotDataset(object):
+    """
+    One snapshot of a dataset in a time series group, the first
+    axis of the dataset is the time axis. Can be used in place of 
+    the dataset of a snapshot stored in its own group.
+    """
+    
+    def __init__(self, dataset, index):
+        self.dataset = dataset
+        self.index = index
+        
+    @property
+    def shape(self):
+        return self.dataset.shape[1:]
+        
+    @property
+    def dtype(self):
+        return self.dataset.dtype
+        
+    @property
+    def attrs(self):
+        return self.dataset.attrs
+        
+    def __len__(self):
+        return self.shape[0]
+        
+    def __getitem__(self, index):
+        if index is Ellipsis or (isinstance(index, slice) and index == slice(None)):
+            return self.dataset[self.index]
+        else:
+            return self.dataset[self.index][index]
+            
+    def __setitem__(self, index, values):
+        snapshot = self.dataset[self.index]
+        snapshot[index] = values
+        self.dataset[self.index] = snapshot
+        
+class HDF5TimeSeriesAttributeStorage(HDF5AttributeStorage):
+    """
+    Attribute storage of one snapshot in a time series group,
+    the snapshots in a group share the keys and attributes. 
+    """
+    
+    def __init__(self, keys, hdfgroup, loader, index, mapping_from_particle_to_index = None):
+        self.hdfgroup = hdfgroup
+        self.attributesgroup = self.hdfgroup["attributes"]
+        self.number_of_particles = len(keys)
+        self.particle_keys = keys
+        self.loader = loader
+        self.index = index
+        if mapping_from_particle_to_index is None:
+            mapping_from_particle_to_index = self.new_index()
+        self.mapping_from_particle_to_index = mapping_from_particle_to_index
+        
+    def can_extend_attributes(self):
+        return False
+        
+    def load_attribute(self, attribute):
+        return HDF5Attribute.load_attribute(
+            attribute,
+            HDF5SnapshotDataset(self.attributesgroup[attribute], self.index),
+            self.loader
+        )
+        
+    def get_values_in_store(self, indices, attributes):
+        return [self.load_attribute(x).get_values(indices) for x in attributes]
+        
+    def set_values_in_store(self, indices, attributes, quantities):
+        for attribute, quantity in zip(attributes, quantities):
+            if not attribute in self.attributesgroup:
+                raise exceptions.AmuseException("cannot add attribute {0} to a set stored in a time series".format(attribute))
+            dataset = self.load_attribute(attribute)
+            bools = numpy.zeros(dataset.get_shape(), dtype='bool')
+            bools[indices] = True
+            dataset.set_values(bools, quantity)
+            
+class HDF5PageCache(object):
+    """
+    Least recently used cache of pages (blocks of page_size rows) of 
+    the datasets in a file, holds at most maximum_size bytes. Rows 
+    are read from the file one page (a hyperslab) at a time.
+    """
+    
+    def __init__(self, page_size, maximum_size):
+        self.page_size = page_size
+        self.maximum_size = maximum_size
+        self.size = 0
+        self.pages = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        
+    def get_page(self, dataset, snapshot, index):
+        key = (dataset.name, snapshot, index)
+        if key in self.pages:
+            self.hits += 1
+            page = self.pages.pop(key)
+            self.pages[key] = page
+            return page
+        
+        self.misses += 1
+        start = index * self.page_size
+        stop = start + self.page_size
+        if snapshot is None:
+            page = dataset[start:stop]
+        else:
+            page = dataset[snapshot, start:stop]
+        
+        if page.nbytes <= self.maximum_size:
+            self.pages[key] = page
+            self.size += page.nbytes
+            while self.size > self.maximum_size:
+                key, removed = self.pages.popitem(last = False)
+                self.size -= removed.nbytes
+        return page
+        
+    def get_rows(self, dataset, rows, snapshot = None):
+        """
+        returns the given rows of the dataset (of the snapshot in a time
+        series), rows is a slice or an array of row indices
+        """
+        length = dataset.shape[0] if snapshot is None else dataset.shape[1]
+        shape_of_row = dataset.shape[1:] if snapshot is None else dataset.shape[2:]
+        page_size = self.page_size
+        
+        if isinstance(rows, slice):
+            start, stop, step = rows.indices(length)
+            if step != 1:
+                return self.get_rows(dataset, numpy.arange(start, stop, step), snapshot)
+            result = numpy.empty((max(stop - start, 0),) + shape_of_row, dtype = dataset.dtype)
+            for index in range(start // page_size, (stop - 1) // page_size + 1):
+                page = self.get_page(dataset, snapshot, index)
+                first = max(start, index * page_size)
+                last = min(stop, (index + 1) * page_size)
+                result[first - start:last - start] = page[first - index * page_size:last - index * page_size]
+            return result
+        
+        rows = numpy.asarray(rows, dtype='int64')
+        if len(rows) > 1 and numpy.any(rows[1:] < rows[:-1]):
+            order = numpy.argsort(rows, kind='mergesort')
+            result = numpy.empty((len(rows),) + shape_of_row, dtype = dataset.dtype)
+            result[order] = self.get_rows(dataset, rows[order], snapshot)
+            return result
+            
+        result = numpy.empty((len(rows),) + shape_of_row, dtype = dataset.dtype)
+        for index in numpy.unique(rows // page_size):
+            page = self.get_page(dataset, snapshot, index)
+            first = numpy.searchsorted(rows, index * page_size)
+            last = numpy.searchsorted(rows, (index + 1) * page_size)
+            result[first:last] = page[rows[first:last] - index * page_size]
+        return result
+    
+    def clear(self):
+        self.pages.clear()
+        self.size = 0
+        
+class HDF5LazyAttributeStorage(HDF5AttributeStorage):
+    """
+    Read only attribute storage of a set in a file, the values and
+    keys are read when needed and only for the requested particles (through 
+    the page cache of the loader). The storage can be limited to some 
+    rows of the stored set (rows is a slice or a sorted array of rows).
+    The keys (and the sorted keys) are needed for every lookup, these 
+    are kept by the storage and do not count towards the size of the 
+    page cache.
+    """
+    
+    def __init__(self, hdfgroup, loader, rows = None, snapshot = None):
+        self.hdfgroup = hdfgroup
+        self.attributesgroup = self.hdfgroup["attributes"]
+        self.loader = loader
+        self.cache = loader.page_cache
+        self.snapshot = snapshot
+        
+        number_of_rows = len(self.hdfgroup["keys"])
+        if rows is None:
+            rows = slice(0, number_of_rows)
+        self.rows = rows
+        if isinstance(rows, slice):
+            self.number_of_particles = len(xrange(*rows.indices(number_of_rows)))
+        else:
+            self.number_of_particles = len(rows)
+            
+        self._particle_keys = None
+        self._sorted_keys = None
+        self._units = {}
+        
+    def can_extend_attributes(self):
+        return False
+        
+    def __len__(self):
+        return self.number_of_particles
+        
+    @property
+    def particle_keys(self):
+        if self._particle_keys is None:
+            if isinstance(self.rows, slice):
+                # read as a whole, the pages of the keys are not needed
+                self._particle_keys = self.hdfgroup["keys"][self.rows]
+            else:
+                self._particle_keys = self.cache.get_rows(self.hdfgroup["keys"], self.rows)
+        return self._particle_keys
+        
+    def get_sorted_keys(self):
+        if self._sorted_keys is None:
+            order = numpy.argsort(self.particle_keys)
+            self._sorted_keys = (order, self.particle_keys[order])
+        return self._sorted_keys
+        
+    def get_indices_of(self, keys):
+        if keys is None:
+            return numpy.arange(0, len(self))
+        
+        order, sorted_keys = self.get_sorted_keys()
+        
+        keys = numpy.asarray(keys)
+        positions = numpy.minimum(numpy.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+        found = sorted_keys[positions] == keys
+        if not numpy.all(found):
+            raise exceptions.KeysNotInStorageException(keys[found], order[positions[found]], keys[~found])
+        return order[positions]
+        
+    def has_key_in_store(self, key):
+        order, sorted_keys = self.get_sorted_keys()
+        position = numpy.searchsorted(sorted_keys, key)
+        return position < len(sorted_keys) and sorted_keys[position] == key
+        
+    def get_rows_in_file(self, indices):
+        if indices is None or indices is Ellipsis:
+            return self.rows
+            
+        if isinstance(indices, slice):
+            start, stop, step = indices.indices(len(self))
+            if step != 1:
+                return self.get_rows_in_file(numpy.arange(start, stop, step))
+            if isinstance(self.rows, slice):
+                return slice(start + self.rows.start, max(start, stop) + self.rows.start)
+            return self.rows[start:stop]
+        
+        indices = numpy.asarray(indices)
+        indices = numpy.where(indices < 0, indices + len(self), indices)
+        if numpy.any((indices < 0) | (indices >= len(self))):
+            raise IndexError("index out of bounds")
+        if isinstance(self.rows, slice):
+            return indices + self.rows.start
+        else:
+            return self.rows[indices]
+            
+    def get_values_in_store(self, indices, attributes):
+        rows = self.get_rows_in_file(indices)
+        results = []
+        for attribute in attributes:
+            dataset = self.attributesgroup[attribute]
+            units_string = dataset.attrs["units"]
+            if units_string == "link":
+                if self.snapshot is not None:
+                    raise exceptions.AmuseException("links are not supported in a time series")
+                attribute = HDF5Attribute.load_attribute(attribute, dataset, self.loader)
+                if isinstance(rows, slice):
+                    rows = numpy.arange(rows.start, rows.stop)
+                results.append(attribute.get_values(rows))
+                continue
+                
+            values = self.cache.get_rows(dataset, rows, self.snapshot)
+            if units_string == "none":
+                results.append(values)
+            elif units_string == "UNICODE":
+                results.append(numpy.char.decode(values, 'UTF-32BE'))
+            else:
+                if not attribute in self._units:
+                    self._units[attribute] = HDF5Attribute.load_attribute(attribute, dataset, self.loader).unit
+                results.append(self._units[attribute].new_quantity(values))
+        return results
+        
+    def get_all_keys_in_store(self):
+        return self.particle_keys
+        
+    def get_all_indices_in_store(self):
+        return numpy.arange(len(self))
+        
+    def set_values_in_store(self, indices, attributes, quantities):
+        raise exceptions.AmuseException("a set that is loaded lazily is read only, copy the set to change it")
+            
 class UneresolvedItemInArrayLink(object):
 
     def __init__(self, group, index, dataset_to_resolve, linked_set):
@@ -629,7 +912,32 @@ class StoreHDF(object):
     INFO_GROUP_NAME = 'AMUSE_INF'
     DATA_GROUP_NAME = 'data'
     
-    def __init__(self, filename, append_to_file=True, open_for_writing = True, copy_history = False, return_working_copy = False):
+    TIMESERIES_CHUNK_LENGTH = 16
+    TIMESERIES_CHUNK_BYTES = 2**20
+    
+    def __init__(self, filename, append_to_file=True, open_for_writing = True, copy_history = False, return_working_copy = False,
+            compression = None, compression_opts = None, shuffle = False, chunks = None, timeseries = False,
+            lazy = False, page_size = 2**16, cache_size = 2**27, index_range = None, key_range = None):
+        """
+        compression, compression_opts and shuffle select the filters
+        of the datasets of the attributes (for example compression="gzip",
+        compression_opts=4 and shuffle=True), chunks is True for chunks
+        chosen by h5py or the shape of the chunks. The shape may be shorter
+        than the shape of a dataset, the chunks span the remaining axes.
+        
+        if timeseries is True, a particle set with the same keys, attributes
+        and units as the previous snapshot is appended to the datasets of that
+        snapshot along an extendable time axis, instead of being stored in
+        a new group (snapshot with links, grids and strings are stored in a new group)
+        
+        if lazy is True, the loaded particle sets read their keys and values
+        from the file when needed and only for the selected particles, in pages 
+        of page_size rows that are kept in a cache of at most cache_size bytes.
+        The history is not copied into memory (copy_history is ignored). The
+        loaded sets can be limited to rows in index_range (start, stop) or to 
+        particles with keys in key_range (minimum, maximum), both exclusive of 
+        the stop or maximum.
+        """
         if h5py is None:
             raise AmuseException("h5py module not available, cannot use hdf5 files")
             
@@ -654,6 +962,17 @@ class StoreHDF(object):
         self.return_working_copy = return_working_copy
         self.mapping_from_groupid_to_set = {}
         
+        self.compression = compression
+        self.compression_opts = compression_opts
+        self.shuffle = shuffle
+        self.chunks = chunks
+        self.timeseries = timeseries
+        
+        self.lazy = lazy
+        self.page_cache = HDF5PageCache(page_size, cache_size)
+        self.index_range = index_range
+        self.key_range = key_range
+        
         #warnings.warn("amuse hdf storage version 2.0 is still in development, do not use it for production scripts")
         
     def is_correct_version(self):
@@ -736,6 +1055,10 @@ class StoreHDF(object):
         if parent is None:
             parent = self.data_group()
             
+        if self.timeseries and self.can_store_in_timeseries(particles, extra_attributes):
+            self.store_particles_in_timeseries(particles, extra_attributes, parent)
+            return
+            
         group = self.new_version(parent)
         group.attrs["type"] = 'particles'
         self.mapping_from_groupid_to_set[group.id] = particles
@@ -745,7 +1068,7 @@ class StoreHDF(object):
         group.attrs["class_of_the_particles"] = pickle_to_string(particles._factory_for_new_collection())
             
         keys = particles.get_all_keys_in_store()
-        dataset = group.create_dataset("keys", data=keys)
+        dataset = self.create_dataset(group, "keys", keys)
         self.hdf5file.flush()
         self.store_collection_attributes(particles, group, extra_attributes, links)
         self.store_values(particles, group, links)
@@ -773,6 +1096,161 @@ class StoreHDF(object):
         self.hdf5file.flush()
         
     
+    def store_particles_in_timeseries(self, particles, extra_attributes, parent):
+        keys = particles.get_all_keys_in_store()
+        names = particles.get_attribute_names_defined_in_store()
+        values = particles.get_values_in_store(Ellipsis, names)
+        collection_attributes = self.get_timeseries_collection_attributes(particles, extra_attributes)
+        class_of_the_particles = pickle_to_string(particles._factory_for_new_collection())
+        
+        group = None
+        if len(parent) > 0:
+            group = parent[format(len(parent),"010d")]
+            if not self.is_timeseries_compatible(group, keys, class_of_the_particles, names, values, collection_attributes):
+                group = None
+        
+        if group is None:
+            group = self.new_version(parent)
+            group.attrs["type"] = 'timeseries'
+            group.attrs["number_of_particles"] = len(particles)
+            group.attrs["number_of_snapshots"] = 0
+            group.attrs["class_of_the_particles"] = class_of_the_particles
+            self.create_dataset(group, "keys", keys)
+            attributes_group = group.create_group("attributes")
+            for name, quantity in zip(names, values):
+                self.new_timeseries_dataset(attributes_group, name, quantity)
+            collection_attributes_group = group.create_group("collection_attributes")
+            for name, quantity in collection_attributes.iteritems():
+                self.new_timeseries_dataset(collection_attributes_group, name, quantity)
+        
+        index = group.attrs["number_of_snapshots"]
+        for name, quantity in zip(names, values):
+            self.append_to_timeseries_dataset(group["attributes"][name], index, quantity)
+        for name, quantity in collection_attributes.iteritems():
+            self.append_to_timeseries_dataset(group["collection_attributes"][name], index, quantity)
+        group.attrs["number_of_snapshots"] = index + 1
+        
+        self.hdf5file.flush()
+        
+    def can_store_in_timeseries(self, particles, extra_attributes):
+        if len(particles) == 0:
+            return False
+            
+        for quantity in particles.get_values_in_store(Ellipsis, particles.get_attribute_names_defined_in_store()):
+            if is_quantity(quantity):
+                quantity = quantity.number
+            if not isinstance(quantity, numpy.ndarray) or not quantity.dtype.kind in 'biuf':
+                return False
+                
+        try:
+            self.get_timeseries_collection_attributes(particles, extra_attributes)
+        except ValueError:
+            return False
+        return True
+        
+    def get_timeseries_collection_attributes(self, container, extra_attributes):
+        result = {}
+        result.update(container.collection_attributes.__getstate__())
+        result.update(extra_attributes)
+        for name, quantity in result.items():
+            if quantity is None:
+                del result[name]
+                continue
+            number = quantity.value_in(quantity.unit) if is_quantity(quantity) else quantity
+            if not numpy.isscalar(number) or not numpy.asarray(number).dtype.kind in 'biuf':
+                raise ValueError("collection attribute {0} cannot be stored in a time series".format(name))
+        return result
+        
+    def is_timeseries_compatible(self, group, keys, class_of_the_particles, names, values, collection_attributes):
+        if group.attrs["type"] != 'timeseries' or group.attrs["class_of_the_particles"] != class_of_the_particles:
+            return False
+        if sorted(group["attributes"].keys()) != sorted(names):
+            return False
+        if sorted(group["collection_attributes"].keys()) != sorted(collection_attributes.keys()):
+            return False
+        for name, quantity in zip(names, values) + list(collection_attributes.iteritems()):
+            if name in group["attributes"]:
+                dataset = group["attributes"][name]
+            else:
+                dataset = group["collection_attributes"][name]
+            if dataset.attrs["units"] != self.units_string_of(quantity):
+                return False
+            number = quantity.value_in(quantity.unit) if is_quantity(quantity) else quantity
+            number = numpy.asarray(number)
+            if dataset.shape[1:] != number.shape or dataset.dtype != number.dtype:
+                return False
+        return numpy.array_equal(group["keys"][:], keys)
+        
+    def units_string_of(self, quantity):
+        if is_quantity(quantity):
+            return quantity.unit.to_simple_form().reference_string()
+        else:
+            return "none"
+            
+    def new_timeseries_dataset(self, group, name, quantity):
+        number = quantity.value_in(quantity.unit) if is_quantity(quantity) else quantity
+        number = numpy.asarray(number)
+        shape = (0,) + number.shape
+        maxshape = (None,) + number.shape
+        dataset = self.create_dataset(group, name, shape = shape, dtype = number.dtype, maxshape = maxshape)
+        dataset.attrs["units"] = self.units_string_of(quantity)
+        return dataset
+        
+    def append_to_timeseries_dataset(self, dataset, index, quantity):
+        if is_quantity(quantity):
+            number = quantity.value_in(quantity.unit)
+        else:
+            number = quantity
+        dataset.resize(index + 1, axis = 0)
+        dataset[index] = number
+        
+    def create_dataset(self, group, name, data = None, shape = None, dtype = None, maxshape = None):
+        if data is not None:
+            data = numpy.asarray(data)
+            shape = data.shape
+            dtype = data.dtype
+        options = self.dataset_options(shape, numpy.dtype(dtype), maxshape)
+        return group.create_dataset(name, shape = shape, dtype = dtype, data = data, maxshape = maxshape, **options)
+        
+    def dataset_options(self, shape, dtype, maxshape = None):
+        if len(shape) == 0 or (maxshape is None and numpy.prod(shape) == 0):
+            return {}
+            
+        result = {}
+        if self.compression is not None:
+            result["compression"] = self.compression
+            if self.compression_opts is not None:
+                result["compression_opts"] = self.compression_opts
+        if self.shuffle:
+            result["shuffle"] = True
+        
+        chunks = self.chunks
+        if chunks is None and maxshape is not None:
+            chunks = self.timeseries_chunks(shape, dtype)
+        if chunks is True:
+            result["chunks"] = True
+        elif chunks is not None:
+            if maxshape is None:
+                maxshape = shape
+            chunks = list(chunks)[:len(shape)]
+            chunks.extend(maxshape[len(chunks):])
+            for i, x in enumerate(maxshape):
+                if x is not None:
+                    chunks[i] = min(chunks[i], x)
+                chunks[i] = max(chunks[i], 1)
+            result["chunks"] = tuple(chunks)
+        return result
+        
+    def timeseries_chunks(self, shape, dtype):
+        """
+        a few snapshots by as many particles as fit in about a megabyte, 
+        so the history of a particle can be read from a few chunks
+        """
+        length = self.TIMESERIES_CHUNK_LENGTH
+        bytes_per_particle = dtype.itemsize * numpy.prod(shape[2:], dtype='int64')
+        number_of_particles = self.TIMESERIES_CHUNK_BYTES // (length * bytes_per_particle)
+        return (length, max(1, number_of_particles))
+        
     def resolve_links(self, mapping_from_setid_to_group, links):
         sets_to_store = []
         seen_sets_by_id = set([])
@@ -793,17 +1271,17 @@ class StoreHDF(object):
         for attribute, quantity in zip(container.get_attribute_names_defined_in_store(), all_values):
             if is_quantity(quantity):
                 value = quantity.value_in(quantity.unit)
-                dataset = attributes_group.create_dataset(attribute, data=value)
+                dataset = self.create_dataset(attributes_group, attribute, value)
                 dataset.attrs["units"] = quantity.unit.to_simple_form().reference_string()
             elif isinstance(quantity, LinkedArray):
                 self.store_linked_array(attribute, attributes_group, quantity, group, links)
             else:
                 dtype = numpy.asanyarray(quantity).dtype
                 if dtype.kind == 'U':
-                    dataset = attributes_group.create_dataset(attribute, data=numpy.char.encode(quantity,  'UTF-32BE'))
+                    dataset = self.create_dataset(attributes_group, attribute, numpy.char.encode(quantity,  'UTF-32BE'))
                     dataset.attrs["units"] = "UNICODE"
                 else:
-                    dataset = attributes_group.create_dataset(attribute, data=quantity)
+                    dataset = self.create_dataset(attributes_group, attribute, quantity)
                     dataset.attrs["units"] = "none"
                 
     
@@ -978,6 +1456,13 @@ class StoreHDF(object):
         except:
             class_of_the_container = Particles
             
+        if self.lazy:
+            particles = class_of_the_container(is_working_copy = False)
+            particles._private.attribute_storage = HDF5LazyAttributeStorage(group, self, self.get_selected_rows(group))
+            self.mapping_from_groupid_to_set[group.id] = particles
+            self.load_collection_attributes(particles, group)
+            return particles
+            
         dataset = group["keys"]
         keys = numpy.ndarray(len(dataset), dtype = dataset.dtype)
         if len(keys) == 0:
@@ -1011,6 +1496,118 @@ class StoreHDF(object):
         
         return container
     
+    def load_timeseries_from_group(self, group):
+        try:
+            class_of_the_container = unpickle_from_string(group.attrs["class_of_the_particles"])
+        except:
+            class_of_the_container = Particles
+            
+        if self.lazy:
+            rows = self.get_selected_rows(group)
+        else:
+            keys = group["keys"][:]
+        mapping_from_particle_to_index = None
+        result = []
+        for index in range(group.attrs["number_of_snapshots"]):
+            particles = class_of_the_container(is_working_copy = False)
+            if self.lazy:
+                storage = HDF5LazyAttributeStorage(group, self, rows, index)
+            else:
+                storage = HDF5TimeSeriesAttributeStorage(keys, group, self, index, mapping_from_particle_to_index)
+                mapping_from_particle_to_index = storage.mapping_from_particle_to_index
+            particles._private.attribute_storage = storage
+            self.load_timeseries_collection_attributes(particles, group, index)
+            result.append(particles)
+        
+        self.mapping_from_groupid_to_set[group.id] = result[-1]
+        return result
+        
+    def load_timeseries_collection_attributes(self, container, group, index):
+        collection_attributes_group = group["collection_attributes"]
+        for name in collection_attributes_group.keys():
+            dataset = collection_attributes_group[name]
+            quantity = dataset[index]
+            if dataset.attrs["units"] != "none":
+                unit = eval(dataset.attrs["units"], core.__dict__) 
+                quantity = unit.new_quantity(quantity)
+            setattr(container.collection_attributes, name, quantity)
+            
+    def get_selected_rows(self, group):
+        """
+        the rows of the set in the group within the index and key range, 
+        a slice or a sorted array of rows (None for all rows)
+        """
+        if self.index_range is None and self.key_range is None:
+            return None
+            
+        dataset = group["keys"]
+        start, stop, step = slice(*(self.index_range or (None,))).indices(len(dataset))
+        if self.key_range is None:
+            return slice(start, stop)
+        
+        minimum, maximum = self.key_range
+        page_size = self.page_cache.page_size
+        result = []
+        for offset in range(start, stop, page_size):
+            keys = dataset[offset:min(offset + page_size, stop)]
+            result.append(numpy.flatnonzero((keys >= minimum) & (keys < maximum)) + offset)
+        if len(result) == 0:
+            return numpy.zeros(0, dtype='int64')
+        return numpy.concatenate(result)
+        
+    def load_attribute_history(self, attribute, keys, container_group = None):
+        """
+        returns the values of the attribute of the particles with the 
+        given keys in all the stored snapshots, the first axis of the 
+        result is the snapshot. Snapshots in a time series are read
+        for the selected particles only, stored grids are skipped
+        """
+        if container_group is None:
+            container_group = self.data_group()
+            
+        keys = numpy.asarray(keys)
+        unit = None
+        result = []
+        for name in sorted(container_group.keys()):
+            group = container_group[name]
+            if not "keys" in group:
+                continue
+            if not attribute in group["attributes"]:
+                raise exceptions.AmuseException("attribute {0} not found in the set stored in group {1}".format(attribute, group.name))
+            indices = self.get_indices_of_keys(group["keys"][:], keys)
+            dataset = group["attributes"][attribute]
+            if group.attrs["type"] == 'timeseries':
+                unique_indices, inverse = numpy.unique(indices, return_inverse = True)
+                values = dataset[:, list(unique_indices)][:, inverse]
+            else:
+                values = dataset[:][indices][numpy.newaxis]
+            
+            units_string = dataset.attrs["units"]
+            if units_string != "none":
+                if unit is None:
+                    unit = HDF5Attribute.load_attribute(attribute, dataset, self).unit
+                else:
+                    values = HDF5Attribute.load_attribute(attribute, dataset, self).unit.new_quantity(values).value_in(unit)
+            result.append(values)
+        
+        if len(result) == 0:
+            raise exceptions.AmuseException("no particle sets stored in group {0}".format(container_group.name))
+        result = numpy.concatenate(result)
+        if unit is None:
+            return result
+        else:
+            return unit.new_quantity(result)
+            
+    def get_indices_of_keys(self, stored_keys, keys):
+        sorted_indices = numpy.argsort(stored_keys)
+        sorted_keys = stored_keys[sorted_indices]
+        positions = numpy.searchsorted(sorted_keys, keys)
+        positions = numpy.minimum(positions, len(sorted_keys) - 1)
+        found = sorted_keys[positions] == keys
+        if not numpy.all(found):
+            raise exceptions.AmuseException("particle with key {0} not found in a snapshot".format(keys[~found][0]))
+        return sorted_indices[positions]
+        
     def load_from_group(self, group):
         container_type = group.attrs['type']
         
@@ -1018,6 +1615,8 @@ class StoreHDF(object):
             return self.load_particles_from_group(group)
         elif container_type == 'grid':
             return self.load_grid_from_group(group)
+        elif container_type == 'timeseries':
+            return self.load_timeseries_from_group(group)[-1]
         else:
             raise Exception('unknown container type in file {0}'.format(container_type))
         
@@ -1036,15 +1635,16 @@ class StoreHDF(object):
         return self.load_container(container_group)
         
     def load_container(self, container_group):
-        number_of_saved_containers= len(container_group)
-        print number_of_saved_containers, container_group
-        all_containers = [None] * number_of_saved_containers
-        for group_index in container_group.keys():
+        all_containers = []
+        for group_index in sorted(container_group.keys()):
             group = container_group[group_index]
-            container = self.load_from_group(group)
-            if self.copy_history:
-                container = container.copy()
-            all_containers[int(group_index) - 1] = container
+            if group.attrs['type'] == 'timeseries':
+                containers = self.load_timeseries_from_group(group)
+            else:
+                containers = [self.load_from_group(group)]
+            if self.copy_history and not self.lazy:
+                containers = [x.copy() for x in containers]
+            all_containers.extend(containers)
         previous = None
         for x in all_containers:
             x._private.previous = previous
@@ -1052,7 +1652,7 @@ class StoreHDF(object):
             
         last = all_containers[-1]
         
-        if self.copy_history:
+        if self.copy_history and not self.lazy:
             copy_of_last = last.copy()
             copy_of_last._private.previous = last
             return copy_of_last
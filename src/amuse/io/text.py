@@ -6,6 +6,8 @@ from amuse.units import core
 from amuse.units.quantities import is_quantity
 
 import re
+import itertools
+import operator
 
 from amuse import datamodel
 class LineBasedFileCursor(object):
@@ -31,6 +33,32 @@ class LineBasedFileCursor(object):
         
     def is_at_end(self):
         return self._line is None
+    
+    def read_lines_until(self, prefix, maximum_number_of_lines):
+        """
+        Returns at most maximum_number_of_lines lines, starting with the
+        current line and up to the first line starting with the prefix. 
+        The lines are read from the file in one block, the cursor
+        is moved to the line after the last returned line.
+        """
+        if self.is_at_end() or self._line.startswith(prefix):
+            return []
+        
+        result = [self._line]
+        result.extend([x.rstrip('\r\n') for x in itertools.islice(self.file, maximum_number_of_lines - 1)])
+        
+        is_prefixed = [x.startswith(prefix) for x in result]
+        if True in is_prefixed:
+            index = is_prefixed.index(True)
+            # lines after the prefixed line are read again by the cursor
+            self.file = itertools.chain(result[index+1:], self.file)
+            self._line = result[index]
+            del result[index:]
+        elif len(result) < maximum_number_of_lines:
+            self._line = None
+        else:
+            self.read_next_line()
+        return result
         
         
 class TableFormattedText(base.FileFormatProcessor):
@@ -60,16 +88,35 @@ class TableFormattedText(base.FileFormatProcessor):
             return line.split(self.column_separator)
     
     def load(self):
-        if self.stream is None:
-            self.stream = open(self.filename, "r")
-            close_function = self.stream.close  
-        else:
-            close_function = lambda : None
-            
+        close_function = self.open_stream_for_reading()
         try:
             return self.load_from_stream()
         finally:
             close_function()
+    
+    def load_chunks(self):
+        """
+        Generator, yields the rows of the table in sets of at 
+        most maximum_number_of_lines_buffered particles. Use this to 
+        process tables that are too big to load into memory at once.
+        """
+        close_function = self.open_stream_for_reading()
+        try:
+            self.cursor = LineBasedFileCursor(self.stream)
+            self.read_header()
+            for number_of_rows, keys, values in self.read_blocks_of_rows():
+                yield self.new_set_with_values(number_of_rows, keys, values)
+            self.cursor.forward()
+            self.read_footer()
+        finally:
+            close_function()
+    
+    def open_stream_for_reading(self):
+        if self.stream is None:
+            self.stream = open(self.filename, "r")
+            return self.stream.close  
+        else:
+            return lambda : None
         
     def load_from_stream(self):
         self.cursor = LineBasedFileCursor(self.stream)
@@ -154,6 +201,18 @@ class TableFormattedText(base.FileFormatProcessor):
         else:
             return self.convert_string_to_long
     
+    def _convert_strings_to_dtype(self, strings, dtype):
+        dtype = numpy.dtype(numpy.float64 if dtype is None else dtype)
+        if dtype.kind in 'fiu':
+            # astype parses every string completely, it raises a ValueError
+            # on trailing characters (fromstring would stop silently)
+            return numpy.asarray(strings, dtype = str).astype(dtype)
+        elif dtype.kind == 'b':
+            strings = numpy.asarray(strings)
+            return (strings == 'True') | (strings == 'true')
+        else:
+            return numpy.asarray(strings).astype(dtype)
+    
 
     @base.format_option
     def header_prefix_string(self):
@@ -226,7 +285,6 @@ class TableFormattedText(base.FileFormatProcessor):
                     current = []
                 else:
                     current = self.attribute_names[:]
-                print index
                 while len(current)<=index:
                     current.append("")
                 current[index] = name
@@ -243,76 +301,101 @@ class TableFormattedText(base.FileFormatProcessor):
         
 
     def read_rows(self):
-        values = map(lambda x : [], range(len(self.attribute_names)))
+        blocks = list(self.read_blocks_of_rows())
         
-        number_of_particles = 0
-        keys = []
+        number_of_particles = sum([x[0] for x in blocks])
+        if number_of_particles > 0:
+            keys = numpy.concatenate([x[1] for x in blocks]) if self.key_in_column >= 0 else []
+            values = [numpy.concatenate(x) for x in zip(*[x[2] for x in blocks])]
+            self.set = self.new_set_with_values(number_of_particles, keys, values)
+        else:
+            self.set = self.new_set(0)
+            
+        self.cursor.forward()
+    
+    def read_blocks_of_rows(self):
+        """
+        Generator, reads the rows up to the footer in blocks of at 
+        most maximum_number_of_lines_buffered lines. Yields the
+        number of rows, the keys and a list of arrays (one for every 
+        attribute) per block.
+        """
+        if self.column_separator == ' ':
+            split = operator.methodcaller('split')
+        else:
+            split = operator.methodcaller('split', self.column_separator)
+        
+        while True:
+            lines = self.cursor.read_lines_until(self.footer_prefix_string, self.maximum_number_of_lines_buffered)
+            if len(lines) == 0:
+                break
+            
+            rows = map(split, lines)
+            lengths = map(len, rows)
+            if 0 in lengths:
+                lines = [x for x, length in zip(lines, lengths) if length > 0]
+                rows = [x for x in rows if len(x) > 0]
+                lengths = [x for x in lengths if x > 0]
+                if len(rows) == 0:
+                    continue
+            
+            result = None
+            number_of_columns = len(self.attribute_names) + (1 if self.key_in_column >= 0 else 0)
+            if lengths.count(number_of_columns) == len(lengths):
+                result = self.convert_rows_to_columns(rows)
+            if result is None:
+                result = self.convert_rows_to_columns_one_by_one(lines, rows)
+            yield result
+    
+    def convert_rows_to_columns(self, rows):
+        columns = zip(*rows)
+        try:
+            if self.key_in_column >= 0:
+                keys = self._convert_strings_to_dtype(columns.pop(self.key_in_column), numpy.uint64)
+            else:
+                keys = []
+            values = map(self._convert_strings_to_dtype, columns, self.attribute_dtypes)
+        except ValueError:
+            # let the rows be converted one by one, to 
+            # raise the error on the offending value
+            return None
+        return len(rows), keys, values
         
-        self.set = None
+    def convert_rows_to_columns_one_by_one(self, lines, rows):
+        values = map(lambda x : [], range(len(self.attribute_names)))
+        keys = []
         string_converters = map(self._new_converter_from_string_to_dtype, self.attribute_dtypes)
-        units_with_dtype = map(core.unit_with_specific_dtype, self.attribute_types, self.attribute_dtypes)
         
-        while not self.cursor.is_at_end() and not self.cursor.line().startswith(self.footer_prefix_string):
-            columns = self.split_into_columns(self.cursor.line())
-            if len(columns)>0:
-                
-                if self.key_in_column >= 0:
-                       
-                    if len(columns) != len(self.attribute_names) + 1:
-                        raise base.IoException(
-                            "Number of values on line '{0}' is {1}, expected {2}".format(self.cursor.line(), len(columns), len(self.attribute_names)))
-            
-                    
-                    key = self.convert_string_to_long(columns[self.key_in_column])
-                    keys.append(key)
-                    del columns[self.key_in_column]
-                    
-                if len(columns) != len(self.attribute_names):
+        for line, columns in zip(lines, rows):
+            if self.key_in_column >= 0:
+                if len(columns) != len(self.attribute_names) + 1:
                     raise base.IoException(
-                        "Number of values on line '{0}' is {1}, expected {2}".format(self.cursor.line(), len(columns), len(self.attribute_names)))
-            
-                map(lambda value_string, list_of_values, conv: list_of_values.append(conv(value_string)), 
-                    columns, values, string_converters)
+                        "Number of values on line '{0}' is {1}, expected {2}".format(line, len(columns), len(self.attribute_names)))
                 
-                number_of_particles += 1
-            self.cursor.forward()
-            if number_of_particles >= self.maximum_number_of_lines_buffered:
-                quantities = map(
-                    lambda value, unit, dtype : unit.new_quantity(value) if not unit is None else (numpy.asarray(value, dtype=dtype) if not dtype is None else value), 
-                    values, 
-                    units_with_dtype,
-                    self.attribute_dtypes
-                )
-                if self.set is None:
-                    self.set = self.new_set(number_of_particles, keys = keys)
-                    self.set.set_values_in_store(self.set.get_all_indices_in_store(), self.attribute_names, quantities)
-                else:
-                    tmp_set = self.new_set(number_of_particles, keys = keys)
-                    tmp_set.set_values_in_store(tmp_set.get_all_indices_in_store(), self.attribute_names, quantities)
-                    self.set.add_particles(tmp_set)
-                    
-                number_of_particles = 0
-                keys = []
-                values = map(lambda x : [], range(len(self.attribute_names)))
+                key = self.convert_string_to_long(columns[self.key_in_column])
+                keys.append(key)
+                del columns[self.key_in_column]
+                
+            if len(columns) != len(self.attribute_names):
+                raise base.IoException(
+                    "Number of values on line '{0}' is {1}, expected {2}".format(line, len(columns), len(self.attribute_names)))
         
-        if number_of_particles > 0:
-            quantities = map(
-                lambda value, unit, dtype : unit.new_quantity(value) if not unit is None else (numpy.asarray(value, dtype=dtype) if not dtype is None else value), 
-                values, 
-                units_with_dtype,
-                self.attribute_dtypes
-            )
-            if self.set is None:
-                self.set = self.new_set(number_of_particles, keys = keys)
-                self.set.set_values_in_store(self.set.get_all_indices_in_store(), self.attribute_names, quantities)
-            else:
-                tmp_set = self.new_set(number_of_particles, keys = keys)
-                tmp_set.set_values_in_store(tmp_set.get_all_indices_in_store(), self.attribute_names, quantities)
-                self.set.add_particles(tmp_set)
-        elif self.set is None:
-            self.set = self.new_set(0)
-            
-        self.cursor.forward()
+            map(lambda value_string, list_of_values, conv: list_of_values.append(conv(value_string)), 
+                columns, values, string_converters)
+        
+        values = map(lambda value, dtype : numpy.asarray(value, dtype=dtype), values, self.attribute_dtypes)
+        return len(rows), numpy.asarray(keys, dtype=numpy.uint64), values
+    
+    def new_set_with_values(self, number_of_items, keys, values):
+        units_with_dtype = map(core.unit_with_specific_dtype, self.attribute_types, self.attribute_dtypes)
+        quantities = map(
+            lambda value, unit : value if unit is None else unit.new_quantity(value), 
+            values, 
+            units_with_dtype
+        )
+        result = self.new_set(number_of_items, keys = keys if self.key_in_column >= 0 else [])
+        result.set_values_in_store(result.get_all_indices_in_store(), self.attribute_names, quantities)
+        return result
         
 
     def read_footer(self):
@@ -340,32 +423,23 @@ class TableFormattedText(base.FileFormatProcessor):
         block_size = min(self.maximum_number_of_lines_buffered, max_row)
         offset = 0
         
+        # every block is formatted with one format string,
+        # equivalent to convert_number_to_string and convert_long_to_string
+        specifiers = [self.number_format_specifier] * len(quantities)
+        if self.key_in_column >= 0:
+            specifiers.insert(self.key_in_column, '%s')
+        row_format = self.column_separator.replace('%', '%%').join(specifiers) + '\n'
+        
         while offset < max_row:
             
             numbers = map(lambda quantity, unit : quantity[offset:offset+block_size] if unit is None else quantity[offset:offset+block_size].value_in(unit), quantities, units)
             
-            columns = []
-            
-            
-                
-            for x in numbers:
-                columns.append(map(self.convert_number_to_string, x))
-            
-            rows = []
-            for i in range(len(columns[0])):
-                row = [x[i] for x in columns]
-                
-                if self.key_in_column >= 0:
-                    row.insert(self.key_in_column, self.convert_long_to_string(self.keys[i+offset]))
-                
-                rows.append(row)
+            columns = map(list, numbers)
+            if self.key_in_column >= 0:
+                columns.insert(self.key_in_column, list(self.keys[offset:offset+block_size]))
             
-            lines = map(lambda  x : self.column_separator.join(x), rows)
-            
-            
-            for x in lines:
-                self.stream.write(x)
-                self.stream.write('\n')
+            rows = zip(*columns)
+            self.stream.write((row_format * len(rows)) % tuple(itertools.chain.from_iterable(rows)))
                 
             offset += block_size
         
@@ -471,7 +545,12 @@ class TableFormattedText(base.FileFormatProcessor):
         else:
             return str(number)
     
-
+    @property
+    def number_format_specifier(self):
+        if self.is_precise:
+            return '%.18e'
+        else:
+            return '%s'
 
     def convert_long_to_string(self, number):
         return str(number)
@@ -529,7 +608,6 @@ class TableFormattedText(base.FileFormatProcessor):
         from amuse.units import core
         from amuse.units import units
         
-        print floats, int(floats[1]) == -1, numpy.all(numpy.asarray(floats[2:]) == 0.0), numpy.asarray(floats[2:]) == 0.0
         if int(floats[1]) == -1 and numpy.all(numpy.asarray(floats[2:]) == 0.0):
             return None
         factor = floats[0]
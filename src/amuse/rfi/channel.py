@@ -9,11 +9,14 @@ import threading
 import select
 import atexit
 import time
+import tempfile
+import warnings
 
 import socket
 import array
 import logging
 import shlex
+import Queue
 
 logger = logging.getLogger(__name__)
 
@@ -738,47 +741,144 @@ Please do a 'make clean; make' in the root directory.
             
         return max(1, max(lengths))
 
+    @option(type="int", sections=("channel",))
+    def split_message_window(self):
+        """
+        Number of blocks of a split message (see max_message_length) that can be
+        send to the worker before the results of the first block are received.
+        With more than one block in flight, the next block is packed and send
+        while the worker handles the current block. Only used by channels that
+        support sending and receiving at the same time.
+        """
+        return 4
+        
+    def is_split_message_pipelining_supported(self):
+        return False
+        
     def split_message(self, call_id, function_id, call_count, dtype_to_arguments, encoded_units = ()):
         
         if call_count<=1:
             raise Exception("split message called with call_count<=1")
+        
+        if self.split_message_window > 1 and self.is_split_message_pipelining_supported():
+            dtype_to_result = self.pipelined_split_message(call_id, function_id, call_count, dtype_to_arguments, encoded_units)
+        else:
+            dtype_to_result = {}
+            
+            ndone=0
+            while ndone<call_count:
+                self.send_message(
+                    call_id,
+                    function_id,
+                    self.split_arguments(dtype_to_arguments, ndone),
+                    encoded_units=encoded_units
+                )
                 
+                partial_dtype_to_result = self.recv_message(call_id, function_id, True)
+                self.merge_split_results(dtype_to_result, partial_dtype_to_result, ndone, call_count)
+                
+                ndone+=self.max_message_length
+        
+        self._communicated_splitted_message = True
+        self._merged_results_splitted_message = dtype_to_result
+        
+    def pipelined_split_message(self, call_id, function_id, call_count, dtype_to_arguments, encoded_units):
+        """
+        Sends the blocks of the message from a separate thread, at most
+        split_message_window blocks are send before their results are received.
+        The results are received (in order) in the calling thread.
+        """
+        offsets = range(0, call_count, self.max_message_length)
+        window = threading.Semaphore(self.split_message_window)
+        sent_offsets = Queue.Queue()
+        must_stop = [False]
+        
+        def send_blocks():
+            try:
+                for ndone in offsets:
+                    window.acquire()
+                    if must_stop[0]:
+                        break
+                    split_dtype_to_argument = self.split_arguments(dtype_to_arguments, ndone)
+                    self.send_split_block(
+                        call_id,
+                        function_id,
+                        self.determine_length_from_data(split_dtype_to_argument),
+                        split_dtype_to_argument,
+                        encoded_units
+                    )
+                    sent_offsets.put(ndone)
+            except Exception as ex:
+                sent_offsets.put(ex)
+                
+        thread = threading.Thread(target = send_blocks)
+        thread.daemon = True
+        thread.start()
+        
         dtype_to_result = {}
+        number_of_blocks_received = 0
+        try:
+            while number_of_blocks_received < len(offsets):
+                ndone = sent_offsets.get()
+                if isinstance(ndone, Exception):
+                    raise ndone
+                number_of_blocks_received += 1
+                partial_dtype_to_result = self.recv_split_block(call_id, function_id)
+                window.release()
+                self.merge_split_results(dtype_to_result, partial_dtype_to_result, ndone, call_count)
+        finally:
+            must_stop[0] = True
+            window.release()
+            # the worker still replies to the blocks that were send, receive
+            # these while the sender finishes (the worker and the sender can
+            # both be blocked on a full socket) to keep the channel valid
+            while number_of_blocks_received < len(offsets):
+                try:
+                    ndone = sent_offsets.get(timeout = 0.1)
+                except Queue.Empty:
+                    if thread.is_alive() or not sent_offsets.empty():
+                        continue
+                    break
+                if isinstance(ndone, Exception):
+                    break
+                number_of_blocks_received += 1
+                try:
+                    self.recv_split_block(call_id, function_id)
+                except exceptions.CodeException:
+                    pass
+                window.release()
+            thread.join()
         
-        ndone=0
-        while ndone<call_count:
-            split_dtype_to_argument = {}
-            for key, value in dtype_to_arguments.iteritems():
-                split_dtype_to_argument[key] = \
-                  [tmp[ndone:ndone+self.max_message_length] if hasattr(tmp, '__iter__') else tmp for tmp in value]
-
-            self.send_message(
-                call_id,
-                function_id,
-                split_dtype_to_argument,
-                encoded_units=encoded_units
-            )
-            
-            partial_dtype_to_result = self.recv_message(call_id, function_id, True)
-            for datatype, value in partial_dtype_to_result.iteritems():
-                if not datatype in dtype_to_result:
-                    dtype_to_result[datatype] = [] 
-                    for j, element in enumerate(value):
-                        if datatype == 'string':
-                            dtype_to_result[datatype].append([])
-                        else:
-                            dtype_to_result[datatype].append(numpy.zeros((call_count,), dtype=datatype))
-                            
+        return dtype_to_result
+        
+    def send_split_block(self, call_id, function_id, call_count, dtype_to_arguments, encoded_units):
+        raise NotImplementedError()
+        
+    def recv_split_block(self, call_id, function_id):
+        raise NotImplementedError()
+        
+    def split_arguments(self, dtype_to_arguments, ndone):
+        split_dtype_to_argument = {}
+        for key, value in dtype_to_arguments.iteritems():
+            split_dtype_to_argument[key] = \
+              [tmp[ndone:ndone+self.max_message_length] if hasattr(tmp, '__iter__') else tmp for tmp in value]
+        return split_dtype_to_argument
+        
+    def merge_split_results(self, dtype_to_result, partial_dtype_to_result, ndone, call_count):
+        for datatype, value in partial_dtype_to_result.iteritems():
+            if not datatype in dtype_to_result:
+                dtype_to_result[datatype] = [] 
                 for j, element in enumerate(value):
                     if datatype == 'string':
-                        dtype_to_result[datatype][j].extend(element)
+                        dtype_to_result[datatype].append([])
                     else:
-                        dtype_to_result[datatype][j][ndone:ndone+self.max_message_length] = element
-                
-            ndone+=self.max_message_length
-        
-        self._communicated_splitted_message = True
-        self._merged_results_splitted_message = dtype_to_result
+                        dtype_to_result[datatype].append(numpy.zeros((call_count,), dtype=datatype))
+                        
+            for j, element in enumerate(value):
+                if datatype == 'string':
+                    dtype_to_result[datatype][j].extend(element)
+                else:
+                    dtype_to_result[datatype][j][ndone:ndone+self.max_message_length] = element
 
 
 
@@ -1154,6 +1254,39 @@ class MpiChannel(AbstractMessageChannel):
             return message.to_result(handle_as_array)
         
 
+    def is_split_message_pipelining_supported(self):
+        return self.is_multithreading_supported()
+        
+    def send_split_block(self, call_id, function_id, call_count, dtype_to_arguments, encoded_units):
+        message = ServerSideMPIMessage(
+            call_id, function_id,
+            call_count, dtype_to_arguments, 
+            encoded_units = encoded_units
+        )
+        message.send(self.intercomm)
+        
+    def recv_split_block(self, call_id, function_id):
+        message = ServerSideMPIMessage(
+            polling_interval=self.polling_interval_in_milliseconds * 1000
+        )
+        try:
+            message.receive(self.intercomm)
+        except MPI.Exception as ex:
+            self.stop()
+            raise ex
+        
+        if message.call_id != call_id:
+            self.stop()
+            raise exceptions.CodeException('Received reply for call id {0} but expected {1}'.format(message.call_id, call_id))
+        if message.function_id != function_id:
+            self.stop()
+            raise exceptions.CodeException('Received reply for function id {0} but expected {1}'.format(message.function_id, function_id))
+        
+        if message.error:
+            raise exceptions.CodeException("Error in code: " + message.strings[0])
+        
+        return message.to_result(True)
+        
     def nonblocking_recv_message(self, call_id, function_id, handle_as_array, has_units = False):
         request = ServerSideMPIMessage().nonblocking_receive(self.intercomm)
         def handle_result(function):
@@ -1442,36 +1575,37 @@ m.run_mpi_channel('{2}')"""
         return True
 
 class SocketMessage(AbstractMessage):
-      
-    def _receive_all(self, nbytes, thesocket):
-
-        # logger.debug("receiving %d bytes", nbytes)
-        
-        result = []
+    
+    # messages smaller than this are joined and send with one call,
+    # larger arrays are send directly from their own memory
+    gather_threshold = 65536
+    
+    def _receive_into(self, buffer, thesocket):
+        view = memoryview(buffer.view('uint8'))
+        nbytes = buffer.nbytes
+        offset = 0
         
-        while nbytes > 0:
-            chunk = min(nbytes, 10240)
-            data_bytes = thesocket.recv(chunk)
+        while offset < nbytes:
+            count = thesocket.recv_into(view[offset:], nbytes - offset)
             
-            if len(data_bytes) == 0:
+            if count == 0:
                 raise exceptions.CodeException("lost connection to code")
             
-            result.append(data_bytes)
-            nbytes -= len(data_bytes)
-            # logger.debug("got %d bytes, result length = %d", len(data_bytes), len(result))
-        
-        if len(result) > 0:
-            return type(result[0])().join(result)
-        else:
-            return b""
-            
+            offset += count
+    
+    def _receive_all(self, nbytes, thesocket):
+        result = numpy.empty(nbytes, dtype='uint8')
+        self._receive_into(result, thesocket)
+        return result.tostring()
+    
     def receive(self, socket):
         
         # logger.debug("receiving message")
         
-        header_bytes = self._receive_all(44, socket)
+        header_bytes = numpy.empty(44, dtype='uint8')
+        self._receive_into(header_bytes, socket)
         
-        flags = numpy.frombuffer(header_bytes, dtype="b", count=4, offset=0)
+        flags = header_bytes[:4].view('b')
         
         if flags[0] != self.big_endian:
             raise exceptions.CodeException("endianness in message does not match native endianness")
@@ -1481,7 +1615,7 @@ class SocketMessage(AbstractMessage):
         else:
             self.error = False
         
-        header = numpy.copy(numpy.frombuffer(header_bytes, dtype="i", offset=0))
+        header = header_bytes.view('i')
         
         # logger.debug("receiving message with flags %s and header %s", flags, header)
 
@@ -1502,81 +1636,83 @@ class SocketMessage(AbstractMessage):
         number_of_booleans = header[8]
         number_of_strings = header[9]
         number_of_units = header[10]
-
-        self.ints = self.receive_ints(socket, number_of_ints)
-        self.longs = self.receive_longs(socket, number_of_longs)
-        self.floats = self.receive_floats(socket, number_of_floats)
-        self.doubles = self.receive_doubles(socket, number_of_doubles)
-        self.booleans = self.receive_booleans(socket, number_of_booleans)
-        self.strings = self.receive_strings(socket, number_of_strings)
-        self.encoded_units = self.receive_doubles(socket, number_of_units)
         
-        # logger.debug("message received")
+        # all arrays up to and including the lengths of the strings
+        # are received in one read, the arrays are views on this buffer
+        layout = (
+            ('ints', 'int32', number_of_ints),
+            ('longs', 'int64', number_of_longs),
+            ('floats', 'f4', number_of_floats),
+            ('doubles', 'f8', number_of_doubles),
+            ('booleans', 'b', number_of_booleans),
+        )
+        nbytes = sum([numpy.dtype(dtype).itemsize * count for name, dtype, count in layout]) + 4 * number_of_strings
+        body = self._receive_payload(socket, flags, nbytes)
         
-
-    def receive_ints(self, socket, count):
-        if count > 0:
-            nbytes = count * 4  # size of int
-            
-            data_bytes = self._receive_all(nbytes, socket)
-            
-            result = numpy.copy(numpy.frombuffer(data_bytes, dtype='int32'))
-            
-            return result
-        else:
-            return []        
-            
-    def receive_longs(self, socket, count):
-        if count > 0:
-            nbytes = count * 8  # size of long
-            
-            data_bytes = self._receive_all(nbytes, socket)
-            
-            result = numpy.copy(numpy.frombuffer(data_bytes, dtype='int64'))
-            
-            return result
-        else:
-            return []
- 
+        offset = 0
+        for name, dtype, count in layout:
+            setattr(self, name, self._view_on(body, offset, dtype, count))
+            offset += numpy.dtype(dtype).itemsize * count
         
-    def receive_floats(self, socket, count):
+        lengths = self._view_on(body, offset, 'int32', number_of_strings)
+        
+        # the characters of the strings and the units are received in the
+        # second read, the size of the characters is only known now
+        number_of_characters = int(numpy.sum(lengths)) + number_of_strings
+        tail = numpy.empty(number_of_characters + 8 * number_of_units, dtype='uint8')
+        self._receive_into(tail, socket)
+        
+        self.strings = self._decode_strings(tail[:number_of_characters].tostring(), lengths)
+        self.encoded_units = self._view_on(tail, number_of_characters, 'f8', number_of_units)
+        
+        # logger.debug("message received")
+    
+    def _receive_payload(self, socket, flags, nbytes):
+        result = numpy.empty(nbytes, dtype='uint8')
+        self._receive_into(result, socket)
+        return result
+    
+    def _view_on(self, buffer, offset, dtype, count):
         if count > 0:
-            nbytes = count * 4  # size of float
-            
-            data_bytes = self._receive_all(nbytes, socket)
-            
-            result = numpy.copy(numpy.frombuffer(data_bytes, dtype='f4'))
-            
+            result = buffer[offset:offset + numpy.dtype(dtype).itemsize * count].view(dtype)
+            if not result.flags.aligned:
+                # the arrays are packed in the message, copy the ones 
+                # that do not start at a multiple of their itemsize
+                result = result.copy()
             return result
         else:
             return []
     
-          
-    def receive_doubles(self, socket, count):
+    def _decode_strings(self, data_bytes, lengths):
+        strings = []
+        begin = 0
+        for size in lengths:
+            strings.append(data_bytes[begin:begin + size].decode('utf-8'))
+            begin = begin + size + 1
+        return strings
+    
+    def _receive_array(self, socket, count, dtype):
         if count > 0:
-            nbytes = count * 8  # size of double
-            
-            data_bytes = self._receive_all(nbytes, socket)
-            
-            result = numpy.copy(numpy.frombuffer(data_bytes, dtype='f8'))
-            
+            result = numpy.empty(count, dtype=dtype)
+            self._receive_into(result, socket)
             return result
         else:
             return []
+    
+    def receive_ints(self, socket, count):
+        return self._receive_array(socket, count, 'int32')
+            
+    def receive_longs(self, socket, count):
+        return self._receive_array(socket, count, 'int64')
         
+    def receive_floats(self, socket, count):
+        return self._receive_array(socket, count, 'f4')
+          
+    def receive_doubles(self, socket, count):
+        return self._receive_array(socket, count, 'f8')
 
     def receive_booleans(self, socket, count):
-        if count > 0:
-            nbytes = count * 1  # size of boolean/byte
-            
-            data_bytes = self._receive_all(nbytes, socket)
-            
-            result = numpy.copy(numpy.frombuffer(data_bytes, dtype='b'))
-            
-            return result
-        else:
-            return []
-    
+        return self._receive_array(socket, count, 'b')
             
     def receive_strings(self, socket, count):
         if count > 0:
@@ -1586,13 +1722,7 @@ class SocketMessage(AbstractMessage):
                         
             data_bytes = self._receive_all(total, socket)
 
-            strings = []
-            begin = 0
-            for size in lengths:
-                strings.append(data_bytes[begin:begin + size].decode('utf-8'))
-                begin = begin + size + 1
-
-            return strings
+            return self._decode_strings(data_bytes, lengths)
         else:
             return []
             
@@ -1619,37 +1749,34 @@ class SocketMessage(AbstractMessage):
         
         # logger.debug("sending message with flags %s and header %s", flags, header)
         
-        socket.sendall(flags.tostring())
-
-        socket.sendall(header.tostring())
-
-        self.send_ints(socket, self.ints)
-        self.send_longs(socket, self.longs)
-        self.send_floats(socket, self.floats)
-        self.send_doubles(socket, self.doubles)
-        self.send_booleans(socket, self.booleans)
-        self.send_strings(socket, self.strings)
-        self.send_doubles(socket, self.encoded_units)
+        # the payload, all arrays up to and including the lengths of the
+        # strings, is followed by the characters of the strings and the units
+        payload = []
+        payload.extend(self._array_buffers(self.ints, 'int32'))
+        payload.extend(self._array_buffers(self.longs, 'int64'))
+        payload.extend(self._array_buffers(self.floats, 'f4'))
+        payload.extend(self._array_buffers(self.doubles, 'f8'))
+        payload.extend(self._array_buffers(self.booleans, 'b'))
+        strings = self._string_buffers(self.strings)
+        payload.extend(strings[:1])
+        
+        rest = strings[1:]
+        rest.extend(self._array_buffers(self.encoded_units, 'f8'))
+        
+        self._send_payload(socket, flags, header, payload, rest)
         
         # logger.debug("message send")
     
-
-    def send_doubles(self, socket, array):
-        if len(array) > 0:
-            data_buffer = numpy.array(array, dtype='f8')
-            socket.sendall(data_buffer.tostring())
-            
-    def send_ints(self, socket, array):
-        if len(array) > 0:
-            data_buffer = numpy.array(array, dtype='int32')
-            socket.sendall(data_buffer.tostring())
-            
-    def send_floats(self, socket, array):
+    def _send_payload(self, socket, flags, header, payload, rest):
+        self._send_buffers(socket, [flags, header] + payload + rest)
+    
+    def _array_buffers(self, array, dtype):
         if len(array) > 0:
-            data_buffer = numpy.array(array, dtype='f4')
-            socket.sendall(data_buffer.tostring())
-            
-    def send_strings(self, socket, array):
+            return [numpy.ascontiguousarray(array, dtype=dtype)]
+        else:
+            return []
+    
+    def _string_buffers(self, array):
         if len(array) > 0:
             
             lengths = numpy.array( [len(s) for s in array] ,dtype='int32')
@@ -1657,19 +1784,87 @@ class SocketMessage(AbstractMessage):
             
             if len(chars) != lengths.sum()+len(lengths):
                 raise Exception("send_strings size mismatch {0} vs {1}".format( len(chars) , lengths.sum()+len(lengths) ))
-
-            self.send_ints(socket, lengths)
-            socket.sendall(chars)
+            
+            return [lengths, chars]
+        else:
+            return []
+    
+    def _send_buffers(self, socket, buffers):
+        arrays = [numpy.frombuffer(x, dtype='uint8') if isinstance(x, bytes) else x.view('uint8') for x in buffers]
+        
+        if len(arrays) == 0:
+            return
+        elif hasattr(socket, 'sendmsg'):
+            # gather write, buffers that are (partially) send are removed from the list
+            views = [memoryview(x) for x in arrays if x.nbytes > 0]
+            while len(views) > 0:
+                count = socket.sendmsg(views)
+                while count > 0:
+                    if count >= len(views[0]):
+                        count -= len(views[0])
+                        del views[0]
+                    else:
+                        views[0] = views[0][count:]
+                        count = 0
+        elif sum([x.nbytes for x in arrays]) < self.gather_threshold:
+            socket.sendall(numpy.concatenate(arrays))
+        else:
+            for x in arrays:
+                socket.sendall(x)
+    
+    def send_doubles(self, socket, array):
+        self._send_buffers(socket, self._array_buffers(array, 'f8'))
+            
+    def send_ints(self, socket, array):
+        self._send_buffers(socket, self._array_buffers(array, 'int32'))
+            
+    def send_floats(self, socket, array):
+        self._send_buffers(socket, self._array_buffers(array, 'f4'))
+            
+    def send_strings(self, socket, array):
+        self._send_buffers(socket, self._string_buffers(array))
         
     def send_booleans(self, socket, array):
-        if len(array) > 0:
-            data_buffer = numpy.array(array, dtype='b')
-            socket.sendall(data_buffer.tostring())
+        self._send_buffers(socket, self._array_buffers(array, 'b'))
 
     def send_longs(self, socket, array):
-        if len(array) > 0:
-            data_buffer = numpy.array(array, dtype='int64')
-            socket.sendall(data_buffer.tostring())
+        self._send_buffers(socket, self._array_buffers(array, 'int64'))
+        
+class SharedMemoryMessage(SocketMessage):
+    """
+    Socket message that places the payload (the numeric arrays and the
+    lengths of the strings) in a memory mapped file shared with the worker.
+    The header, the characters of the strings and the units are still
+    send over the socket. The fourth flag of the header tells if the payload
+    is in the shared memory, if the payload does not fit, it is send over
+    the socket.
+    """
+    
+    def __init__(self, shared_memory, *arguments, **keyword_arguments):
+        SocketMessage.__init__(self, *arguments, **keyword_arguments)
+        self.shared_memory = shared_memory
+    
+    def _receive_payload(self, socket, flags, nbytes):
+        if flags[3]:
+            # copy, the memory is reused by the next message
+            return numpy.array(self.shared_memory[:nbytes])
+        else:
+            return SocketMessage._receive_payload(self, socket, flags, nbytes)
+    
+    def _send_payload(self, socket, flags, header, payload, rest):
+        nbytes = sum([x.nbytes for x in payload])
+        
+        if self.shared_memory is None or nbytes > len(self.shared_memory):
+            SocketMessage._send_payload(self, socket, flags, header, payload, rest)
+            return
+        
+        offset = 0
+        for x in payload:
+            self.shared_memory[offset:offset + x.nbytes] = x.view('uint8')
+            offset += x.nbytes
+        
+        flags[3] = True
+        self._send_buffers(socket, [flags, header] + rest)
         
 class SocketChannel(AbstractMessageChannel):
     
@@ -1742,6 +1937,9 @@ class SocketChannel(AbstractMessageChannel):
 
     
 
+    def is_started_with_mpiexec(self):
+        return self.initialize_mpi and len(self.mpiexec) > 0
+    
     def start(self):
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         
@@ -1779,7 +1977,7 @@ class SocketChannel(AbstractMessageChannel):
         #start arguments with command        
         arguments.insert(0, command)
 
-        if self.initialize_mpi and len(self.mpiexec) > 0:
+        if self.is_started_with_mpiexec():
             mpiexec = shlex.split(self.mpiexec)
             # prepend with mpiexec and arguments back to front
             arguments.insert(0, str(self.number_of_workers))
@@ -1803,6 +2001,8 @@ class SocketChannel(AbstractMessageChannel):
             #do not initialize MPI inside worker executable
             arguments.append('false')
             
+            arguments.extend(self.get_extra_worker_arguments())
+            
         logger.debug("starting process with command `%s`, arguments `%s` and environment '%s'", command, arguments, os.environ)
         self.process = Popen(arguments, executable=command, stdin=PIPE, stdout=None, stderr=None, close_fds=True)
         logger.debug("waiting for connection from worker")
@@ -1822,6 +2022,12 @@ class SocketChannel(AbstractMessageChannel):
 
 
 
+    def get_extra_worker_arguments(self):
+        return []
+    
+    def new_message(self, *arguments, **keyword_arguments):
+        return SocketMessage(*arguments, **keyword_arguments)
+    
     @option(choices=AbstractMessageChannel.DEBUGGERS.keys(), sections=("channel",))
     def debugger(self):
         """Name of the debugger to use when starting the code"""
@@ -1898,7 +2104,7 @@ class SocketChannel(AbstractMessageChannel):
         if call_count > self.max_message_length:
             self.split_message(call_id, function_id, call_count, dtype_to_arguments, encoded_units)
         else:
-            message = SocketMessage(call_id, function_id, call_count, dtype_to_arguments, encoded_units = encoded_units)
+            message = self.new_message(call_id, function_id, call_count, dtype_to_arguments, encoded_units = encoded_units)
             message.send(self.socket)
 
             self._is_inuse = True
@@ -1916,7 +2122,7 @@ class SocketChannel(AbstractMessageChannel):
             return x
         
         
-        message = SocketMessage()
+        message = self.new_message()
         
         message.receive(self.socket)
 
@@ -1938,8 +2144,31 @@ class SocketChannel(AbstractMessageChannel):
         
 
 
+    def is_split_message_pipelining_supported(self):
+        return True
+        
+    def send_split_block(self, call_id, function_id, call_count, dtype_to_arguments, encoded_units):
+        message = self.new_message(call_id, function_id, call_count, dtype_to_arguments, encoded_units = encoded_units)
+        message.send(self.socket)
+        
+    def recv_split_block(self, call_id, function_id):
+        message = self.new_message()
+        message.receive(self.socket)
+        
+        if message.call_id != call_id:
+            self.stop()
+            raise exceptions.CodeException('Received reply for call id {0} but expected {1}'.format(message.call_id, call_id))
+        if message.function_id != function_id:
+            self.stop()
+            raise exceptions.CodeException('Received reply for function id {0} but expected {1}'.format(message.function_id, function_id))
+        
+        if message.error:
+            raise exceptions.CodeException("Error in code: " + message.strings[0])
+        
+        return message.to_result(True)
+        
     def nonblocking_recv_message(self, call_id, function_id, handle_as_array, has_units=False):
-        request = SocketMessage().nonblocking_receive(self.socket)
+        request = self.new_message().nonblocking_receive(self.socket)
     
         def handle_result(function):
             self._is_inuse = False
@@ -1975,6 +2204,73 @@ class SocketChannel(AbstractMessageChannel):
         return 1000000
 
 
+class SharedMemoryChannel(SocketChannel):
+    """
+    Socket channel for workers on the same machine, the arrays of the
+    messages are exchanged in a memory mapped file instead of over
+    the socket (see SharedMemoryMessage). The worker maps the file before
+    connecting, after which the file is removed. Workers started with
+    mpiexec may run on another machine, these do not use the shared memory
+    and communicate over the socket only (a warning is given).
+    """
+    
+    def __init__(self, name_of_the_worker, legacy_interface_type=None, interpreter_executable=None, **options):
+        SocketChannel.__init__(self, name_of_the_worker, legacy_interface_type, interpreter_executable, **options)
+        
+        self.shared_memory = None
+        self.shared_memory_path = None
+    
+    @option(type="int", sections=("channel",))
+    def shared_memory_size(self):
+        """
+        Size of the shared memory in bytes, messages with larger payloads are send
+        over the socket. The file is sparse, only the part that is used takes memory
+        """
+        return 2**27
+    
+    @option(sections=("channel",))
+    def shared_memory_directory(self):
+        """Directory to create the shared memory file in, preferably a memory backed file system"""
+        if os.path.isdir('/dev/shm'):
+            return '/dev/shm'
+        else:
+            return tempfile.gettempdir()
+    
+    def get_extra_worker_arguments(self):
+        file_descriptor, self.shared_memory_path = tempfile.mkstemp(prefix = 'amuse_', suffix = '.shm', dir = self.shared_memory_directory)
+        try:
+            os.ftruncate(file_descriptor, self.shared_memory_size)
+        finally:
+            os.close(file_descriptor)
+        
+        self.shared_memory = numpy.memmap(self.shared_memory_path, dtype='uint8', mode='r+', shape=(self.shared_memory_size,))
+        
+        return [self.shared_memory_path]
+    
+    def start(self):
+        if self.is_started_with_mpiexec():
+            warnings.warn("shared memory is not supported for workers started with mpiexec, "
+                "all data of {0} is send over the socket".format(self.name_of_the_worker))
+        try:
+            SocketChannel.start(self)
+        finally:
+            if not self.shared_memory_path is None:
+                os.remove(self.shared_memory_path)
+                self.shared_memory_path = None
+    
+    def stop(self):
+        SocketChannel.stop(self)
+        
+        self.shared_memory = None
+    
+    def new_message(self, *arguments, **keyword_arguments):
+        return SharedMemoryMessage(self.shared_memory, *arguments, **keyword_arguments)
+    
+    def is_split_message_pipelining_supported(self):
+        # the blocks in flight and the results would overwrite each other in the shared memory
+        return False
+    
+    
 class OutputHandler(threading.Thread):
     
     def __init__(self, stream, port):
@@ -27,6 +27,7 @@ from amuse.rfi.channel import MpiChannel
 from amuse.rfi.channel import MultiprocessingMPIChannel
 from amuse.rfi.channel import DistributedChannel
 from amuse.rfi.channel import SocketChannel
+from amuse.rfi.channel import SharedMemoryChannel
 from amuse.rfi.channel import is_mpd_running
 from amuse.rfi.async_request import DependentASyncRequest
 
@@ -908,7 +909,7 @@ class CodeInterface(OptionalAttributes):
     def stop(self):
         self._stop()
     
-    @option(choices=['mpi','remote','distributed', 'sockets', 'local'], sections=("channel",))
+    @option(choices=['mpi','remote','distributed', 'sockets', 'shared_memory', 'local'], sections=("channel",))
     def channel_type(self):
         return 'mpi'
     
@@ -963,6 +964,8 @@ class CodeInterface(OptionalAttributes):
             return DistributedChannel
         elif self.channel_type == 'sockets':
             return SocketChannel
+        elif self.channel_type == 'shared_memory':
+            return SharedMemoryChannel
         elif self.channel_type == 'local':
             return LocalChannel
         else:
@@ -1154,8 +1157,39 @@ class PythonCodeInterface(CodeInterface):
     @classmethod
     def new_executable_script_string_for(cls, implementation_factory, channel_type = 'mpi'):
         raise Exception("tracing use")
-            
-    
+
+    @legacy_function
+    def internal__get_number_of_call_statistics():
+        function = LegacyFunctionSpecification()
+        function.addParameter('number_of_functions', dtype='int32', direction=function.OUT)
+        function.result_type = 'int32'
+        return function
+
+    @legacy_function
+    def internal__get_call_statistics():
+        function = LegacyFunctionSpecification()
+        function.addParameter('index', dtype='int32', direction=function.IN)
+        function.addParameter('name', dtype='string', direction=function.OUT)
+        function.addParameter('number_of_calls', dtype='int64', direction=function.OUT)
+        function.addParameter('number_of_elements', dtype='int64', direction=function.OUT)
+        function.addParameter('total_time', dtype='float64', direction=function.OUT)
+        function.result_type = 'int32'
+        function.can_handle_array = True
+        return function
+
+    def get_call_statistics(self):
+        """
+        Returns a list of (name, number of calls, number of elements,
+        total time in seconds) for every function called in the worker.
+        The time is measured in the worker and does not include the
+        communication.
+        """
+        number_of_functions, error = self.internal__get_number_of_call_statistics()
+        if error < 0 or number_of_functions == 0:
+            return []
+        names, calls, elements, times, errors = self.internal__get_call_statistics(range(number_of_functions))
+        return zip(names, calls, elements, times)
+
     @option(type='boolean', sections=("channel",))
     def use_python_interpreter(self):
         return False
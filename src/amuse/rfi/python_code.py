@@ -6,12 +6,14 @@ import numpy
 import sys
 import os
 import socket
+import time
 import traceback
 import types
 import warnings
 
 from amuse.rfi.channel import ClientSideMPIMessage
 from amuse.rfi.channel import SocketMessage
+from amuse.rfi.channel import SharedMemoryMessage
 
 from amuse.rfi.channel import pack_array
 from amuse.rfi.channel import unpack_array
@@ -29,7 +31,17 @@ class ValueHolder(object):
     def __str__(self):
         return "V({0!s})".format(self.value)
 
-    
+
+def vectorized(function):
+    """
+    Decorator for methods of a python implementation that can handle
+    arrays. The worker calls a vectorized method once per message, with
+    arrays for all input parameters, instead of once for every element.
+    The output parameters and the result can be set to arrays or to scalars.
+    """
+    function.is_vectorized = True
+    return function
+
 class PythonImplementation(object):
     dtype_to_message_attribute = { 
         'int32' : 'ints',
@@ -49,6 +61,8 @@ class PythonImplementation(object):
         self.lastid = -1
         self.activeid = -1
         self.id_to_activate = -1
+        self.call_statistics = {}
+        self.function_is_vectorized = {}
         if not self.implementation is None:
             self.implementation._interface = self
         
@@ -111,16 +125,22 @@ class PythonImplementation(object):
 
 
 
-    def start_socket(self, port, host):
+    def start_socket(self, port, host, shared_memory_path = None):
+        if shared_memory_path is None:
+            shared_memory = None
+        else:
+            # map before connecting, the channel removes the file once we are connected
+            shared_memory = numpy.memmap(shared_memory_path, dtype='uint8', mode='r+')
+        
         client_socket = socket.create_connection((host, port))
         
         self.must_run = True
         while self.must_run:
             
-            message = SocketMessage()
+            message = SharedMemoryMessage(shared_memory)
             message.receive(client_socket)
                 
-            result_message = SocketMessage(message.call_id, message.function_id, message.call_count)
+            result_message = SharedMemoryMessage(shared_memory, message.call_id, message.function_id, message.call_count)
             
             if message.function_id == 0:
                 self.must_run = False
@@ -215,6 +235,7 @@ class PythonImplementation(object):
             unpacked = unpack_array(array, input_message.call_count, type)
             setattr(input_message,attribute, unpacked)
         
+        start_time = time.time()
         units = [False] * len(specification.output_parameters)
         if specification.must_handle_array:
             keyword_arguments = self.new_keyword_arguments_from_message(input_message, None,  specification, input_units)
@@ -224,7 +245,7 @@ class PythonImplementation(object):
                 warnings.warn("mismatch in python function specification(?): "+str(ex))
                 result = method(*list(keyword_arguments))
             self.fill_output_message(output_message, None, result, keyword_arguments, specification, units)
-        else:
+        elif not self.handle_vectorized_call(method, input_message, output_message, specification, input_units, units):
             for index in range(input_message.call_count):
                 keyword_arguments = self.new_keyword_arguments_from_message(input_message, index,  specification, input_units)
                 try:
@@ -237,8 +258,9 @@ class PythonImplementation(object):
                     if result < 0:
                         warnings.warn("result <0 detected: list "+str( (result, keyword_arguments) ))
                 self.fill_output_message(output_message, index, result, keyword_arguments, specification, units)
-        
-            
+
+        self.update_call_statistics(specification.name, input_message.call_count, time.time() - start_time)
+
         for type, attribute in self.dtype_to_message_attribute.iteritems():
             array = getattr(output_message, attribute)
             packed = pack_array(array, input_message.call_count, type)
@@ -246,7 +268,87 @@ class PythonImplementation(object):
         
         if specification.has_units:
             output_message.encoded_units = self.convert_output_units_to_floats(units)
-    
+
+    def handle_vectorized_call(self, method, input_message, output_message, specification, input_units, units):
+        """
+        Calls the method once with the arrays of the message if the method
+        is marked with the vectorized decorator, or if the implementation
+        sets auto_vectorize to True and the method was detected to handle
+        arrays. Returns False if the message must be handled element by element.
+
+        Detection is done on the first message with more than one element,
+        the method is assumed to handle arrays if it does not raise an
+        exception, returns no errors and all outputs are arrays with one
+        value per element.
+        So, in auto_vectorize mode, methods must not change the state of
+        the implementation before failing on array arguments.
+        """
+        name = specification.name
+        is_vectorized = self.function_is_vectorized.get(name, None)
+        if is_vectorized is None:
+            if getattr(method, 'is_vectorized', False):
+                is_vectorized = True
+            elif name.startswith('internal__') or not getattr(self.implementation, 'auto_vectorize', False):
+                is_vectorized = False
+            elif input_message.call_count < 2:
+                return False
+            else:
+                return self.detect_vectorized_call(method, input_message, output_message, specification, input_units, units)
+            self.function_is_vectorized[name] = is_vectorized
+
+        if not is_vectorized:
+            return False
+
+        keyword_arguments = self.new_keyword_arguments_from_message(input_message, None,  specification, input_units)
+        result = method(**keyword_arguments)
+        if not specification.result_type is None and numpy.any(numpy.asarray(result) < 0):
+            warnings.warn("result <0 detected: "+str( (result, keyword_arguments) ))
+        self.fill_output_message(output_message, None, result, keyword_arguments, specification, units)
+        return True
+
+    def detect_vectorized_call(self, method, input_message, output_message, specification, input_units, units):
+        keyword_arguments = self.new_keyword_arguments_from_message(input_message, None,  specification, input_units)
+        try:
+            result = method(**keyword_arguments)
+        except Exception:
+            is_vectorized = False
+        else:
+            is_vectorized = self.is_valid_vectorized_output(result, keyword_arguments, specification, input_message.call_count)
+
+        self.function_is_vectorized[specification.name] = is_vectorized
+        if is_vectorized:
+            self.fill_output_message(output_message, None, result, keyword_arguments, specification, units)
+        return is_vectorized
+
+    def is_valid_vectorized_output(self, result, keyword_arguments, specification, call_count):
+        from amuse.units import quantities
+
+        values = []
+        if not specification.result_type is None:
+            if result is None or numpy.any(numpy.asarray(result) < 0):
+                return False
+            # a single 0 is taken as the (no) error code of all elements
+            if not (numpy.shape(result) == () and result == 0):
+                values.append(result)
+        for parameter in specification.output_parameters:
+            value = keyword_arguments[parameter.name].value
+            if value is None:
+                return False
+            values.append(value.number if quantities.is_quantity(value) else value)
+
+        for x in values:
+            if isinstance(x, basestring) or numpy.shape(x) != (call_count,):
+                return False
+        return True
+
+    def update_call_statistics(self, name, number_of_elements, seconds):
+        statistics = self.call_statistics.get(name, None)
+        if statistics is None:
+            statistics = [0, 0, 0.0]
+            self.call_statistics[name] = statistics
+        statistics[0] += 1
+        statistics[1] += number_of_elements
+        statistics[2] += seconds
 
 
     def new_keyword_arguments_from_message(self, input_message, index, specification, units = []):
@@ -255,7 +357,7 @@ class PythonImplementation(object):
             attribute = self.dtype_to_message_attribute[parameter.datatype]
             argument_value = None
             if parameter.direction == LegacyFunctionSpecification.IN:
-                if specification.must_handle_array:
+                if index is None:
                     argument_value = getattr(input_message, attribute)[parameter.input_index]
                 else:
                     argument_value = getattr(input_message, attribute)[parameter.input_index][index]
@@ -264,7 +366,7 @@ class PythonImplementation(object):
                     if not unit is None:
                         argument_value = argument_value | unit
             elif parameter.direction == LegacyFunctionSpecification.INOUT:
-                if specification.must_handle_array:
+                if index is None:
                     argument_value = ValueHolder(getattr(input_message, attribute)[parameter.input_index])
                 else:
                     argument_value = ValueHolder(getattr(input_message, attribute)[parameter.input_index][index])
@@ -287,7 +389,7 @@ class PythonImplementation(object):
         
         if not specification.result_type is None:
             attribute = self.dtype_to_message_attribute[specification.result_type]
-            if specification.must_handle_array:
+            if index is None:
                 getattr(output_message, attribute)[0] = result
             else:
                 getattr(output_message, attribute)[0][index] = result
@@ -300,13 +402,13 @@ class PythonImplementation(object):
                 output = argument_value.value
                 if specification.has_units:
                     unit = output.unit if quantities.is_quantity(output) else None
-                    if specification.must_handle_array or index == 0:
+                    if index is None or index == 0:
                         units[parameter.index_in_output] = unit
                     else:
                         unit = units[parameter.index_in_output]
                     if not unit is None:
                         output = output.value_in(unit)
-                if specification.must_handle_array:
+                if index is None:
                     getattr(output_message, attribute)[parameter.output_index] = output
                 else:
                     getattr(output_message, attribute)[parameter.output_index][index] = output
@@ -354,6 +456,18 @@ class PythonImplementation(object):
     def internal__set_message_polling_interval(self, inval):
         self.polling_interval = inval
         return 0
+
+    def internal__get_number_of_call_statistics(self, number_of_functions):
+        number_of_functions.value = len(self.call_statistics)
+        return 0
+
+    def internal__get_call_statistics(self, index, name, number_of_calls, number_of_elements, total_time):
+        names = sorted(self.call_statistics.keys())
+        if index < 0 or index >= len(names):
+            return -1
+        name.value = names[index]
+        number_of_calls.value, number_of_elements.value, total_time.value = self.call_statistics[names[index]]
+        return 0
     
     def internal__get_message_polling_interval(self, outval):
         outval.value = self.polling_interval 
@@ -40,11 +40,15 @@ HEADER_CODE_STRING = """
 	#include <unistd.h>
 	#include <netinet/tcp.h>
   #include <arpa/inet.h>
+	#include <sys/mman.h>
+	#include <sys/stat.h>
+	#include <fcntl.h>
 #endif
 """
 
 CONSTANTS_AND_GLOBAL_VARIABLES_STRING = """
 static int ERROR_FLAG = 256;
+static int SHARED_MEMORY_FLAG = 16777216;
 static int HEADER_SIZE = 11; //integers
 
 static int HEADER_FLAGS = 0;
@@ -66,6 +70,12 @@ static bool mpiIntercom = false;
 
 static int socketfd = 0;
 
+/* payload of socket messages, mapped when the worker is started by a shared memory channel */
+static char * shared_memory = 0;
+static long long int shared_memory_size = 0;
+static long long int shared_memory_offset = 0;
+static bool payload_in_shared_memory = false;
+
 static int * header_in;
 static int * header_out;
 
@@ -337,6 +347,49 @@ void receive_array_sockets(void *buffer, int length, int file_descriptor, int ra
     }
 }
 
+void map_shared_memory(char *path) {
+#ifdef WIN32
+    fprintf(stderr, "shared memory channel is not supported on windows\\n");
+    exit(1);
+#else
+    struct stat info;
+    int file_descriptor = open(path, O_RDWR);
+
+    if (file_descriptor < 0 || fstat(file_descriptor, &info) < 0) {
+        perror("could not open shared memory file");
+        exit(1);
+    }
+
+    shared_memory_size = info.st_size;
+    shared_memory = (char *) mmap(0, shared_memory_size, PROT_READ | PROT_WRITE, MAP_SHARED, file_descriptor, 0);
+
+    if (shared_memory == MAP_FAILED) {
+        perror("could not map shared memory file");
+        exit(1);
+    }
+
+    close(file_descriptor);
+#endif
+}
+
+void receive_payload_sockets(void *buffer, int length, int file_descriptor) {
+    if (payload_in_shared_memory) {
+        memcpy(buffer, shared_memory + shared_memory_offset, length);
+        shared_memory_offset += length;
+    } else {
+        receive_array_sockets(buffer, length, file_descriptor, 0);
+    }
+}
+
+void send_payload_sockets(void *buffer, int length, int file_descriptor) {
+    if (payload_in_shared_memory) {
+        memcpy(shared_memory + shared_memory_offset, buffer, length);
+        shared_memory_offset += length;
+    } else {
+        send_array_sockets(buffer, length, file_descriptor, 0);
+    }
+}
+
 void new_arrays(int max_call_count) {
   ints_in = new int[ max_call_count * MAX_INTS_IN];
   ints_out = new int[ max_call_count * MAX_INTS_OUT];
@@ -761,7 +814,7 @@ void run_sockets_mpi(int argc, char *argv[], int port, char *host) {
 #endif
 }
 
-void run_sockets(int port, char *host) {
+void run_sockets(int port, char *host, char *shared_memory_path) {
   bool must_run_loop = true;
   int max_call_count = 10;
   struct sockaddr_in serv_addr;
@@ -782,7 +835,12 @@ void run_sockets(int port, char *host) {
   mpiIntercom = false;
 
   //fprintf(stderr, "C worker: running in sockets mode\\n");
-   
+
+  if (shared_memory_path) {
+    // map before connecting, the channel may remove the file once we are connected
+    map_shared_memory(shared_memory_path);
+  }
+
   socketfd = socket(AF_INET, SOCK_STREAM, 0);
     
   if (socketfd < 0) {
@@ -825,6 +883,9 @@ void run_sockets(int port, char *host) {
     
     int call_count = header_in[HEADER_CALL_COUNT];
 
+    payload_in_shared_memory = (header_in[HEADER_FLAGS] & SHARED_MEMORY_FLAG) != 0;
+    shared_memory_offset = 0;
+
     if (call_count > max_call_count) {
       delete_arrays();
       max_call_count = call_count + 255;
@@ -832,27 +893,27 @@ void run_sockets(int port, char *host) {
     }
     
     if (header_in[HEADER_INTEGER_COUNT] > 0) {
-      receive_array_sockets(ints_in, header_in[HEADER_INTEGER_COUNT] * sizeof(int), socketfd, 0);
+      receive_payload_sockets(ints_in, header_in[HEADER_INTEGER_COUNT] * sizeof(int), socketfd);
     }
      
     if (header_in[HEADER_LONG_COUNT] > 0) {
-      receive_array_sockets(longs_in, header_in[HEADER_LONG_COUNT] * sizeof(long long int), socketfd, 0);
+      receive_payload_sockets(longs_in, header_in[HEADER_LONG_COUNT] * sizeof(long long int), socketfd);
     }
     
     if(header_in[HEADER_FLOAT_COUNT] > 0) {
-      receive_array_sockets(floats_in, header_in[HEADER_FLOAT_COUNT] * sizeof(float), socketfd, 0);
+      receive_payload_sockets(floats_in, header_in[HEADER_FLOAT_COUNT] * sizeof(float), socketfd);
     }
     
     if(header_in[HEADER_DOUBLE_COUNT] > 0) {
-      receive_array_sockets(doubles_in, header_in[HEADER_DOUBLE_COUNT] * sizeof(double), socketfd, 0);
+      receive_payload_sockets(doubles_in, header_in[HEADER_DOUBLE_COUNT] * sizeof(double), socketfd);
     }
     
     if(header_in[HEADER_BOOLEAN_COUNT] > 0) {
-      receive_array_sockets(booleans_in, header_in[HEADER_BOOLEAN_COUNT] * sizeof(bool), socketfd , 0);
+      receive_payload_sockets(booleans_in, header_in[HEADER_BOOLEAN_COUNT] * sizeof(bool), socketfd);
     }
     
     if(header_in[HEADER_STRING_COUNT] > 0) {
-      receive_array_sockets(string_sizes_in, header_in[HEADER_STRING_COUNT] * sizeof(int), socketfd, 0);
+      receive_payload_sockets(string_sizes_in, header_in[HEADER_STRING_COUNT] * sizeof(int), socketfd);
       
       int total_string_size = 0;
       for (int i = 0; i < header_in[HEADER_STRING_COUNT];i++) {
@@ -888,28 +949,47 @@ void run_sockets(int port, char *host) {
     
     //fprintf(stderr, "c worker sockets: call handled\\n");
 
-    send_array_sockets(header_out, HEADER_SIZE * sizeof(int), socketfd, 0);
+    payload_in_shared_memory = false;
+    shared_memory_offset = 0;
+    if (shared_memory) {
+      long long int payload_size = header_out[HEADER_INTEGER_COUNT] * sizeof(int)
+        + header_out[HEADER_LONG_COUNT] * sizeof(long long int)
+        + header_out[HEADER_FLOAT_COUNT] * sizeof(float)
+        + header_out[HEADER_DOUBLE_COUNT] * sizeof(double)
+        + header_out[HEADER_BOOLEAN_COUNT] * sizeof(bool)
+        + header_out[HEADER_STRING_COUNT] * sizeof(int);
+
+      if (payload_size <= shared_memory_size) {
+        payload_in_shared_memory = true;
+        header_out[HEADER_FLAGS] |= SHARED_MEMORY_FLAG;
+      }
+    }
+
+    if (!payload_in_shared_memory) {
+      send_array_sockets(header_out, HEADER_SIZE * sizeof(int), socketfd, 0);
+    }
       
     if(header_out[HEADER_INTEGER_COUNT] > 0) {
-      send_array_sockets(ints_out, header_out[HEADER_INTEGER_COUNT] * sizeof(int), socketfd, 0);
+      send_payload_sockets(ints_out, header_out[HEADER_INTEGER_COUNT] * sizeof(int), socketfd);
     }
       
     if(header_out[HEADER_LONG_COUNT] > 0) {
-      send_array_sockets(longs_out, header_out[HEADER_LONG_COUNT] * sizeof(long long int), socketfd, 0);
+      send_payload_sockets(longs_out, header_out[HEADER_LONG_COUNT] * sizeof(long long int), socketfd);
     }
       
     if(header_out[HEADER_FLOAT_COUNT] > 0) {
-      send_array_sockets(floats_out, header_out[HEADER_FLOAT_COUNT] * sizeof(float), socketfd, 0);
+      send_payload_sockets(floats_out, header_out[HEADER_FLOAT_COUNT] * sizeof(float), socketfd);
     }
       
     if(header_out[HEADER_DOUBLE_COUNT] > 0) {
-      send_array_sockets(doubles_out, header_out[HEADER_DOUBLE_COUNT] * sizeof(double), socketfd, 0);
+      send_payload_sockets(doubles_out, header_out[HEADER_DOUBLE_COUNT] * sizeof(double), socketfd);
     }
       
     if(header_out[HEADER_BOOLEAN_COUNT] > 0) {
-        send_array_sockets(booleans_out, header_out[HEADER_BOOLEAN_COUNT] * sizeof(bool), socketfd, 0);
+        send_payload_sockets(booleans_out, header_out[HEADER_BOOLEAN_COUNT] * sizeof(bool), socketfd);
     }
       
+    int characters_out_size = 0;
     if(header_out[HEADER_STRING_COUNT] > 0) {
         int offset = 0;
         for( int i = 0; i < header_out[HEADER_STRING_COUNT] ; i++) {          
@@ -925,9 +1005,18 @@ void run_sockets(int port, char *host) {
           strcpy(characters_out+offset, strings_out[i]);
           offset += string_sizes_out[i] + 1;
         }
+        characters_out_size = offset;
         
-        send_array_sockets(string_sizes_out, header_out[HEADER_STRING_COUNT] * sizeof(int), socketfd, 0);
-        send_array_sockets(characters_out, offset * sizeof(char), socketfd, 0);
+        send_payload_sockets(string_sizes_out, header_out[HEADER_STRING_COUNT] * sizeof(int), socketfd);
+    }
+    
+    if (payload_in_shared_memory) {
+      // the payload must be in place before the header is received
+      send_array_sockets(header_out, HEADER_SIZE * sizeof(int), socketfd, 0);
+    }
+    
+    if(header_out[HEADER_STRING_COUNT] > 0) {
+        send_array_sockets(characters_out, characters_out_size * sizeof(char), socketfd, 0);
     }
     
     if (characters_in) { 
@@ -955,16 +1044,21 @@ int main(int argc, char *argv[]) {
   int port;
   bool use_mpi;
   char *host;
-  
+  char *shared_memory_path = 0;
+
   //for(int i = 0 ; i < argc; i++) {
   //  fprintf(stderr, "argument %d is %s\\n", i, argv[i]);
   //}
 
   if (argc == 1) {
     run_mpi(argc, argv);
-  } else if (argc == 4) {
+  } else if (argc == 4 || argc == 5) {
     port = atoi(argv[1]);
     host = argv[2];
+
+    if (argc == 5) {
+      shared_memory_path = argv[4];
+    }
     
     if (strcmp(argv[3], "true") == 0) {
       use_mpi = true;
@@ -979,11 +1073,11 @@ int main(int argc, char *argv[]) {
     if (use_mpi) {
       run_sockets_mpi(argc, argv, port, host);
     } else {
-      run_sockets(port, host);
+      run_sockets(port, host, shared_memory_path);
     }
   } else {
-    fprintf(stderr, "%s need either 0 or 4 arguments, not %d\\n", argv[0], argc);
-    fprintf(stderr, "usage: %s [PORT HOST MPI_ENABLED]\\n", argv[0]);
+    fprintf(stderr, "%s need either 0, 4 or 5 arguments, not %d\\n", argv[0], argc);
+    fprintf(stderr, "usage: %s [PORT HOST MPI_ENABLED [SHARED_MEMORY_FILE]]\\n", argv[0]);
     exit(1);
   }
 
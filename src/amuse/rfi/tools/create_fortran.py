@@ -572,8 +572,11 @@ RUN_LOOP_SOCKETS_STRING = """
       integer :: max_call_count = 255
       integer :: must_run_loop, maximum_size, total_string_length
       integer :: i, offset, call_count, port
+      integer (c_int64_t) :: payload_size
+      logical :: payload_in_shared_memory
       character(len=32) :: port_string
       character(kind=c_char, len=64) :: host
+      character(kind=c_char, len=4096) :: shared_memory_path
       logical (c_bool), allocatable, target :: c_booleans_in(:)
       logical (c_bool), allocatable, target :: c_booleans_out(:)
       
@@ -605,13 +608,21 @@ RUN_LOOP_SOCKETS_STRING = """
       !add a null character to the end of the string so c knows when the string ends
       host = trim(host) // c_null_char
 
+      if (command_argument_count() .ge. 4) then
+        ! map before connecting, the channel may remove the file once we are connected
+        call get_command_argument(4, shared_memory_path)
+        shared_memory_path = trim(shared_memory_path) // c_null_char
+        call forsockets_shared_memory_init(shared_memory_path)
+      end if
 
       call forsockets_init(host, port)
       
       must_run_loop = 1
       
       do while (must_run_loop .eq. 1)
+        call forsockets_begin_payload(0)
         call receive_integers(c_loc(header_in), HEADER_SIZE)
+        call forsockets_begin_payload(header_in(HEADER_FLAGS))
         
         !print*, 'fortran sockets: got header ', header_in
         
@@ -724,8 +735,18 @@ RUN_LOOP_SOCKETS_STRING = """
         must_run_loop = handle_call()
         
         !print*, 'fortran: sending header ', header_out
-    
-        call send_integers(c_loc(header_out), HEADER_SIZE)
+
+        payload_size = 4_8 * header_out(HEADER_INTEGER_COUNT) + 8_8 * header_out(HEADER_LONG_COUNT) + &
+            4_8 * header_out(HEADER_FLOAT_COUNT) + 8_8 * header_out(HEADER_DOUBLE_COUNT) + &
+            header_out(HEADER_BOOLEAN_COUNT) + 4_8 * header_out(HEADER_STRING_COUNT)
+        header_out(HEADER_FLAGS) = IOR(header_out(HEADER_FLAGS), forsockets_shared_memory_flag(payload_size))
+        payload_in_shared_memory = forsockets_shared_memory_flag(payload_size) .ne. 0
+
+        if (.not. payload_in_shared_memory) then
+          call forsockets_begin_payload(0)
+          call send_integers(c_loc(header_out), HEADER_SIZE)
+        end if
+        call forsockets_begin_payload(header_out(HEADER_FLAGS))
 
         if (header_out(HEADER_INTEGER_COUNT) .gt. 0) then
           call send_integers(c_loc(integers_out), header_out(HEADER_INTEGER_COUNT))
@@ -773,7 +794,16 @@ RUN_LOOP_SOCKETS_STRING = """
           enddo
 
           call send_integers(c_loc(string_sizes_out), header_out(HEADER_STRING_COUNT))
-          call send_string(c_loc(c_characters_out), offset-1 )
+        end if
+
+        if (payload_in_shared_memory) then
+          ! the payload must be in place before the header is received
+          call forsockets_begin_payload(0)
+          call send_integers(c_loc(header_out), HEADER_SIZE)
+        end if
+
+        if (header_out(HEADER_STRING_COUNT) .gt. 0) then
+          call send_string(c_loc(c_characters_out), total_string_length)
         end if
       end do
     
@@ -1109,7 +1139,7 @@ MAIN_STRING = """
 
   if (count .eq. 0) then
     call run_loop_mpi()
-  else if (count .eq. 3) then
+  else if (count .eq. 3 .or. count .eq. 4) then
     call get_command_argument(3, use_mpi_string)
       
     if (use_mpi_string .eq. 'true') then
@@ -1127,7 +1157,7 @@ MAIN_STRING = """
       call run_loop_sockets()
     end if
   else
-    print*, 'fortran worker: need either 0 or 3 arguments, not', count
+    print*, 'fortran worker: need either 0, 3 or 4 arguments, not', count
     stop
   end if
 """
@@ -9,6 +9,7 @@ from amuse.support.options import OptionalAttributes, option
 
 from amuse.support.methods import CodeMethodWrapper, CodeMethodWrapperDefinition, IncorrectWrappedMethodException
 from amuse.support.methods import ProxyingMethodWrapper
+from amuse.support.methods import AbstractCodeMethodWrapper
 from amuse.support.core import late
 from amuse.support import exceptions
 from amuse.support import state
@@ -141,6 +142,15 @@ class LinkMethodArgumentOrResultType(MethodArgumentOrResultType):
             all_indices[valid] = valid_indices
             return all_indices
 
+def definitions_changed(interface):
+    """
+    Called by the handlers when a definition (made in one of
+    the define_* methods) changes after setup, the interface 
+    must forget the methods it resolved before
+    """
+    if isinstance(interface, InCodeComponentImplementation):
+        interface.clear_dispatch_cache()
+        
 class CodeAttributeWrapper(object):
 
     def __init__(self):
@@ -234,6 +244,7 @@ class HandleConvertUnits(HandleCodeInterfaceAttributeAccess, CodeMethodWrapperDe
 
     def set_converter(self, converter):
         self.converter = converter
+        definitions_changed(self.handler)
 
     def set_nbody_converter(self, nbody_converter):
         self.set_converter(nbody_converter.as_converter_from_si_to_generic())
@@ -404,6 +415,7 @@ class HandleState(HandleCodeInterfaceAttributeAccess):
         if not function_name in self._mapping_from_name_to_state_method:
             state_method = StateMethodDefinition(self._state_machine, self.interface, from_state, to_state, function_name)
             self._mapping_from_name_to_state_method[function_name] = state_method
+            definitions_changed(self.interface)
         else:
             state_method = self._mapping_from_name_to_state_method[function_name]
             state_method.add_transition(from_state, to_state)
@@ -792,6 +804,8 @@ class HandleMethodsWithUnits(object):
             public_name
         )
         self.method_definitions[public_name] = definition
+        self.method_instances.pop(public_name, None)
+        definitions_changed(self.interface)
 
     def has_name(self, name):
         return name == 'METHOD'
@@ -1462,6 +1476,7 @@ class InCodeComponentImplementation(OldObjectsBindingMixin, OptionalAttributes):
         self.legacy_interface = legacy_interface
         self._options = options
         self._handlers = []
+        self._dispatch_cache = {}
         self.__init_handlers__(legacy_interface, options)
 
     def __init_handlers__(self, legacy_interface, options):
@@ -1519,6 +1534,10 @@ class InCodeComponentImplementation(OldObjectsBindingMixin, OptionalAttributes):
         return None
 
     def __getattr__(self, name):
+        dispatch_cache = self.__dict__.get('_dispatch_cache', None)
+        if dispatch_cache is not None and name in dispatch_cache:
+            return dispatch_cache[name]
+        
         result = None
         found = False
         for handler in self._handlers:
@@ -1527,7 +1546,15 @@ class InCodeComponentImplementation(OldObjectsBindingMixin, OptionalAttributes):
                 found = True
         if not found:
             raise AttributeError(name)
+        
+        # methods are wrapped the same way on every access, until
+        # the definitions change, values (properties, parameters) are not cached
+        if dispatch_cache is not None and isinstance(result, AbstractCodeMethodWrapper):
+            dispatch_cache[name] = result
         return result
+    
+    def clear_dispatch_cache(self):
+        self._dispatch_cache = {}
 
     def __dir__(self):
         result = set(dir(type(self)))
@@ -1548,8 +1575,14 @@ class InCodeComponentImplementation(OldObjectsBindingMixin, OptionalAttributes):
         builder_function(definition, **extra_arguments)
         return definition.new_set_instance(handler)
         
+    def __getstate__(self):
+        result = self.__dict__.copy()
+        result.pop('_dispatch_cache', None)
+        return result
+        
     def __setstate__(self, state):
         self.__dict__ = state
+        self._dispatch_cache = {}
 
     def data_store_names(self):
         self.before_get_data_store_names()
@@ -135,6 +135,7 @@ class StateMachine(OptionalAttributes):
         self._current_state = State(self, None)
         self.interface = interface
         self._initial_state = None
+        self._transition_paths = {}
 
     @option(type='boolean', sections=['state',])
     def is_enabled(self):
@@ -146,9 +147,22 @@ class StateMachine(OptionalAttributes):
         
     def enable(self):
         self.is_enabled = True
+        self.definitions_changed()
 
     def disable(self):
         self.is_enabled = False
+        self.definitions_changed()
+    
+    def definitions_changed(self):
+        """
+        Forget the transition paths found before, and the methods
+        resolved by the interface (the wrapped methods depend on the
+        state machine being enabled)
+        """
+        self._transition_paths = {}
+        clear_dispatch_cache = getattr(self.interface, 'clear_dispatch_cache', None)
+        if not clear_dispatch_cache is None:
+            clear_dispatch_cache()
 
 
     def new_transition(self, from_name, to_name, is_auto = True):
@@ -162,7 +176,8 @@ class StateMachine(OptionalAttributes):
         
         if not to_state is None:
             to_state.add_to_transition(transition)
-    
+        
+        self._transition_paths = {}
         return transition
         
     def remove_transition(self, from_name, to_name):
@@ -174,6 +189,8 @@ class StateMachine(OptionalAttributes):
     
         if not to_state is None:
             to_state.remove_to_transition(from_state)
+        
+        self._transition_paths = {}
             
     def iter_states(self):
         return iter(self.states.values())
@@ -189,6 +206,8 @@ class StateMachine(OptionalAttributes):
             return self.states[name]
             
         self.states[name] = State(self, name)
+        # the transitions of all except states include the new state
+        self._transition_paths = {}
         return self.states[name]
     
     
@@ -235,12 +254,23 @@ class StateMachine(OptionalAttributes):
         return
     
     
-    def _get_state_transition_path_to(self, state):
-        all_transitions = list(self._get_transitions_path_from_to(self._current_state, state))
+    def _get_shortest_transitions_path_from_to(self, from_state, to_state):
+        all_transitions = list(self._get_transitions_path_from_to(from_state, to_state))
         transitions = []
         for x in all_transitions:
             if len(transitions) == 0 or len(x) < len(transitions):
                 transitions = x
+        return transitions
+        
+    def _get_state_transition_path_to(self, state):
+        # the shortest paths between two states are stored in a table
+        # that is filled when needed and cleared when the transitions change
+        key = (self._current_state, state)
+        if key in self._transition_paths:
+            transitions = self._transition_paths[key]
+        else:
+            transitions = self._get_shortest_transitions_path_from_to(self._current_state, state)
+            self._transition_paths[key] = transitions
                 
         if len(transitions) == 0:
             raise Exception("No transition from current state {0} to {1} possible".format(self._current_state, state))
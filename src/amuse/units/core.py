@@ -1,12 +1,49 @@
 from amuse.support.core import late
 from amuse.support import exceptions
 import numpy
+import weakref
 
 
 from amuse.support.core import memoize
 
 from amuse.support.core import MultitonMetaClass
 
+# interned canonical forms of the units, equal units share
+# the same (identical) canonical base and canonical form,
+# these are kept as long as a unit refers to them
+CANONICAL_BASES = weakref.WeakValueDictionary()
+CANONICAL_FORMS = weakref.WeakValueDictionary()
+
+# tables with the simple forms of products and quotients of units,
+# limited in size like the memoize tables
+MAXIMUM_NUMBER_OF_PRODUCTS = 5000
+PRODUCTS = {}
+QUOTIENTS = {}
+
+class canonical(object):
+    """
+    Interned value, created by :func:`intern_canonical`. Equal values
+    share the same instance, these can be compared on identity.
+    """
+    __slots__ = ('value', '__weakref__')
+    
+    def __init__(self, value):
+        self.value = value
+        
+    def __repr__(self):
+        return 'canonical({0!r})'.format(self.value)
+
+def intern_canonical(table, value):
+    """
+    Returns the instance of :class:`canonical` for the value in the 
+    table, a new instance is added if the value is not in the table
+    """
+    result = table.get(value, None)
+    if result is None:
+        result = canonical(value)
+        table[value] = result
+    return result
+
 class system(object):
     ALL = {}
     
@@ -125,7 +162,7 @@ class unit(object):
         if self is other:
             return True
         elif isinstance(other, unit):
-            return self.base == other.base and self.factor == other.factor
+            return self.canonical_form is other.canonical_form
         else:
             return False
     
@@ -139,12 +176,34 @@ class unit(object):
         else:
             return True
    
-    def __hash__(self):
-        return self._hash
+    __hash__ = object.__hash__
         
     @late
     def _hash(self):
         return hash(id(self))
+    
+    @late
+    def canonical_base(self):
+        """
+        The powers of the base units of this unit, interned.
+        Units with the same base share the same canonical base.
+        """
+        return intern_canonical(CANONICAL_BASES, self.base)
+        
+    @late
+    def canonical_form(self):
+        """
+        The factor and the powers of the base units of this unit, interned.
+        Equal units share the same canonical form.
+        """
+        return intern_canonical(CANONICAL_FORMS, (self.factor, self.canonical_base))
+    
+    def __getstate__(self):
+        result = self.__dict__.copy()
+        # interned values are only valid in this process
+        for name in ('canonical_base', 'canonical_form', '_simple_form', '_hash'):
+            result.pop(name, None)
+        return result
         
     @property
     def dtype(self):
@@ -190,7 +249,10 @@ class unit(object):
         >>> J.to_simple_form()
         unit<m**2 * kg * s**-2>
         """
+        return self._simple_form
         
+    @late
+    def _simple_form(self):
         if not self.base:
             return none_unit('none', 'none') * self.factor
         
@@ -294,7 +356,7 @@ class unit(object):
     def conversion_factor_from(self, x):
         if x.base is None:
             return self.factor * 1.0
-        elif self._compare_bases(x):
+        elif self.canonical_base is x.canonical_base or self._compare_bases(x):
             this_factor = self.factor * 1.0
             other_factor = x.factor
             return 1*(this_factor == other_factor) or this_factor / other_factor
@@ -401,7 +463,7 @@ class unit(object):
         False
         
         """
-        return other.base == self.base
+        return other.canonical_base is self.canonical_base
 
     def base_unit(self):
         if not self.base:
@@ -502,8 +564,7 @@ class base_unit(unit):
     def __str__(self):
         return self.symbol
     
-    def __hash__(self):
-        return self._hash
+    __hash__ = unit.__hash__
         
     @property
     def factor(self):
@@ -785,8 +846,7 @@ class enumeration_unit(nonnumeric_unit):
         else:
             return list(names_for_values)
             
-    def __hash__(self):
-        return self._hash
+    __hash__ = unit.__hash__
         
     def is_valid_value(self, value):
         return value in self.mapping_from_values_to_names
@@ -1131,6 +1191,44 @@ class div_unit(derived_unit):
         
         return result
     
+def simple_product(left, right):
+    """
+    The simple form of the product of the two units, the
+    simple forms are stored in a table so repeated products
+    of the same units (common in quantity arithmetic) do not
+    need to create and simplify the unit every time.
+    
+    >>> from amuse.units import units
+    >>> simple_product(units.m, units.m / units.s)
+    unit<m**2 * s**-1>
+    """
+    key = (left, right)
+    try:
+        return PRODUCTS[key]
+    except KeyError:
+        result = (left * right).to_simple_form()
+        if len(PRODUCTS) < MAXIMUM_NUMBER_OF_PRODUCTS:
+            PRODUCTS[key] = result
+        return result
+
+def simple_quotient(left, right):
+    """
+    The simple form of the quotient of the two units, see
+    also :func:`simple_product`
+    
+    >>> from amuse.units import units
+    >>> simple_quotient(units.m, units.s)
+    unit<m * s**-1>
+    """
+    key = (left, right)
+    try:
+        return QUOTIENTS[key]
+    except KeyError:
+        result = (left / right).to_simple_form()
+        if len(QUOTIENTS) < MAXIMUM_NUMBER_OF_PRODUCTS:
+            QUOTIENTS[key] = result
+        return result
+
 class UnitException(exceptions.AmuseException):
     formatstring = "Unit exception: {0}"
 
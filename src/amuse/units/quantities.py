@@ -124,7 +124,7 @@ class Quantity(object):
 
     def __mul__(self, other):
         other = to_quantity(other)
-        return new_quantity_nonone(self.number * other.number, (self.unit * other.unit).to_simple_form())
+        return new_quantity_nonone(self.number * other.number, core.simple_product(self.unit, other.unit))
 
     __rmul__ = __mul__
 
@@ -133,7 +133,7 @@ class Quantity(object):
 
     def __truediv__(self, other):
         other = to_quantity(other)
-        return new_quantity_nonone(operator.__truediv__(self.number,other.number), (self.unit / other.unit).to_simple_form())
+        return new_quantity_nonone(operator.__truediv__(self.number,other.number), core.simple_quotient(self.unit, other.unit))
 
     def __rtruediv__(self, other):
         return new_quantity_nonone(operator.__truediv__(other,self.number), (1.0 / self.unit).to_simple_form())
@@ -147,7 +147,7 @@ class Quantity(object):
 
     def __div__(self, other):
         other = to_quantity(other)
-        return new_quantity_nonone(self.number/other.number, (self.unit / other.unit).to_simple_form())
+        return new_quantity_nonone(self.number/other.number, core.simple_quotient(self.unit, other.unit))
 
     def __rdiv__(self, other):
         return new_quantity_nonone(other/self.number, (1.0 / self.unit).to_simple_form())
@@ -1,6 +1,7 @@
 # nosetests --nocapture --nologcapture -w test/codes_tests --tests=test_multiples 
 
 from amuse.test.amusetest import TestWithMPI
+from amuse.test.amusetest import TestCase
 
 import os
 import sys
@@ -15,6 +16,7 @@ from amuse.community.smalln.interface import SmallN
 from amuse.units import nbody_system
 from amuse.units import units
 from amuse.units import constants
+from amuse.units.quantities import zero
 
 from amuse import datamodel
 from amuse.ic import plummer
@@ -1058,3 +1060,117 @@ class TestSimpleMultiples(TestWithMPI):
             self.assertEquals(len(code.singles_in_binaries), 2)
             self.assertEquals(len(code.components_of_multiples), 3)
             self.assertEquals(id(code.components_of_multiples), id(code.multiples[0].components[0].particles_set))
+
+    
+    def test17(self):
+        results = []
+        for copy_neighbors_only in [False, True]:
+            numpy.random.seed(42)
+            stars = plummer.new_plummer_model(100)
+            stars.mass = 0.01 | nbody_system.mass
+            stars.scale_to_standard()
+            stars.id = numpy.arange(100) + 1
+            stars.radius = 0.005 | nbody_system.length
+            
+            code = Hermite()
+            code.particles.add_particles(stars)
+            code.stopping_conditions.collision_detection.enable()
+            multiples_code = multiples.Multiples(code, self.new_smalln, self.new_kepler())
+            multiples_code.neighbor_perturbation_limit = 0.05
+            multiples_code.global_debug = 0
+            multiples_code.copy_neighbors_only = copy_neighbors_only
+            multiples_code.evolve_model(0.3493 | nbody_system.time)
+            
+            self.assertTrue(multiples_code.number_of_collisions > 0)
+            self.assertTrue(multiples_code.gravity_code_time > 0)
+            self.assertTrue(multiples_code.encounter_time > 0)
+            results.append((
+                multiples_code.number_of_collisions,
+                code.particles.position,
+                multiples_code.multiples_external_tidal_correction
+            ))
+            code.stop()
+            multiples_code.kepler.stop()
+        
+        self.assertEquals(results[0][0], results[1][0])
+        self.assertAlmostRelativeEquals(results[0][1], results[1][1], 10)
+        self.assertAlmostRelativeEquals(results[0][2], results[1][2], 10)
+
+class TestMultiplesFunctions(TestCase):
+    
+    def new_particles(self, n):
+        numpy.random.seed(123)
+        particles = plummer.new_plummer_model(n)
+        particles.mass = numpy.random.uniform(0.5, 1.5, n) / n | nbody_system.mass
+        particles.id = numpy.arange(n) + 1
+        return particles
+    
+    def test1(self):
+        particles = self.new_particles(300)
+        plist = particles[:4]
+        field = particles[4:]
+        
+        pmin, fmin, dxmin = multiples.find_nn3(plist, field, nbody_system.G)
+        phi = [(-(p.mass * field.mass / (p.position - field.position).lengths())).min() for p in plist]
+        i = numpy.argmin(phi)
+        self.assertEquals(pmin.id, plist[i].id)
+        self.assertAlmostRelativeEquals(dxmin, (fmin.position - pmin.position).length(), 14)
+        self.assertAlmostRelativeEquals(-(pmin.mass * fmin.mass / dxmin), phi[i], 14)
+        
+        self.assertEquals(multiples.find_nn(plist, field, nbody_system.G)[1].id, fmin.id)
+        self.assertEquals(multiples.find_nn3(plist, field, nbody_system.G, block_size = 1)[1].id, fmin.id)
+        self.assertEquals(multiples.find_nn3(plist, field[:0], nbody_system.G), (None, None, None))
+    
+    def test2(self):
+        particles = self.new_particles(300)
+        particles[1].position = particles[0].position + ([0.001, 0, 0] | nbody_system.length)
+        particles[1].velocity = particles[0].velocity
+        particles[7].position = particles[5].position + ([0, 0.002, 0] | nbody_system.length)
+        particles[7].velocity = particles[5].velocity + ([0, 0, 0.01] | nbody_system.speed)
+        
+        pairs = multiples.find_binaries(particles, nbody_system.G)
+        
+        expected = []
+        for p in particles:
+            mu = p.mass*particles.mass/(p.mass+particles.mass)
+            dr = (particles.position - p.position).lengths()
+            dv = (particles.velocity - p.velocity).lengths()
+            E = 0.5*mu*dv*dv - nbody_system.G*p.mass*particles.mass/dr
+            indices = numpy.argsort(E.number)
+            Emin = E[indices[1]].number
+            if Emin < -1.e-4 and p.id < particles[indices[1]].id:
+                expected.append((p.id, particles[indices[1]].id, Emin))
+        self.assertEquals([x[:2] for x in pairs], [x[:2] for x in expected])
+        self.assertEquals([x[:2] for x in pairs], [(1, 2), (6, 8)])
+        self.assertAlmostRelativeEquals(numpy.array([x[2] for x in pairs]), numpy.array([x[2] for x in expected]), 12)
+    
+    def test3(self):
+        particles = self.new_particles(200)
+        plist = particles[:5]
+        field = particles[5:]
+        
+        expected = zero
+        for p in plist:
+            dr = ((p.position - field.position).lengths_squared() + (0.01 | nbody_system.length**2)).sqrt()
+            expected -= (p.mass * field.mass / dr).sum()
+        energy = multiples.potential_energy_in_field(plist, field, 
+            smoothing_length_squared = 0.01 | nbody_system.length**2, G = nbody_system.G)
+        self.assertAlmostRelativeEquals(energy, nbody_system.G * expected, 14)
+        self.assertEquals(multiples.potential_energy_in_field(plist, field[:0]), zero)
+    
+    def test4(self):
+        particles = self.new_particles(300)
+        center = particles[0].position + ([0.01, 0, 0] | nbody_system.length)
+        excluded = particles[:2].key
+        
+        others = particles[2:]
+        perturbations = others.mass / (others.position - center).lengths()**3
+        i = numpy.argmax(perturbations.number)
+        
+        for distances in [None, (particles.position - center).lengths()]:
+            star, distance, found = multiples.find_strongest_perturber(particles, center, excluded, distances)
+            self.assertEquals(star.id, others[i].id)
+            self.assertAlmostRelativeEquals(distance, (others[i].position - center).length(), 14)
+            self.assertAlmostRelativeEquals(found, perturbations[i], 14)
+        
+        self.assertEquals(multiples.find_strongest_perturber(particles[:2], center, excluded), (None, None, None))
@@ -291,3 +291,60 @@ class TwoBodyTests(TestWithMPI):
         self.assertAlmostEqual(instance.particles.z[0] - instance.particles.z[1], -0.2562478900031234|nbody_system.length, 7)
         instance.stop()
     
+        
+    def test12(self):
+        numpy.random.seed(12)
+        number_of_binaries = 5
+        p = datamodel.Particles(2 * number_of_binaries)
+        p.mass = numpy.random.uniform(0.1, 1.0, len(p)) | nbody_system.mass
+        p.radius = 0.001 | nbody_system.length
+        p.position = numpy.random.uniform(-1.0, 1.0, (len(p), 3)) | nbody_system.length
+        p.velocity = numpy.random.uniform(-0.5, 0.5, (len(p), 3)) | nbody_system.speed
+        
+        instance = interface.TwoBody()
+        self.assertEquals(instance.parameters.many_binaries, False)
+        instance.parameters.many_binaries = True
+        self.assertEquals(instance.parameters.many_binaries, True)
+        instance.particles.add_particles(p)
+        energy = instance.kinetic_energy + instance.potential_energy
+        instance.evolve_model(0.5 | nbody_system.time)
+        self.assertAlmostRelativeEquals(instance.kinetic_energy + instance.potential_energy, energy, 10)
+        self.assertAlmostRelativeEquals(instance.model_time, 0.5 | nbody_system.time)
+        many_binaries = instance.particles.copy()
+        instance.stop()
+        
+        for i in range(number_of_binaries):
+            instance = interface.TwoBody()
+            instance.particles.add_particles(p[2*i:2*i+2])
+            instance.evolve_model(0.5 | nbody_system.time)
+            self.assertAlmostRelativeEquals(many_binaries[2*i:2*i+2].position, instance.particles.position, 8)
+            self.assertAlmostRelativeEquals(many_binaries[2*i:2*i+2].velocity, instance.particles.velocity, 8)
+            instance.stop()
+
+    def test13(self):
+        p = datamodel.Particles(4)
+        p.mass = [1.0, 1.0, 2.0, 2.0] | nbody_system.mass
+        p.radius = 0.001 | nbody_system.length
+        p.position = [[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 3.0, 0.0], [0.0, 4.0, 0.0]] | nbody_system.length
+        p.velocity = [0.0, 0.0, 0.0] | nbody_system.speed
+        
+        instance = interface.TwoBody()
+        instance.parameters.many_binaries = True
+        instance.particles.add_particles(p)
+        
+        zeros = [0.0, 0.0] | nbody_system.length
+        x = [0.5, 0.0] | nbody_system.length
+        y = [0.0, 1.0] | nbody_system.length
+        ax, ay, az = instance.get_gravity_at_point(zeros, x, y, zeros)
+        phi = instance.get_potential_at_point(zeros, x, y, zeros)
+        instance.stop()
+        
+        # the field of all binaries together
+        for i in range(2):
+            dx = p.x - x[i]
+            dy = p.y - y[i]
+            dr = (dx**2 + dy**2).sqrt()
+            self.assertAlmostRelativeEquals(phi[i], (-nbody_system.G * p.mass / dr).sum(), 12)
+            self.assertAlmostRelativeEquals(ax[i], (nbody_system.G * p.mass * dx / dr**3).sum(), 12)
+            self.assertAlmostRelativeEquals(ay[i], (nbody_system.G * p.mass * dy / dr**3).sum(), 12)
+            self.assertAlmostRelativeEquals(az[i], zero * nbody_system.acceleration, 12)
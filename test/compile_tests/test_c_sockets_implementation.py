@@ -31,6 +31,17 @@ class TestCSocketsImplementationInterface(test_c_implementation.TestCImplementat
         
     def test29(self):
         self.skip("this test uses mpi internals, skip here")
+    
+    def test33(self):
+        for split_message_window in [1, 2, 4]:
+            x = test_c_implementation.ForTestingInterface(self.exefile, max_message_length=10, split_message_window=split_message_window)
+            N = 101
+            doubles, errors = x.echo_double([1.0*i for i in range(N)])
+            self.assertEquals(list(doubles), [1.0*i for i in range(N)])
+            out1, out2, errors = x.echo_strings(['abc' + str(i) for i in range(N)], ['def'] * N)
+            self.assertEquals(list(out1), ['def'] * N)
+            self.assertEquals(list(out2), ['abc' + str(i) for i in range(N)])
+            x.stop()
                      
     def check_not_in_mpiexec(self):
         """
@@ -44,4 +55,9 @@ class TestCSocketsImplementationInterface(test_c_implementation.TestCImplementat
             return # for now assume HYDI_CONTROL_FD is newer, and sockets will work!
         if 'HYDRA_CONTROL_FD' in os.environ or 'PMI_FD' in os.environ:
             self.skip('cannot run the socket tests under mpi process manager')
-         
+
+class TestCSharedMemoryImplementationInterface(TestCSocketsImplementationInterface):
+
+    def setUp(self):
+        super(TestCSharedMemoryImplementationInterface, self).setUp()
+        options.GlobalOptions.instance().override_value_for_option("channel_type", "shared_memory")
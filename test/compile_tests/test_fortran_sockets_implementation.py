@@ -272,3 +272,26 @@ class TestInterface(TestWithMPI):
         
         self.assertEquals(error, 0)
         self.assertEquals(out, "a"*N)
+        
+    def test37(self):
+        instance = ForTestingInterface(self.exefile, channel_type="shared_memory")
+        input = [1.0,2.1,3.3,4.2]
+        output, errors = instance.echo_double(input)
+        out1, out2, error = instance.echo_strings("abc","def")
+        del instance
+        
+        self.assertEquals(errors, [0] * 4)
+        self.assertEquals(output, input)
+        self.assertEquals(out1, "Abc")
+        self.assertEquals(out2, "Bef")
+        
+    def test38(self):
+        # payloads larger than the shared memory are send over the socket
+        instance = ForTestingInterface(self.exefile, channel_type="shared_memory", shared_memory_size = 1024)
+        for n in [10, 1000]:
+            input = range(n)
+            output, errors = instance.echo_int(input)
+            self.assertEquals(output, input)
+            output, errors = instance.echo_string(["abc","def"] * n)
+            self.assertEquals(output[-1], "def")
+        del instance
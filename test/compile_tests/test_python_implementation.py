@@ -402,6 +402,25 @@ class ForTestingImplementation(object):
         
 
 
+class ForTestingVectorizedImplementation(ForTestingImplementation):
+    
+    def __init__(self):
+        ForTestingImplementation.__init__(self)
+        self.masses = numpy.zeros(100)
+        self.number_of_calls = 0
+        
+    @python_code.vectorized
+    def get_mass(self, index_of_the_particle,  mass):
+        self.number_of_calls += 1
+        mass.value = self.masses[index_of_the_particle]
+        return 0
+        
+    @python_code.vectorized
+    def set_mass(self, index_of_the_particle,  mass):
+        self.number_of_calls += 1
+        self.masses[index_of_the_particle] = mass
+        return 0
+        
 
 class ForTesting(InCodeComponentImplementation):
     
@@ -1157,3 +1176,111 @@ class TestInterface(TestWithMPI):
         self.assertEquals(out, [True, False, True])
         x.stop()
 
+    def test41(self):
+        x = self.ForTesting()
+        y = self.ForTesting()
+        p = datamodel.Particles(5)
+        p.mass = [1,2,3,4,5] | units.kg
+        p.other = None
+        x.particles.add_particles(p[:3])
+        y.particles.add_particles(p[3:])
+        superset = datamodel.ParticlesSuperset([x.particles, y.particles])
+        self.assertAlmostRelativeEquals(superset.mass, [1,2,3,4,5])
+        self.assertAlmostRelativeEquals(superset[1:4].mass, [2,3,4])
+        superset.mass = [10,20,30,40,50]
+        self.assertAlmostRelativeEquals(x.particles.mass, [10,20,30])
+        self.assertAlmostRelativeEquals(y.particles.mass, [40,50])
+        superset[[4,0]].mass = [5,1]
+        self.assertAlmostRelativeEquals(superset.mass, [1,20,30,40,5])
+        # sets in the same code are handled one after the other
+        superset = datamodel.ParticlesSuperset([x.particles[:1], y.particles, x.particles[1:]])
+        self.assertAlmostRelativeEquals(superset.mass, [1,40,5,20,30])
+        superset.mass = [1,2,3,4,5]
+        self.assertAlmostRelativeEquals(x.particles.mass, [1,4,5])
+        self.assertAlmostRelativeEquals(y.particles.mass, [2,3])
+        x.stop()
+        y.stop()
+
+    def test43(self):
+        implementation = ForTestingVectorizedImplementation()
+        x = python_code.PythonImplementation(implementation, ForTestingInterface)
+        
+        input_message = python_code.ClientSideMPIMessage(0, 11, 4)
+        input_message.ints = [1,2,3,4]
+        input_message.doubles = [12.0,13.0,14.0,15.0]
+        output_message = python_code.ClientSideMPIMessage(0, 11, 4)
+        x.handle_message(input_message, output_message)
+        
+        self.assertEquals(implementation.number_of_calls, 1)
+        self.assertEquals(output_message.ints, [0, 0, 0, 0])
+        self.assertEquals(implementation.masses[1:5], [12.0, 13.0, 14.0, 15.0])
+        
+        input_message = python_code.ClientSideMPIMessage(0, 10, 3)
+        input_message.ints = [4,1,2]
+        output_message = python_code.ClientSideMPIMessage(0, 10, 3)
+        x.handle_message(input_message, output_message)
+        
+        self.assertEquals(implementation.number_of_calls, 2)
+        self.assertEquals(output_message.ints, [0, 0, 0])
+        self.assertEquals(output_message.doubles, [15.0, 12.0, 13.0])
+        
+    def test44(self):
+        implementation = ForTestingImplementation()
+        implementation.auto_vectorize = True
+        x = python_code.PythonImplementation(implementation, ForTestingInterface)
+        
+        function_id = ForTestingInterface.echo_double.specification.id
+        input_message = python_code.ClientSideMPIMessage(0, function_id, 3)
+        input_message.doubles = [1.0, 2.0, 3.0]
+        output_message = python_code.ClientSideMPIMessage(0, function_id, 3)
+        x.handle_message(input_message, output_message)
+        
+        self.assertTrue(x.function_is_vectorized['echo_double'])
+        self.assertEquals(output_message.ints, [0, 0, 0])
+        self.assertEquals(output_message.doubles, [1.0, 2.0, 3.0])
+        
+        # the masses are stored in a list, indexing with an array fails,
+        # detected as not vectorized and handled element by element
+        implementation.masses[1:4] = [12.0, 13.0, 14.0]
+        input_message = python_code.ClientSideMPIMessage(0, 10, 3)
+        input_message.ints = [3,1,2]
+        output_message = python_code.ClientSideMPIMessage(0, 10, 3)
+        x.handle_message(input_message, output_message)
+        
+        self.assertFalse(x.function_is_vectorized['get_mass'])
+        self.assertEquals(output_message.ints, [0, 0, 0])
+        self.assertEquals(output_message.doubles, [14.0, 12.0, 13.0])
+        
+        self.assertEquals(x.call_statistics['echo_double'][:2], [1, 3])
+        self.assertEquals(x.call_statistics['get_mass'][:2], [1, 3])
+        
+    def test45(self):
+        x = self.ForTestingInterface()
+        self.assertEquals(x.get_call_statistics(), [])
+        x.echo_int([1, 2, 3])
+        x.echo_int(4)
+        statistics = dict([(name, (calls, elements)) for name, calls, elements, seconds in x.get_call_statistics()])
+        self.assertEquals(statistics['echo_int'], (2, 4))
+        x.stop()
+
+    def test46(self):
+        class SummingImplementation(ForTestingImplementation):
+            def echo_double(self, double_in, double_out):
+                # works on arrays, but returns a single value for all elements
+                double_out.value = numpy.sum(double_in)
+                return 0
+        
+        implementation = SummingImplementation()
+        implementation.auto_vectorize = True
+        x = python_code.PythonImplementation(implementation, ForTestingInterface)
+        
+        function_id = ForTestingInterface.echo_double.specification.id
+        input_message = python_code.ClientSideMPIMessage(0, function_id, 3)
+        input_message.doubles = [1.0, 2.0, 3.0]
+        output_message = python_code.ClientSideMPIMessage(0, function_id, 3)
+        x.handle_message(input_message, output_message)
+        
+        self.assertFalse(x.function_is_vectorized['echo_double'])
+        self.assertEquals(output_message.ints, [0, 0, 0])
+        self.assertEquals(output_message.doubles, [1.0, 2.0, 3.0])
+
@@ -7,15 +7,32 @@ import parser
 import sys
 import os
 import time
+import socket
 from amuse.units import nbody_system
 from amuse.units import units
 from amuse import datamodel
 from amuse.rfi import python_code
+from amuse.rfi import channel
 from amuse.rfi.core import *
 from amuse.rfi.async_request import AsyncRequestsPool
+from amuse.support import exceptions
 
 import test_python_implementation
 import test_python_implementation_mpi
+
+class ForTestingFailingBlockImplementation(test_python_implementation.ForTestingImplementation):
+    
+    @python_code.vectorized
+    def echo_double(self, double_in, double_out):
+        if numpy.any(double_in < 0):
+            raise Exception("negative values")
+        double_out.value = double_in
+        return 0
+
+class ForTestingFailingBlockInterface(test_python_implementation.ForTestingInterface):
+    
+    def __init__(self, **options):
+        PythonCodeInterface.__init__(self, implementation_factory = ForTestingFailingBlockImplementation, **options)
                         
 class TestInterfaceSockets(test_python_implementation.TestInterface):
     def setUp(self):
@@ -117,6 +134,96 @@ class TestInterfaceSockets(test_python_implementation.TestInterface):
         
     def test27(self):
         pass # skip because only supported for mpi channel
+    
+    def test47(self):
+        # the arrays are packed in the message, after one int the longs and
+        # doubles do not start at a multiple of 8 bytes
+        first, second = socket.socketpair()
+        try:
+            message = channel.SocketMessage(1, 2, 3)
+            message.ints = [1]
+            message.longs = [2, 3, 4]
+            message.doubles = [0.5, 1.5, 2.5]
+            message.booleans = [True]
+            message.strings = ['a', 'bc']
+            message.encoded_units = [1.0, 2.0]
+            message.send(first)
+            
+            received = channel.SocketMessage()
+            received.receive(second)
+            for x in [received.ints, received.longs, received.doubles, received.encoded_units]:
+                self.assertTrue(x.flags.aligned)
+            self.assertEquals(received.ints, [1])
+            self.assertEquals(received.longs, [2, 3, 4])
+            self.assertEquals(received.doubles, [0.5, 1.5, 2.5])
+            self.assertEquals(list(received.strings), ['a', 'bc'])
+            self.assertEquals(received.encoded_units, [1.0, 2.0])
+        finally:
+            first.close()
+            second.close()
+    
+    def test48(self):
+        # the first block fails while the blocks after it, with replies that
+        # do not fit in the socket buffers, are still being send
+        x = ForTestingFailingBlockInterface(
+            worker_dir = self.get_path_to_results(),
+            channel_type = "sockets",
+            max_message_length = 2000000,
+            split_message_window = 4
+        )
+        doubles = numpy.arange(8000000) * 1.5
+        doubles[0] = -1
+        self.assertRaises(exceptions.CodeException, x.echo_double, doubles)
+        out, error = x.echo_double(doubles[1:100])
+        self.assertEquals(out, doubles[1:100])
+        x.stop()
+
+class TestInterfaceSharedMemory(TestInterfaceSockets):
+    
+    def ForTesting(self, **options):
+        options["worker_dir"]=self.get_path_to_results()
+        options["channel_type"]="shared_memory"
+        return test_python_implementation.ForTesting( **options)
+    def ForTestingInterface(self, **options):
+        options["worker_dir"]=self.get_path_to_results()
+        options["channel_type"]="shared_memory"
+        return test_python_implementation.ForTestingInterface(**options)
+    
+    def test41(self):
+        # payloads larger than the shared memory are send over the socket
+        x = self.ForTestingInterface(shared_memory_size = 1024)
+        for n in [10, 1000]:
+            doubles = numpy.arange(n) * 1.5
+            out, error = x.echo_double(doubles)
+            self.assertEquals(error, [0] * n)
+            self.assertEquals(out, doubles)
+            strings = [str(i) for i in range(n)]
+            out, error = x.echo_string(strings)
+            self.assertEquals(out, strings)
+        x.stop()
+    
+    def test42(self):
+        shared_memory = numpy.zeros(1024, dtype='uint8')
+        first, second = socket.socketpair()
+        try:
+            for n in [10, 1000]:
+                message = channel.SharedMemoryMessage(shared_memory, 1, 2, n)
+                message.ints = numpy.arange(n)
+                message.doubles = numpy.arange(n) * 0.5
+                message.strings = ['a', 'bc'] * (n // 2)
+                message.send(first)
+                
+                received = channel.SharedMemoryMessage(shared_memory)
+                received.receive(second)
+                self.assertEquals(received.call_count, n)
+                self.assertEquals(received.ints, message.ints)
+                self.assertEquals(received.doubles, message.doubles)
+                self.assertEquals(list(received.strings), message.strings)
+            # only the first (small) message was placed in the shared memory
+            self.assertEquals(shared_memory[:40].view('int32'), range(10))
+        finally:
+            first.close()
+            second.close()
 
 class TestInterfaceSocketsMPI(test_python_implementation_mpi.TestInterface):
     def setUp(self):
@@ -4,6 +4,7 @@ import time
 from amuse.test import amusetest
 from amuse.datamodel.memory_storage import InMemoryAttributeStorageUseDictionaryForKeySet
 from amuse.datamodel.memory_storage import InMemoryAttributeStorageUseSortedKeys
+from amuse.datamodel.memory_storage import InMemoryAttributeStorageUseAmortizedGrowth
 from amuse.datamodel.memory_storage import get_in_memory_attribute_storage_factory
 from amuse.datamodel.memory_storage import InMemoryVectorQuantityAttribute
 from amuse.datamodel.incode_storage import *
@@ -331,6 +332,47 @@ class TestDictionaryKeysInMemoryAttributeStorage(_AbstractTestInMemoryAttributeS
     def new_inmemory_storage(self, is_with_units = True):
         return InMemoryAttributeStorageUseDictionaryForKeySet()
 
+class TestAmortizedGrowthInMemoryAttributeStorage(_AbstractTestInMemoryAttributeStorage):
+      
+    def new_inmemory_storage(self, is_with_units = True):
+        return InMemoryAttributeStorageUseAmortizedGrowth()
+        
+    def test_add_and_remove_one_at_a_time(self):
+        instance = self.new_inmemory_storage()
+        for i in range(100):
+            instance.add_particles_to_store([i + 1], ["mass", "position"], [[i] | units.kg, [[i, 0, 0]] | units.m])
+        
+        self.assertEquals(len(instance), 100)
+        self.assertEquals(instance.capacity, 128)
+        
+        for key in range(1, 51, 2):
+            instance.remove_particles_from_store(instance.get_indices_of([key]))
+        
+        self.assertEquals(len(instance), 75)
+        self.assertEquals(instance.capacity, 128)
+        self.assertEquals(instance.number_of_removed_rows, 25)
+        indices = instance.get_indices_of([2, 100])
+        self.assertEquals(indices, [1, 99])
+        self.assertEquals(instance.get_values_in_store(indices, ["mass"])[0], [1, 99] | units.kg)
+        self.assertEquals(instance.get_all_keys_in_store()[:3], [2, 4, 6])
+        self.assertEquals(instance.get_values_in_store(None, ["mass"])[0][:3], [1, 3, 5] | units.kg)
+        self.assertFalse(instance.has_key_in_store(1))
+        self.assertRaises(Exception, instance.get_indices_of, [1, 2])
+        
+        for key in range(51, 81):
+            instance.remove_particles_from_store(instance.get_indices_of([key]))
+            
+        # compacted after removing key 76, 4 rows removed after that
+        self.assertEquals(len(instance), 45)
+        self.assertEquals(instance.number_of_rows, 49)
+        self.assertEquals(instance.number_of_removed_rows, 4)
+        self.assertEquals(instance.get_indices_of([2, 100]), [0, 48])
+        self.assertEquals(instance.get_values_in_store([0, 48], ["position"])[0], [[1, 0, 0], [99, 0, 0]] | units.m)
+        
+        copy = instance.copy()
+        self.assertEquals(copy.get_all_keys_in_store(), instance.get_all_keys_in_store())
+        self.assertEquals(copy.get_values_in_store(None, ["position"])[0], instance.get_values_in_store(None, ["position"])[0])
+        
 class _Code(object):
     def __init__(self, is_with_units):
         self.data = {}
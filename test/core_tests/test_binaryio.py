@@ -1,5 +1,6 @@
 from amuse.test import amusetest
 from io import BytesIO
+from StringIO import StringIO
 from collections import namedtuple
 
 import os.path
@@ -290,6 +291,88 @@ class GadgetFileFormatProcessorTests(amusetest.TestCase):
         self.assertEquals(data.gas.position, data_converted.gas.position)
         self.assertAlmostRelativeEquals(data.gas.velocity, math.sqrt(data_converted.Time) * data_converted.gas.velocity, 7)
         
+    def test14(self):
+        print "Test loading a snapshot stored in multiple files"
+        directory_name = os.path.dirname(__file__)
+        filename = os.path.join(directory_name, 'tiny_lcdm_data_littleendian.dat')
+        data = io.read_set_from_file(filename, format='gadget')
+        
+        Header = namedtuple("Header", ["NumFiles"])
+        outputfilename = os.path.join(self.get_path_to_results(), 'gadgettest_multiple_files')
+        for i in range(2):
+            io.write_set_to_file((data.gas[i::2], data.halo[i::2]), outputfilename + '.' + str(i), 
+                format='gadget', write_header_from=Header(NumFiles = 2), overwrite_file = True)
+        
+        result = io.read_set_from_file(outputfilename + '.0', format='gadget', return_header=True, number_of_threads=2)
+        self.assertEquals(result.Npart, (32, 32, 0, 0, 0, 0))
+        self.assertEquals(result.NumFiles, 2)
+        self.assertEquals(result.gas.key[:16], data.gas.key[0::2])
+        self.assertEquals(result.gas.key[16:], data.gas.key[1::2])
+        self.assertEquals(result.halo[16:].position, data.halo[1::2].position)
+        self.assertAlmostRelativeEquals(result.halo[:16].mass, data.halo[0::2].mass, 7)
+        self.assertEquals(result.gas[16:].u, data.gas[1::2].u)
+        
+        result = io.read_set_from_file(outputfilename + '.1', format='gadget')
+        self.assertEquals(len(result.gas), 16)
+        self.assertEquals(result.gas.key, data.gas.key[1::2])
+    
+    def test15(self):
+        print "Test loading only some blocks and particle types"
+        directory_name = os.path.dirname(__file__)
+        filename = os.path.join(directory_name, 'tiny_lcdm_data_littleendian.dat')
+        data = io.read_set_from_file(filename, format='gadget')
+        
+        result = io.read_set_from_file(filename, format='gadget', 
+            particle_types_to_load = (gadget.GadgetFileFormatProcessor.HALO,), blocks_to_load = ('position', 'mass'))
+        self.assertEquals(len(result.gas), 0)
+        self.assertEquals(len(result.halo), 32)
+        self.assertEquals(result.halo.key, data.halo.key)
+        self.assertEquals(result.halo.position, data.halo.position)
+        self.assertEquals(result.halo.mass, data.halo.mass)
+        self.assertEquals(sorted(result.halo.get_attribute_names_defined_in_store()), ['mass', 'x', 'y', 'z'])
+        
+        result = io.read_set_from_file(filename, format='gadget', ids_are_keys = False, blocks_to_load = ('u',))
+        self.assertEquals(len(result.gas), 32)
+        self.assertEquals(result.gas.get_attribute_names_defined_in_store(), ['u'])
+        self.assertEquals(result.gas.u, data.gas.u)
+        
+        with open(filename, 'rb') as stream:
+            contents = stream.read()
+        for in_memory_file in [StringIO(contents), BytesIO(contents)]:
+            result = gadget.GadgetFileFormatProcessor().load_file(in_memory_file)
+            self.assertEquals(len(result.gas), 32)
+            self.assertEquals(result.gas.key, data.gas.key)
+            self.assertEquals(result.gas.u, data.gas.u)
+            self.assertEquals(result.halo.position, data.halo.position)
+    
+    def test16(self):
+        p = Particles(3)
+        p.position = [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0], [7.0, 8.0, 9.0]] | nbody_system.length
+        p.velocity = [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0], [7.0, 8.0, 9.0]] | nbody_system.speed
+        p.mass = [1.0, 2.0, 3.0] | nbody_system.mass
+        p.timestep = [0.1, 0.2, 0.3] | nbody_system.time
+        p.acceleration = [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]] | nbody_system.acceleration
+        file = BytesIO()
+        x = gadget.GadgetFileFormatProcessor(set = (Particles(), p))
+        x.is_initial_conditions_format = False
+        x.has_timestep = True
+        x.has_acceleration = True
+        x.store_file(file)
+        
+        y = gadget.GadgetFileFormatProcessor()
+        y.is_initial_conditions_format = False
+        y.has_timestep = True
+        y.has_acceleration = True
+        y.blocks_to_load = ('acceleration', 'timestep')
+        result = y.load_file(BytesIO(file.getvalue()))
+        self.assertEquals(result.halo.key, p.key)
+        self.assertEquals(result.halo.acceleration, p.acceleration)
+        self.assertAlmostRelativeEquals(result.halo.timestep, p.timestep, 7)
+        
+        y.blocks_to_load = ('velocity', 'timestep')
+        self.assertRaises(io.IoException, y.load_file, BytesIO(file.getvalue()[:-24]),
+            expected_message = "IO exception: Unexpected end of file, block at position 404 is truncated")
+        
     
 
 class NemoBinaryFileFormatProcessorTests(amusetest.TestCase):
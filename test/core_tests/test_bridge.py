@@ -9,6 +9,7 @@ from amuse.ic.plummer import new_plummer_model
 
 from amuse.test import amusetest
 from amuse.couple import bridge
+from amuse.rfi.async_request import FakeASyncRequest
 
 class TestCalculateFieldForParticles(amusetest.TestCase):
     
@@ -385,3 +386,145 @@ class TestBridge(amusetest.TestCase):
         self.assertAlmostRelativeEqual(cluster.kinetic_energy, bridgesys.kinetic_energy)
     
 
+    
+    def test5(self):
+        print "Bridge evolve_model with asynchronous kicks"
+        convert = nbody_system.nbody_to_si(1.e5 | units.MSun, 1.0 | units.parsec)
+        epsilon = 1.0e-2 | units.parsec
+        test_class=ExampleGravityCodeInterface
+        
+        numpy.random.seed(12345)
+        stars = new_plummer_model(100, convert_nbody=convert)
+        first_half = stars.select_array(lambda x: (x > 0 | units.m), ['x'] )
+        second_half = stars - first_half
+        
+        results = []
+        for use_async_kicks in [False, True]:
+            cluster1 = system_from_particles(test_class, dict(), first_half, epsilon)
+            cluster2 = system_from_particles(test_class, dict(), second_half, epsilon)
+            cluster3 = system_from_particles(test_class, dict(), second_half, epsilon)
+            cluster1.get_gravity_at_point = ExampleAsynchronousMethod(cluster1.get_gravity_at_point)
+            cluster2.get_gravity_at_point = ExampleAsynchronousMethod(cluster2.get_gravity_at_point)
+            
+            bridgesys=bridge.Bridge(use_async_kicks = use_async_kicks)
+            bridgesys.add_system(cluster1, (cluster2, cluster3) )
+            bridgesys.add_system(cluster2, (cluster1,) )
+            
+            one_timestep = cluster1.next_timestep
+            bridgesys.evolve_model(2 * one_timestep, timestep=one_timestep)
+            results.append(cluster1.particles.velocity)
+            
+            self.assertEquals(cluster1.get_gravity_at_point.number_of_requests, 3 if use_async_kicks else 0)
+            self.assertEquals(cluster2.get_gravity_at_point.number_of_requests, 3 if use_async_kicks else 0)
+            self.assertEquals(sorted(bridgesys.step_timing.keys()), ["copy", "drift", "kick"])
+            self.assertTrue(bridgesys.timing["kick"] >= bridgesys.step_timing["kick"] > 0)
+        
+        self.assertAlmostRelativeEqual(results[0], results[1], 12)
+    
+    def test6(self):
+        print "Bridge evolve_model with field cache"
+        convert = nbody_system.nbody_to_si(1.e5 | units.MSun, 1.0 | units.parsec)
+        epsilon = 1.0e-2 | units.parsec
+        test_class=ExampleGravityCodeInterface
+        
+        numpy.random.seed(12345)
+        stars = new_plummer_model(100, convert_nbody=convert)
+        first_half = stars.select_array(lambda x: (x > 0 | units.m), ['x'] )
+        second_half = stars - first_half
+        
+        results = []
+        for use_field_cache in [False, True]:
+            cluster1 = system_from_particles(test_class, dict(), first_half, epsilon)
+            cluster2 = system_from_particles(test_class, dict(), second_half, epsilon)
+            cluster3 = system_from_particles(test_class, dict(), second_half, epsilon)
+            cluster1.get_gravity_at_point = ExampleAsynchronousMethod(cluster1.get_gravity_at_point)
+            cluster2.get_gravity_at_point = ExampleAsynchronousMethod(cluster2.get_gravity_at_point)
+            
+            bridgesys=bridge.Bridge(use_field_cache = use_field_cache)
+            bridgesys.add_system(cluster1, (cluster2, cluster3) )
+            bridgesys.add_system(cluster2, (cluster1,) )
+            
+            one_timestep = cluster1.next_timestep
+            bridgesys.evolve_model(one_timestep, timestep=one_timestep)
+            bridgesys.evolve_model(2 * one_timestep, timestep=one_timestep)
+            results.append(cluster1.particles.velocity)
+            
+            # the first kick of the second call reuses the last kick of the first call
+            self.assertEquals(cluster1.get_gravity_at_point.number_of_requests, 3 if use_field_cache else 4)
+            self.assertEquals(cluster2.get_gravity_at_point.number_of_requests, 3 if use_field_cache else 4)
+            if use_field_cache:
+                self.assertEquals(bridgesys.field_cache_statistics, dict(hits=5, misses=15))
+            else:
+                self.assertEquals(bridgesys.field_cache_statistics, dict(hits=0, misses=0))
+            
+            bridgesys.clear_field_cache()
+            bridgesys.evolve_model(3 * one_timestep, timestep=one_timestep)
+            self.assertEquals(cluster1.get_gravity_at_point.number_of_requests, 5 if use_field_cache else 6)
+        
+        self.assertAlmostRelativeEqual(results[0], results[1], 12)
+    
+    def test7(self):
+        print "Bridge asynchronous kicks with one field code for two codes"
+        convert = nbody_system.nbody_to_si(1.e5 | units.MSun, 1.0 | units.parsec)
+        epsilon = 1.0e-2 | units.parsec
+        test_class=ExampleGravityCodeInterface
+        
+        numpy.random.seed(12345)
+        stars = new_plummer_model(150, convert_nbody=convert)
+        
+        events = []
+        class LoggingGravityCodeInField(bridge.GravityCodeInField):
+            def begin_kick(self):
+                events.append("begin_kick")
+                return bridge.GravityCodeInField.begin_kick(self)
+        
+        class OwnKickGravityCodeInField(bridge.GravityCodeInField):
+            number_of_kicks = 0
+            def kick(self, dt):
+                self.number_of_kicks += 1
+                return bridge.GravityCodeInField.kick(self, dt)
+        
+        results = []
+        for use_async_kicks in [False, True]:
+            del events[:]
+            cluster1 = system_from_particles(test_class, dict(), stars[:50], epsilon)
+            cluster2 = system_from_particles(test_class, dict(), stars[50:100], epsilon)
+            cluster3 = system_from_particles(test_class, dict(), stars[100:], epsilon)
+            field = system_from_particles(test_class, dict(), stars[100:], epsilon)
+            field.get_gravity_at_point = ExampleAsynchronousMethod(field.get_gravity_at_point, events)
+            
+            bridgesys = bridge.Bridge(use_async_kicks = use_async_kicks)
+            bridgesys.add_code(LoggingGravityCodeInField(cluster1, (field,)))
+            bridgesys.add_code(LoggingGravityCodeInField(cluster2, (field,)))
+            own_kick = OwnKickGravityCodeInField(cluster3, (cluster1,))
+            bridgesys.add_code(own_kick)
+            
+            one_timestep = cluster1.next_timestep
+            bridgesys.evolve_model(one_timestep, timestep=one_timestep)
+            results.append(cluster1.particles.velocity.copy())
+            results.append(cluster2.particles.velocity.copy())
+            self.assertEquals(own_kick.number_of_kicks, 2)
+            if use_async_kicks:
+                self.assertEquals(events, ["begin_kick", "begin_kick", "request", "request"] * 2)
+            else:
+                self.assertEquals(events, [])
+        
+        self.assertAlmostRelativeEqual(results[0], results[2], 12)
+        self.assertAlmostRelativeEqual(results[1], results[3], 12)
+    
+class ExampleAsynchronousMethod(object):
+    is_async_supported = True
+    
+    def __init__(self, method, events = None):
+        self.method = method
+        self.number_of_requests = 0
+        self.events = events
+        
+    def __call__(self, *arguments):
+        return self.method(*arguments)
+    
+    def asynchronous(self, *arguments):
+        self.number_of_requests += 1
+        if not self.events is None:
+            self.events.append("request")
+        return FakeASyncRequest(self.method(*arguments))
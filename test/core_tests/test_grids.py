@@ -1068,3 +1068,71 @@ class TestGridSamplingMultiplePoints(amusetest.TestCase):
         samples = SamplePointsOnMultipleGrids((grid1, grid2), [[3.0,3.0,3.0], [4.0,3.0,3.0], [13,3,3]]| units.m)
         self.assertEquals(len(samples), 3)
         self.assertEquals(samples.mass , [3.0, 4.0, 13.0] | units.kg)
+        
+    def test4(self):
+        grid = datamodel.new_regular_grid((5,4,3), [10.0, 8.0, 6.0] | units.m)
+        grid.mass = (grid.x.value_in(units.m) + 2 * grid.y.value_in(units.m) - grid.z.value_in(units.m)) | units.kg
+        grid.rho = grid.x.value_in(units.m) * grid.y.value_in(units.m)
+        numpy.random.seed(123)
+        points = numpy.random.uniform(-1.0, 11.0, (100, 3)) | units.m
+        for method in ["nearest", "linear"]:
+            samples = grid.samplePoints(points, method=method)
+            expected = [grid.samplePoint(x, method=method) for x in points]
+            expected = [x for x in expected if x.isvalid]
+            self.assertTrue(len(samples) > 10)
+            self.assertEquals(len(samples), len(expected))
+            self.assertAlmostRelativeEquals(samples.mass, [x.mass.value_in(units.kg) for x in expected] | units.kg)
+            if method == "nearest":
+                self.assertAlmostRelativeEquals(samples.rho, [x.rho for x in expected])
+            else:
+                self.assertAlmostRelativeEquals(samples.rho, samples.x.value_in(units.m) * samples.y.value_in(units.m))
+            self.assertAlmostRelativeEquals(samples.position, [x.position.value_in(units.m) for x in expected] | units.m)
+            self.assertEquals(samples.indices, [x.index for x in expected])
+            self.assertEquals(samples[3].position, expected[3].position)
+            
+    def test5(self):
+        grid = datamodel.new_regular_grid((5,5,5), [10.0, 10.0, 10.0] | units.m)
+        grid.mass = grid.x.value_in(units.m) | units.kg
+        points = [[3.5,3.0,3.0], [0.5,3.0,3.0], [9.5,3.0,3.0], [0.8,0.8,0.8], [10.5,3.0,3.0]] | units.m
+        samples = grid.samplePoints(points, method="linear")
+        self.assertEquals(len(samples), 1)
+        samples = grid.samplePoints(points, method="conservative")
+        self.assertEquals(len(samples), 4)
+        self.assertAlmostRelativeEquals(samples.mass, [3.5, 1.0, 9.0, 1.0] | units.kg)
+        self.assertAlmostRelativeEquals(samples.weighing_factors.sum(axis=1), 1.0)
+        self.assertEquals(samples.weighing_factors[3], [0,0,0,0,0,0,0,1])
+        self.assertEquals(samples.surrounding_cell_indices[0], [[1,1,1],[1,1,2],[1,2,1],[1,2,2],[2,1,1],[2,1,2],[2,2,1],[2,2,2]])
+        self.assertEquals(samples.position, points[:4])
+        
+    def test6(self):
+        grid = datamodel.new_regular_grid((4,4), [4.0, 4.0] | units.m)
+        grid.momentum = grid.position.value_in(units.m) | units.kg * units.m / units.s
+        samples = grid.samplePoints([[1.0,1.0], [2.0,2.5]] | units.m, method="linear")
+        self.assertAlmostRelativeEquals(samples.momentum, [[1.0,1.0], [2.0,2.5]] | units.kg * units.m / units.s)
+        samples = grid.samplePoints([[1.0,1.0], [2.0,2.5]] | units.m, method="nearest")
+        self.assertAlmostRelativeEquals(samples.momentum, [[1.5,1.5], [2.5,2.5]] | units.kg * units.m / units.s)
+        samples = grid.samplePoints([[1.0,1.0], [2.0,2.5]] | units.m, method="conservative")
+        self.assertAlmostRelativeEquals(samples.momentum, [[1.0,1.0], [2.0,2.5]] | units.kg * units.m / units.s)
+        
+    def test7(self):
+        grids = []
+        for i in range(2):
+            for j in range(2):
+                grid = datamodel.new_regular_grid((5,5,5), [10.0, 10.0, 10.0] | units.m, offset = [10.0 * i, 10.0 * j, 0.0] | units.m)
+                grid.mass = (grid.x.value_in(units.m) + grid.y.value_in(units.m)) | units.kg
+                grids.append(grid)
+        points = [[13.0,3.0,3.0], [3.0,13.0,3.0], [3.0,3.0,3.0], [25.0,3.0,3.0], [13.0,13.0,3.0], [13.5,13.0,3.0]] | units.m
+        for index_factory in [None, NonOverlappingGridsIndexer]:
+            samples = SamplePointsOnMultipleGrids(grids, points, SamplePointOnCellCenter, index_factory)
+            self.assertEquals(len(samples), 5)
+            self.assertEquals(samples.mass, [16.0, 16.0, 6.0, 26.0, 26.0] | units.kg)
+            self.assertTrue(samples[0].grid is grids[2])
+            self.assertTrue(samples[1].grid is grids[1])
+            samples.filterout_duplicate_indices()
+            self.assertEquals(len(samples), 4)
+            self.assertEquals(samples.mass, [16.0, 16.0, 6.0, 26.0] | units.kg)
+        
+        indexer = NonOverlappingGridsIndexer(grids)
+        self.assertEquals(indexer.grids_for_points(points), [2, 1, 0, -1, 3, 3])
+        self.assertTrue(indexer.grid_for_point([3.0,13.0,3.0] | units.m) is grids[1])
+        self.assertTrue(indexer.grid_for_point([-3.0,13.0,3.0] | units.m) is None)
@@ -708,6 +708,42 @@ class CodeInterfaceTests(amusetest.TestCase):
         self.assertRaises( Exception, instance.returns_2, expected_message=
          "While calling returns_2 of InCodeComponentImplementation: No transition from current state state 'ZERO' to state 'TWO' possible")
 
+    def test11(self):
+        original = ClassWithState()
+        
+        instance = interface.InCodeComponentImplementation(original)
+        
+        handler = instance.get_handler('STATE')
+        handler.add_transition('ZERO', 'ONE', 'move_to_state_1')
+        handler.add_transition('ONE', 'TWO', 'move_to_state_2')
+        handler.add_method('TWO', 'returns_2')
+        handler.set_initial_state('ZERO')
+        
+        self.assertTrue(instance.returns_2 is instance.returns_2)
+        self.assertEquals(instance.returns_3(), 0)
+        
+        for i in range(3):
+            handler.set_initial_state('ZERO')
+            self.assertEquals(instance.returns_2(), 2)
+            self.assertEquals(instance.get_name_of_current_state(), 'TWO')
+        self.assertEquals(original.number_of_times_move_to_state_1_called, 3)
+        self.assertEquals(original.number_of_times_move_to_state_2_called, 3)
+        self.assertEquals(len(handler._state_machine._transition_paths), 1)
+        
+        # new definitions clear the methods and paths found before
+        handler.add_transition('ZERO', 'TWO', 'move_to_state_2')
+        handler.add_method('THREE', 'returns_3')
+        self.assertEquals(len(handler._state_machine._transition_paths), 0)
+        
+        handler.set_initial_state('ZERO')
+        self.assertEquals(instance.returns_2(), 2)
+        self.assertEquals(original.number_of_times_move_to_state_1_called, 3)
+        self.assertRaises(Exception, instance.returns_3, expected_message=
+         "While calling returns_3 of InCodeComponentImplementation: No transition from current state state 'TWO' to state 'THREE' possible")
+        
+        instance.state_machine.disable()
+        self.assertEquals(instance.returns_3(), 2)
+
         
 class CodeInterfaceWithUnitsAndStateTests(amusetest.TestCase):
     class TestClass(object):
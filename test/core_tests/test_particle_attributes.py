@@ -6,6 +6,8 @@ from amuse.test import amusetest
 from amuse.units import units
 from amuse.units import constants
 from amuse.units import nbody_system
+from amuse.units.quantities import zero
+from amuse.support import exceptions
 from amuse.support.interface import ConvertArgumentsException
 
 from amuse.ic.plummer import new_plummer_sphere
@@ -191,6 +193,10 @@ class TestParticlesAttributes(amusetest.TestCase):
         self.assertEqual(particles.nearest_neighbour(neighbours, max_array_length=189).key, neighbours.key[[0]*8 + [1]*10 + [2]*3]) # all in one go
         self.assertEqual(particles.nearest_neighbour(neighbours, max_array_length=188).key, neighbours.key[[0]*8 + [1]*10 + [2]*3]) # two passes
         self.assertEqual(particles.nearest_neighbour(neighbours, max_array_length=1).key, neighbours.key[[0]*8 + [1]*10 + [2]*3]) # 21 passes, one for each particle
+        
+        self.assertEqual(len(particles[:0].nearest_neighbour(neighbours)), 0)
+        self.assertRaises(exceptions.AmuseException, particles.nearest_neighbour, neighbours[:0],
+            expected_message="Cannot find the nearest neighbours in an empty particles set.")
     
     def new_koch_star(self, level=5):
         height = numpy.sqrt(3) / 6.0
@@ -351,6 +357,154 @@ class TestParticlesAttributes(amusetest.TestCase):
             for i,x in enumerate(stars):
               self.assertAlmostRelativeEqual(potential[i],x.potential())
 
+    def test17(self):
+        print "Test potential_energy methods"
+        numpy.random.seed(123)
+        converter = nbody_system.nbody_to_si(1000.0 | units.MSun, 1.0 | units.parsec)
+        stars = new_plummer_sphere(500, convert_nbody=converter)
+        stars.mass = numpy.random.uniform(0.1, 10.0, 500) | units.MSun
+        epsilon_squared = (0.01 | units.parsec)**2
+
+        for smoothing_length_squared in [zero, epsilon_squared]:
+            exact = stars.potential_energy(smoothing_length_squared=smoothing_length_squared)
+            self.assertAlmostRelativeEquals(exact, stars.potential_energy(method="direct-blocked",
+                smoothing_length_squared=smoothing_length_squared), 12)
+            self.assertAlmostRelativeEquals(exact, stars.potential_energy(method="direct-blocked",
+                smoothing_length_squared=smoothing_length_squared, block_size=7), 12)
+            self.assertAlmostRelativeEquals(exact, stars.potential_energy(method="tree", opening_angle=0.0,
+                smoothing_length_squared=smoothing_length_squared), 12)
+            self.assertAlmostRelativeEquals(exact, stars.potential_energy(method="tree", opening_angle=0.5,
+                smoothing_length_squared=smoothing_length_squared), 3)
+
+        self.assertEqual(stars[:1].potential_energy(method="tree"), zero)
+        self.assertRaises(exceptions.AmuseException, stars.potential_energy, method="unknown",
+            expected_message="Unknown method 'unknown' for potential_energy, use 'direct', 'direct-blocked' or 'tree'")
+
+    def test18(self):
+        print "Test potential_energy tree with coincident particles"
+        particles = Particles(20)
+        particles.position = [[0.0, 0.0, 0.0]] * 10 + [[1.0, 0.0, 0.0]] * 10 | nbody_system.length
+        particles.position += [[0.0, 0.0, 1e-3]] * 20 | nbody_system.length
+        particles.position[::2] += [0.0, 1e-3, 0.0] | nbody_system.length
+        particles.mass = 0.05 | nbody_system.mass
+        exact = particles.potential_energy(G=nbody_system.G)
+        self.assertAlmostRelativeEquals(exact, particles.potential_energy(G=nbody_system.G, method="tree", opening_angle=0.0), 12)
+        self.assertAlmostRelativeEquals(exact, particles.potential_energy(G=nbody_system.G, method="tree"), 6)
+
+    def test19(self):
+        print "Test spatial_index nearest neighbours"
+        numpy.random.seed(123)
+        particles = new_plummer_sphere(500)
+        index = particles.spatial_index()
+        self.assertTrue(index is particles.spatial_index())
+
+        distances_squared = particles.distances_squared(particles).value_in(nbody_system.length**2)
+        distances_squared[numpy.diag_indices(500)] = numpy.inf
+        indices, distances = index.nearest(k=4)
+        self.assertEqual(indices, numpy.argsort(distances_squared, axis=1)[:,:4])
+        self.assertAlmostRelativeEquals(distances**2, numpy.sort(distances_squared, axis=1)[:,:4] | nbody_system.length**2)
+
+        points = new_plummer_sphere(50).position
+        indices, distances = index.nearest(points, k=3)
+        distances_squared = ((points.reshape((50, 1, 3)) - particles.position)**2).sum(-1).value_in(nbody_system.length**2)
+        self.assertEqual(indices, numpy.argsort(distances_squared, axis=1)[:,:3])
+
+        indices, distances = particles[:3].spatial_index().nearest(k=3)
+        self.assertEqual(indices[:,2], [-1, -1, -1])
+        self.assertEqual(distances[:,2], [numpy.inf] * 3 | nbody_system.length)
+
+    def test20(self):
+        print "Test spatial_index radius queries and cache invalidation"
+        numpy.random.seed(123)
+        particles = new_plummer_sphere(500)
+        index = particles.spatial_index()
+        radius = 0.2 | nbody_system.length
+        distances_squared = particles.distances_squared(particles)
+        i, j = index.within(radius)
+        expected = (distances_squared <= radius**2)
+        expected[numpy.diag_indices(500)] = False
+        self.assertEqual(len(i), expected.sum())
+        self.assertTrue(expected[i, j].all())
+
+        i, j = index.pairs_within(radius)
+        self.assertEqual(len(i), expected.sum() // 2)
+        self.assertTrue((i < j).all())
+
+        particles.x += 1 | nbody_system.length
+        self.assertFalse(index is particles.spatial_index())
+        index = particles.spatial_index()
+        particles.add_particle(Particle(position=[0, 0, 0] | nbody_system.length))
+        self.assertFalse(index is particles.spatial_index())
+        self.assertEqual(len(particles.spatial_index()), 501)
+
+    def test21(self):
+        print "Test connected_components"
+        particles = Particles(7)
+        particles.position = [[0, 0, 0], [0.5, 0, 0], [1.0, 0, 0], [5, 0, 0], [5, 0.9, 0], [10, 0, 0], [5, 1.8, 0]] | units.m
+        components = particles.connected_components(threshold=1 | units.m)
+        self.assertEqual([len(x) for x in components], [3, 1, 3])
+        self.assertEqual(sorted(components[0].key), sorted(particles[[3, 4, 6]].key))
+        self.assertEqual(components[1].key, particles[[5]].key)
+        self.assertEqual(sorted(components[2].key), sorted(particles[:3].key))
+        self.assertEqual(len(particles.connected_components(threshold=0.5 | units.m)), 7)
+        self.assertEqual(len(particles.connected_components(threshold=0.6 | units.m)), 5)
+
+        numpy.random.seed(123)
+        particles = new_plummer_sphere(300)
+        components = particles.connected_components(threshold=0.1 | nbody_system.length)
+        def distance(p, q):
+            return (((p.x-q.x)**2+(p.y-q.y)**2+(p.z-q.z)**2)**0.5)
+        expected = particles.connected_components(threshold=0.1 | nbody_system.length, distfunc=distance)
+        self.assertEqual([sorted(x.key) for x in components], [sorted(x.key) for x in expected])
+
+    def test22(self):
+        print "Test find_closest_particle_to"
+        numpy.random.seed(123)
+        particles = new_plummer_sphere(100)
+        points = [[0, 0, 0], [0.1, -0.5, 1.0], [10.0, 10.0, 10.0]] | nbody_system.length
+        expected = [particles[(particles.position - x).lengths().argmin()] for x in points]
+        for x, particle in zip(points, expected):
+            self.assertEqual(particles.find_closest_particle_to(x[0], x[1], x[2]), particle)
+        # a single point does not build the index, but does use a cached one
+        self.assertFalse("spatial_index" in particles._private.cached_results.results)
+        closest = particles.find_closest_particle_to(points[:,0], points[:,1], points[:,2])
+        self.assertEqual(list(closest.key), [x.key for x in expected])
+        self.assertTrue("spatial_index" in particles._private.cached_results.results)
+        for x, particle in zip(points, expected):
+            self.assertEqual(particles.find_closest_particle_to(x[0], x[1], x[2]), particle)
+
+    def test23(self):
+        print "Test minimum_spanning_tree_length against Kruskal on the full graph"
+        from amuse.ext.basicgraph import Graph, MinimumSpanningTree
+        numpy.random.seed(123)
+        particles = new_plummer_sphere(60)
+        particles[10:20].position = particles[0].position # coincident points
+        graph = Graph()
+        for i in range(len(particles)):
+            for j in range(i + 1, len(particles)):
+                graph.add_edge(i, j, (particles[i].position - particles[j].position).length().number)
+        expected = sum([edge[0] for edge in MinimumSpanningTree(graph)])
+        self.assertAlmostRelativeEquals(particles.minimum_spanning_tree_length(), expected | nbody_system.length, 12)
+
+        numpy.random.seed(123)
+        particles = new_plummer_sphere(60)
+        def distfunc(p, q):
+            return (((p.x-q.x)**2+(p.y-q.y)**2)**0.5).value_in(p.x.unit)
+        self.assertAlmostRelativeEquals(particles.Qparameter(), particles.Qparameter(distfunc=distfunc), 12)
+
+    def test24(self):
+        print "Test mass_segregation_ratio with number_of_processes"
+        numpy.random.seed(123)
+        particles = new_plummer_sphere(200)
+        particles.mass = numpy.random.random(200) | nbody_system.mass
+        random.seed(456)
+        serial = particles.mass_segregation_ratio(number_of_particles=10, number_of_random_sets=20, also_compute_uncertainty=True)
+        random.seed(456)
+        parallel = particles.mass_segregation_ratio(number_of_particles=10, number_of_random_sets=20, also_compute_uncertainty=True,
+            number_of_processes=4)
+        self.assertAlmostRelativeEquals(serial.mass_segregation_ratio, parallel.mass_segregation_ratio, 14)
+        self.assertAlmostRelativeEquals(serial.uncertainty, parallel.uncertainty, 14)
+
 
 class TestParticlesDomainAttributes(amusetest.TestCase):
     
@@ -16,6 +16,7 @@ from amuse.units import quantities
 from amuse.units import constants
 from amuse.units import nbody_system
 from amuse.units.core import unit_with_specific_dtype
+from amuse.units.core import IncompatibleUnitsException
 from amuse import datamodel
 from amuse.datamodel import incode_storage
 from amuse.datamodel import memory_storage
@@ -615,6 +616,53 @@ class TestParticlesSubset(amusetest.TestCase):
             particles[0].xy(),
             15 | units.m*units.m
         )
+    
+    def test20(self):
+        particles = datamodel.Particles(keys = [10,11,12,13])
+        particles.mass = [10.0, 20.0, 30.0, 40.0] | units.kg
+        particles.name = ["a", "b", "c", "d"]
+        
+        calls = []
+        def heavy(mass):
+            calls.append(mass)
+            return mass > 25.0 | units.kg
+        subset = particles.select(heavy, ["mass"])
+        self.assertEquals(subset.key, [12, 13])
+        self.assertEquals(len(calls), 1)
+        
+        subset = particles.select(lambda m, n : m > 15.0 | units.kg and n != "c", ["mass", "name"])
+        self.assertEquals(subset.key, [11, 13])
+        
+        subset = particles.select(lambda n : n in ("a", "d"), ["name"])
+        self.assertEquals(subset.key, [10, 13])
+        
+        subset = particles.select(lambda n : n == "b", ["name"])
+        self.assertEquals(subset.key, [11])
+        
+        subset = particles[:0].select(lambda m : m > 0 | units.kg, ["mass"])
+        self.assertEquals(len(subset), 0)
+    
+    def test21(self):
+        particles = datamodel.Particles(keys = [10,11,12,13])
+        particles.mass = [10.0, 20.0, 30.0, 40.0] | units.kg
+        particles.radius = [3.0, 2.5, 2.0, 1.0] | units.m
+        particles.number = [1, 2, 3, 4]
+        mass = datamodel.AttributeReference("mass")
+        radius = datamodel.AttributeReference("radius")
+        number = datamodel.AttributeReference("number")
+        
+        self.assertEquals(particles.where(mass > 15000 | units.g).key, [11, 12, 13])
+        self.assertEquals(particles.where(mass > 15.0 | units.kg, radius >= 200 | units.cm).key, [11, 12])
+        self.assertEquals(particles.where((mass < 15.0 | units.kg) | (number == 4)).key, [10, 13])
+        self.assertEquals(particles.where(~(number > 2)).key, [10, 11])
+        self.assertEquals(particles.where(number != 3, number <= 3).key, [10, 11])
+        self.assertEquals(particles.where().key, [10, 11, 12, 13])
+        self.assertEquals(particles[1:].where(mass < 35 | units.kg).key, [11, 12])
+        
+        particles.other_radius = [1.0, 3.0, 1.0, 3.0] | units.m
+        self.assertEquals(particles.where(radius > datamodel.AttributeReference("other_radius")).key, [10, 12])
+        self.assertRaises(IncompatibleUnitsException, particles.where, mass > 1 | units.m)
+        
 class TestParticlesChannel(amusetest.TestCase):
 
     def test1(self):
@@ -936,6 +984,33 @@ class TestParticlesChannel(amusetest.TestCase):
 
         self.assertEquals(particles2.vx_by_another_name,[12,10] | units.m/units.s)
 
+    def test17(self):
+        particles1 = datamodel.Particles(keys=[10,11,12,13])
+        other = datamodel.Particles(keys=[20])
+        particles1.child1 = [particles1[1], particles1[3], None, other[0]]
+        particles1.child2 = [None, particles1[0], particles1[0], None]
+
+        particles2 = datamodel.Particles(keys=[12,11,10])
+
+        channel = particles1.new_channel_to(particles2)
+        channel.copy_attributes(["child1", "child2"])
+
+        self.assertEquals(particles2[2].child1.key, 11)
+        self.assertTrue(particles2[2].child1.get_containing_set() is particles2)
+        self.assertEquals(particles2[1].child1.key, 13)
+        self.assertTrue(particles2[1].child1.get_containing_set() is particles2)
+        self.assertEquals(particles2[0].child1, None)
+        self.assertEquals(particles2[2].child2, None)
+        self.assertTrue(particles2[1].child2 == particles2[2])
+        self.assertTrue(particles2[0].child2 == particles2[2])
+
+        particles1[0].child1 = other[0]
+        particles1[1].child1 = other
+        channel.copy_attributes(["child1"])
+        self.assertTrue(particles2[2].child1.get_containing_set() is other)
+        self.assertTrue(particles2[1].child1 is other)
+        self.assertEquals(particles2[0].child1, None)
+
 
 class TestParticlesSuperset(amusetest.TestCase):
 
@@ -1126,6 +1201,31 @@ class TestParticlesSuperset(amusetest.TestCase):
         self.assertEquals(superset[4].name, '1234')
         self.assertEquals(superset.name[4], '1234')
 
+    def test15(self):
+        particles1 = datamodel.Particles(2)
+        particles1.mass = [1,2] | units.kg
+        particles2 = datamodel.Particles(1)
+        particles2.mass = 3000 | units.g
+        superset = particles1  | particles2
+        self.assertEquals(superset.mass, [1,2,3] | units.kg)
+        self.assertEquals(superset[[2,0]].mass, [3,1] | units.kg)
+        indices_in_sets = superset._get_indices_in_sets()
+        self.assertTrue(superset._get_indices_in_sets() is indices_in_sets)
+
+        particles2.add_particle(datamodel.Particle(mass = 4 | units.kg))
+        self.assertFalse(superset._get_indices_in_sets() is indices_in_sets)
+        self.assertEquals(superset.mass, [1,2,3,4] | units.kg)
+        particles1.remove_particle(particles1[0])
+        self.assertEquals(superset.mass, [2,3,4] | units.kg)
+
+        superset.mass = [5,6,7] | units.kg
+        self.assertEquals(particles1.mass, [5] | units.kg)
+        self.assertEquals(particles2.mass, [6,7] | units.kg)
+        superset[1:].mass = 8 | units.kg
+        self.assertEquals(superset.mass, [5,8,8] | units.kg)
+        superset.position = [1,2,3] | units.m
+        self.assertEquals(particles2.position, [[1,2,3],[1,2,3]] | units.m)
+
 
 class TestParticlesWithFilteredAttributes(amusetest.TestCase):
 
@@ -2666,6 +2766,58 @@ class TestParticlesWithChildren(amusetest.TestCase):
         self.assertAlmostRelativeEquals(copy_of_parent.child1.mass,1 | units.kg)
         self.assertAlmostRelativeEquals(copy_of_parent.child2.mass,2 | units.kg)
 
+    def test10(self):
+        particles = datamodel.Particles(keys = [1, 2, 3, 4, 5, 6])
+        particles[1].parent = particles[0]
+        particles[2].parent = particles[1]
+        particles[3].parent = particles[0]
+        particles[4].parent = particles[3]
+        
+        self.assertEquals(particles[0].children().key, [2, 4])
+        self.assertEquals(particles[0].descendents().key, [2, 3, 4, 5])
+        self.assertEquals(particles[3].descendents().key, [5])
+        self.assertEquals(len(particles[5].children()), 0)
+        self.assertEquals(len(particles[5].descendents()), 0)
+        self.assertTrue(particles._children_index() is particles._children_index())
+        
+        particles[5].parent = particles[3]
+        self.assertEquals(particles[3].children().key, [5, 6])
+        self.assertEquals(particles[0].descendents().key, [2, 3, 4, 5, 6])
+        
+        particles.remove_particle(particles[1])
+        self.assertEquals(particles[0].children().key, [4])
+        self.assertEquals(particles[0].descendents().key, [4, 5, 6])
+        
+        new_particle = particles.add_particle(datamodel.Particle(key = 7))
+        new_particle.parent = particles[0]
+        self.assertEquals(particles[0].children().key, [4, 7])
+        
+        particles[0].parent = particles[4]
+        self.assertEquals(particles[4].descendents().key, [1, 4, 5, 6, 7])
+    
+    def test11(self):
+        particles = datamodel.Particles(keys = [1, 2, 3, 4])
+        particles[1].parent = particles[0]
+        particles[2].parent = particles[0]
+        index = particles._children_index()
+        
+        # other attributes do not change the index
+        particles.mass = [1, 2, 3, 4] | units.kg
+        particles[3].mass = 5 | units.kg
+        self.assertTrue(particles._children_index() is index)
+        
+        # the parents are set through a subset and by a channel
+        particles[2:].parent = particles[1]
+        self.assertEquals(particles[0].children().key, [2])
+        self.assertEquals(particles[1].children().key, [3, 4])
+        self.assertFalse(particles._children_index() is index)
+        
+        copy = particles.copy()
+        copy[3].parent = copy[2]
+        copy.new_channel_to(particles).copy_attributes(["parent"])
+        self.assertEquals(particles[1].children().key, [3])
+        self.assertEquals(particles[2].children().key, [4])
+
 class TestParticlesSupersetComplex(amusetest.TestCase):
 
     def test1(self):
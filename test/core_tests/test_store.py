@@ -1064,3 +1064,161 @@ class TestStoreHDFV2(_AbstractTestStoreHDF):
 
         os.remove(output_file)
 
+    def test62(self):
+        test_results_path = self.get_path_to_results()
+        output_file = os.path.join(test_results_path, "test62"+self.store_version()+".h5")
+        if os.path.exists(output_file):
+            os.remove(output_file)
+
+        x = Particles(100)
+        x.mass = numpy.arange(100) | units.kg
+        x.position = numpy.arange(300).reshape(100, 3) | units.m
+        x.id = numpy.arange(100)
+
+        io.write_set_to_file(x, output_file,"amuse", version=self.store_version(), 
+            compression = "gzip", compression_opts = 4, shuffle = True, chunks = (16,))
+        
+        processor = self.store_factory()(output_file, open_for_writing = False)
+        attributes = processor.data_group()["0000000001"]["attributes"]
+        self.assertEquals(attributes["mass"].compression, "gzip")
+        self.assertTrue(attributes["mass"].shuffle)
+        self.assertEquals(attributes["mass"].chunks, (16,))
+        self.assertEquals(attributes["x"].chunks, (16,))
+        processor.close()
+        
+        z = io.read_set_from_file(output_file,"amuse", close_file = True)
+        self.assertAlmostRelativeEquals(z.mass, x.mass)
+        self.assertAlmostRelativeEquals(z.position, x.position)
+        self.assertEquals(z.id, x.id)
+
+        os.remove(output_file)
+
+    def test63(self):
+        test_results_path = self.get_path_to_results()
+        output_file = os.path.join(test_results_path, "test63"+self.store_version()+".h5")
+        if os.path.exists(output_file):
+            os.remove(output_file)
+
+        x = Particles(10)
+        x.mass = numpy.arange(10) | units.kg
+        x.x = 0 | units.m
+        for i in range(5):
+            x.x += 1 | units.m
+            io.write_set_to_file(x, output_file,"amuse", version=self.store_version(), 
+                timeseries = True, model_time = i | units.s)
+        
+        y = x.copy()
+        y.add_particle(Particles(1, mass = 20 | units.kg, x = 6 | units.m))
+        io.write_set_to_file(y, output_file,"amuse", version=self.store_version(), 
+            timeseries = True, model_time = 5 | units.s)
+        
+        processor = self.store_factory()(output_file, open_for_writing = False)
+        self.assertEquals(len(processor.data_group()), 2)
+        self.assertEquals(processor.data_group()["0000000001"].attrs["number_of_snapshots"], 5)
+        history = processor.load_attribute_history("x", x[3:5].key)
+        self.assertEquals(history.shape, (6, 2))
+        self.assertAlmostRelativeEquals(history[:,0], [1, 2, 3, 4, 5, 5] | units.m)
+        self.assertRaises(Exception, processor.load_attribute_history, "mass", y[-1:].key, 
+            expected_message = "particle with key {0} not found in a snapshot".format(y[-1].key))
+        processor.close()
+        
+        z = io.read_set_from_file(output_file,"amuse", copy_history = True, close_file = True)
+        snapshots = list(z.history)
+        self.assertEquals(len(snapshots), 6)
+        self.assertEquals(len(snapshots[-1]), 11)
+        self.assertEquals(len(snapshots[-2]), 10)
+        self.assertAlmostRelativeEquals(snapshots[0].x, 1 | units.m)
+        self.assertAlmostRelativeEquals(snapshots[-2].x, 5 | units.m)
+        self.assertAlmostRelativeEquals(snapshots[-2].mass, x.mass)
+        self.assertAlmostRelativeEquals(snapshots[2].collection_attributes.model_time, 2 | units.s)
+        self.assertAlmostRelativeEquals(z.collection_attributes.model_time, 5 | units.s)
+        
+        z = io.read_set_from_file(output_file,"amuse")
+        self.assertAlmostRelativeEquals(z.x, [5] * 10 + [6] | units.m)
+        
+        os.remove(output_file)
+
+    def test64(self):
+        test_results_path = self.get_path_to_results()
+        output_file = os.path.join(test_results_path, "test64"+self.store_version()+".h5")
+        if os.path.exists(output_file):
+            os.remove(output_file)
+
+        x = Particles(keys = numpy.arange(1, 1001))
+        x.mass = numpy.arange(1000) | units.kg
+        x.position = numpy.arange(3000).reshape(1000, 3) | units.m
+        x.name = "star"
+        for i in range(3):
+            io.write_set_to_file(x, output_file,"amuse", version=self.store_version())
+            x.mass += 1000 | units.kg
+        
+        processor = self.store_factory()(output_file, lazy = True, page_size = 100, cache_size = 1600)
+        z = processor.load()
+        self.assertEquals(len(z), 1000)
+        misses = processor.page_cache.misses
+        self.assertAlmostRelativeEquals(z[150:160].mass, numpy.arange(2150, 2160) | units.kg)
+        self.assertEquals(processor.page_cache.misses, misses + 1)
+        self.assertAlmostRelativeEquals(z[155].mass, 2155 | units.kg)
+        self.assertEquals(processor.page_cache.misses, misses + 1)
+        self.assertEquals(processor.page_cache.hits, 1)
+        self.assertAlmostRelativeEquals(z.position, x.position)
+        self.assertAlmostRelativeEquals(z.previous_state().mass, numpy.arange(1000, 2000) | units.kg)
+        self.assertTrue(processor.page_cache.size <= 1600)
+        self.assertEquals(z.name[0], "star")
+        self.assertRaises(Exception, setattr, z, "mass", 1 | units.kg,
+            expected_message = "a set that is loaded lazily is read only, copy the set to change it")
+        processor.close()
+        
+        # the keys (8000 bytes) are larger than the cache, the pages are
+        # evicted but the keys are read only once
+        processor = self.store_factory()(output_file, lazy = True, page_size = 100, cache_size = 800)
+        z = processor.load()
+        self.assertAlmostRelativeEquals(z[150:160].mass, numpy.arange(2150, 2160) | units.kg)
+        self.assertAlmostRelativeEquals(z[950].mass, 2950 | units.kg)
+        misses = processor.page_cache.misses
+        for i in range(150, 160) + range(950, 960):
+            self.assertEquals(z[i].key, i + 1)
+            self.assertTrue(z._private.attribute_storage.has_key_in_store(i + 1))
+        self.assertEquals(z.get_indices_of_keys(numpy.arange(901, 911)), numpy.arange(900, 910))
+        self.assertEquals(processor.page_cache.misses, misses)
+        self.assertAlmostRelativeEquals(z[::100].mass, numpy.arange(2000, 3000, 100) | units.kg)
+        self.assertAlmostRelativeEquals(z[-1].mass, 2999 | units.kg)
+        self.assertTrue(processor.page_cache.size <= 800)
+        processor.close()
+        
+        z = io.read_set_from_file(output_file,"amuse", lazy = True, index_range = (100, 200))
+        self.assertEquals(len(z), 100)
+        self.assertEquals(z.key, numpy.arange(101, 201))
+        self.assertAlmostRelativeEquals(z.mass, numpy.arange(2100, 2200) | units.kg)
+        self.assertEquals(len(list(z.history)), 3)
+        z = io.read_set_from_file(output_file,"amuse", lazy = True, key_range = (996, 2000))
+        self.assertEquals(z.key, [996, 997, 998, 999, 1000])
+        self.assertAlmostRelativeEquals(z.x, numpy.arange(2985, 3000, 3) | units.m)
+        
+        os.remove(output_file)
+
+    def test65(self):
+        test_results_path = self.get_path_to_results()
+        output_file = os.path.join(test_results_path, "test65"+self.store_version()+".h5")
+        if os.path.exists(output_file):
+            os.remove(output_file)
+
+        x = Particles(3)
+        x.mass = [1, 2, 3] | units.kg
+        io.write_set_to_file(x, output_file,"amuse", version=self.store_version())
+        grid = Grid(2, 2)
+        grid.mass = 1 | units.kg
+        io.write_set_to_file(grid, output_file,"amuse", version=self.store_version())
+        x.mass *= 2
+        io.write_set_to_file(x, output_file,"amuse", version=self.store_version())
+        io.write_set_to_file(x.copy(), output_file,"amuse", version=self.store_version())
+        
+        processor = self.store_factory()(output_file, open_for_writing = False)
+        # the grid is skipped
+        history = processor.load_attribute_history("mass", x[1:].key)
+        self.assertAlmostRelativeEquals(history, [[2, 3], [4, 6], [4, 6]] | units.kg)
+        self.assertRaises(Exception, processor.load_attribute_history, "radius", x.key, 
+            expected_message = "attribute radius not found in the set stored in group /data/0000000001")
+        processor.close()
+        
+        os.remove(output_file)
@@ -347,6 +347,74 @@ class TableFormattedTextTests(amusetest.TestCase):
         self.assertAlmostRelativeEquals(p2.a, p.a)
         self.assertAlmostRelativeEquals(p2.b, p.b)
         
+    def test15(self):
+        p = datamodel.Particles(keys = numpy.arange(1, 26))
+        p.a = numpy.arange(25) * 0.5 | units.m
+        p.b = numpy.arange(25) * 2
+        
+        path=os.path.abspath(os.path.join(self.get_path_to_results(), "test15.txt"))
+        io.write_set_to_file(
+            p, 
+            path,
+            "amuse-txt", 
+            attribute_names = ('a', 'b'),
+            maximum_number_of_lines_buffered = 10,
+            key_in_column = 1
+        )
+        instance = text.AmuseText(path)
+        instance.maximum_number_of_lines_buffered = 10
+        chunks = list(instance.load_chunks())
+        
+        self.assertEquals([len(x) for x in chunks], [10, 10, 5])
+        self.assertEquals(chunks[1].key, p.key[10:20])
+        self.assertAlmostRelativeEquals(chunks[1].a, p.a[10:20])
+        self.assertAlmostRelativeEquals(chunks[2].b, p.b[20:])
+        
+        p2 = io.read_set_from_file(path, "amuse-txt", maximum_number_of_lines_buffered = 7)
+        self.assertEquals(p2.key, p.key)
+        self.assertAlmostRelativeEquals(p2.a, p.a)
+        self.assertAlmostRelativeEquals(p2.b, p.b)
+        
+    def test16(self):
+        contents = "#header\n1 2 3\n4 5\n7 8 9\n"
+        instance = text.TableFormattedText("test.txt", StringIO(contents))
+        instance.attribute_names = ['a', 'b', 'c']
+        self.assertRaises(io.IoException, instance.load, 
+            expected_message = "IO exception: Number of values on line '4 5' is 2, expected 3")
+        
+        contents = "1 2 3\n4 5 x\n"
+        instance = text.TableFormattedText("test.txt", StringIO(contents))
+        instance.attribute_names = ['a', 'b', 'c']
+        self.assertRaises(ValueError, instance.load)
+        
+        contents = "1 2 3\n4 5 4.0abc\n"
+        instance = text.TableFormattedText("test.txt", StringIO(contents))
+        instance.attribute_names = ['a', 'b', 'c']
+        self.assertRaises(ValueError, instance.load,
+            expected_message = "invalid literal for float(): 4.0abc")
+        
+        for value in ['3.7', '1e5']:
+            contents = "1 2 3\n4 5 {0}\n".format(value)
+            instance = text.TableFormattedText("test.txt", StringIO(contents))
+            instance.attribute_names = ['a', 'b', 'c']
+            instance.attribute_dtypes = ['int32', 'int32', 'int32']
+            self.assertRaises(ValueError, instance.load,
+                expected_message = "invalid literal for long() with base 10: '{0}'".format(value))
+        
+    def test17(self):
+        contents = "#header\n1 2 True\n\n4 5 false\n#footer1\n#footer2\n"
+        instance = text.TableFormattedText("test.txt", StringIO(contents))
+        instance.attribute_names = ['a', 'b', 'c']
+        instance.attribute_dtypes = ['int32', 'str', 'bool']
+        footer = []
+        instance.read_footer_line = footer.append
+        particles = instance.load()
+        
+        self.assertEquals(particles.a, [1, 4])
+        self.assertEquals(particles.a.dtype, numpy.dtype('int32'))
+        self.assertEquals(particles.b, ['2', '5'])
+        self.assertEquals(particles.c, [True, False])
+        self.assertEquals(footer, ['footer2'])
 
 
 
@@ -106,6 +106,39 @@ class TestUnitConversions(amusetest.TestCase):
         self.assertAlmostRelativeEquals( (s / m).to_array_of_floats(), [1, 1, -1, 0, 1, 0, 0, 0, 0])
         self.assertAlmostRelativeEquals( (kg ** 2/ s).to_array_of_floats(), [1, 1,  0, 2, -1, 0, 0, 0, 0])
         
+    def test16(self):
+        km = named('kilometer','km',1000 * m)
+        self.assertTrue((m / s).canonical_form is (s**-1 * m).canonical_form)
+        self.assertTrue((km / s).canonical_base is (m / s).canonical_base)
+        self.assertFalse((km / s).canonical_form is (m / s).canonical_form)
+        self.assertEqual(km * m, (1000 * m) * m)
+        self.assertFalse(km * m == m ** 2)
+        self.assertTrue(core.simple_product(km, m) is core.simple_product(km, m))
+        self.assertEqual(str(core.simple_product(km, m)), "1000.0 * m**2")
+        self.assertEqual(str(core.simple_quotient(km, s)), "1000.0 * m * s**-1")
+        self.assertEqual(str((2 | km) * (3 | m)), "6 1000.0 * m**2")
+        self.assertRaises(core.IncompatibleUnitsException, (1 | km).as_quantity_in, s)
+        
+    def test17(self):
+        import pickle
+        velocity = pickle.loads(pickle.dumps((m / s)))
+        self.assertEqual(velocity, m / s)
+        self.assertEqual((1 | velocity).value_in(km / s), 0.001)
+    
+    def test18(self):
+        import pickle
+        number_of_forms = len(core.CANONICAL_FORMS)
+        number_of_bases = len(core.CANONICAL_BASES)
+        # (unpickled units are not kept in the tables of unit instances)
+        unit = pickle.loads(pickle.dumps(1234.5 * m ** 17))
+        self.assertTrue(unit == pickle.loads(pickle.dumps(1.2345 * km * m ** 16)))
+        self.assertEqual(len(core.CANONICAL_FORMS), number_of_forms + 1)
+        self.assertEqual(len(core.CANONICAL_BASES), number_of_bases + 1)
+        # the interned forms are removed with the last unit that refers to these
+        del unit
+        self.assertEqual(len(core.CANONICAL_FORMS), number_of_forms)
+        self.assertEqual(len(core.CANONICAL_BASES), number_of_bases)
+        
 
 
 class TestNonNumericUnits(amusetest.TestCase):
@@ -0,0 +1,87 @@
+import numpy
+
+from amuse.test import amusetest
+from amuse.units import nbody_system
+from amuse.units import units
+from amuse.units import constants
+from amuse.community.twobody import interface
+from amuse.ext.kepler_drift import kepler_drift, stumpff_C, stumpff_S
+
+class TestKeplerDrift(amusetest.TestCase):
+
+    def test1(self):
+        z = numpy.concatenate([numpy.linspace(-50.0, 50.0, 101), [0.0, 1.e-8, -1.e-8, 0.099, -0.099, 0.1, -0.1]])
+        c = stumpff_C(z)
+        s = stumpff_S(z)
+        self.assertEquals(c[101], 0.5)
+        self.assertAlmostRelativeEquals(s[101], 1.0 / 6.0, 14)
+        for zi, ci, si in zip(z, c, s):
+            if abs(zi) > 1.e-3:
+                self.assertAlmostRelativeEquals(ci, interface.stumpff_C(zi), 10)
+                self.assertAlmostRelativeEquals(si, interface.stumpff_S(zi), 10)
+
+    def test2(self):
+        numpy.random.seed(123)
+        n = 500
+        mu = numpy.random.uniform(0.5, 2.0, n)
+        position = numpy.random.uniform(-1.0, 1.0, (n, 3))
+        velocity = numpy.random.uniform(-1.0, 1.0, (n, 3)) * 1.5
+        dt = numpy.random.uniform(-2.0, 2.0, n)
+
+        new_position, new_velocity = kepler_drift(mu, position, velocity, dt)
+        self.assertEquals(new_position.shape, (n, 3))
+
+        energy = 0.5 * (velocity**2).sum(axis=1) - mu / numpy.sqrt((position**2).sum(axis=1))
+        self.assertTrue((energy > 0).any())
+        self.assertTrue((energy < 0).any())
+        for i in range(0, n, 10):
+            expected_position, expected_velocity = interface.universal_solver(mu[i], position[i], velocity[i], dt[i])
+            self.assertAlmostRelativeEquals(new_position[i], expected_position, 10)
+            self.assertAlmostRelativeEquals(new_velocity[i], expected_velocity, 10)
+
+    def test3(self):
+        numpy.random.seed(456)
+        n = 100
+        mu = numpy.ones(n)
+        position = numpy.random.uniform(-1.0, 1.0, (n, 3))
+        velocity = numpy.random.uniform(-1.0, 1.0, (n, 3))
+
+        new_position, new_velocity = kepler_drift(mu, position, velocity, 0.7)
+        energy = 0.5 * (velocity**2).sum(axis=1) - mu / numpy.sqrt((position**2).sum(axis=1))
+        new_energy = 0.5 * (new_velocity**2).sum(axis=1) - mu / numpy.sqrt((new_position**2).sum(axis=1))
+        self.assertAlmostRelativeEquals(new_energy, energy, 10)
+        self.assertAlmostRelativeEquals(numpy.cross(new_position, new_velocity), numpy.cross(position, velocity), 10)
+
+        back_position, back_velocity = kepler_drift(mu, new_position, new_velocity, -0.7)
+        self.assertAlmostRelativeEquals(back_position, position, 10)
+        self.assertAlmostRelativeEquals(back_velocity, velocity, 10)
+
+    def test4(self):
+        mu = constants.G * ([1.0, 2.0] | units.MSun)
+        position = [[1.0, 0.0, 0.0], [0.0, 2.0, 0.0]] | units.AU
+        velocity = [[0.0, 30.0, 0.0], [-40.0, 0.0, 0.0]] | units.kms
+
+        new_position, new_velocity = kepler_drift(mu, position, velocity, 0.5 | units.yr)
+        self.assertEquals(new_position.unit, units.AU)
+        self.assertEquals(new_velocity.unit, units.kms)
+
+        converter = nbody_system.nbody_to_si(1.0 | units.MSun, 1.0 | units.AU)
+        nbody_position, nbody_velocity = kepler_drift(
+            converter.to_nbody(mu).number,
+            converter.to_nbody(position).number,
+            converter.to_nbody(velocity).number,
+            converter.to_nbody(0.5 | units.yr).number
+        )
+        self.assertAlmostRelativeEquals(new_position, converter.to_si(nbody_position | nbody_system.length), 10)
+        self.assertAlmostRelativeEquals(new_velocity, converter.to_si(nbody_velocity | nbody_system.speed), 10)
+
+    def test5(self):
+        # the example in the docstring of kepler_drift, the second orbit is
+        # circular with a period of 4 pi
+        position, velocity = kepler_drift(
+            [1.0, 2.0] | nbody_system.length**3 / nbody_system.time**2,
+            [[1.0, 0.0, 0.0], [2.0, 0.0, 0.0]] | nbody_system.length,
+            [[0.0, 1.0, 0.0], [0.0, 1.0, 0.0]] | nbody_system.speed,
+            numpy.pi | nbody_system.time)
+        self.assertAlmostEquals(position, [[-1.0, 0.0, 0.0], [0.0, 2.0, 0.0]] | nbody_system.length, 12)
+        self.assertAlmostEquals(velocity, [[0.0, -1.0, 0.0], [-1.0, 0.0, 0.0]] | nbody_system.speed, 12)
@@ -1,3 +1,5 @@
+import os
+import shutil
 import numpy
 
 from amuse.test import amusetest
@@ -54,3 +56,33 @@ class TestKingModel(amusetest.TestCase):
         self.assertAlmostEqual(particles[:3].position, [[-0.23147381,-0.19421449,-0.01165137],
             [-0.09283025,-0.06444658,-0.07922396], [-0.44189946,0.23786357,0.39115629]] | units.AU)
     
+    
+    def test6(self):
+        print "Testing the cache of the King model profile."
+        from amuse.ic import kingmodel
+        directory = os.path.join(self.get_path_to_results(), "king_model_cache")
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        
+        numpy.random.seed(345672)
+        particles1 = new_king_model(500, 5.5, cache_directory = directory)
+        self.assertEquals(len(os.listdir(directory)), 1)
+        
+        kingmodel._profiles.clear()
+        numpy.random.seed(345672)
+        particles2 = new_king_model(500, 5.5, cache_directory = directory)
+        self.assertEquals(particles1.position, particles2.position)
+        self.assertEquals(particles1.velocity, particles2.velocity)
+        
+        kingmodel._profiles.clear()
+        numpy.random.seed(345672)
+        particles3 = new_king_model(500, 5.5)
+        self.assertEquals(particles1.position, particles3.position)
+        self.assertEquals(particles1.velocity, particles3.velocity)
+    
+    def test7(self):
+        print "Testing the speeds of a large King model realisation."
+        particles = new_king_model(100000, 3.0)
+        self.assertEquals(len(particles), 100000)
+        self.assertAlmostRelativeEquals(particles.kinetic_energy(), 0.25 | nbody_system.energy, 1)
+        self.assertAlmostEqual(particles.center_of_mass(), [0,0,0] | nbody_system.length)
@@ -147,11 +147,46 @@ class TestSinkParticles(TestCase):
         self.assertEqual(particles.total_momentum(), copy.total_momentum()) # momentum is conserved
         self.assertEqual(particles.total_angular_momentum()+sinks.angular_momentum.sum(axis=0), copy.total_angular_momentum()) # angular_momentum is conserved
 
+    def test6(self):
+        print "Testing SinkParticles accrete, many sources and overlapping sinks"
+        numpy.random.seed(123)
+        particles = Particles(2000)
+        particles.mass = numpy.random.uniform(1, 2, 2000) | units.MSun
+        particles.position = numpy.random.uniform(-10, 10, (2000, 3)) | units.parsec
+        particles.velocity = numpy.random.uniform(-1, 1, (2000, 3)) | units.km/units.s
+        particles.radius = 0 | units.parsec
+        copy = particles.copy()
+
+        sink_radius = numpy.random.uniform(0.5, 3.0, 20) | units.parsec
+        sinks = SinkParticles(particles[:20], sink_radius=sink_radius, looping_over=self.looping_over)
+        sink_mass = sinks.mass.copy()
+
+        distances_squared = (copy[20:].position.reshape((-1,1,3)) - copy[:20].position.reshape((1,-1,3))).lengths_squared()
+        is_within = distances_squared < sink_radius**2
+        attraction = numpy.where(is_within, copy[:20].mass / distances_squared, 0 | units.MSun / units.parsec**2)
+        is_accreted = is_within.any(axis=1)
+        strongest_sink = attraction.argmax(axis=1)[is_accreted]
+
+        accreted = sinks.accrete(particles)
+        self.assertEqual(len(accreted), is_accreted.sum())
+        self.assertEqual(len(particles), 2000 - is_accreted.sum())
+        self.assertEqual(set(accreted.key), set(copy[20:][is_accreted].key))
+        expected_mass = sink_mass + (numpy.bincount(strongest_sink, weights=copy[20:][is_accreted].mass.value_in(units.MSun), minlength=20) | units.MSun)
+        self.assertAlmostRelativeEqual(sinks.mass, expected_mass, 12)
+        self.assertAlmostRelativeEqual(particles.total_mass(), copy.total_mass(), 12)
+        self.assertAlmostRelativeEqual(particles.center_of_mass(), copy.center_of_mass(), 12)
+        self.assertAlmostRelativeEqual(particles.total_momentum(), copy.total_momentum(), 12)
+        self.assertAlmostRelativeEqual(particles.total_angular_momentum()+sinks.angular_momentum.sum(axis=0), copy.total_angular_momentum(), 12)
+
 
 class TestSinkParticlesLoopingOverSources(TestSinkParticles):
 
     looping_over="sources"
 
+class TestSinkParticlesLoopingOverCells(TestSinkParticles):
+
+    looping_over="cells"
+
 class TestNewSinkParticles(TestCase):
 
     looping_over="sinks"
@@ -292,6 +327,10 @@ class TestNewSinkParticlesLoopingOverSources(TestNewSinkParticles):
 
     looping_over="sources"
 
+class TestNewSinkParticlesLoopingOverCells(TestNewSinkParticles):
+
+    looping_over="cells"
+
 
 class TestNonSphericalSinkParticles(TestCase):
 
@@ -342,6 +381,16 @@ class TestNonSphericalSinkParticles(TestCase):
         self.assertEqual(accreted.z.max(), 2.5|units.RSun)
         self.assertIsSubvector([2, 2, 1]|units.RSun, particles.position)
 
+    def test4(self):
+        """ Test that cells and sources accretion are refused for non spherical sinks """
+        particles = self.create_particle_grid()
+        sink_particles = Particles(1, mass=10.|units.MSun, radius=0.|units.RSun, position=[[1., 1., 1.]]|units.RSun)
+        for looping_over in ["cells", "sources"]:
+            sinks = new_sink_particles(sink_particles, shapes=sink.Disc(*[5., 1.]|units.RSun), looping_over=looping_over)
+            self.assertRaises(AmuseException, sinks.accrete, particles,
+                expected_message = "Looping over {0} not supported for non spherical sink particles".format(looping_over))
+        self.assertEqual(len(particles), 2000)
+
     def create_particle_grid(self):
         particles = Particles(2000)
         particles.radius = 1. | units.RSun
@@ -585,8 +585,8 @@ class TestAccelerationFunctions(TestStellarWind):
         print "radii", radii
 
         self.assertAlmostEquals(radii[0], 312. | units.RSun)
-        self.assertAlmostEquals(radii[1], 22644.6086263 | units.RSun)
-        self.assertAlmostEquals(radii[2], 90704.1183516 | units.RSun)
+        self.assertAlmostEquals(radii[1], 22644.6086596 | units.RSun)
+        self.assertAlmostEquals(radii[2], 90704.118351 | units.RSun)
 
         return
 
@@ -613,6 +613,51 @@ class TestAccelerationFunctions(TestStellarWind):
         radius = func.radius_from_number(x, r_max, star)
         self.assertAlmostEquals(radius,  10.6029030808 | units.RSun)
 
+    def test_wind_profile(self):
+        func = stellar_wind.RSquaredAcceleration()
+        star = self.create_star()
+
+        profile = func.wind_profile(star)
+        self.assertTrue(func.wind_profile(star) is profile)
+        self.assertTrue(10. in profile.radius)
+
+        times = [0., 0.5, 1., 10.] | units.yr
+        radii = func.radius_from_time(times, star)
+        self.assertEqual(radii[0], star.radius)
+        x = numpy.linspace(0., 1., 5)
+        numbers = func.radius_from_number(x, radii[2], star)
+        self.assertAlmostRelativeEquals(numbers[-1], radii[2], 12)
+        self.assertAlmostRelativeEquals(
+            profile.time_from_radius(radii.value_in(units.RSun)),
+            times.value_in(units.yr), 12)
+
+        star.terminal_wind_velocity = 24 | units.kms
+        self.assertFalse(func.wind_profile(star) is profile)
+        self.assertTrue((func.radius_from_time(times, star)[1:] > radii[1:]).all())
+
+    def test_radius_for_stars(self):
+        func = stellar_wind.BetaLawAcceleration()
+        stars = Particles(3)
+        stars.radius = [2., 10., 30.] | units.RSun
+        stars.initial_wind_velocity = [4., 100., 10.] | units.kms
+        stars.terminal_wind_velocity = [12., 1000., 40.] | units.kms
+
+        times = [0.1, 0.01, 1.] | units.yr
+        radii = func.radius_from_time_for_stars(times, stars)
+        for t, r, star in zip(times, radii, stars):
+            self.assertAlmostRelativeEquals(r, func.radius_from_time(t, star), 10)
+
+        x = numpy.linspace(0., 1., 9)
+        indices = numpy.array([0, 0, 0, 1, 1, 1, 2, 2, 2])
+        new_radii = func.radius_from_number_for_stars(x, radii, stars, indices)
+        velocities = func.velocity_from_radius_for_stars(new_radii, stars, indices)
+        for i, star in enumerate(stars):
+            selection = indices == i
+            self.assertAlmostRelativeEquals(new_radii[selection],
+                func.radius_from_number(x[selection], radii[i], star), 10)
+            self.assertEqual(velocities[selection],
+                func.velocity_from_radius(new_radii[selection], star))
+
 
 class TestAcceleratingWind(TestStellarWind):
     def test_wind_creation_constant(self):
@@ -678,6 +723,44 @@ class TestAcceleratingWind(TestStellarWind):
         self.assertLessEqual(velocities.max(), star.terminal_wind_velocity)
         self.assertAlmostEqual(velocities.mean(), 0.103550548126 | units.kms)
 
+    def test_wind_creation_many_stars(self):
+        numpy.random.seed(123457)
+        stars = self.create_star(3)
+        stars.x = [-10, 0, 10] | units.parsec
+        stars.terminal_wind_velocity = [500, 1000, 2000] | units.ms
+        star_wind = stellar_wind.new_stellar_wind(
+            3e-9 | units.MSun,
+            mode="accelerate",
+            acceleration_function="rsquared",
+            r_out_ratio=5,
+            critical_timestep=1 | units.day,
+            tag_gas_source=True,
+            )
+        stars = star_wind.particles.add_particles(stars)
+        stars[2].wind_release_time = 9.5 | units.day
+
+        star_wind.evolve_model(10 | units.day)
+        wind = star_wind.create_wind_particles()
+        self.assertEqual(len(wind), 27)
+        self.assertAlmostRelativeEquals(stars.wind_release_time,
+                                        [10, 10, 10] | units.day)
+
+        acc_function = star_wind.acc_function
+        for i, star in enumerate(stars):
+            star_gas = wind[wind.source == star.key]
+            self.assertEqual(len(star_gas), 9)
+            radii = (star_gas.position - star.position).lengths()
+            velocities = (star_gas.velocity - star.velocity).lengths()
+            self.assertGreaterEqual(radii.min(), star.radius)
+            if i == 2:
+                self.assertLessEqual(radii.max(), star.radius
+                    + 0.5 * star.initial_wind_velocity * (1 | units.day))
+                self.assertAlmostRelativeEquals(velocities,
+                    star.initial_wind_velocity, 6)
+            else:
+                self.assertAlmostRelativeEquals(velocities,
+                    acc_function.velocity_from_radius(radii, star), 6)
+
     def test_acceleration(self):
         star = self.create_star()
         star.position = [1, 1, 1] | units.RSun
@@ -26,11 +26,22 @@ import time
 import sys
 import signal
 
+from StringIO import StringIO
+
 from optparse import OptionParser
 
 from mpi4py import MPI
 
 from amuse.datamodel import ParticlesSuperset
+from amuse.datamodel import AttributeReference
+from amuse.datamodel import new_regular_grid
+from amuse.ext.sink import new_sink_particles
+from amuse.ext.kepler_drift import kepler_drift
+from amuse.community.twobody.interface import universal_solver
+from amuse.ext.stellar_wind import new_stellar_wind
+from amuse.couple.multiples import find_binaries
+from amuse.datamodel.memory_storage import InMemoryAttributeStorageUseAmortizedGrowth
+from amuse.units import core as units_core
 class TimeoutException(Exception):
     pass
     
@@ -194,6 +205,13 @@ class RunSpeedTests(object):
         new_plummer_model(self.total_number_of_points)
         self.end_measurement()
         
+    def speed_make_king_model(self):
+        """king model"""
+        new_king_model(10, 6.0)
+        self.start_measurement()
+        new_king_model(self.total_number_of_points, 6.0)
+        self.end_measurement()
+        
     def speed_make_salpeter_mass_distribution(self):
         """plummer sphere"""
         self.start_measurement()
@@ -230,8 +248,39 @@ class RunSpeedTests(object):
         self.start_measurement()
         input.potential_energy(G=nbody_system.G)
         self.end_measurement()
-        
-        
+
+    def speed_calculate_potential_energy_direct_blocked(self):
+
+        self.is_slow_test()
+        input = new_plummer_model(self.total_number_of_points)
+        self.start_measurement()
+        input.potential_energy(G=nbody_system.G, method="direct-blocked")
+        self.end_measurement()
+
+    def speed_calculate_potential_energy_tree(self):
+        input = new_plummer_model(self.total_number_of_points)
+        self.start_measurement()
+        input.potential_energy(G=nbody_system.G, method="tree")
+        self.end_measurement()
+
+    def speed_find_nearest_neighbours(self):
+        input = new_plummer_model(self.total_number_of_points)
+        self.start_measurement()
+        input.nearest_neighbour()
+        self.end_measurement()
+
+    def speed_find_connected_components(self):
+        input = new_plummer_model(self.total_number_of_points)
+        self.start_measurement()
+        input.connected_components(threshold=0.01 | nbody_system.length)
+        self.end_measurement()
+
+    def speed_calculate_minimum_spanning_tree_length(self):
+        input = new_plummer_model(self.total_number_of_points)
+        self.start_measurement()
+        input.minimum_spanning_tree_length()
+        self.end_measurement()
+
     def speed_calculate_kinetic_energy(self):
         input = new_plummer_model(self.total_number_of_points)
         self.start_measurement()
@@ -537,6 +586,121 @@ class RunSpeedTests(object):
         self.start_measurement()
         particles_selected = particles_all[particles_all.position.lengths() > 0.5 | nbody_system.length]
         self.end_measurement()
+    
+    def speed_select(self):
+        particles_all = new_plummer_model(self.total_number_of_points)
+        
+        self.start_measurement()
+        particles_selected = particles_all.select(lambda x: x > 0.5 | nbody_system.length, ["x"])
+        self.end_measurement()
+    
+    def speed_where(self):
+        particles_all = new_plummer_model(self.total_number_of_points)
+        x = AttributeReference("x")
+        
+        self.start_measurement()
+        particles_selected = particles_all.where(x > 0.5 | nbody_system.length)
+        self.end_measurement()
+    
+    def speed_children_of_particles(self):
+        self.is_single_particle_test()
+        
+        particles = Particles(self.total_number_of_points)
+        parents = particles[:self.total_number_of_points // 10]
+        for i, x in enumerate(particles[len(parents):]):
+            x.parent = parents[i % len(parents)]
+        
+        self.start_measurement()
+        for x in parents:
+            x.children()
+        self.end_measurement()
+
+    def speed_sample_grid_at_points(self):
+        grid = new_regular_grid((32,32,32), [1.0, 1.0, 1.0] | nbody_system.length)
+        grid.rho = grid.x.value_in(nbody_system.length) | nbody_system.density
+        particles = new_plummer_model(self.total_number_of_points)
+        
+        self.start_measurement()
+        samples = grid.samplePoints(particles.position, method="linear")
+        samples.rho
+        self.end_measurement()
+
+    def speed_copy_links_with_channel(self):
+        particles = Particles(self.total_number_of_points)
+        particles.child1 = list(particles.random_sample(self.total_number_of_points))
+        copy = Particles(keys = particles.key)
+        channel = particles.new_channel_to(copy)
+        channel.copy_attributes(["child1"])
+        
+        self.start_measurement()
+        channel.copy_attributes(["child1"])
+        self.end_measurement()
+
+    def speed_sink_accretion(self):
+        gas = new_plummer_model(self.total_number_of_points)
+        sinks = new_sink_particles(
+            gas[:self.total_number_of_points // 1000 + 1].copy(),
+            sink_radius = 0.01 | nbody_system.length,
+            angular_momentum = [0, 0, 0] | nbody_system.mass * nbody_system.length**2 / nbody_system.time,
+            looping_over = "cells"
+        )
+        
+        self.start_measurement()
+        sinks.accrete(gas)
+        self.end_measurement()
+
+    def speed_kepler_drift_scalar(self):
+        numpy.random.seed(123)
+        position = numpy.random.uniform(-1.0, 1.0, (self.total_number_of_points, 3))
+        velocity = numpy.random.uniform(-1.0, 1.0, (self.total_number_of_points, 3))
+        
+        self.is_slow_test()
+        
+        self.start_measurement()
+        for x, v in zip(position, velocity):
+            universal_solver(1.0, x, v, 1.0)
+        self.end_measurement()
+
+    def speed_kepler_drift_vectorized(self):
+        numpy.random.seed(123)
+        position = numpy.random.uniform(-1.0, 1.0, (self.total_number_of_points, 3))
+        velocity = numpy.random.uniform(-1.0, 1.0, (self.total_number_of_points, 3))
+        
+        self.start_measurement()
+        kepler_drift(1.0, position, velocity, 1.0)
+        self.end_measurement()
+
+    def speed_find_binaries(self):
+        particles = new_plummer_model(self.total_number_of_points)
+        particles.id = numpy.arange(len(particles))
+        
+        self.start_measurement()
+        find_binaries(particles, nbody_system.G)
+        self.end_measurement()
+
+    def speed_accelerating_wind(self):
+        numpy.random.seed(123)
+        number_of_stars = self.total_number_of_points // 100 + 1
+        stars = Particles(number_of_stars)
+        stars.radius = numpy.random.uniform(5.0, 20.0, number_of_stars) | units.RSun
+        stars.position = numpy.random.uniform(-1.0, 1.0, (number_of_stars, 3)) | units.parsec
+        stars.velocity = [0, 0, 0] | units.kms
+        stars.temperature = 30000 | units.K
+        stars.wind_mass_loss_rate = 1e-6 | units.MSun / units.yr
+        stars.initial_wind_velocity = 100 | units.kms
+        stars.terminal_wind_velocity = 1000 | units.kms
+        wind = new_stellar_wind(
+            1e-6 | units.MSun / self.total_number_of_points,
+            mode = "accelerate",
+            acceleration_function = "rsquared",
+            r_out_ratio = 5
+        )
+        wind.particles.add_particles(stars)
+        wind.evolve_model(0.01 | units.yr)
+        
+        self.start_measurement()
+        wind.create_wind_particles()
+        self.end_measurement()
 
     def speed_iterate_over_quantity(self):
         
@@ -564,6 +728,83 @@ class RunSpeedTests(object):
             particles.add_particles(x)
         self.end_measurement()
         
+    def speed_add_and_remove_single_particles(self):
+        self.is_single_particle_test()
+        self.add_and_remove_single_particles(Particles())
+        
+    def speed_add_and_remove_single_particles_amortized_growth(self):
+        self.is_single_particle_test()
+        self.add_and_remove_single_particles(Particles(storage = InMemoryAttributeStorageUseAmortizedGrowth()))
+        
+    def add_and_remove_single_particles(self, particles):
+        particles_to_add = new_plummer_model(self.total_number_of_points)
+        particles_to_add = [x.as_set().copy() for x in particles_to_add]
+        self.start_measurement()
+        for x in particles_to_add:
+            particles.add_particles(x)
+        for x in particles_to_add:
+            particles.remove_particles(x)
+        self.end_measurement()
+        
+    def speed_scalar_quantity_arithmetic(self):
+        self.scalar_quantity_arithmetic()
+        
+    def speed_scalar_quantity_arithmetic_without_unit_tables(self):
+        maximum_number_of_products = units_core.MAXIMUM_NUMBER_OF_PRODUCTS
+        units_core.MAXIMUM_NUMBER_OF_PRODUCTS = 0
+        units_core.PRODUCTS.clear()
+        units_core.QUOTIENTS.clear()
+        try:
+            self.scalar_quantity_arithmetic()
+        finally:
+            units_core.MAXIMUM_NUMBER_OF_PRODUCTS = maximum_number_of_products
+        
+    def scalar_quantity_arithmetic(self):
+        mass = 1.0 | units.MSun
+        length = 2.0 | units.AU
+        other_length = 3.0 | units.km
+        time = 4.0 | units.yr
+        self.start_measurement()
+        for x in range(self.total_number_of_points):
+            velocity = length / time
+            acceleration = velocity / time
+            force = mass * acceleration
+            energy = force * (length + other_length)
+            energy.value_in(units.J)
+            length < other_length
+        self.end_measurement()
+        
+    def speed_write_text_file(self):
+        particles = new_plummer_model(self.total_number_of_points)
+        stream = StringIO()
+        self.start_measurement()
+        write_set_to_file(particles, None, "amuse-txt", stream = stream, key_in_column = 0)
+        self.end_measurement()
+        
+    def speed_read_text_file(self):
+        particles = new_plummer_model(self.total_number_of_points)
+        stream = StringIO()
+        write_set_to_file(particles, None, "amuse-txt", stream = stream, key_in_column = 0)
+        stream.seek(0)
+        self.start_measurement()
+        read_set_from_file(None, "amuse-txt", stream = stream, key_in_column = 0)
+        self.end_measurement()
+        
+    def speed_write_gadget_file(self):
+        particles = new_plummer_model(self.total_number_of_points)
+        self.start_measurement()
+        write_set_to_file((Particles(), particles), "speed_report.gadget", "gadget", overwrite_file = True)
+        self.end_measurement()
+        os.remove("speed_report.gadget")
+        
+    def speed_read_positions_from_gadget_file(self):
+        particles = new_plummer_model(self.total_number_of_points)
+        write_set_to_file((Particles(), particles), "speed_report.gadget", "gadget", overwrite_file = True)
+        self.start_measurement()
+        read_set_from_file("speed_report.gadget", "gadget", blocks_to_load = ('position',))
+        self.end_measurement()
+        os.remove("speed_report.gadget")
+        
 def new_option_parser():
     result = OptionParser()
     result.add_option(
@@ -6,6 +6,8 @@ import subprocess
 import os
 import numpy
 import time
+import socket
+import threading
 
 from amuse import datamodel
 from amuse.rfi.tools import create_c
@@ -138,8 +140,8 @@ int reset()
 
 class TestCode(CodeInterface):
     
-    def __init__(self, exefile):
-        CodeInterface.__init__(self, exefile)
+    def __init__(self, exefile, **options):
+        CodeInterface.__init__(self, exefile, **options)
          
          
     @legacy_function
@@ -272,6 +274,7 @@ class RunSpeedTests(object):
     
     def __init__(self):
         self.number_of_gridpoints = [8]            
+        self.channel_types = ['mpi', 'sockets', 'shared_memory']
     
     def build_worker(self):
         
@@ -304,14 +307,15 @@ class RunSpeedTests(object):
         self.build_worker()
         
         
-        for number_of_points_in_one_dimension in self.number_of_gridpoints:
-            result = self.run(number_of_points_in_one_dimension)
-    
-            print ', '.join(map(lambda x: str(x), result))
+        for channel_type in self.channel_types:
+            for number_of_points_in_one_dimension in self.number_of_gridpoints:
+                result = self.run(number_of_points_in_one_dimension, channel_type)
+        
+                print channel_type + ', ' + ', '.join(map(lambda x: str(x), result))
                 
-    def run(self, number_of_points_in_one_dimension):
+    def run(self, number_of_points_in_one_dimension, channel_type = 'mpi'):
     
-        instance = TestCode(self.exefile)
+        instance = TestCode(self.exefile, channel_type = channel_type)
 
         total_number_of_points = number_of_points_in_one_dimension ** 3
         number_of_bytes = 4 + 8 + 8 + 8
@@ -342,13 +346,124 @@ class RunSpeedTests(object):
         return dt, total_number_of_points, mbytes_per_second, t3-t2, (dt - (t3-t2)) / (t3-t2)     
         
         
+class RunSplitMessageSpeedTests(RunSpeedTests):
+    """
+    Measures the time to set and get data with messages that are
+    split in blocks (see max_message_length), for different numbers
+    of blocks in flight (a window of 1 sends the blocks one by one)
+    """
+    
+    def __init__(self):
+        RunSpeedTests.__init__(self)
+        self.number_of_gridpoints = [32]
+        self.channel_types = ['sockets']
+        self.max_message_length = 1000
+        self.split_message_windows = [1, 4]
+    
+    def start(self):
+        self.build_worker()
+        
+        for channel_type in self.channel_types:
+            for split_message_window in self.split_message_windows:
+                for number_of_points_in_one_dimension in self.number_of_gridpoints:
+                    result = self.run(number_of_points_in_one_dimension, channel_type, split_message_window)
+                    
+                    print channel_type + ' (split, window ' + str(split_message_window) + '), ' + ', '.join(map(lambda x: str(x), result))
+    
+    def run(self, number_of_points_in_one_dimension, channel_type = 'sockets', split_message_window = 1):
+        instance = TestCode(
+            self.exefile,
+            channel_type = channel_type,
+            max_message_length = self.max_message_length,
+            split_message_window = split_message_window
+        )
+        
+        total_number_of_points = number_of_points_in_one_dimension ** 3
+        indices = numpy.arange(total_number_of_points, dtype='int32')
+        data = numpy.arange(total_number_of_points, dtype='float64')
+        
+        errorcode = instance.set_number_of_points_in_one_dimension(number_of_points_in_one_dimension)
+        if errorcode < 0:
+            raise Exception("Could not allocate memory")
+        
+        t0 = time.time()
+        instance.set_data(indices, data, data, data)
+        t1 = time.time()
+        x, y, z, errorcodes = instance.get_data(indices)
+        t2 = time.time()
+        
+        if not (x == data).all():
+            raise Exception("Data not returned correctly")
+        
+        instance.reset()
+        instance.stop()
+        
+        return t1 - t0, t2 - t1, total_number_of_points
+        
+class RunMessageSpeedTests(object):
+    """
+    Measures the throughput of the socket messages, without a worker
+    on the other side (the messages are send over a socket pair)
+    """
+    
+    def __init__(self):
+        self.number_of_points = [1000]
+        self.number_of_repeats = 3
+    
+    def start(self):
+        for number_of_points in self.number_of_points:
+            result = self.run(number_of_points)
+            
+            print 'sockets (message), ' + ', '.join(map(lambda x: str(x), result))
+    
+    def run(self, number_of_points):
+        sender, receiver = socket.socketpair()
+        
+        indices = numpy.arange(number_of_points, dtype='int32')
+        data = numpy.arange(number_of_points, dtype='float64')
+        total_number_of_bytes = number_of_points * (4 + 8 + 8 + 8)
+        message = channel.SocketMessage(1, 2, number_of_points, {'int32':[indices], 'float64':[data, data, data]})
+        
+        dt = None
+        for i in range(self.number_of_repeats):
+            thread = threading.Thread(target = message.send, args = (sender,))
+            t0 = time.time()
+            thread.start()
+            channel.SocketMessage().receive(receiver)
+            thread.join()
+            t1 = time.time()
+            dt = t1 - t0 if dt is None else min(dt, t1 - t0)
+        
+        sender.close()
+        receiver.close()
+        
+        mbytes_per_second = total_number_of_bytes / dt / (1000.0 * 1000.0)
+        return dt, number_of_points, mbytes_per_second
+        
 def test_speed():
     x = RunSpeedTests()
     x.number_of_gridpoints = [8]
     x.start()
 
+def test_split_message_speed():
+    x = RunSplitMessageSpeedTests()
+    x.number_of_gridpoints = [8]
+    x.max_message_length = 100
+    x.start()
+
+def test_message_speed():
+    x = RunMessageSpeedTests()
+    x.number_of_points = [1000]
+    x.start()
+
 if __name__ == '__main__':
     #channel.MessageChannel.DEBUGGER = channel.MessageChannel.DDD
     x = RunSpeedTests()
     x.number_of_gridpoints = [64, 128, 192]
     x.start()
+    x = RunSplitMessageSpeedTests()
+    x.number_of_gridpoints = [32, 64]
+    x.start()
+    x = RunMessageSpeedTests()
+    x.number_of_points = [64**3, 128**3, 192**3]
+    x.start()